@@ -0,0 +1,84 @@
+"""
+基准测试脚本共用的东西
+
+脚本直接在仓库根目录运行，比如 ``python benchmarks/bench_save.py``，
+数字只看同一台机器上的相对大小，不同机器之间没法比。
+"""
+
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+"仓库根目录"
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from utils.classobjects import (  # noqa: E402
+    DEFAULT_ACHIEVEMENTS,
+    DEFAULT_CLASS_KEY,
+    DEFAULT_CLASSES,
+    DEFAULT_SCORE_TEMPLATES,
+    AttendanceInfo,
+    ScoreModification,
+)
+from utils.classobjects.dataloader import UserDataBase  # noqa: E402
+
+
+def make_db(records: int = 0) -> UserDataBase:
+    """
+    用默认数据造一个数据库，默认班级里轮流给学生加records条分数记录。
+
+    :param records: 分数记录的数量
+    :return: 数据库
+    """
+    classes = copy.deepcopy(DEFAULT_CLASSES.to_dict())
+    templates = DEFAULT_SCORE_TEMPLATES.to_dict()
+    students = list(list(classes.values())[0].students.values())
+    template_list = list(templates.values())
+    for i in range(records):
+        modification = ScoreModification(
+            template_list[i % len(template_list)], students[i % len(students)]
+        )
+        modification.execute()
+        modification.execute_time_key += i  # 同一时刻执行的记录时间戳会撞
+    return UserDataBase(
+        "bench",
+        time.time(),
+        "bench",
+        1,
+        time.time(),
+        {},
+        classes,
+        templates,
+        dict(DEFAULT_ACHIEVEMENTS),
+        time.time(),
+        {DEFAULT_CLASS_KEY: {}},
+        {DEFAULT_CLASS_KEY: AttendanceInfo(DEFAULT_CLASS_KEY)},
+    )
+
+
+@contextmanager
+def temp_dir() -> Iterator[str]:
+    "临时目录，用完删掉"
+    path = tempfile.mkdtemp(prefix="bench_")
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def timer(label: str) -> Iterator[None]:
+    "打印一段代码的耗时"
+    start = time.perf_counter()
+    yield
+    print(f"{label}: {(time.perf_counter() - start) * 1000:.1f} ms")
@@ -0,0 +1,37 @@
+"""
+完整加载历史记录时，不同进程数（Chunk.history_load_workers）的耗时对比
+
+用法：python benchmarks/bench_history_workers.py [历史记录数量] [每周分数记录数量]，
+默认50和1500，进程数为1、2、4
+"""
+
+import copy
+import sys
+import time
+
+from _common import make_db, temp_dir, timer
+
+import utils.classobjects.classdataobj as classdataobj
+from utils.classobjects import ClassDataTypeUUID, History
+from utils.classobjects.dataloader import Chunk, DataObject
+
+
+def main(histories: int, records: int):
+    db = make_db(records)
+    for i in range(histories):
+        classdataobj.current_archive_uuid = ClassDataTypeUUID(History)
+        history = History(copy.deepcopy(db.classes), {}, time.time() + i)
+        db.history_data[history.time] = history
+    with temp_dir() as path:
+        Chunk(path, db).save_data()
+        Chunk.relase_connections()
+        for workers in (1, 2, 4):
+            DataObject.clear_loaded_objects()
+            with timer(f"{histories}个历史记录 {workers}个进程"):
+                Chunk(path).load_data(load_all=True, lazy_histories=False, workers=workers)
+            Chunk.relase_connections()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [50, 1500][len(args):]))
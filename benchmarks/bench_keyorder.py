@@ -0,0 +1,99 @@
+"""
+OrderedKeyList按key建了索引以后和以前挨个比key的写法的对比：构造、按key取值、in、按key交换
+
+用法：python benchmarks/bench_keyorder.py [模板数量] [操作次数]，默认10000和2000
+"""
+
+import random
+import sys
+
+from _common import timer
+
+from utils.algorithm import OrderedKeyList
+from utils.classobjects import ScoreModificationTemplate
+
+
+class LegacyOrderedKeyList(list):
+    "以前的OrderedKeyList：没有索引，构造、取值、in和交换都是从头挨个比key"
+
+    keyattr = "key"
+
+    def __init__(self, objects):
+        super().__init__()
+        keys = []
+        for v in objects:
+            if getattr(v, self.keyattr) in keys:
+                raise ValueError(f"模板的key（{getattr(v, self.keyattr)!r}）重复")
+            keys.append(getattr(v, self.keyattr))
+            self.append(v)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return super().__getitem__(key)
+        for obj in self:
+            if getattr(obj, self.keyattr) == key:
+                return obj
+        for obj in self:
+            if obj is key:
+                return obj
+        raise KeyError(f"列表中不存在key为{key!r}的模板")
+
+    def __contains__(self, item) -> bool:
+        return (
+            super().__contains__(item)
+            or [getattr(obj, self.keyattr) for obj in self].count(item) > 0
+        )
+
+    def position(self, key) -> int:
+        for i, obj in enumerate(self):
+            if getattr(obj, self.keyattr) == key:
+                return i
+        raise KeyError(f"列表中不存在key为{key!r}的模板")
+
+    def swaps(self, lh, rh):
+        # 以前按key找右边的时候赋值给了lh（是个bug），这里按本来的意思两边都找，耗时是一样的
+        if isinstance(lh, str):
+            lh = self.position(lh)
+        if isinstance(rh, str):
+            rh = self.position(rh)
+        self[lh], self[rh] = self[rh], self[lh]
+        return self
+
+    def append(self, obj):
+        if getattr(obj, self.keyattr) in self.keys():
+            raise ValueError(f"模板的key（{getattr(obj, self.keyattr)!r}）重复")
+        super().append(obj)
+        return self
+
+    def keys(self) -> list:
+        return [getattr(obj, self.keyattr) for obj in self]
+
+
+def run(name: str, make, count: int, ops: int) -> list:
+    "跑一遍，返回交换以后的key的顺序"
+    templates = [ScoreModificationTemplate(f"t{i}", 1.0, f"模板{i}") for i in range(count)]
+    rnd = random.Random(22)
+    keys = [f"t{rnd.randrange(count)}" for _ in range(ops)]
+    missing = [f"missing{i}" for i in range(ops // 10)]
+    with timer(f"{name}：构造{count}个模板"):
+        m = make(templates)
+    with timer(f"{name}：按key取值{ops}次"):
+        for key in keys:
+            m[key]  # pylint: disable=pointless-statement
+    with timer(f"{name}：in {ops + len(missing)}次（其中{len(missing)}次不在列表里）"):
+        for key in keys + missing:
+            key in m  # pylint: disable=pointless-statement
+    with timer(f"{name}：按key交换{ops // 10}次"):
+        for i in range(ops // 10):
+            m.swaps(keys[i], keys[-1 - i])
+    return [t.key for t in m]
+
+
+def main(count: int, ops: int):
+    legacy = run("以前", LegacyOrderedKeyList, count, ops)
+    assert run("现在", OrderedKeyList, count, ops) == legacy, "两种写法交换以后的顺序不一样"
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [10000, 2000][len(args):]))
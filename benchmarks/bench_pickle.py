@@ -0,0 +1,110 @@
+"""
+pickle存档旧格式（dill + base85文本 + 临时文件）和新格式（picklefile，流式）的耗时和内存峰值对比
+
+用法：python benchmarks/bench_pickle.py [分数记录数量]，默认20000
+
+内存峰值用的是ru_maxrss（整个进程的峰值，只会涨不会跌），所以每一项都在单独的子进程里跑，
+打印的是这一项比开始之前多用了多少内存。ru_maxrss只有类Unix系统上有。
+"""
+
+import base64
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+from _common import make_db, temp_dir
+
+import dill
+
+from utils.classobjects.picklefile import convert_legacy_pickle, dump_pickle, load_pickle
+
+
+def peak_rss() -> float:
+    "进程到目前为止的内存峰值（MB）"
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def build(records: int) -> dict:
+    "和ClassObj.save_data_strict存进pickle的内容差不多"
+    db = make_db(records)
+    return {"classes": db.classes, "templates": db.templates, "achievements": db.achievements}
+
+
+def legacy_dump(obj: dict, path: str) -> None:
+    "旧的写法：整个dumps进内存，base85编码，再写成文本"
+    data = base64.b85encode(dill.dumps(obj, protocol=dill.HIGHEST_PROTOCOL))
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def legacy_load(path: str) -> dict:
+    "旧的读法：整个文件解码进内存，写一个.tmp文件，再dill.load"
+    with open(path, "r", encoding="utf-8") as f:
+        data = base64.b85decode(f.read())
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    try:
+        with open(path + ".tmp", "rb") as f:
+            return dill.load(f)
+    finally:
+        os.remove(path + ".tmp")
+
+
+def run(op: str, directory: str, records: int) -> None:
+    "在子进程里跑一项，打印耗时和内存峰值"
+    legacy = os.path.join(directory, "legacy.datas")
+    if op in ("旧格式保存", "新格式保存", "新格式保存（不压缩）"):
+        obj = build(records)
+        before = peak_rss()
+        start = time.perf_counter()
+        if op == "旧格式保存":
+            legacy_dump(obj, legacy)
+        else:
+            dump_pickle(obj, os.path.join(directory, op + ".datas"), compress="不压缩" not in op)
+    else:
+        if op == "转换旧格式":
+            shutil.copy(legacy, os.path.join(directory, "converted.datas"))
+        before = peak_rss()
+        start = time.perf_counter()
+        if op == "旧格式读取（旧的读法）":
+            legacy_load(legacy)
+        elif op == "旧格式读取（流式）":
+            load_pickle(legacy)
+        elif op == "转换旧格式":
+            convert_legacy_pickle(os.path.join(directory, "converted.datas"))
+        else:
+            load_pickle(os.path.join(directory, op.replace("读取", "保存") + ".datas"))
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"{op}: {elapsed:.1f} ms，内存峰值 +{peak_rss() - before:.1f} MB")
+
+
+def main(records: int):
+    with temp_dir() as directory:
+        for op in (
+            "旧格式保存",
+            "新格式保存",
+            "新格式保存（不压缩）",
+            "旧格式读取（旧的读法）",
+            "旧格式读取（流式）",
+            "新格式读取",
+            "新格式读取（不压缩）",
+            "转换旧格式",
+        ):
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run", op, directory, str(records)],
+                check=True,
+            )
+        for name in ("legacy", "新格式保存", "新格式保存（不压缩）", "converted"):
+            size = os.path.getsize(os.path.join(directory, name + ".datas"))
+            print(f"{name}.datas: {size / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--run"]:
+        run(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
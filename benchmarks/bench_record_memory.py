@@ -0,0 +1,90 @@
+"""
+分数修改记录和成就每条占多少内存（tracemalloc），__slots__和以前用__dict__的两种存法对比
+
+用法：python benchmarks/bench_record_memory.py [记录数量]，默认20000
+
+记录都是从json字符串解出来的（和从存档加载一样，字符串都是新的），模板和学生是共用的；
+"__dict__存法"是把同样的属性值放进一个普通对象的__dict__里，只多算了对象本身和__dict__的开销
+"""
+
+import gc
+import json
+import sys
+import tracemalloc
+import uuid
+
+from _common import make_db
+
+from utils.classobjects import DEFAULT_ACHIEVEMENTS, Achievement, ScoreModification
+from utils.classobjects.classdataobj import ClassDataObj
+
+
+def measure(build) -> tuple:
+    "构造一批对象，返回(对象, 新增的内存字节数)"
+    gc.collect()
+    tracemalloc.start()
+    objects = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return objects, size
+
+
+def as_dict_records(objects: list) -> list:
+    "把同样的属性值放进没有__slots__的对象（属性都在__dict__里，以前的存法）"
+    record_type = type(f"Dict{type(objects[0]).__name__}", (), {})
+    records = []
+    for obj in objects:
+        record = record_type()
+        # 一个一个设置，同一个类的__dict__可以共用key（和在__init__里设置的时候一样）
+        for name, value in obj.instance_attrs().items():
+            setattr(record, name, value)
+        records.append(record)
+    return records
+
+
+def fresh_strings(objects: list) -> list:
+    "序列化成字符串，换上新的uuid（不和构造的时候还活着的对象共用）"
+    strings = []
+    for obj in objects:
+        data = json.loads(obj.to_string())
+        data["uuid"] = str(uuid.uuid4())
+        strings.append(json.dumps(data))
+    return strings
+
+
+def main(count: int):
+    db = make_db()
+    students = list(list(db.classes.values())[0].students.values())
+    templates = list(db.templates.values())
+    achievement_templates = list(DEFAULT_ACHIEVEMENTS.values())
+    modifications = []
+    for i in range(count):
+        modification = ScoreModification(templates[i % len(templates)], students[i % len(students)])
+        modification.execute()
+        modification.execute_time_key += i
+        modifications.append(modification)
+    achievements = [
+        Achievement(achievement_templates[i % len(achievement_templates)], students[i % len(students)])
+        for i in range(count)
+    ]
+    lookup = {str(obj.uuid): obj for obj in templates + achievement_templates + students}
+    ClassDataObj.LoadUUID = lambda value, _type: lookup[str(value)]
+    for cls, objects in ((ScoreModification, modifications), (Achievement, achievements)):
+        strings = fresh_strings(objects)
+        loaded, slots_size = measure(lambda: [cls.from_string(s) for s in strings])
+        _, dict_overhead = measure(lambda: as_dict_records(loaded))
+        title = getattr(loaded[0], "title", None)
+        shared = title is None or title is loaded[0].temp.title
+        record = as_dict_records(loaded[:2])[1]
+        print(
+            f"{cls.__name__}：__slots__ {slots_size / count:.0f} B/条，"
+            f"__dict__ {(slots_size + dict_overhead) / count:.0f} B/条"
+            f"（对象本身 {sys.getsizeof(loaded[0])} B / "
+            f"{sys.getsizeof(record) + sys.getsizeof(record.__dict__)} B），"
+            f"标题和模板共用：{shared}"
+        )
+
+
+if __name__ == "__main__":
+    main(*([int(arg) for arg in sys.argv[1:]] or [20000]))
@@ -0,0 +1,77 @@
+"""
+重置分数（ClassObj.reset_scores）的耗时和内存：重置前的学生冻结成浅拷贝的版本，不再整个深拷贝
+
+用法：python benchmarks/bench_reset.py [每个学生的点评数 ...]，默认20和100，
+数据是50个班、每班60个学生、10个小组
+"""
+
+import gc
+import sys
+import tracemalloc
+import types
+
+from _common import timer
+
+from utils.algorithm import Stack
+from utils.classobjects import (
+    DEFAULT_SCORE_TEMPLATES,
+    Class,
+    Group,
+    ScoreModification,
+    Student,
+)
+from utils.classobjects.classobj import ClassObj
+
+
+class ResetClassObj(ClassObj):
+    "只有重置分数要用到的东西"
+
+    def __init__(self, classes):  # pylint: disable=super-init-not-called
+        self.classes = classes
+        self.history_data = {}
+        self.weekday_record = {}
+        self.current_day_attendance = {}
+        self.target_class = next(iter(classes.values()))
+        self.class_obs = types.SimpleNamespace(opreation_record=Stack())
+        self._tracking_chunk = None
+
+    tracking_chunk = types.SimpleNamespace(catalog=types.SimpleNamespace(update=lambda rows: None))
+
+    def insert_action_history_info(self, text, func, color, stepcount=0):
+        pass
+
+
+def make_classes(modifications: int):
+    "50个班、每班60个学生，每个学生执行modifications条点评"
+    templates = list(DEFAULT_SCORE_TEMPLATES.to_dict().values())
+    classes = {}
+    for c in range(50):
+        key = f"class{c}"
+        students = {n: Student(f"学生{n}", n, 0.0, key) for n in range(1, 61)}
+        members = list(students.values())
+        groups = {
+            f"g{g}": Group(f"g{g}", f"小组{g}", members[g * 6], members[g * 6 : (g + 1) * 6], key)
+            for g in range(10)
+        }
+        classes[key] = Class(f"班级{c}", "老师", students, key, groups)
+        for student in members:
+            for i in range(modifications):
+                ScoreModification(templates[(i + student.num) % len(templates)], student).execute()
+    return classes
+
+
+def main(sizes):
+    for size in sizes:
+        obj = ResetClassObj(make_classes(size))
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        with timer(f"每人{size}条点评 重置"):
+            obj.reset_scores()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"每人{size}条点评 新增内存 {(current - base) / 1e6:.1f} MB，峰值 {(peak - base) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [20, 100])
@@ -0,0 +1,36 @@
+"""
+逐个保存（DataObject.save）和批量保存（DataObject.save_batch）的耗时对比
+
+用法：python benchmarks/bench_save.py [数量 ...]，默认10000和100000
+"""
+
+import sys
+
+from _common import make_db, temp_dir, timer
+
+from utils.classobjects import ScoreModification
+from utils.classobjects.dataloader import Chunk, DataObject
+
+
+def main(sizes):
+    db = make_db()
+    students = list(list(db.classes.values())[0].students.values())
+    templates = list(db.templates.values())
+    for size in sizes:
+        objects = [
+            ScoreModification(templates[i % len(templates)], students[i % len(students)])
+            for i in range(size)
+        ]
+        with temp_dir() as path:
+            chunk = Chunk(path, db)
+            with timer(f"{size} 逐个保存"):
+                for obj in objects:
+                    DataObject(obj, chunk).save(path)
+                DataObject.relase_connections()
+        with temp_dir() as path:
+            with timer(f"{size} 批量保存"):
+                DataObject.save_batch(objects, path)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
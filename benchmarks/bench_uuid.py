@@ -0,0 +1,85 @@
+"""
+ClassDataTypeUUID（驻留、哈希缓存、分表前缀预先算好）和以前的写法的对比，再加上加载存档的耗时
+
+用法：python benchmarks/bench_uuid.py [uuid数量] [分数记录数量]，默认10000和20000
+"""
+
+import gc
+import sys
+import timeit
+import uuid
+
+from _common import make_db, temp_dir, timer
+
+from utils.classobjects import ClassDataTypeUUID, History, Student
+from utils.classobjects.dataloader import Chunk, DataObject
+
+
+class LegacyUUID(uuid.UUID):
+    "以前的ClassDataTypeUUID：每次取哈希、取分表前缀都要拼字符串，同一个uuid每次构造一个新的"
+
+    def __init__(self, dt, _uuid=None):
+        super().__init__(int=_uuid.int if _uuid else uuid.uuid4().int)
+        object.__setattr__(self, "dtype", dt)
+
+    def __eq__(self, other: object) -> bool:
+        if self.__class__ != other.__class__:
+            return False
+        return super(uuid.UUID, self).__eq__(other)
+
+    def __getitem__(self, item):
+        return str(self).replace("-", "")[item]
+
+    def __hash__(self) -> int:
+        return hash(self.dtype.__qualname__ + "_" + str(self))
+
+
+def per_item(stmt, items: list, number: int = 20) -> float:
+    "平均每个uuid的耗时（纳秒）"
+    return min(timeit.repeat(stmt, number=number, repeat=3)) / number / len(items) * 1e9
+
+
+def micro(count: int):
+    for name, make in (("以前", LegacyUUID), ("现在", ClassDataTypeUUID)):
+        uuids = [make(Student) for _ in range(count)]
+        archive = make(History)
+        table = {(archive, "Student", u): i for i, u in enumerate(uuids)}
+        keys = [(archive, "Student", u) for u in uuids]
+        strings = [str(u) for u in uuids]
+        if make is ClassDataTypeUUID:
+            parse = lambda: [ClassDataTypeUUID.parse(Student, s) for s in strings]
+        else:
+            parse = lambda: [LegacyUUID(Student, uuid.UUID(s)) for s in strings]
+        print(
+            f"{name}：哈希 {per_item(lambda: [hash(u) for u in uuids], uuids):.0f} ns，"
+            f"字典取值 {per_item(lambda: [table[k] for k in keys], uuids):.0f} ns，"
+            f"分表前缀 {per_item(lambda: [u[:1] for u in uuids], uuids):.0f} ns，"
+            f"从字符串构造 {per_item(parse, uuids, 3):.0f} ns"
+        )
+
+
+def load(records: int):
+    db = make_db(records)
+    with temp_dir() as path:
+        chunk = Chunk(path, db)
+        chunk.save_data(full=True)
+        Chunk.relase_connections()
+        for _ in range(3):
+            DataObject.clear_loaded_objects()
+            gc.collect()
+            with timer(f"加载{records}条分数记录"):
+                loaded = Chunk(path).load_data()
+            Chunk.relase_connections()
+        alive = sum(1 for obj in gc.get_objects() if type(obj) is ClassDataTypeUUID)
+        print(f"活着的ClassDataTypeUUID {alive} 个（同一个uuid只有一个实例）")
+        del loaded
+
+
+def main(count: int, records: int):
+    micro(count)
+    load(records)
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [10000, 20000][len(args):]))
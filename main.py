@@ -96,7 +96,10 @@ from utils.functions import (
     question_chooose,
     wait_until
 )
-from utils.classobjects.dataloader import Chunk, UserDataBase
+from utils.classobjects.dataloader import Chunk, UserDataBase, SaveSnapshot
+from utils.classobjects.basetype import ClassDataType
+from utils.classobjects.catalog import catalog_key
+from utils.recovery import RecoveryStore, RecoveryManifest, RetentionPolicy
 from utils.settings import SettingsInfo
 from utils.basetypes import DataObject
 from utils.algorithm import Thread
@@ -345,6 +348,12 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
     signal_show_exc_window = Signal(Exception)
     "显示异常窗口信号"
 
+    signal_save_finished = Signal(object)
+    "后台保存完成信号，参数为写入的快照（SaveSnapshot）"
+
+    signal_save_failed = Signal(tuple)
+    "后台保存失败信号，参数为错误信息(类型, 异常, 回溯)"
+
     ###########################################################################
     #                                初始化                                    #
     ###########################################################################
@@ -474,6 +483,10 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
         "存档路径"
         self.backup_path = "backups/"
         "备份路径"
+        self.recovery_store = RecoveryStore(self.backup_path)
+        "还原点存储"
+        self.backup_retention = RetentionPolicy(keep_last=20, keep_daily=14, keep_weekly=8)
+        "还原点保留策略，每次创建还原点之后按照这个清理"
         super().__init__(user=current_user)
 
         # 初始化设置信息
@@ -534,6 +547,8 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
         "是否使用动态背景"
         self.max_framerate = 60
         "动态背景最大帧率"
+        self.history_load_workers = 1
+        "完整加载历史记录时的进程数（0为自动，1为不开子进程）"
         self.saving = False
         "正在保存"
         self.load_settings()
@@ -667,6 +682,8 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
         self.signal_dont_click_btn_clicked.connect(self._dont_click)
         self.signal_refresh_hint_widget.connect(self._refresh_hint_widget)
         self.signal_anim_group_state_changed.connect(self._anim_group_state_changed)
+        self.signal_save_finished.connect(self._save_finished)
+        self.signal_save_failed.connect(self._save_failed)
         self.tip_handler = self.TipHandler(self)
         "提示处理器"
         self.tip_handler.start()
@@ -1328,6 +1345,8 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
                 )
             setattr(self, key, value)
             setattr(settings, key, value)
+        if "history_load_workers" in kwargs:
+            Chunk.history_load_workers = int(kwargs["history_load_workers"])
         self.save_settings()
 
     def save_current_settings(self):
@@ -1362,6 +1381,7 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
             subwindow_y_offset=self.subwindow_y_offset,
             use_animate_background=self.use_animate_background,
             max_framerate=self.max_framerate,
+            history_load_workers=self.history_load_workers,
         )
 
     ###########################################################################
@@ -1913,6 +1933,44 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
         )
         return super().on_auto_save_failure(exc_info)
 
+    def on_save_finished(self, snapshot: SaveSnapshot):
+        "后台保存完成时执行的操作（在工作线程里）"
+        self.signal_save_finished.emit(snapshot)
+        return super().on_save_finished(snapshot)
+
+    def on_save_failure(self, exc_info: ExceptionInfoType):
+        "后台保存失败时执行的操作（在工作线程里）"
+        self.signal_save_failed.emit(exc_info)
+        return super().on_save_failure(exc_info)
+
+    @Slot(object)
+    def _save_finished(self, snapshot: SaveSnapshot):
+        "后台保存完成的槽"
+        self.show_tip(
+            "提示",
+            "保存成功",
+            icon=InfoBarIcon.SUCCESS,
+            duration=2500,
+            further_info=(
+                f"{'增量' if snapshot.incremental else '完整'}保存，"
+                f"拍快照时占用了{snapshot.lock_time * 1000:.1f}ms"
+            ),
+        )
+        Base.log("I", "存档保存完成", "MainWindow.save")
+
+    @Slot(tuple)
+    def _save_failed(self, exc_info: ExceptionInfoType):
+        "后台保存失败的槽"
+        self.show_tip(
+            "警告",
+            "保存失败，请查看日志",
+            self,
+            duration=8000,
+            closeable=False,
+            icon=InfoBarIcon.WARNING,
+            further_info=f"详细信息：\n\n{''.join(traceback.format_exception(*exc_info))}",
+        )
+
     def on_exit(self):
         "将要退出时执行的操作"
         Base.log("I", "进行将要退出操作", "MainWindow.on_exit")
@@ -1923,7 +1981,7 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
 
     def _do_exit(self):
         "退出时执行的操作，有东西写这里"
-        self.save_data(self.save_path)
+        self.save_data(self.save_path, full=True)
         self.save_current_settings()
         self.script_backup(self.auto_backup_scheme)
         self.class_obs.stop()
@@ -2308,51 +2366,21 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
     @Slot()
     @as_command("save", "保存数据")
     def save(self):
-        "保存当前存档。"
+        """
+        保存当前存档。
+
+        存档在后台写入（见save_data_async），不会卡住界面，完成或者失败之后会弹出提示。
+        """
         if self.last_save_from_action - time.time() < -3:
-            Chunk.loading_info["history_stage"] = "保存存档"
-            Chunk.loading_info["current_saving_obj_name"] = "存档"
-            Chunk.loading_info["current_saving_obj_current"] = 1
-            Chunk.loading_info["current_saving_obj_total"] = 1
-            Chunk.loading_info["total_percentage"] = 0
-            loading_screen = LoadingScreenWidget(
-                self,
-                progress_condition=lambda: Chunk.loading_info["total_percentage"],
-                stage_desc_condition=lambda: Chunk.loading_info["history_stage"],
-                stage_progress_desc_condition=lambda: (
-                    "保存" +
-                    Chunk.loading_info["current_saving_obj_name"] + 
-                    "（" +
-                    str(Chunk.loading_info["current_saving_obj_current"]) +
-                    "/" +
-                    str(Chunk.loading_info["current_saving_obj_total"]) +
-                    "）"
-                ))
-            loading_screen.show()
-            finished = False
-            def _set_finished():
-                nonlocal finished
-                finished = True
             Base.log("I", "保存当前存档", "MainWindow.save")
             self.last_save_from_action = time.time()
             Thread(
                 target=lambda: (
                     self.save_current_settings(),
-                    self.save_data(self.save_path),
                     self.save_quick_command_config(),
-                    self.show_tip(
-                        "提示",
-                        "保存成功",
-                        icon=InfoBarIcon.SUCCESS,
-                        duration=2500,
-                        further_info="保存成功，没什么好说的",
-                    ),
-                    Base.log("I", "存档保存完成", "MainWindow.save"),
-                    _set_finished()
                 )
             ).start()
-            wait_until(lambda: finished)
-            loading_screen.close()
+            self.save_data_async()
 
 
     def refresh_hint_widget(self, mode: int = 0):
@@ -2501,114 +2529,140 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
     @Slot()
     @as_command("show_all_history", "历史记录")
     def show_all_history(self):
-        """显示所有历史"""
-        if not hasattr(self, "is_loading_all_history"):
-            self.is_loading_all_history = False
-        if self.is_loading_all_history:
-            Base.log("I", "还正在加载历史记录", "MainWindow.show_all_history")
-        finished = False
-
-        def _load_history():
-            nonlocal finished
-            self.show_tip("提示", "正在保存当前数据以保证完整性", duration=2000)
-            self.save_data()
-            self.show_tip("提示", "历史记录正在加载中，请稍等", duration=2000)
-            self.config_data(
-                os.path.abspath(f"chunks/{self.current_user}"),
-                load_full_histories=True,
-                reset_current=False,
-                strict=True,
+        """显示所有历史（从历史记录目录分页读，不用加载存档）"""
+        page_size = 50
+        offset = 0
+        view: Optional[ListView] = None
+
+        def _format_time(t: float) -> str:
+            lt = time.localtime(t)
+            return (
+                f"{lt.tm_year}/{lt.tm_mon}/{lt.tm_mday} "
+                f"{lt.tm_hour}:{lt.tm_min:02}:{lt.tm_sec:02}"
             )
-            finished = True
 
-        self.is_loading_all_history = True
-        Thread(target=_load_history, name="HistoryLoader").start()
-        self.is_loading_all_history = False
-        wait_until(lambda: finished)
-        view = ListView(
-            self,
-            self,
-            "所有历史记录",
-            [
-                (
-                    f"位于{time.localtime(history.time).tm_year}/{time.localtime(history.time).tm_mon}/{time.localtime(history.time).tm_mday} {time.localtime(history.time).tm_hour}:{time.localtime(history.time).tm_min:02}:{time.localtime(history.time).tm_sec:02}的历史记录",
-                    lambda h=history: self.show_classes_history(h.classes),
+        def _open(history_uuid: str):
+            history = self.get_history(history_uuid)
+            if history is None:
+                self.information("提示", "这个历史记录的存档已经不在了")
+                return
+            self.show_classes_history(history.classes)
+
+        def _items():
+            items = []
+            for entry in self.history_catalog(offset, page_size):
+                size = (
+                    "未保存"
+                    if entry.byte_size is None
+                    else f"{entry.byte_size / 1024:.1f}KB"
                 )
-                for history in self.history_data.values()
-            ],
-        )
+                items.append(
+                    (
+                        f"位于{_format_time(entry.create_time)}的历史记录"
+                        f"（{len(entry.class_keys)}个班级，{entry.student_count}个学生，"
+                        f"{entry.modification_count}条点评，{size}）",
+                        lambda u=entry.uuid: _open(u),
+                    )
+                )
+            return items
+
+        def _turn(step: int):
+            nonlocal offset
+            new_offset = max(offset + step * page_size, 0)
+            if new_offset >= max(self.tracking_chunk.catalog.count(), 1):
+                self.information("提示", "已经是最后一页了")
+                return
+            offset = new_offset
+            view.setData(_items())
+
+        def _forget(history_uuid: str):
+            "删掉之后把已经加载了的历史记录也去掉"
+            for key, history in list(self.history_data.items()):
+                if catalog_key(history.uuid) == history_uuid:
+                    self.history_data.pop(key)
+
+        def _del_earliest():
+            oldest = self.tracking_chunk.catalog.page(0, 1, newest_first=False)
+            if not oldest:
+                self.information("提示", "没有历史记录可以删除...")
+                return
+            entry = oldest[0]
+
+            def _delete():
+                if not self.tracking_chunk.del_history(entry.uuid):
+                    self.information("提示", "删除失败，详细信息请查看日志")
+                    view.setData(_items())
+                    return
+                _forget(entry.uuid)
+                self.insert_action_history_info(
+                    f"删除{_format_time(entry.create_time)}的记录",
+                    self.show_all_history,
+                    (201, 94, 232, 235, 176, 252),
+                    40,
+                )
+                self.information("提示", "删除成功")
+                view.setData(_items())
+
+            self.question_if_exec(
+                "警告",
+                f"最早的一次记录来自于{_format_time(entry.create_time)};\n"
+                "接下来的操作将会彻底删除这个时间段的记录，此操作不可逆！\n\n"
+                "你确定要删除吗？",
+                _delete,
+            )
+
+        def _del_all():
+            total = self.tracking_chunk.catalog.count()
+            if not total:
+                self.information("提示", "没有历史记录可以删除...")
+                return
+
+            def _delete():
+                nonlocal offset
+                deleted = failed = 0
+                while True:
+                    # 删除失败的还留在目录里，跳过它们往后翻
+                    entries = self.tracking_chunk.catalog.page(failed, page_size, newest_first=False)
+                    if not entries:
+                        break
+                    for entry in entries:
+                        if self.tracking_chunk.del_history(entry.uuid, collect=False):
+                            _forget(entry.uuid)
+                            deleted += 1
+                        else:
+                            failed += 1
+                self.tracking_chunk.collect_blobs()
+                self.insert_action_history_info(
+                    f"删除所有的历史记录（{deleted}）",
+                    self.show_all_history,
+                    (142, 30, 114, 246, 139, 219),
+                    40,
+                )
+                if failed:
+                    self.information(
+                        "提示", f"删除了{deleted}条历史记录，{failed}条删除失败，详细信息请查看日志"
+                    )
+                else:
+                    self.information("提示", "删除成功")
+                offset = 0
+                view.setData(_items())
+
+            self.question_if_exec(
+                "警告",
+                "你确定要删除所有记录吗？\n"
+                "接下来的操作将会彻底删除所有记录，没错，是所有，请慎重！\n\n"
+                f"当前共有{total}条历史记录, "
+                "你确定要删除吗？",
+                _delete,
+            )
+
+        view = ListView(self, self, "所有历史记录", _items())
         view.setCommands(
             [
-                (
-                    "删除最早记录",
-                    lambda: (
-                        self.question_if_exec(
-                            "警告",
-                            "最早的一次记录来自于"
-                            f"{time.localtime(list(self.history_data)[0]).tm_year}/"
-                            f"{time.localtime(list(self.history_data)[0]).tm_mon}/"
-                            f"{time.localtime(list(self.history_data)[0]).tm_mday} "
-                            f"{time.localtime(list(self.history_data)[0]).tm_hour}:"
-                            f"{time.localtime(list(self.history_data)[0]).tm_min:02}:"
-                            f"{time.localtime(list(self.history_data)[0]).tm_sec:02};\n"
-                            "接下来的操作将会彻底删除这个时间段的记录，此操作不可逆！\n\n"
-                            "你确定要删除吗？",
-                            lambda: (
-                                Chunk(self.save_path, None).del_history(
-                                    list(self.history_data.values())[0].uuid
-                                ),
-                                self.history_data.pop(list(self.history_data)[0]),
-                                self.insert_action_history_info(
-                                    "删除"
-                                    f"{time.localtime(list(self.history_data)[0]).tm_year}/"
-                                    f"{time.localtime(list(self.history_data)[0]).tm_mon}/"
-                                    f"{time.localtime(list(self.history_data)[0]).tm_mday} "
-                                    f"{time.localtime(list(self.history_data)[0]).tm_hour}:"
-                                    f"{time.localtime(list(self.history_data)[0]).tm_min:02}:"
-                                    f"{time.localtime(list(self.history_data)[0]).tm_sec:02}的记录",
-                                    self.show_all_history,
-                                    (201, 94, 232, 235, 176, 252),
-                                    40,
-                                ),
-                                self.information(
-                                    "提示", "删除成功，请重新加载此窗口！"
-                                ),
-                                view.close(),
-                            ),
-                        )
-                        if len(self.history_data)
-                        else (self.information("提示", "没有历史记录可以删除..."))
-                    ),
-                ),
-                (
-                    "删除所有记录",
-                    lambda: (
-                        (
-                            self.question_if_exec(
-                                "警告",
-                                "你确定要删除所有记录吗？\n"
-                                "接下来的操作将会彻底删除所有记录，没错，是所有，请慎重！\n\n"
-                                f"当前共有{len(self.history_data)}条历史记录, "
-                                "你确定要删除吗？",
-                                lambda: (
-                                    self.insert_action_history_info(
-                                        f"删除所有的历史记录（{len(self.history_data)}）",
-                                        self.show_all_history,
-                                        (142, 30, 114, 246, 139, 219),
-                                        40,
-                                    ),
-                                    self.history_data.clear(),
-                                    self.information(
-                                        "提示", "删除成功，请重新加载此窗口！"
-                                    ),
-                                    view.close(),
-                                ),
-                            )
-                        )
-                        if len(self.history_data)
-                        else (self.information("提示", "没有历史记录可以删除..."))
-                    ),
-                ),
+                ("上一页", lambda: _turn(-1) if offset else None),
+                ("下一页", lambda: _turn(1)),
+                ("删除最早记录", _del_earliest),
+                ("删除所有记录", _del_all),
             ]
         )
         view.show()
@@ -2745,21 +2799,22 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
     def show_recover_points(self):
         """显示还原点"""
         Base.log("I", "读取列表", "MainWindow.show_recovery_point")
-        if not os.path.exists(self.backup_path + "backup_info.dat"):
-            pickle.dump({}, open(self.backup_path + "backup_info.dat", "wb"))
-        self.recovery_points: Dict[float, RecoveryPoint] = pickle.load(
-            open(self.backup_path + "backup_info.dat", "rb")
-        )
-        Base.log("I", "检查各个还原点", "MainWindow.show_recovery_point")
+        self.import_legacy_recovery_points()
+        self.recovery_points: Dict[float, RecoveryPoint] = {
+            manifest.create_time: RecoveryPoint(self.recovery_store, manifest)
+            for manifest in self.recovery_store.points()
+        }
 
         Base.log("I", "显示列表", "MainWindow.show_recovery_point")
         self.list_view(
             [
                 (
-                    f"在 {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(point.time))} 创建的还原点",  # + f"  {'可用' if point.stat == 'active' else '损坏' if point.stat == 'damaged' else '不存在' if point.stat == 'missed' else '未知错误'}",
+                    f"在 {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(point.time))} 创建的还原点"
+                    f"（{'仅数据' if point.mode == 'only_data' else '完整'}，"
+                    f"{len(point.manifest.files)}个文件，{point.manifest.total_size / 1024 / 1024:.1f}MB）",
                     lambda point=point: self.load_recovery_point(point),
                 )
-                for point in self.recovery_points.values()
+                for point in reversed(list(self.recovery_points.values()))
             ],
             "还原点",
             self,
@@ -2771,7 +2826,7 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
         if question_yes_no(
             self,
             "提示",
-            "是否加载还原点？\n恢复后，需要手动重启程序。\n还原点将会覆盖当前存档且无法恢复。",
+            "是否加载还原点？\n还原点将会覆盖当前存档且无法恢复。",
             False,
             "warning",
         ):
@@ -2948,86 +3003,86 @@ class ClassWindow(ClassObj, MainClassWindow.Ui_MainWindow, MyMainWindow):
 
     def script_backup(self, mode: Literal["none", "all", "only_data"] = "only_data"):
         """
-        执行应用程序备份
+        执行应用程序备份（创建还原点，见utils.recovery）
 
         :param mode: 备份模式
             "none": 不执行备份
             "all": 备份所有程序文件
             "only_data": 仅备份数据文件
         """
-        if not os.path.exists(self.backup_path):
-            os.mkdir(self.backup_path)
-        try:
-            infof: Dict[float, str] = pickle.load(
-                open(self.backup_path + "backup_info.dat", "rb")
-            )
-        except FileNotFoundError:
-            infof = {}
-        except pickle.PickleError:
-            Base.log_exc("备份信息文件损坏", "MainWindow.script_backup")
-            QMessageBox.critical(self, "错误", "备份信息文件损坏，已经重置备份信息文件")
-            infof = {}
-        except BaseException as unused:  # pylint: disable=broad-exception-caught
-            Base.log_exc("备份信息文件损坏", "MainWindow.script_backup")
-            QMessageBox.critical(
-                self,
-                "错误",
-                "加载备份信息文件出错：\n"
-                + traceback.format_exc()
-                + "\n可以尝试过一会再试试？",
-            )
-            return
-
-        today_and_time = time.strftime("%Y%m%d_%H%M%S", time.localtime())
-
         if mode == "none":
             Base.log("I", "脚本备份已关闭，跳过此步", "MainWindow.script_backup")
             return
 
+        self.import_legacy_recovery_points()
         if mode == "only_data":
             Base.log("I", "正在对数据文件进行备份...", "MainWindow.script_backup")
-            try:
-                p = self.backup_path + f"dataonly/b_{today_and_time}"
-                for i in range(6):
-                    try:
-                        copytree("chunks", p + "/chunks")
-                    except OSError as e:
-                        if i > 4:
-                            raise e
-                    else:
-                        break
-
-                t = time.time()
-                infof[t] = RecoveryPoint(p, mode, "active")
-                Base.log("I", "备份成功！", "MainWindow.script_backup")
-
-            except BaseException as unused:  # pylint: disable=broad-exception-caught
-                Base.log_exc("保存失败！", "MainWindow.script_backup")
-
-        if mode == "all":
+            source, exclude = "chunks", ()
+        else:
             Base.log("I", "正在对完整程序进行备份...", "MainWindow.script_backup")
-            try:
-                copytree(os.getcwd(), "backup_tmp")
-                for i in range(6):
-                    try:
-                        copytree(
-                            "backup_tmp", self.backup_path + f"full/b_{today_and_time}"
-                        )
-                        rmtree("backup_tmp")
-                    except OSError as e:
-                        if i > 4:
-                            raise e
-                    else:
-                        break
+            source = os.getcwd()
+            exclude = (os.path.abspath(self.backup_path), "backup_tmp", "__pycache__", "log")
 
+        try:
+            # 保存写到一半的数据库文件备份下来是坏的，等保存写完
+            with Chunk.save_task_mutex:
                 t = time.time()
-                infof[t] = RecoveryPoint(p, mode, "active")
-                Base.log("I", "备份成功！", "MainWindow.script_backup")
+                manifest, stats = self.recovery_store.create(source, mode, exclude)
+            Base.log(
+                "I",
+                f"备份成功！还原点{manifest.point_id}：{stats.files}个文件，"
+                f"重新读取了{stats.hashed}个，新存入{stats.new_objects}个"
+                f"（{stats.new_bytes / 1024:.1f}KB），耗时{time.time() - t:.3f}s",
+                "MainWindow.script_backup",
+            )
+        except BaseException as unused:  # pylint: disable=broad-exception-caught
+            Base.log_exc("保存失败！", "MainWindow.script_backup")
+            return
 
-            except BaseException as unused:  # pylint: disable=broad-exception-caught
-                Base.log_exc("保存失败！", "MainWindow.script_backup")
+        try:
+            expired, removed_objects = self.recovery_store.prune(self.backup_retention)
+            if expired:
+                Base.log(
+                    "I",
+                    f"清理了{len(expired)}个旧的还原点，删除了{removed_objects}个不再使用的文件",
+                    "MainWindow.script_backup",
+                )
+        except OSError:
+            Base.log_exc_short("清理旧的还原点失败", "MainWindow.script_backup", "W")
 
-        pickle.dump(infof, open(self.backup_path + "backup_info.dat", "wb"))
+    def import_legacy_recovery_points(self):
+        """
+        把以前用copytree备份、记在backup_info.dat里的还原点导入到还原点存储里，
+        导入完之后backup_info.dat会改名为backup_info.dat.imported（原来的备份文件夹不删，可以手动删除）。
+        """
+        info_file = os.path.join(self.backup_path, "backup_info.dat")
+        if not os.path.isfile(info_file):
+            return
+        try:
+            with open(info_file, "rb") as f:
+                legacy_points: Dict[float, RecoveryPoint] = pickle.load(f)
+        except BaseException as unused:  # pylint: disable=broad-exception-caught
+            Base.log_exc("备份信息文件损坏，跳过导入", "MainWindow.import_legacy_recovery_points")
+            os.replace(info_file, info_file + ".damaged")
+            return
+        count = 0
+        for point in legacy_points.values():
+            data_path = os.path.join(point.path, "chunks")
+            if point.mode != "only_data" or not os.path.isdir(data_path):
+                continue
+            try:
+                self.recovery_store.create(data_path, "only_data", create_time=point.time)
+                count += 1
+            except OSError:
+                Base.log_exc_short(
+                    f"导入旧的还原点{point.path}失败", "MainWindow.import_legacy_recovery_points", "W"
+                )
+        os.replace(info_file, info_file + ".imported")
+        Base.log(
+            "I",
+            f"导入了{count}个旧的还原点，原来的备份文件夹可以手动删除",
+            "MainWindow.import_legacy_recovery_points",
+        )
 
     def exec_command(self, command: str) -> Any:
         """
@@ -3644,98 +3699,79 @@ class TipViewerWindow(NoticeViewer.Ui_widget, MyWidget):
 class RecoveryPoint:
     """还原点"""
 
-    def __init__(
-        self,
-        path: str,
-        mode: Literal["all", "only_data"],
-        stat: Literal["active", "unknown", "damaged", "missed"],
-    ):
+    def __init__(self, store: RecoveryStore, manifest: RecoveryManifest):
         """
         初始化
 
-        :param path: 路径
-        :param mode: 模式
-        :param stat: 状态
+        :param store: 还原点存储
+        :param manifest: 还原点清单
         """
-        self.path = path
-        self.mode = mode
-        self.time = time.time()
-        self.stat = stat
-
-    def get_data_path(self, current_user: str):
+        self.store = store
+        self.manifest = manifest
+        self.path = manifest.source
+        self.mode = manifest.mode
+        self.time = manifest.create_time
+        self.stat: Literal["active", "unknown", "damaged", "missed"] = "active"
+
+    def get_data_prefix(self, current_user: str) -> str:
         """
-        获取数据路径
+        获取还原点里用户存档的相对路径
 
         :param current_user: 当前用户
         """
-        return os.path.join(self.path, "chunks", current_user)
+        if self.mode == "only_data":
+            return f"{current_user}/"
+        return f"chunks/{current_user}/"
 
     def exists(self):
         """检查换还原点是否存在"""
-        return os.path.exists(self.path)
+        return self.store.get(self.manifest.point_id) is not None
 
     def load_onlydata_and_set(self, current_user="测试用户1"):
         """
-        加载数据并设置
+        把还原点恢复到当前存档并重新加载（只重写内容不一样的文件）
 
         :param current_user: 当前用户
         """
+        main_instance = ClassWindow.main_instance
         Base.log("I", "正在从还原点恢复数据", "RecoveryPoint.load_onlydata")
-        Base.log("I", "还原点路径：" + self.path, "RecoveryPoint.load_onlydata")
+        Base.log("I", "还原点：" + self.manifest.point_id, "RecoveryPoint.load_onlydata")
         Base.log("I", "还原点模式：" + self.mode, "RecoveryPoint.load_onlydata")
         Base.log("I", "还原点时间：" + str(self.time), "RecoveryPoint.load_onlydata")
         Base.log("I", "当前用户：" + current_user, "RecoveryPoint.load_onlydata")
-        wait_until(lambda: ClassWindow.main_instance.auto_saving)
-        self.load_onlydata(ClassWindow.main_instance.current_user)
-        ClassWindow.main_instance.stop()
-        rmtree(ClassWindow.main_instance.save_path)
-
-        def _copy():
-            for root, dirs, files in os.walk(self.get_data_path(ClassWindow.main_instance.current_user)):
-                for file in files:
-                    os.makedirs(
-                        os.path.join(
-                            ClassWindow.main_instance.save_path,
-                            os.path.relpath(
-                                root, self.get_data_path(ClassWindow.main_instance.current_user)
-                            ),
-                        ),
-                        exist_ok=True,
-                    )
-                    shutil_copy(
-                        os.path.join(root, file),
-                        os.path.join(
-                            ClassWindow.main_instance.save_path,
-                            os.path.relpath(
-                                root, self.get_data_path(ClassWindow.main_instance.current_user)
-                            ),
-                            file,
-                        ),
-                    )
-
-        _copy()
+        wait_until(lambda: not main_instance.auto_saving)
+        chunk = main_instance.tracking_chunk
+        with Chunk.save_task_mutex:
+            # 日志里没写进去的记录是当前数据的，不能盖到恢复出来的数据上
+            chunk.journal.pending.clear()
+            chunk.journal.close()
+            Chunk.relase_connections()
+            stats = self.store.restore(
+                self.manifest.point_id, main_instance.save_path, self.get_data_prefix(current_user)
+            )
         Base.log(
             "I",
-            f"将文件从{self.get_data_path(ClassWindow.main_instance.current_user)}"
-            f"复制到{ClassWindow.main_instance.save_path}...",
+            f"恢复完成：重写了{stats.written}个文件，{stats.unchanged}个文件没有变化，"
+            f"删除了{stats.deleted}个文件",
             "RecoveryPoint.load_onlydata_and_set",
         )
-        QMessageBox.information(ClassWindow.main_instance, "恢复成功", "恢复成功，请重新启动程序")
-
-        wait_until(lambda: not ClassWindow.main_instance.auto_saving)
-        _copy()  # 我就不信保存两次还能失败
-        pid = os.getpid()  # 获取当前进程的PID
-        os.kill(pid, signal.SIGTERM)  # 发送终止信号给当前进程（什么抽象关闭方法）
+        DataObject.clear_loaded_objects()
+        with ClassDataType.state_lock:
+            main_instance.config_data(main_instance.save_path, strict=True)
+        chunk.dirty_objects.clear()
+        chunk.synced = False  # 内存里的对象全换了，下次完整保存
+        QMessageBox.information(main_instance, "恢复成功", "恢复成功，数据已经重新加载")
 
     def load_onlydata(self, current_user="测试用户1"):
-        """只加载数据"""
+        """只加载数据（恢复到备份文件夹里的临时文件夹再加载，不动当前存档）"""
         Base.log("I", "正在从还原点加载数据", "RecoveryPoint.load_onlydata")
-        Base.log("I", "还原点路径：" + self.path, "RecoveryPoint.load_onlydata")
+        Base.log("I", "还原点：" + self.manifest.point_id, "RecoveryPoint.load_onlydata")
         Base.log("I", "还原点模式：" + self.mode, "RecoveryPoint.load_onlydata")
         Base.log("I", "还原点时间：" + str(self.time), "RecoveryPoint.load_onlydata")
         Base.log("I", "当前用户：" + current_user, "RecoveryPoint.load_onlydata")
-        return ClassWindow.main_instance.load_data(self.get_data_path(current_user), strict=True)
-
+        path = os.path.join(self.store.root, "preview", self.manifest.point_id)
+        self.store.restore(self.manifest.point_id, path, self.get_data_prefix(current_user))
+        return ClassWindow.main_instance.load_data(path, strict=True)
 
 
 @profile(precision=4)
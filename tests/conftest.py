@@ -0,0 +1,66 @@
+"""
+测试的公共设置
+
+在仓库根目录运行 ``python -m pytest -q tests``，
+标了slow的测试（比如加载200个存档的浸泡测试）要加上 ``--runslow`` 才会跑。
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import pytest  # noqa: E402
+
+import utils.classobjects.classdataobj as classdataobj  # noqa: E402
+from utils.classobjects import ClassDataObj, Student  # noqa: E402
+from utils.classobjects.basetype import ClassDataType  # noqa: E402
+from utils.classobjects.dataloader import Chunk, DataObject  # noqa: E402
+from utils.classobjects.journal import ScoreJournal  # noqa: E402
+
+
+def pytest_addoption(parser):
+    parser.addoption("--runslow", action="store_true", help="也跑标了slow的测试")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: 跑得很慢的测试，加上--runslow才会跑")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--runslow"):
+        return
+    skip = pytest.mark.skip(reason="加上--runslow才会跑")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(autouse=True)
+def isolate_globals():
+    "加载器、缓存、连接和日志都是全局的，每个测试结束后恢复原样"
+    saved = (
+        ClassDataObj.LoadUUID,
+        ClassDataType.dirty_hook,
+        Chunk.codec,
+        Chunk.history_load_workers,
+        Student.reset_parent_resolver,
+        classdataobj.current_archive_uuid,
+    )
+    yield
+    for journal in list(ScoreJournal.journals.values()):
+        journal.close()
+    Chunk.relase_connections()
+    DataObject.clear_loaded_objects()
+    (
+        ClassDataObj.LoadUUID,
+        ClassDataType.dirty_hook,
+        Chunk.codec,
+        Chunk.history_load_workers,
+        Student.reset_parent_resolver,
+        classdataobj.current_archive_uuid,
+    ) = saved
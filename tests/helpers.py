@@ -0,0 +1,126 @@
+"""
+测试用的小工具
+"""
+
+import copy
+import random
+import time
+import uuid
+from typing import Dict, Iterable, List, Tuple
+
+from utils.classobjects import (
+    DEFAULT_ACHIEVEMENTS,
+    DEFAULT_CLASS_KEY,
+    DEFAULT_CLASSES,
+    DEFAULT_SCORE_TEMPLATES,
+    Achievement,
+    AttendanceInfo,
+    ClassDataObj,
+    History,
+    ScoreModification,
+)
+from utils.classobjects.basetype import ClassDataType
+from utils.classobjects.dataloader import Chunk, UserDataBase
+
+
+def make_db(records: int = 0, achievements: int = 0) -> UserDataBase:
+    """
+    用默认数据造一个数据库。
+
+    :param records: 默认班级里轮流给学生加的分数记录数量
+    :param achievements: 默认班级里轮流给学生发的成就数量
+    :return: 数据库
+    """
+    classes = copy.deepcopy(DEFAULT_CLASSES.to_dict())
+    templates = DEFAULT_SCORE_TEMPLATES.to_dict()
+    achievement_templates = dict(DEFAULT_ACHIEVEMENTS)
+    students = list(classes[DEFAULT_CLASS_KEY].students.values())
+    template_list = list(templates.values())
+    for i in range(records):
+        modification = ScoreModification(
+            template_list[i % len(template_list)], students[i % len(students)]
+        )
+        modification.execute()
+        modification.execute_time_key += i  # 同一时刻执行的记录时间戳会撞
+    achievement_list = list(achievement_templates.values())
+    for i in range(achievements):
+        Achievement(
+            achievement_list[i % len(achievement_list)],
+            students[i % len(students)],
+            reach_time_key=i,
+        ).give()
+    return UserDataBase(
+        "test",
+        time.time(),
+        "test",
+        1,
+        time.time(),
+        {},
+        classes,
+        templates,
+        achievement_templates,
+        time.time(),
+        {DEFAULT_CLASS_KEY: {}},
+        {DEFAULT_CLASS_KEY: AttendanceInfo(DEFAULT_CLASS_KEY)},
+    )
+
+
+def reachable_objects(roots: Iterable) -> Dict[int, ClassDataType]:
+    """
+    从roots出发能走到的所有班级数据对象。
+
+    :param roots: 起点（对象、字典、列表都行）
+    :return: id(对象) -> 对象
+    """
+    seen: Dict[int, ClassDataType] = {}
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, ClassDataType):
+            if id(obj) in seen:
+                continue
+            seen[id(obj)] = obj
+            stack.extend(obj.instance_attrs().values())
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            stack.extend(obj)
+        elif hasattr(obj, "values") and callable(obj.values):
+            stack.extend(obj.values())
+    return seen
+
+
+def database_roots(db: UserDataBase) -> Tuple:
+    "数据库里所有对象的起点"
+    return (
+        db.classes,
+        db.templates,
+        db.achievements,
+        db.current_day_attendance,
+        db.weekday_record,
+    )
+
+
+def save_histories(chunk: Chunk, count: int, rnd: random.Random) -> List[History]:
+    """
+    往分组绑定的数据库里加count个历史记录并逐个保存，每两个之间只有几个学生的分数变了。
+
+    :param chunk: 分组
+    :param count: 历史记录数量
+    :param rnd: 随机数生成器
+    :return: 保存的历史记录
+    """
+    db = chunk.bound_db
+    students = list(db.classes[DEFAULT_CLASS_KEY].students.values())
+    templates = list(db.templates.values())
+    histories = []
+    for k in range(count):
+        for student in rnd.sample(students, 4):
+            ScoreModification(rnd.choice(templates), student).execute()
+        ClassDataObj.set_archive_uuid(str(uuid.uuid4()))
+        history = History(copy.deepcopy(db.classes), db.weekday_record, time.time() + k)
+        db.history_data[history.time] = history
+        chunk.save_data()
+        histories.append(history)
+    Chunk.relase_connections()
+    return histories
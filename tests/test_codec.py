@@ -0,0 +1,216 @@
+"""
+二进制编码（codec.py）的往返测试
+
+- 按照每个数据类型的codec_fields随机造数据，编码再解码要原样回来
+- 真实对象的to_bytes解码出来要和to_string的json一样，两条路加载出来的对象也要一样
+"""
+
+import json
+import random
+import string
+import time
+import uuid
+
+import pytest
+
+import utils.classobjects.objects as objects
+from utils.classobjects import (
+    DEFAULT_CLASS_KEY,
+    Achievement,
+    ClassDataObj,
+    DayRecord,
+    History,
+)
+from utils.classobjects.basetype import ClassDataType
+from utils.classobjects.codec import decode_record, encode_record
+
+from .helpers import database_roots, make_db, reachable_objects
+
+CODEC_TYPES = sorted(
+    (
+        cls
+        for cls in vars(objects).values()
+        if isinstance(cls, type) and issubclass(cls, ClassDataType) and cls.codec_fields
+    ),
+    key=lambda cls: cls.__name__,
+)
+
+TEXT = string.printable + "中文测试，。😀\u0000"
+
+
+def random_text(rnd: random.Random) -> str:
+    return "".join(rnd.choice(TEXT) for _ in range(rnd.randint(0, 24)))
+
+
+def random_value(rnd: random.Random, depth: int = 0):
+    "value字段能放的东西：None/bool/int/float/str/list/dict"
+    choices = ["none", "bool", "int", "bigint", "float", "str"]
+    if depth < 3:
+        choices += ["list", "dict"]
+    kind = rnd.choice(choices)
+    if kind == "none":
+        return None
+    if kind == "bool":
+        return rnd.random() < 0.5
+    if kind == "int":
+        return rnd.randint(-(2 ** 63), 2 ** 63 - 1)
+    if kind == "bigint":
+        return rnd.choice((-1, 1)) * rnd.randint(2 ** 63, 2 ** 80)
+    if kind == "float":
+        return rnd.choice([rnd.uniform(-1e12, 1e12), -0.0, float("inf"), float("-inf")])
+    if kind == "str":
+        return random_text(rnd)
+    if kind == "list":
+        return [random_value(rnd, depth + 1) for _ in range(rnd.randint(0, 4))]
+    return {
+        rnd.choice([random_text(rnd), rnd.randint(-5, 5)]): random_value(rnd, depth + 1)
+        for _ in range(rnd.randint(0, 4))
+    }
+
+
+def random_field(rnd: random.Random, kind):
+    "按照字段类型造一个值，返回(编码前的值, 解码后应该得到的值)"
+    if kind == "uuid":
+        choice = rnd.random()
+        if choice < 0.7:
+            value = str(uuid.UUID(int=rnd.getrandbits(128)))
+            return value, value
+        if choice < 0.8:
+            return None, None
+        # 不是标准格式的字符串要原样回来
+        value = rnd.choice(["None", "", str(uuid.uuid4()).upper(), random_text(rnd)])
+        return value, value
+    if kind == "str":
+        value = rnd.choice([None, random_text(rnd), random_value(rnd)])
+        return value, normalize(value)
+    if kind == "value":
+        value = random_value(rnd)
+        return value, normalize(value)
+    if kind[0] == "list":
+        pairs = [random_field(rnd, kind[1]) for _ in range(rnd.randint(0, 5))]
+        value = [a for a, _ in pairs]
+        if rnd.random() < 0.5:
+            value = tuple(value)
+        return value, [b for _, b in pairs]
+    if kind[0] in ("pairs", "map"):
+        items = [
+            (random_field(rnd, kind[1]), random_field(rnd, kind[2]))
+            for _ in range(rnd.randint(0, 5))
+        ]
+        if kind[0] == "map":
+            items = [(k, v) for k, v in items if isinstance(k[0], (str, int, float, type(None)))]
+            value = {k[0]: v[0] for k, v in items}
+            return value, {k[1]: v[1] for k, v in items}
+        return [(k[0], v[0]) for k, v in items], [[k[1], v[1]] for k, v in items]
+    if kind[0] == "record":
+        return random_record(rnd, find_codec_type(kind[1]))
+    raise AssertionError(kind)
+
+
+def random_record(rnd: random.Random, dtype):
+    "按照codec_fields造一条记录（可能带不在codec_fields里的字段）"
+    data = {"type": dtype.chunk_type_name}
+    expected = dict(data)
+    for name, kind in dtype.codec_fields:
+        data[name], expected[name] = random_field(rnd, kind)
+    for i in range(rnd.choice([0, 0, 1, 3])):
+        value = random_value(rnd)
+        data[f"extra_{i}"], expected[f"extra_{i}"] = value, normalize(value)
+    return data, expected
+
+
+def find_codec_type(type_name: str):
+    for cls in CODEC_TYPES:
+        if cls.chunk_type_name == type_name:
+            return cls
+    raise KeyError(type_name)
+
+
+def normalize(value):
+    "解码出来的容器都是list/dict"
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()}
+    return value
+
+
+def test_every_object_type_has_a_schema():
+    names = {cls.__name__ for cls in CODEC_TYPES}
+    assert names >= {
+        "Achievement",
+        "AchievementTemplate",
+        "AttendanceInfo",
+        "Class",
+        "DayRecord",
+        "Group",
+        "History",
+        "HomeworkRule",
+        "ScoreModification",
+        "ScoreModificationTemplate",
+        "Student",
+    }
+
+
+@pytest.mark.parametrize("dtype", CODEC_TYPES, ids=lambda cls: cls.__name__)
+@pytest.mark.parametrize("seed", range(5))
+def test_random_records_round_trip(dtype, seed):
+    rnd = random.Random(f"{dtype.__name__}-{seed}")
+    for _ in range(100):
+        data, expected = random_record(rnd, dtype)
+        assert decode_record(dtype, encode_record(dtype, data)) == expected
+
+
+@pytest.mark.parametrize("dtype", CODEC_TYPES, ids=lambda cls: cls.__name__)
+def test_corrupted_records_raise_value_error(dtype):
+    rnd = random.Random(dtype.__name__)
+    data, _ = random_record(rnd, dtype)
+    encoded = encode_record(dtype, data)
+    with pytest.raises(ValueError):
+        decode_record(dtype, encoded + b"\x00")
+    for cut in sorted(rnd.sample(range(len(encoded)), min(20, len(encoded)))):
+        try:
+            decode_record(dtype, encoded[:cut])
+        except ValueError:
+            continue
+        # 截断的位置刚好是一条完整记录的话可以解出来，但一定要和原来的对不上
+        assert cut == len(encoded)
+
+
+@pytest.fixture
+def real_objects():
+    "默认数据里各种类型的真实对象"
+    db = make_db(records=200, achievements=20)
+    attendance = db.current_day_attendance[DEFAULT_CLASS_KEY]
+    day_record = DayRecord(db.classes[DEFAULT_CLASS_KEY], 1, time.time(), attendance)
+    db.weekday_record[DEFAULT_CLASS_KEY][day_record.utc] = day_record
+    history = History(db.classes, db.weekday_record, time.time())
+    found = reachable_objects(database_roots(db)).values()
+    return [*found, history]
+
+
+def test_real_objects_cover_every_type(real_objects):
+    assert {type(obj) for obj in real_objects} >= set(CODEC_TYPES)
+
+
+def test_real_objects_decode_like_json(real_objects):
+    for obj in real_objects:
+        decoded = decode_record(type(obj), obj.to_bytes())
+        assert normalize(decoded) == json.loads(obj.to_string()), type(obj).__name__
+
+
+def test_real_objects_load_the_same_from_bytes_and_json(real_objects, monkeypatch):
+    lookup = {str(obj.uuid): obj for obj in real_objects}
+    monkeypatch.setattr(ClassDataObj, "LoadUUID", lambda uuid, dtype=None: lookup.get(str(uuid)))
+    for obj in real_objects:
+        dtype = type(obj)
+        from_json = dtype.new_dummy().inst_from_data(obj.to_string())
+        from_bytes = dtype.new_dummy().inst_from_data(obj.to_bytes())
+        # 元组经过json和二进制都会变成列表
+        assert (
+            normalize(from_bytes.to_dict())
+            == normalize(from_json.to_dict())
+            == normalize(obj.to_dict())
+        ), dtype.__name__
+        assert from_bytes.to_bytes() == obj.to_bytes()
+        assert isinstance(obj, Achievement) or from_bytes.uuid == obj.uuid
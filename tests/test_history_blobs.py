@@ -0,0 +1,125 @@
+"""
+历史记录共享对象库：删掉一个历史记录之后，剩下的历史记录要能完整地加载回来
+"""
+
+import json
+import os
+import random
+import sqlite3
+import uuid
+
+import pytest
+
+from utils.classobjects import History
+from utils.classobjects.catalog import CatalogEntry
+from utils.classobjects.dataloader import BLOB_STORE_FILE_NAME, Chunk, DataObject
+
+from .helpers import make_db, reachable_objects, save_histories
+
+HISTORIES = 6
+
+
+def history_signature(history: History):
+    "历史记录里所有对象的序列化结果，(类名, uuid) -> json"
+    return {
+        (type(obj).__name__, str(obj.uuid)): json.loads(obj.to_string())
+        for obj in reachable_objects([history.classes]).values()
+    }
+
+
+def blob_count(path: str) -> int:
+    conn = sqlite3.connect(os.path.join(path, BLOB_STORE_FILE_NAME))
+    try:
+        return conn.execute("SELECT count(*) FROM blobs").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def shared_histories(tmp_path):
+    """
+    保存HISTORIES个历史记录，每两个之间只有几个学生的分数变了，所以大部分对象是共享的。
+
+    :return: (分组, {历史记录uuid: 保存时的对象})
+    """
+    chunk = Chunk(str(tmp_path / "data"), make_db(records=200))
+    saved = [history_signature(h) for h in save_histories(chunk, HISTORIES, random.Random(9))]
+    uuids = chunk.catalog.saved_uuids()
+    assert len(uuids) == HISTORIES
+    return chunk, dict(zip(uuids, saved))
+
+
+def load_signature(path: str, history_uuid: str):
+    DataObject.clear_loaded_objects()
+    Chunk.relase_connections()
+    history = Chunk(path).load_history(history_uuid)
+    Chunk.relase_connections()
+    return history_signature(history)
+
+
+def test_histories_share_blobs(shared_histories):
+    chunk, saved = shared_histories
+    objects = sum(len(signature) for signature in saved.values())
+    assert all(len(signature) > 300 for signature in saved.values())
+    assert blob_count(chunk.path) < objects / 2
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_remaining_histories_reload_after_each_deletion(shared_histories, seed):
+    chunk, saved = shared_histories
+    order = list(saved)
+    random.Random(seed).shuffle(order)
+    for history_uuid in order:
+        assert chunk.del_history(history_uuid)
+        del saved[history_uuid]
+        assert sorted(chunk.catalog.saved_uuids()) == sorted(saved)
+        for remaining, signature in saved.items():
+            assert load_signature(chunk.path, remaining) == signature, remaining
+    assert blob_count(chunk.path) == 0
+
+
+def test_deleting_a_missing_history_fails(shared_histories):
+    chunk, saved = shared_histories
+    before = blob_count(chunk.path)
+    assert not chunk.del_history(uuid.uuid4().hex)
+    assert blob_count(chunk.path) == before
+    for history_uuid, signature in saved.items():
+        assert load_signature(chunk.path, history_uuid) == signature
+
+
+def delete_all(chunk: Chunk, page_size: int = 4):
+    "和主界面的“删除所有记录”一样：按目录分页删，最后清理一次共享对象库"
+    deleted = failed = 0
+    while True:
+        entries = chunk.catalog.page(failed, page_size, newest_first=False)
+        if not entries:
+            break
+        for entry in entries:
+            if chunk.del_history(entry.uuid, collect=False):
+                deleted += 1
+            else:
+                failed += 1
+    chunk.collect_blobs()
+    return deleted, failed
+
+
+def test_delete_all_from_catalog(shared_histories):
+    chunk, saved = shared_histories
+    assert blob_count(chunk.path) > 0
+    assert delete_all(chunk) == (HISTORIES, 0)
+    assert chunk.catalog.count() == 0
+    assert blob_count(chunk.path) == 0
+    for history_uuid in saved:
+        assert not os.path.exists(
+            os.path.join(chunk.path, "Histories", history_uuid[:2], history_uuid[2:])
+        )
+
+
+def test_unsaved_catalog_entry_is_deleted(shared_histories):
+    chunk, saved = shared_histories
+    unsaved = uuid.uuid4().hex
+    chunk.catalog.update([CatalogEntry(unsaved, 0.0, [], 0, 0, {})])
+    assert chunk.catalog.count() == HISTORIES + 1
+    assert delete_all(chunk) == (HISTORIES + 1, 0)
+    assert chunk.catalog.get(unsaved) is None
+    assert not chunk.del_history(unsaved)
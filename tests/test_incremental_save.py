@@ -0,0 +1,79 @@
+"""
+增量保存：执行一条分数修改之后只写有修改的学生、修改记录和每次都写的小对象
+"""
+
+import pytest
+
+from utils.classobjects import DEFAULT_CLASS_KEY, ScoreModification
+from utils.classobjects.dataloader import Chunk, DataObject
+
+from .helpers import make_db
+
+
+@pytest.fixture
+def written_rows(monkeypatch):
+    "记录每次save_rows实际写入的行数，written_rows[-1]为最近一次保存的行数"
+    counts = []
+    save_rows = DataObject.save_rows
+
+    def counting_save_rows(*args, **kwargs):
+        count = save_rows(*args, **kwargs)
+        counts[-1] += count
+        return count
+
+    monkeypatch.setattr(DataObject, "save_rows", staticmethod(counting_save_rows))
+
+    def save(chunk: Chunk, **kwargs):
+        counts.append(0)
+        chunk.save_data(**kwargs)
+        return counts[-1]
+
+    return save
+
+
+def test_one_execute_writes_two_more_rows_than_a_noop_save(tmp_path, written_rows):
+    db = make_db(records=3000)
+    chunk = Chunk(str(tmp_path / "data"), db).track_changes()
+    full = written_rows(chunk)
+    noop = written_rows(chunk)
+
+    classes = db.classes.values()
+    always_written = (
+        len(db.classes)
+        + sum(len(c.groups) for c in classes)
+        + len(db.templates)
+        + sum(len(rule.rule_mapping) for c in classes for rule in c.homework_rules)
+        + len(db.achievements)
+        + sum(len(records) for records in db.weekday_record.values())
+        + len(db.current_day_attendance)
+    )
+    assert noop == always_written
+    assert full >= noop + 3000
+
+    student = db.classes[DEFAULT_CLASS_KEY].students[1]
+    ScoreModification(list(db.templates.values())[0], student).execute()
+    assert written_rows(chunk) == always_written + 2
+    assert written_rows(chunk) == always_written
+
+
+def test_incremental_save_reloads_the_same_scores(tmp_path):
+    db = make_db(records=200)
+    path = str(tmp_path / "data")
+    chunk = Chunk(path, db).track_changes()
+    chunk.save_data()
+    student = db.classes[DEFAULT_CLASS_KEY].students[2]
+    modification = ScoreModification(list(db.templates.values())[1], student)
+    modification.execute()
+    chunk.save_data()
+    expected = {
+        s.num: (s.score, sorted(str(m.uuid) for m in s.history.values()))
+        for s in db.classes[DEFAULT_CLASS_KEY].students.values()
+    }
+
+    Chunk.relase_connections()
+    DataObject.clear_loaded_objects()
+    loaded = Chunk(path).load_data()
+    assert {
+        s.num: (s.score, sorted(str(m.uuid) for m in s.history.values()))
+        for s in loaded.classes[DEFAULT_CLASS_KEY].students.values()
+    } == expected
@@ -0,0 +1,194 @@
+"""
+分数事件日志：写到一半断电（截断、损坏）之后重放，以及丢掉已经保存的记录
+"""
+
+import os
+import random
+
+import pytest
+
+from utils.classobjects import DEFAULT_CLASS_KEY
+from utils.classobjects.dataloader import Chunk, read_archive_rows
+from utils.classobjects.journal import JOURNAL_MAGIC, ScoreJournal
+
+from .helpers import make_db
+
+RECORDS = 40
+
+
+@pytest.fixture
+def students():
+    return list(make_db().classes[DEFAULT_CLASS_KEY].students.values())
+
+
+def write_records(journal: ScoreJournal, students, count: int, start: int = 0):
+    """
+    追加count条记录，第i条记录里是第i % n个学生（分数为i）和它后面的一个学生。
+
+    :return: (每条记录结束的位置, 每条记录写进去的行)
+    """
+    ends, written = [], []
+    for i in range(start, start + count):
+        a, b = students[i % len(students)], students[(i + 1) % len(students)]
+        a.score = float(i)
+        journal.append("test", [a, b], codec="binary" if i % 2 else "json")
+        ends.append(journal.sync())
+        written.append(
+            {
+                (s.chunk_type_name, str(s.uuid)): (
+                    type(s).__qualname__,
+                    s.to_bytes() if i % 2 else s.to_string(),
+                )
+                for s in (a, b)
+            }
+        )
+    return ends, written
+
+
+def expected_rows(written, count: int):
+    "前count条记录重放的结果：同一个对象只留最后一次"
+    rows = {}
+    for record in written[:count]:
+        rows.update(record)
+    return rows
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(ScoreJournal, "flush_interval", 0)
+    journal = ScoreJournal.open(str(tmp_path / "Current"))
+    yield journal
+    journal.close()
+
+
+@pytest.fixture
+def filled(journal, students):
+    ends, written = write_records(journal, students, RECORDS)
+    with open(journal.file, "rb") as f:
+        data = f.read()
+    assert len(data) == ends[-1]
+    return data, [len(JOURNAL_MAGIC)] + ends, written
+
+
+def overwrite(journal: ScoreJournal, data: bytes):
+    with open(journal.file, "wb") as f:
+        f.write(data)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_replay_after_truncation_keeps_complete_records(journal, filled, seed):
+    data, bounds, written = filled
+    rnd = random.Random(seed)
+    cuts = rnd.sample(range(len(JOURNAL_MAGIC), len(data) + 1), 60) + bounds[:3] + bounds[-2:]
+    for cut in cuts:
+        overwrite(journal, data[:cut])
+        rows, pos, count = journal.replay()
+        complete = sum(1 for end in bounds[1:] if end <= cut)
+        assert (pos, count) == (bounds[complete], complete), cut
+        assert rows == expected_rows(written, complete)
+        assert os.path.getsize(journal.file) == pos
+
+
+@pytest.mark.parametrize("cut", range(len(JOURNAL_MAGIC)))
+def test_replay_of_a_partial_header_removes_the_file(journal, filled, cut):
+    data, _, _ = filled
+    overwrite(journal, data[:cut])
+    assert journal.replay() == ({}, 0, 0)
+    assert not os.path.exists(journal.file)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_replay_after_corruption_stops_before_the_damaged_record(journal, filled, seed):
+    data, bounds, written = filled
+    rnd = random.Random(seed)
+    for offset in rnd.sample(range(len(JOURNAL_MAGIC), len(data)), 60):
+        damaged = bytearray(data)
+        damaged[offset] ^= rnd.randrange(1, 256)
+        overwrite(journal, bytes(damaged))
+        rows, pos, count = journal.replay()
+        record = sum(1 for end in bounds[1:] if end <= offset)
+        assert (pos, count) == (bounds[record], record), offset
+        assert rows == expected_rows(written, record)
+        assert os.path.getsize(journal.file) == pos
+
+
+def test_replay_of_a_wrong_header_keeps_the_file_aside(journal, filled):
+    data, _, _ = filled
+    overwrite(journal, b"XXXX" + data[len(JOURNAL_MAGIC):])
+    assert journal.replay() == ({}, 0, 0)
+    assert not os.path.exists(journal.file)
+    assert os.path.exists(journal.file + ".corrupt")
+
+
+def test_discard_until_keeps_records_appended_later(journal, students):
+    rnd = random.Random(8)
+    ends, written = write_records(journal, students, RECORDS)
+    kept = rnd.randrange(1, RECORDS)
+    later_ends, later = write_records(journal, students, 10, start=RECORDS)
+    generation = journal.generation
+    journal.discard_until(ends[kept - 1])
+    assert journal.generation == generation + 1
+    rows, pos, count = journal.replay()
+    assert count == RECORDS - kept + 10
+    # 返回的是逻辑位置，文件本身只剩下检查点之后的记录
+    assert pos == later_ends[-1] == journal.tell()
+    assert os.path.getsize(journal.file) == later_ends[-1] - ends[kept - 1] + len(JOURNAL_MAGIC)
+    assert rows == expected_rows(written[kept:] + later, RECORDS - kept + 10)
+
+
+def test_discard_until_everything_removes_the_file(journal, students):
+    ends, _ = write_records(journal, students, 5)
+    journal.discard_until(journal.tell())
+    assert not os.path.exists(journal.file)
+    assert journal.replay() == ({}, ends[-1] - len(JOURNAL_MAGIC), 0)
+    # 之后追加的记录接着往后排
+    later_ends, later = write_records(journal, students, 2, start=5)
+    assert later_ends[0] > ends[-1]
+    assert journal.replay() == (expected_rows(later, 2), later_ends[-1], 2)
+
+
+@pytest.fixture
+def saved_chunk(tmp_path, monkeypatch):
+    monkeypatch.setattr(ScoreJournal, "flush_interval", 0)
+    db = make_db(records=50)
+    chunk = Chunk(str(tmp_path / "data"), db)
+    chunk.save_data()
+    Chunk.relase_connections()
+    yield chunk, list(db.classes[DEFAULT_CLASS_KEY].students.values())
+    chunk.journal.close()
+
+
+def test_compact_journal_keeps_records_appended_after_replay(saved_chunk):
+    chunk, students = saved_chunk
+    write_records(chunk.journal, students, 12)
+    rows, offset, count = chunk.journal.replay()
+    generation = chunk.journal.generation
+    assert count == 12
+    _, later = write_records(chunk.journal, students, 5, start=100)
+
+    assert chunk.compact_journal(rows, offset, generation) == len(rows)
+    stored = read_archive_rows(os.path.join(chunk.path, "Current"))
+    for (type_name, uuid), (_, data) in rows.items():
+        assert stored[type_name][uuid] == data
+    rows_after, _, count_after = chunk.journal.replay()
+    assert count_after == 5
+    assert rows_after == expected_rows(later, 5)
+
+
+def test_compact_journal_skips_after_a_save(saved_chunk):
+    chunk, students = saved_chunk
+    current = os.path.join(chunk.path, "Current")
+    before = read_archive_rows(current)
+    write_records(chunk.journal, students, 6)
+    rows, offset, _ = chunk.journal.replay()
+    generation = chunk.journal.generation
+    chunk.journal.discard_until(offset)  # 相当于重放之后保存过一次
+    _, later = write_records(chunk.journal, students, 3, start=100)
+
+    assert chunk.compact_journal(rows, offset, generation) == 0
+    assert read_archive_rows(current) == before
+    assert chunk.journal.replay() == (
+        expected_rows(later, 3),
+        chunk.journal.base + os.path.getsize(chunk.journal.file),
+        3,
+    )
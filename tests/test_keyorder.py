@@ -0,0 +1,221 @@
+"""
+按key建了索引的有序列表：随机操作之后要和挨个比key的参考实现一模一样（包括直接改元素的key）
+"""
+
+import copy
+import pickle
+import random
+from typing import List, Optional
+
+import pytest
+
+from utils.algorithm import IndexedOrderedMap, OrderedKeyList, SupportsKeyOrdering
+from utils.classobjects import ScoreModificationTemplate
+
+
+class Item(SupportsKeyOrdering):
+    def __init__(self, key: str):
+        self.key = key
+
+    def __repr__(self) -> str:
+        return f"Item({self.key!r})"
+
+
+class Reference:
+    "参考实现：普通列表，按key找的时候从头挨个比，找不到再按是不是同一个对象找"
+
+    def __init__(self):
+        self.items: List[Item] = []
+
+    def find(self, key) -> Optional[int]:
+        for position, item in enumerate(self.items):
+            if item.key == key:
+                return position
+        for position, item in enumerate(self.items):
+            if item is key:
+                return position
+        return None
+
+
+def assert_same(m: IndexedOrderedMap, ref: Reference) -> None:
+    assert list(m) == ref.items
+    assert m.keys() == [item.key for item in ref.items]
+    for key in {item.key for item in ref.items}:
+        position = ref.find(key)
+        assert key in m
+        assert m.index(key) == position
+        assert m[key] is ref.items[position]
+    for position, item in enumerate(ref.items):
+        assert item in m
+        assert m.index(item) == position
+
+
+KEYS = [f"k{i}" for i in range(40)]
+
+
+def step(m: IndexedOrderedMap, ref: Reference, rnd: random.Random) -> IndexedOrderedMap:
+    "随机做一个操作，返回操作之后的列表（pickle之后是新的对象）"
+    op = rnd.choice(
+        "append insert delk deli setk seti swap get contains pop remove sort reverse slice "
+        "rename rename pickle".split()
+    )
+    key = rnd.choice(KEYS)
+    position = ref.find(key)
+    if op == "append":
+        if position is None:
+            item = Item(key)
+            m.append(item)
+            ref.items.append(item)
+        else:
+            with pytest.raises(ValueError):
+                m.append(Item(key))
+    elif op == "insert" and position is None:
+        where = rnd.randint(-len(ref.items) - 2, len(ref.items) + 2)
+        item = Item(key)
+        m.insert(where, item)
+        ref.items.insert(where, item)
+    elif op == "delk":
+        if position is None:
+            with pytest.raises(KeyError):
+                del m[key]
+        else:
+            del m[key]
+            del ref.items[position]
+    elif op == "deli" and ref.items:
+        where = rnd.randrange(-len(ref.items), len(ref.items))
+        del m[where]
+        del ref.items[where]
+    elif op == "setk" and position is not None:
+        item = Item(key)
+        m[key] = item
+        ref.items[position] = item
+    elif op == "seti" and ref.items:
+        where = rnd.randrange(len(ref.items))
+        item = Item(key)
+        if position is None or ref.items[where].key == key:
+            m[where] = item
+            ref.items[where] = item
+        else:
+            with pytest.raises(ValueError):
+                m[where] = item
+    elif op == "swap" and ref.items:
+        left = rnd.randrange(len(ref.items))
+        right = rnd.randrange(len(ref.items))
+        # 按key交换的时候用这个key找到的那个（有重复的key就是前面那个）
+        right_key = ref.items[right].key
+        right = ref.find(right_key)
+        m.swaps(ref.items[left].key if ref.find(ref.items[left].key) == left else left,
+                right_key if rnd.random() < 0.5 else right)
+        ref.items[left], ref.items[right] = ref.items[right], ref.items[left]
+    elif op == "get":
+        assert m.get(key) is (None if position is None else ref.items[position])
+        if position is None:
+            with pytest.raises(KeyError):
+                m[key]  # pylint: disable=pointless-statement
+    elif op == "contains":
+        assert (key in m) == (position is not None)
+        assert Item(key) not in m
+    elif op == "pop" and ref.items:
+        where = rnd.randrange(len(ref.items))
+        assert m.pop(where) is ref.items.pop(where)
+    elif op == "remove" and position is not None:
+        m.remove(key)
+        del ref.items[position]
+    elif op == "sort":
+        m.sort(key=lambda item: item.key)
+        ref.items.sort(key=lambda item: item.key)
+    elif op == "reverse":
+        m.reverse()
+        ref.items.reverse()
+    elif op == "slice" and len(ref.items) > 2:
+        del m[1:3]
+        del ref.items[1:3]
+    elif op == "rename" and ref.items:
+        # 直接改元素的key，不通过列表（大多数改成没用过的，偶尔改成重复的）
+        item = rnd.choice(ref.items)
+        item.key = key if rnd.random() < 0.2 else rnd.choice(KEYS) + "_renamed"
+    elif op == "pickle" and len(set(m.keys())) == len(m):
+        loaded = pickle.loads(pickle.dumps(m))
+        assert type(loaded) is type(m)
+        assert [item.key for item in copy.deepcopy(m)] == m.keys()
+        ref.items = list(loaded)
+        return loaded
+    return m
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_matches_reference(seed):
+    rnd = random.Random(seed)
+    m = IndexedOrderedMap() if seed % 2 else OrderedKeyList([])
+    ref = Reference()
+    for n in range(300):
+        m = step(m, ref, rnd)
+        if n % 3 == 0:
+            assert_same(m, ref)
+    assert_same(m, ref)
+
+
+def test_renamed_item_is_found_by_new_key():
+    items = [Item(k) for k in "abcde"]
+    m = OrderedKeyList(items)
+    assert m.index("d") == 3
+    items[3].key = "z"
+    assert "d" not in m and "z" in m
+    assert m["z"] is items[3] and m.index("z") == 3
+    with pytest.raises(KeyError):
+        m["d"]  # pylint: disable=pointless-statement
+    # 原来的key空出来了，可以放新的；新的key被占了，不能再放
+    m.append(Item("d"))
+    with pytest.raises(ValueError):
+        m.append(Item("z"))
+    assert m.keys() == ["a", "b", "c", "z", "e", "d"]
+
+
+def test_renamed_template_in_ordered_key_list():
+    templates = OrderedKeyList(
+        [ScoreModificationTemplate(f"t{i}", i, f"模板{i}") for i in range(5)]
+    )
+    templates["t2"].key = "renamed"
+    assert templates["renamed"].title == "模板2"
+    assert "t2" not in templates
+    assert templates.to_dict()["renamed"] is templates[2]
+
+
+def test_rename_into_existing_key_finds_the_first():
+    items = [Item(k) for k in "abcd"]
+    m = OrderedKeyList(items)
+    items[3].key = "b"
+    assert m["b"] is items[1]
+    del m["b"]
+    # 前面那个删掉以后就找到后面那个
+    assert m["b"] is items[3] and m.index("b") == 2
+    assert m.keys() == ["a", "c", "b"]
+    items[0].key = "c"
+    # 有重复的key的列表加载回来的时候通不过查重
+    with pytest.raises(ValueError):
+        pickle.loads(pickle.dumps(m))
+
+
+def test_construction_does_not_count_as_rename():
+    before = SupportsKeyOrdering._key_renames
+    m = OrderedKeyList([Item(f"k{i}") for i in range(100)])
+    item = m["k5"]
+    item.key = "k5"  # 没有变
+    assert SupportsKeyOrdering._key_renames == before
+    item.key = "changed"
+    assert SupportsKeyOrdering._key_renames == before + 1
+
+
+class Plain:
+    "不是SupportsKeyOrdering的对象，改key不会被发现"
+
+    def __init__(self, key: str):
+        self.key = key
+
+
+def test_plain_objects_need_reindex():
+    items = [Plain(k) for k in "abc"]
+    m = OrderedKeyList(items)
+    items[1].key = "z"
+    m.reindex()
+    assert m["z"] is items[1] and "b" not in m
@@ -0,0 +1,206 @@
+"""
+存档结构迁移：每一步都从改回旧格式的存档开始迁移，迁移完要和原来的存档一样，再跑一遍不会改动任何一行
+"""
+
+import json
+import os
+import random
+from typing import Callable, Dict, List
+
+import pytest
+
+from utils.classobjects.dataloader import (
+    Chunk,
+    DataObject,
+    iter_archive_records,
+    migrate_archive_rows,
+)
+from utils.classobjects.migrations import (
+    MIGRATIONS,
+    SCHEMA_VERSION_KEY,
+    Migration,
+    latest_schema_version,
+    read_schema_version,
+)
+
+from .helpers import make_db, reachable_objects, save_histories
+
+
+def old_achievement_template(d: Dict) -> bool:
+    "版本1之前的成就模板没有图标、触发时机和说明"
+    for k in ("icon", "when_triggered", "further_info", "condition_info"):
+        d.pop(k, None)
+    return True
+
+
+def old_score_template(d: Dict) -> bool:
+    "版本2之前的分数修改模板没有is_visible"
+    d.pop("is_visible", None)
+    return True
+
+
+def old_class(d: Dict) -> bool:
+    "版本3之前的班级：cleaning拼错了，作业规则是套在里面的json字符串"
+    d["cleaing_mapping"] = d.pop("cleaning_mapping")
+    d["homework_rules"] = [(n, json.dumps(rule)) for n, rule in d["homework_rules"]]
+    return True
+
+
+def old_student(d: Dict) -> bool:
+    "版本4之前的学生没有上次重置信息"
+    d.pop("last_reset_info", None)
+    return True
+
+
+OLD_FORMATS: Dict[int, Callable[[Dict], bool]] = {
+    1: old_achievement_template,
+    2: old_score_template,
+    3: old_class,
+    4: old_student,
+}
+"迁移版本号 -> 把这一步处理的数据改回旧格式的函数"
+
+
+def downgrade(version: int) -> List[Migration]:
+    "把某一步迁移反过来：用migrate_archive_rows把它处理的数据改回旧格式"
+    step = next(m for m in MIGRATIONS if m.version == version)
+    return [Migration(0, f"降级{version}", step.type_names, OLD_FORMATS[version])]
+
+
+def set_schema_version(root: str, version: int) -> None:
+    file = os.path.join(root, "info.json")
+    with open(file, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    if version:
+        info[SCHEMA_VERSION_KEY] = version
+    else:
+        # 加这个功能之前的存档
+        info.pop(SCHEMA_VERSION_KEY)
+    with open(file, "w", encoding="utf-8") as f:
+        json.dump(info, f)
+
+
+def reload(root: str):
+    DataObject.clear_loaded_objects()
+    Chunk.relase_connections()
+    db = Chunk(root).load_data(True, lazy_histories=False)
+    Chunk.relase_connections()
+    return db
+
+
+def signature(db) -> Dict:
+    "此周和历史记录里所有对象的to_dict，(类名, uuid) -> 数据"
+    roots = [db.classes, db.templates, db.achievements]
+    roots += [history.classes for history in db.history_data.values()]
+    return {
+        (type(obj).__name__, str(obj.uuid)): json.loads(json.dumps(obj.to_dict(), default=str))
+        for obj in reachable_objects(roots).values()
+    }
+
+
+def count_rows(chunk: Chunk, type_names) -> int:
+    return sum(
+        1
+        for path in chunk.archive_paths()
+        for _, type_name, _, _ in iter_archive_records(path)
+        if type_name in type_names
+    )
+
+
+@pytest.fixture(params=["sharded", "single"])
+def archive(request, tmp_path, monkeypatch):
+    "此周加上两个历史记录的存档（老存档都是json编码的），和它加载回来的样子"
+    monkeypatch.setattr(Chunk, "codec", "json")
+    chunk = Chunk(str(tmp_path / "data"), make_db(records=300), request.param)
+    save_histories(chunk, 2, random.Random(14))
+    assert read_schema_version(chunk.path) == latest_schema_version()
+    return chunk, signature(reload(chunk.path))
+
+
+def test_migrations_are_registered_in_order():
+    assert [m.version for m in MIGRATIONS] == sorted(OLD_FORMATS)
+    assert latest_schema_version() == max(OLD_FORMATS)
+
+
+@pytest.mark.parametrize("version", sorted(OLD_FORMATS))
+def test_step_migrates_old_rows(archive, version):
+    chunk, expected = archive
+    type_names = next(m for m in MIGRATIONS if m.version == version).type_names
+    old_rows = sum(migrate_archive_rows(path, downgrade(version)) for path in chunk.archive_paths())
+    assert old_rows == count_rows(chunk, type_names) > 0
+    set_schema_version(chunk.path, version - 1)
+
+    assert Chunk(chunk.path).migrate_schema() == old_rows
+    assert read_schema_version(chunk.path) == latest_schema_version()
+    db = reload(chunk.path)
+    assert db.schema_version == latest_schema_version()
+    assert signature(db) == expected
+
+
+def test_all_steps_from_unversioned_archive(archive):
+    chunk, expected = archive
+    for version in OLD_FORMATS:
+        for path in chunk.archive_paths():
+            migrate_archive_rows(path, downgrade(version))
+    set_schema_version(chunk.path, 0)
+    assert read_schema_version(chunk.path) == 0
+
+    changed = Chunk(chunk.path).migrate_schema()
+    all_types = {t for m in MIGRATIONS for t in m.type_names}
+    assert changed == count_rows(chunk, all_types)
+    assert signature(reload(chunk.path)) == expected
+
+    # 幂等：再跑一遍所有迁移不会改动任何一行
+    assert sum(migrate_archive_rows(path, MIGRATIONS) for path in chunk.archive_paths()) == 0
+    set_schema_version(chunk.path, 0)
+    assert Chunk(chunk.path).migrate_schema() == 0
+    assert read_schema_version(chunk.path) == latest_schema_version()
+    assert signature(reload(chunk.path)) == expected
+
+
+def test_up_to_date_archive_is_not_touched(archive):
+    chunk, expected = archive
+    info = os.path.join(chunk.path, "info.json")
+    mtime = os.stat(info).st_mtime_ns
+    assert Chunk(chunk.path).migrate_schema() == 0
+    assert os.stat(info).st_mtime_ns == mtime
+
+
+@pytest.mark.parametrize(
+    "version, old, new",
+    [
+        (
+            3,
+            {"key": "c", "cleaing_mapping": [["a", 1]]},
+            {"key": "c", "cleaning_mapping": [["a", 1]], "groups": [], "homework_rules": []},
+        ),
+        (
+            3,
+            {"key": "c", "cleaing_mapping": [], "cleaning_mapping": [["b", 2]], "groups": [],
+             "homework_rules": [["语文", '{"a": 1}'], ["数学", {"b": 2}]]},
+            {"key": "c", "cleaning_mapping": [["b", 2]], "groups": [],
+             "homework_rules": [("语文", {"a": 1}), ("数学", {"b": 2})]},
+        ),
+        (4, {"name": "s"}, {"name": "s", "last_reset_info": None}),
+        (2, {"key": "不存在的模板"}, {"key": "不存在的模板", "is_visible": True}),
+    ],
+)
+def test_step_on_handwritten_rows(version, old, new):
+    step = next(m for m in MIGRATIONS if m.version == version).step
+    assert step(old)
+    assert old == new
+    assert not step(old)
+    assert old == new
+
+
+@pytest.mark.parametrize("version", sorted(OLD_FORMATS))
+def test_old_rows_differ_without_migration(archive, version):
+    "旧格式的数据不迁移直接加载是不一样的（说明上面的测试确实测到了迁移）"
+    chunk, expected = archive
+    for path in chunk.archive_paths():
+        migrate_archive_rows(path, downgrade(version))
+    try:
+        db = reload(chunk.path)
+    except Exception:
+        return
+    assert signature(db) != expected
@@ -0,0 +1,153 @@
+"""
+加载对象的缓存：大小有上限，淘汰之后还活着的对象再次加载是同一个实例
+"""
+
+import gc
+import random
+import tracemalloc
+
+import pytest
+
+from utils.classobjects import DEFAULT_CLASS_KEY, Student
+from utils.classobjects.dataloader import Chunk, DataObject
+from utils.classobjects.objectcache import ObjectCache
+
+from .helpers import make_db, save_histories
+
+
+def make_objects(count: int):
+    return [Student(f"s{i}", i, 0.0, DEFAULT_CLASS_KEY) for i in range(count)]
+
+
+def test_size_stays_within_limits():
+    cache = ObjectCache(max_objects=10, max_bytes=1000)
+    rnd = random.Random(11)
+    objects = make_objects(200)
+    for i, obj in enumerate(objects):
+        cache.put(("h", "Student", i), obj, size=rnd.randint(1, 300))
+        assert len(cache.entries) <= 10
+        assert cache.total_bytes <= 1000
+        assert cache.total_bytes == sum(size for _, size in cache.entries.values())
+    assert cache.evictions == 200 - len(cache.entries)
+
+
+def test_least_recently_used_is_evicted_first():
+    cache = ObjectCache(max_objects=3)
+    objects = make_objects(4)
+    for i in range(3):
+        cache[("h", "Student", i)] = objects[i]
+    cache[("h", "Student", 0)]  # 用过一次，变成最新的
+    cache[("h", "Student", 3)] = objects[3]
+    assert list(cache.entries) == [("h", "Student", i) for i in (2, 0, 3)]
+
+
+def test_evicted_objects_that_are_alive_come_back_as_the_same_instance():
+    cache = ObjectCache(max_objects=5)
+    objects = make_objects(50)
+    for i, obj in enumerate(objects):
+        cache[("h", "Student", i)] = obj
+    assert len(cache.entries) == 5
+    for i in random.Random(3).sample(range(45), 20):
+        assert cache[("h", "Student", i)] is objects[i]
+        assert len(cache.entries) <= 5
+    assert cache.revived == 20
+
+
+def test_evicted_objects_that_died_are_gone():
+    cache = ObjectCache(max_objects=5)
+    objects = make_objects(50)
+    for i, obj in enumerate(objects):
+        cache[("h", "Student", i)] = obj
+    kept = objects[:10]
+    del objects
+    gc.collect()
+    for i in range(10, 45):
+        assert ("h", "Student", i) not in cache
+        with pytest.raises(KeyError):
+            cache[("h", "Student", i)]
+    assert all(cache[("h", "Student", i)] is kept[i] for i in range(10))
+    assert len(cache.weak) <= 15
+
+
+def test_pinned_histories_are_not_evicted_or_counted():
+    cache = ObjectCache(max_objects=3)
+    pinned, others = make_objects(20), make_objects(20)
+    for i, obj in enumerate(pinned):
+        cache[(None, "Student", i)] = obj
+    for i, obj in enumerate(others):
+        cache[("h", "Student", i)] = obj
+    assert len(cache.pinned) == 20 and len(cache.entries) == 3
+    cache.unpin(None)
+    assert len(cache.pinned) == 0 and len(cache.entries) == 3
+    cache.pin("h")
+    assert all(key[0] == "h" for key in cache.pinned)
+
+
+def test_release_history_drops_weak_references_too():
+    cache = ObjectCache(max_objects=5)
+    objects = make_objects(20)
+    for i, obj in enumerate(objects):
+        cache[("h", "Student", i)] = obj
+        cache[("g", "Student", i)] = obj
+    cached = sum(1 for key in cache.entries if key[0] == "h")
+    assert cache.release_history("h") == cached > 0
+    assert all(("h", "Student", i) not in cache for i in range(20))
+    assert cache[("g", "Student", 0)] is objects[0]
+
+
+def test_loading_histories_with_a_small_cache(tmp_path, monkeypatch):
+    chunk = Chunk(str(tmp_path / "data"), make_db(records=100))
+    save_histories(chunk, 4, random.Random(5))
+    cache = ObjectCache(max_objects=50)
+    monkeypatch.setattr(DataObject, "loaded_object_list", cache)
+    uuids = chunk.catalog.saved_uuids()
+
+    loaded = Chunk(chunk.path)
+    first = [loaded.load_history(u) for u in uuids]
+    assert len(cache.entries) <= 50
+    assert cache.evictions > 0
+    # 第一次加载的历史记录都还活着，再加载一遍拿到的是同一批对象
+    again = [loaded.load_history(u) for u in uuids]
+    for a, b in zip(first, again):
+        for key, cls in a.classes.items():
+            assert b.classes[key] is cls
+            for num, student in cls.students.items():
+                assert b.classes[key].students[num] is student
+    assert cache.revived > 0
+    assert len(cache.entries) <= 50
+
+
+@pytest.mark.parametrize("count", [24, pytest.param(200, marks=pytest.mark.slow)])
+def test_soak_many_archives_under_byte_limit(tmp_path, monkeypatch, count):
+    "一个接一个加载很多存档：缓存的字节估计不超过上限，填满以后占的内存不再跟着存档数量涨"
+    chunk = Chunk(str(tmp_path / "data"), make_db(records=100))
+    save_histories(chunk, count, random.Random(11))
+    chunk.bound_db.history_data.clear()
+    cache = ObjectCache(max_bytes=2 * 1024 * 1024)
+    monkeypatch.setattr(DataObject, "loaded_object_list", cache)
+    uuids = chunk.catalog.saved_uuids()
+    assert len(uuids) == count
+
+    loader = Chunk(chunk.path)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        memory = []
+        full = None
+        for i, history_uuid in enumerate(uuids):
+            history = loader.load_history(history_uuid)
+            del history
+            # 和平常加载完一样关掉连接，不然每个存档的连接都留在连接池里
+            Chunk.relase_connections()
+            gc.collect()
+            assert cache.total_bytes <= cache.max_bytes
+            memory.append(tracemalloc.get_traced_memory()[0])
+            if full is None and cache.evictions:
+                full = i
+    finally:
+        tracemalloc.stop()
+    assert full is not None and full < count // 2, "缓存没有填满，测不出来"
+    # 填满之前每个存档都会多占一些，填满以后只剩字典扩容之类的抖动
+    filling = memory[full] - memory[0]
+    settled = max(memory[full:]) - memory[full]
+    assert settled < filling / 2, (filling, settled)
@@ -0,0 +1,90 @@
+"""
+pickle存档：v2格式读写，旧格式（base85文本）的读取和转换
+"""
+
+import base64
+import os
+import random
+
+import dill
+import pytest
+
+from utils.classobjects.picklefile import (
+    _B85_CHUNK,
+    PICKLE_MAGIC,
+    convert_legacy_pickle,
+    dump_pickle,
+    is_legacy_pickle,
+    load_pickle,
+)
+
+
+def sample_data(size: int):
+    rnd = random.Random(size)
+    return {
+        "rows": [(i, rnd.random(), str(rnd.getrandbits(64))) for i in range(size)],
+        "blob": bytes(rnd.getrandbits(8) for _ in range(size)),
+    }
+
+
+def write_legacy(obj, path: str) -> None:
+    "原来ClassObj.save_data_strict的写法"
+    with open(path, "wb") as f:
+        f.write(base64.b85encode(dill.dumps(obj, protocol=dill.HIGHEST_PROTOCOL)))
+
+
+@pytest.mark.parametrize("compress", [True, False])
+@pytest.mark.parametrize("size", [0, 10, 50000])
+def test_round_trip(tmp_path, compress, size):
+    path = str(tmp_path / "data.datas")
+    obj = sample_data(size)
+    assert dump_pickle(obj, path, compress=compress) == os.path.getsize(path)
+    assert not is_legacy_pickle(path)
+    assert load_pickle(path) == obj
+    assert not os.path.exists(path + ".writing")
+
+
+@pytest.mark.parametrize("size", [0, 10, 50000])
+def test_legacy_read_and_convert(tmp_path, size):
+    # 50000条的时候base85文本比_B85_CHUNK长很多，要分很多段解码
+    path = str(tmp_path / "data.datas")
+    obj = sample_data(size)
+    write_legacy(obj, path)
+    assert size < 50000 or os.path.getsize(path) > 10 * _B85_CHUNK
+    assert is_legacy_pickle(path)
+    assert load_pickle(path) == obj
+    assert convert_legacy_pickle(path)
+    assert not is_legacy_pickle(path)
+    assert load_pickle(path) == obj
+    assert not convert_legacy_pickle(path)
+
+
+def test_convert_to_other_file(tmp_path):
+    src, dst = str(tmp_path / "old.datas"), str(tmp_path / "new.datas")
+    obj = sample_data(100)
+    write_legacy(obj, src)
+    with open(src, "rb") as f:
+        legacy = f.read()
+    assert convert_legacy_pickle(src, dst, compress=False)
+    with open(src, "rb") as f:
+        assert f.read() == legacy
+    assert load_pickle(dst) == obj
+
+
+def test_truncated_file_fails(tmp_path):
+    path = str(tmp_path / "data.datas")
+    dump_pickle(sample_data(5000), path)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[: len(data) // 2])
+    with pytest.raises(Exception):
+        load_pickle(path)
+
+
+def test_unknown_version_fails(tmp_path):
+    path = str(tmp_path / "data.datas")
+    with open(path, "wb") as f:
+        f.write(PICKLE_MAGIC + bytes((99, 0)))
+    with pytest.raises(ValueError):
+        load_pickle(path)
@@ -0,0 +1,172 @@
+"""
+排名索引：随机增删改之后，所有排名都要和直接排一遍的结果一样（分数故意取得很集中，同分很多）
+"""
+
+import copy
+import random
+import types
+from typing import Dict, List, Tuple
+
+import pytest
+
+from utils.algorithm import RankingIndex
+from utils.classobjects import DEFAULT_CLASSES, Student
+
+
+class Item:
+    "只有分数和编号的对象"
+
+    def __init__(self, num: int, score: float):
+        self.num = num
+        self.score = score
+
+    def __repr__(self) -> str:
+        return f"Item({self.num}, {self.score})"
+
+
+def naive_order(items) -> list:
+    "从高分到低分，同分按编号从小到大"
+    return sorted(items, key=lambda item: (-item.score, item.num))
+
+
+def naive_competition(items) -> List[Tuple[int, object]]:
+    order = naive_order(items)
+    return [(1 + sum(other.score > item.score for other in order), item) for item in order]
+
+
+def naive_dense(items) -> List[Tuple[int, object]]:
+    order = naive_order(items)
+    scores = sorted({item.score for item in order}, reverse=True)
+    return [(scores.index(item.score) + 1, item) for item in order]
+
+
+def naive_ascending(items) -> list:
+    return sorted(items, key=lambda item: (item.score, item.num))
+
+
+def assert_same(index: RankingIndex, members: Dict[int, Item]) -> None:
+    items = list(members.values())
+    assert len(index) == len(items)
+    assert list(index) == naive_order(items)
+    assert index.competition_ranking() == naive_competition(items)
+    assert index.dense_ranking() == naive_dense(items)
+    assert index.ascending() == naive_ascending(items)
+    assert index.distinct_count == len({item.score for item in items})
+    assert index.first() is (naive_order(items)[0] if items else None)
+    for k in (0, 1, 3, len(items) + 1):
+        assert index.top(k) == naive_order(items)[:k]
+    competition = {id(item): rank for rank, item in naive_competition(items)}
+    dense = {id(item): rank for rank, item in naive_dense(items)}
+    for item in items:
+        assert item in index
+        assert index.competition_rank(item) == competition[id(item)]
+        assert index.dense_rank(item) == dense[id(item)]
+
+
+SCORES = [0, 0.5, 1, 1, 2, 3, -1, -2.5, 10, 100]
+"分数从这里面取，同分的很多"
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_index_matches_naive_sort(seed):
+    rnd = random.Random(seed)
+    members = {n: Item(n, rnd.choice(SCORES)) for n in range(rnd.randint(0, 30))}
+    index = RankingIndex(members.values())
+    assert_same(index, members)
+    next_num = len(members)
+    for step in range(1500):
+        action = rnd.random()
+        if members and action < 0.5:
+            item = rnd.choice(list(members.values()))
+            item.score = rnd.choice(SCORES) + rnd.choice([0, 0, 0.1])
+            index.update(item)
+        elif members and action < 0.65:
+            item = members.pop(rnd.choice(list(members)))
+            assert index.remove(item)
+            assert not index.remove(item)
+            assert item not in index
+        elif members and action < 0.7:
+            # 编号一样的新对象替换掉原来的
+            num = rnd.choice(list(members))
+            old = members[num]
+            members[num] = Item(num, rnd.choice(SCORES))
+            index.add(members[num])
+            assert old not in index
+            assert not index.remove(old)
+            old.score += 1
+            index.update(old)  # 不在索引里的不管
+        elif action < 0.75:
+            # 分数没变也可以update
+            for item in members.values():
+                index.update(item)
+        else:
+            members[next_num] = Item(next_num, rnd.choice(SCORES))
+            index.add(members[next_num])
+            next_num += 1
+        if step % 7 == 0:
+            assert_same(index, members)
+    assert_same(index, members)
+
+
+def test_cached_results_follow_changes():
+    items = [Item(n, n % 3) for n in range(9)]
+    index = RankingIndex(items)
+    first = index.dense_ranking()
+    assert index.dense_ranking() is first
+    items[0].score = 5
+    index.update(items[0])
+    assert index.dense_ranking() is not first
+    assert index.dense_ranking() == naive_dense(items)
+    with pytest.raises(KeyError):
+        index.competition_rank(Item(100, 0))
+
+
+def class_ranks(cls) -> dict:
+    "班级上所有和排名有关的结果，用学号表示学生"
+    observer = types.SimpleNamespace(class_id=cls.key, target_class=cls)
+    return {
+        "competition": [(rank, s.num) for rank, s in cls.rank_non_dumplicate],
+        "dense": [(rank, s.num) for rank, s in cls.rank_dumplicate],
+        "ascending": {rank: s.num for rank, s in cls.stu_score_ord.items()},
+        "student": {s.num: s.get_dumplicated_ranking(observer) for s in cls.students.values()},
+    }
+
+
+def naive_class_ranks(cls) -> dict:
+    students = list(cls.students.values())
+    competition = naive_competition(students)
+    return {
+        "competition": [(rank, s.num) for rank, s in competition],
+        "dense": [(rank, s.num) for rank, s in naive_dense(students)],
+        "ascending": {rank: s.num for rank, s in enumerate(naive_ascending(students), start=1)},
+        "student": {s.num: rank for rank, s in competition},
+    }
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_class_ranking_matches_naive_sort(seed):
+    rnd = random.Random(seed)
+    cls = copy.deepcopy(list(DEFAULT_CLASSES.values())[0])
+    for step in range(1000):
+        action = rnd.random()
+        students = list(cls.students.values())
+        if action < 0.7:
+            rnd.choice(students).score = rnd.choice(SCORES) + rnd.choice([0, 0, 0.1])
+        elif action < 0.8 and len(students) > 2:
+            del cls.students[rnd.choice(students).num]
+            cls.invalidate_indexes()
+        elif action < 0.9:
+            num = max(cls.students) + 1
+            cls.students[num] = Student("新学生", num, rnd.choice(SCORES), cls.key, {})
+            cls.invalidate_indexes()
+        elif action < 0.95:
+            # 改学号（学生字典和人数都没变）
+            student = rnd.choice(students)
+            del cls.students[student.num]
+            student.num = max(students, key=lambda s: s.num).num + 1
+            cls.students[student.num] = student
+        else:
+            # 换了整个学生字典
+            cls.students = dict(cls.students)
+        if step % 10 == 0:
+            assert class_ranks(cls) == naive_class_ranks(cls)
@@ -0,0 +1,221 @@
+"""
+还原点：每一个还原点都要能逐字节地恢复出来（包括删掉多余文件和只恢复一个子文件夹）
+"""
+
+import copy
+import os
+import random
+import shutil
+import time
+import uuid
+from typing import Dict
+
+import pytest
+
+from utils.classobjects import History, ScoreModification
+from utils.classobjects.classdataobj import ClassDataObj
+from utils.classobjects.dataloader import Chunk
+from utils.recovery import RecoveryStore, RetentionPolicy, iter_files
+
+from .helpers import make_db
+
+
+def tree(root: str) -> Dict[str, bytes]:
+    "文件夹里所有文件的内容，相对路径 -> 内容"
+    result = {}
+    for rel, path in iter_files(root):
+        with open(path, "rb") as f:
+            result[rel] = f.read()
+    return result
+
+
+def mtimes(root: str) -> Dict[str, int]:
+    return {rel: os.stat(path).st_mtime_ns for rel, path in iter_files(root)}
+
+
+def write(root: str, rel: str, data: bytes) -> None:
+    path = os.path.join(root, *rel.split("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def random_bytes(rnd: random.Random, size: int) -> bytes:
+    return bytes(rnd.getrandbits(8) for _ in range(size))
+
+
+def mutate(root: str, rnd: random.Random) -> None:
+    "随机增加、修改、删除一些文件（内容有的会和别的文件重复）"
+    files = sorted(tree(root))
+    for _ in range(rnd.randint(1, 6)):
+        action = rnd.random()
+        if files and action < 0.3:
+            os.remove(os.path.join(root, *rnd.choice(files).split("/")))
+        elif files and action < 0.6:
+            write(root, rnd.choice(files), random_bytes(rnd, rnd.randint(0, 3000)))
+        else:
+            depth = rnd.randint(0, 3)
+            rel = "/".join(
+                [rnd.choice(["a", "b", "c", "u", "u2"]) for _ in range(depth)]
+                + [f"f{rnd.randint(0, 40)}.db"]
+            )
+            if any(f.startswith(rel + "/") for f in files) or any(
+                rel.startswith(f + "/") for f in files
+            ):
+                continue
+            data = rnd.choice([b"", b"same content", random_bytes(rnd, rnd.randint(1, 5000))])
+            write(root, rel, data)
+        files = sorted(tree(root))
+
+
+@pytest.fixture
+def points(tmp_path):
+    """
+    随机改动一个文件夹，每次改完创建一个还原点。
+
+    :return: (还原点存储, {还原点id: 创建时的文件内容})
+    """
+    rnd = random.Random(15)
+    source = str(tmp_path / "source")
+    os.makedirs(source)
+    store = RecoveryStore(str(tmp_path / "backups"))
+    expected = {}
+    for _ in range(15):
+        mutate(source, rnd)
+        manifest, _ = store.create(source)
+        expected[manifest.point_id] = tree(source)
+        time.sleep(0.002)
+    return store, expected
+
+
+def test_points_share_objects(points):
+    store, expected = points
+    stored = sum(1 for _ in iter_files(store.objects_path))
+    assert stored < sum(len(files) for files in expected.values())
+    assert all(not store.verify(point_id) for point_id in expected)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_restore_every_point(points, tmp_path, seed):
+    store, expected = points
+    target = str(tmp_path / "target")
+    order = list(expected)
+    random.Random(seed).shuffle(order)
+    for point_id in order + order[::-1]:
+        before = tree(target) if os.path.isdir(target) else {}
+        stats = store.restore(point_id, target)
+        assert tree(target) == expected[point_id], point_id
+        assert stats.deleted == len(set(before) - set(expected[point_id]))
+        assert stats.written + stats.unchanged == len(expected[point_id])
+        manifest = store.get(point_id)
+        assert mtimes(target) == {rel: entry[2] for rel, entry in manifest.files.items()}
+        # 再恢复一遍什么都不用写
+        assert store.restore(point_id, target) == (0, len(expected[point_id]), 0)
+
+
+def test_restore_removes_extra_files_and_empty_folders(points, tmp_path):
+    store, expected = points
+    point_id = list(expected)[-1]
+    target = str(tmp_path / "target")
+    store.restore(point_id, target)
+    write(target, "extra.txt", b"x")
+    write(target, "new/deep/folder/file.db", b"y")
+    write(target, "new/deep/other.db-journal", b"z")
+    stats = store.restore(point_id, target)
+    assert stats.deleted == 3
+    assert tree(target) == expected[point_id]
+    assert not os.path.exists(os.path.join(target, "new"))
+
+
+def test_restore_replaces_conflicting_files_and_folders(tmp_path):
+    source, target = str(tmp_path / "source"), str(tmp_path / "target")
+    write(source, "a/b.db", b"1")
+    write(source, "c", b"2")
+    store = RecoveryStore(str(tmp_path / "backups"))
+    manifest, _ = store.create(source)
+    # 还原点里a是文件夹、c是文件，恢复的地方反过来
+    write(target, "a", b"file where a folder should be")
+    write(target, "c/d.db", b"folder where a file should be")
+    write(target, "c/e/f.db", b"")
+    stats = store.restore(manifest.point_id, target)
+    assert tree(target) == tree(source)
+    assert stats == (2, 0, 3)
+
+
+def test_restore_with_prefix(points, tmp_path):
+    store, expected = points
+    for point_id, files in expected.items():
+        for prefix in ("u", "u/", "a/b"):
+            target = str(tmp_path / "prefix" / prefix.strip("/").replace("/", "_"))
+            # 恢复的地方原来有的文件都不在这个前缀下面，都要删掉
+            write(target, "leftover.db", b"old")
+            store.restore(point_id, target, prefix)
+            start = prefix.rstrip("/") + "/"  # "u"不能匹配到"u2/..."
+            assert tree(target) == {
+                rel[len(start):]: data for rel, data in files.items() if rel.startswith(start)
+            }
+
+
+def test_missing_object_leaves_target_untouched(points, tmp_path):
+    store, expected = points
+    point_id = next(p for p, files in expected.items() if files)
+    target = str(tmp_path / "target")
+    write(target, "keep.db", b"keep")
+    digest = next(iter(store.get(point_id).files.values()))[0]
+    os.remove(store.object_path(digest))
+    with pytest.raises(FileNotFoundError):
+        store.restore(point_id, target)
+    assert tree(target) == {"keep.db": b"keep"}
+    with pytest.raises(FileNotFoundError):
+        store.restore("不存在的还原点", target)
+
+
+def test_pruned_store_still_restores(points, tmp_path):
+    store, expected = points
+    # 把还原点的时间分散到过去一个月里
+    now = time.time()
+    for i, manifest in enumerate(store.points()):
+        store._write_manifest(manifest._replace(create_time=now - (len(expected) - i) * 86400 * 2))
+    removed, _ = store.prune(RetentionPolicy(keep_last=2, keep_daily=3, keep_weekly=2))
+    left = [m.point_id for m in store.points()]
+    assert removed and left and set(removed) | set(left) == set(expected)
+    target = str(tmp_path / "target")
+    for point_id in left:
+        assert not store.verify(point_id)
+        store.restore(point_id, target)
+        assert tree(target) == expected[point_id]
+
+
+def test_restore_real_archives(tmp_path):
+    "真实的存档文件夹：每保存一次创建一个还原点，之后恢复出来的存档逐字节一样"
+    rnd = random.Random(5)
+    source = str(tmp_path / "chunks")
+    store = RecoveryStore(str(tmp_path / "backups"))
+    db = make_db(records=200)
+    chunk = Chunk(os.path.join(source, "user"), db).track_changes()
+    chunk.save_data(full=True)
+    expected = {}
+    students = [s for c in db.classes.values() for s in c.students.values()]
+    templates = list(db.templates.values())
+    for k in range(6):
+        for student in rnd.sample(students, 5):
+            ScoreModification(rnd.choice(templates), student).execute()
+        if k % 3 == 2:
+            ClassDataObj.set_archive_uuid(str(uuid.uuid4()))
+            history = History(copy.deepcopy(db.classes), db.weekday_record, time.time() + k)
+            db.history_data[history.time] = history
+        chunk.save_data()
+        Chunk.relase_connections()
+        manifest, stats = store.create(source)
+        assert stats.hashed < stats.files or k == 0
+        expected[manifest.point_id] = tree(source)
+        time.sleep(0.002)
+    target = str(tmp_path / "restored")
+    for point_id in reversed(list(expected)):
+        store.restore(point_id, target)
+        assert tree(target) == expected[point_id]
+        store.restore(point_id, str(tmp_path / "user_only"), "user")
+        assert tree(str(tmp_path / "user_only")) == {
+            rel[5:]: data for rel, data in expected[point_id].items() if rel.startswith("user/")
+        }
+    shutil.rmtree(target)
@@ -0,0 +1,197 @@
+"""
+uuid登记表：在随机构造的数据上，ClassObj.find_with_uuid要和原来挨个扫一遍的结果一模一样
+"""
+
+import copy
+import gc
+import random
+import time
+import types
+import uuid as uuid_module
+
+import pytest
+
+from utils.algorithm import OrderedKeyList
+from utils.classobjects import (
+    DEFAULT_ACHIEVEMENTS,
+    DEFAULT_CLASSES,
+    DEFAULT_SCORE_TEMPLATES,
+    Achievement,
+    History,
+    HomeworkRule,
+    ScoreModification,
+)
+from utils.classobjects.classobj import ClassObj
+from utils.classobjects.dataloader import Chunk, DataObject
+from utils.classobjects.registry import uuid_registry
+
+from .helpers import database_roots, make_db, reachable_objects, save_histories
+
+KINDS = ["modify", "modify_template", "achievement", "achievement_template", "student", "group"]
+
+def class_obj(db):
+    "find_with_uuid只用到classes和两种模板"
+    return types.SimpleNamespace(
+        classes=db.classes,
+        modify_templates=OrderedKeyList(db.templates),
+        achievement_templates=OrderedKeyList(db.achievements).to_dict(),
+    )
+
+
+def old_scan(obj, uuid, kind):
+    "原来的find_with_uuid：挨个扫一遍，找不到为None"
+    number = uuid_module.UUID(str(uuid)).int
+    students = [s for c in obj.classes.values() for s in c.students.values()]
+    table = {
+        "modify": lambda: (m for s in students for m in s.history.values()),
+        "modify_template": lambda: obj.modify_templates.values(),
+        "achievement": lambda: (a for s in students for a in s.achievements.values()),
+        "achievement_template": lambda: obj.achievement_templates.values(),
+        "student": lambda: students,
+        "group": lambda: (g for c in obj.classes.values() for g in c.groups.values()),
+    }
+    for kind in KINDS if kind == "any" else [kind]:
+        for candidate in table[kind]():
+            if candidate.uuid.int == number:
+                return candidate
+    return None
+
+
+def find(obj, uuid, kind):
+    try:
+        return ClassObj.find_with_uuid(obj, uuid, kind)
+    except ValueError:
+        return None
+
+
+def shuffle_graph(db, rnd: random.Random) -> list:
+    """
+    随机改动数据：发成就、撤回和删掉点评、重置学生、换uuid、深拷贝出历史记录。
+
+    :return: 改动过程中出现过的所有对象（包括已经不在此周数据里的）
+    """
+    students = [s for c in db.classes.values() for s in c.students.values()]
+    # 从存档加载出来的模板是列表
+    templates = list(OrderedKeyList(db.templates).values())
+    achievement_templates = list(OrderedKeyList(db.achievements).values())
+    for i in range(rnd.randint(10, 100)):
+        Achievement(
+            rnd.choice(achievement_templates), rnd.choice(students), reach_time_key=i
+        ).give()
+    for _ in range(rnd.randint(10, 100)):
+        ScoreModification(rnd.choice(templates), rnd.choice(students)).execute()
+    seen = list(reachable_objects([db.classes, db.templates, db.achievements]).values())
+    modifications = [m for s in students for m in s.history.values()]
+    for m in rnd.sample(modifications, len(modifications) // 10):
+        m.retract()
+    for m in rnd.sample(modifications, len(modifications) // 10):
+        m.target.history.pop(m.execute_time_key, None)
+    for obj in rnd.sample(seen, 20):
+        obj.refresh_uuid()
+    # 深拷贝出来的副本uuid一样，也会登记，不能被当成此周的对象
+    history = History(copy.deepcopy(db.classes), {}, time.time())
+    seen += list(reachable_objects([history.classes]).values())
+    for student in rnd.sample(students, 3):
+        student.reset()
+    # 构造出来但是没有放进数据里的对象
+    seen.append(ScoreModification(rnd.choice(templates), rnd.choice(students)))
+    return seen
+
+
+def check(obj, seen, rnd: random.Random, checks: int = 2000) -> None:
+    pool = [o.uuid for o in seen] + [uuid_module.uuid4() for _ in range(50)]
+    for _ in range(checks):
+        uuid = rnd.choice(pool)
+        if rnd.random() < 0.3:
+            uuid = rnd.choice([str(uuid), uuid.hex])
+        kind = rnd.choice(KINDS + ["any"])
+        expected = old_scan(obj, uuid, kind)
+        if expected is not None:
+            # 此周的对象都要能直接从登记表里查到，不用回退到挨个扫
+            assert any(
+                c is expected for c in uuid_registry.candidates(uuid, [expected.chunk_type_name])
+            )
+        assert find(obj, uuid, kind) is expected, (uuid, kind)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_find_matches_scan(seed):
+    rnd = random.Random(seed)
+    db = make_db(records=rnd.randint(200, 1500))
+    seen = shuffle_graph(db, rnd)
+    check(class_obj(db), seen, rnd)
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_find_matches_scan_after_reload(tmp_path, seed):
+    rnd = random.Random(seed)
+    db = make_db(records=rnd.randint(200, 1500))
+    seen = shuffle_graph(db, rnd)
+    chunk = Chunk(str(tmp_path / "data"), db)
+    chunk.save_data(full=True)
+    Chunk.relase_connections()
+    DataObject.clear_loaded_objects()
+    loaded = Chunk(chunk.path).load_data()
+    Chunk.relase_connections()
+    # 原来的对象也还活着，uuid一样
+    seen += list(reachable_objects([loaded.classes]).values())
+    check(class_obj(loaded), seen, rnd)
+    seen = shuffle_graph(loaded, rnd)
+    check(class_obj(loaded), seen, rnd)
+
+
+def test_history_objects_are_registered_per_archive(tmp_path):
+    chunk = Chunk(str(tmp_path / "data"), make_db(records=300))
+    save_histories(chunk, 2, random.Random(16))
+    first, second = chunk.catalog.saved_uuids()
+    DataObject.clear_loaded_objects()
+    history = chunk.load_history(first, lazy=True)
+    # 历史记录里用到的此周的模板还是此周的对象；作业规则存在班级的数据里面，不是单独加载的
+    current = reachable_objects(database_roots(chunk.bound_db))
+
+    def loaded_objects(classes):
+        return [
+            o
+            for o in reachable_objects([classes]).values()
+            if id(o) not in current and not isinstance(o, HomeworkRule)
+        ]
+
+    objects = loaded_objects(history.classes)
+    assert len(objects) > 300
+    for obj in objects:
+        assert uuid_registry.get(obj.uuid, [obj.chunk_type_name], first) is obj
+        # 此周没有这个历史记录的对象
+        assert all(c is not obj for c in uuid_registry.candidates(obj.uuid, [obj.chunk_type_name]))
+    assert history.unload()
+    assert all(
+        uuid_registry.get(obj.uuid, [obj.chunk_type_name], first) is None for obj in objects
+    )
+
+    objects = loaded_objects(chunk.load_history(second).classes)
+    assert chunk.del_history(second)
+    assert all(
+        uuid_registry.get(obj.uuid, [obj.chunk_type_name], second) is None for obj in objects
+    )
+
+
+def test_dead_objects_leave_the_registry():
+    # 默认数据是全局的，一直活着；make_db里深拷贝出来的学生和默认班级的学生uuid一样
+    defaults = reachable_objects(
+        [DEFAULT_CLASSES.to_dict(), DEFAULT_SCORE_TEMPLATES.to_dict(), DEFAULT_ACHIEVEMENTS]
+    )
+    default_uuids = {o.uuid.int for o in defaults.values()}
+    gc.collect()
+    before = len(uuid_registry)
+    db = make_db(records=500)
+    # uuid第一次读的时候才生成、登记
+    uuids = [
+        (o.uuid, o.chunk_type_name)
+        for o in reachable_objects(database_roots(db)).values()
+        if o.uuid.int not in default_uuids
+    ]
+    assert len(uuids) > 500
+    assert all(uuid_registry.get(u, [t]) is not None for u, t in uuids)
+    del db
+    gc.collect()
+    assert len(uuid_registry) <= before
+    assert all(uuid_registry.get(u, [t]) is None for u, t in uuids)
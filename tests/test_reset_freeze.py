@@ -0,0 +1,117 @@
+"""
+重置分数：重置前的学生冻结成一个版本放进历史记录，冻结的版本上的点评不能再撤回、执行，也不能再发成就
+"""
+
+import types
+
+import pytest
+
+from utils.algorithm import OrderedKeyList, Stack
+from utils.classobjects import DEFAULT_CLASS_KEY, Achievement, ScoreModification
+from utils.classobjects.classobj import ClassObj
+
+from .helpers import make_db
+
+
+class FakeClassObj(ClassObj):
+    "只有重置分数和撤回点评要用到的东西"
+
+    def __init__(self, db):  # pylint: disable=super-init-not-called
+        self.classes = db.classes
+        self.modify_templates = OrderedKeyList(db.templates)
+        self.achievement_templates = dict(db.achievements)
+        self.history_data = {}
+        self.weekday_record = {}
+        self.current_day_attendance = {}
+        self.target_class = db.classes[DEFAULT_CLASS_KEY]
+        self.class_obs = types.SimpleNamespace(opreation_record=Stack())
+        self._tracking_chunk = None
+        self.journal = []
+
+    tracking_chunk = types.SimpleNamespace(catalog=types.SimpleNamespace(update=lambda rows: None))
+
+    def journal_event(self, event, objects):
+        self.journal.append((event, len(objects)))
+
+    def insert_action_history_info(self, text, func, color, stepcount=0):
+        pass
+
+
+def state(student) -> tuple:
+    "学生身上和分数、成就有关的状态"
+    return (
+        student.score,
+        student.total_score,
+        student.highest_score,
+        student.lowest_score,
+        [(id(m), m.executed, m.target) for m in student.history.values()],
+        [(id(a), a.target) for a in student.achievements.values()],
+    )
+
+
+@pytest.fixture
+def reset():
+    "发过点评和成就之后重置一次，返回(ClassObj, 重置前的点评, 历史记录)"
+    db = make_db(records=200, achievements=30)
+    obj = FakeClassObj(db)
+    students = list(obj.target_class.students.values())
+    before = [m for s in students for m in s.history.values()]
+    assert before and all(m.executed for m in before)
+    obj.reset_scores()
+    history = list(obj.history_data.values())[0]
+    return obj, before, history
+
+
+def test_frozen_students_keep_pre_reset_state(reset):
+    obj, before, history = reset
+    for key, cls in obj.classes.items():
+        frozen_class = history.classes[key]
+        assert frozen_class is not cls
+        for num, student in cls.students.items():
+            frozen = frozen_class.students[num]
+            assert frozen is student.last_reset_info and frozen is not student
+            assert frozen.is_frozen and not student.is_frozen
+            assert student.score == 0 and len(student.history) == 0
+            assert all(m.target is frozen for m in frozen.history.values())
+            assert all(a.target is frozen for a in frozen.achievements.values())
+        for group_key, group in frozen_class.groups.items():
+            assert all(m is frozen_class.students[m.num] for m in group.members)
+            assert all(m is cls.students[m.num] for m in cls.groups[group_key].members)
+    assert {id(m) for m in before} == {
+        id(m) for s in history.classes[DEFAULT_CLASS_KEY].students.values() for m in s.history.values()
+    }
+
+
+def test_retract_after_reset_touches_nothing(reset):
+    obj, before, history = reset
+    frozen_students = list(history.classes[DEFAULT_CLASS_KEY].students.values())
+    frozen_states = [state(s) for s in frozen_students]
+    current_states = [state(s) for s in obj.target_class.students.values()]
+    for m in before[:20]:
+        assert m.retract() == (False, "并不在本周历史中")
+        assert obj.retract_modify(m) == (False, "并不在本周历史中")
+    success, _ = obj.retract_modify(before[20:40], None, atomic=True)
+    assert not success
+    assert all(m.executed for m in before)
+    assert [state(s) for s in frozen_students] == frozen_states
+    assert [state(s) for s in obj.target_class.students.values()] == current_states
+    assert obj.journal == []
+
+
+def test_frozen_students_take_no_new_modifications(reset):
+    obj, _, history = reset
+    frozen = next(iter(history.classes[DEFAULT_CLASS_KEY].students.values()))
+    before = state(frozen)
+    template = next(iter(obj.modify_templates.values()))
+    modification = ScoreModification(template, frozen)
+    assert not modification.execute()
+    assert not modification.executed
+    achievement = Achievement(next(iter(obj.achievement_templates.values())), frozen)
+    achievement.give()
+    assert state(frozen) == before
+    # 重置后的学生照常
+    current = obj.target_class.students[frozen.num]
+    assert ScoreModification(template, current).execute()
+    assert current.score == template.mod
+    assert obj.retract_modify(list(current.history.values()))[0]
+    assert current.score == 0
@@ -0,0 +1,85 @@
+"""
+逐层批量加载（breadth_first）和逐个递归加载（depth_first）得到的对象图要完全一样
+"""
+
+from typing import Dict, List, Tuple
+
+import pytest
+
+from utils.classobjects.basetype import ClassDataType
+from utils.classobjects.dataloader import Chunk, DataObject
+
+from .helpers import database_roots, make_db, reachable_objects
+
+
+def direct_references(value) -> List[ClassDataType]:
+    "一个属性值里直接引用的班级数据对象（不往对象里面走）"
+    found, stack = [], [value]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, ClassDataType):
+            found.append(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            stack.extend(obj)
+        elif hasattr(obj, "values") and callable(obj.values):
+            stack.extend(obj.values())
+    return found
+
+
+def node_key(obj: ClassDataType) -> Tuple[str, str]:
+    return type(obj).__name__, str(obj.uuid)
+
+
+def graph_signature(db) -> Dict[Tuple[str, str], Tuple[str, List]]:
+    """
+    对象图的描述：(类名, uuid) -> (序列化结果, 每个属性引用了哪些对象)
+
+    同一个(类名, uuid)只能对应一个对象，不然引用关系就不是同一张图了
+    """
+    signature = {}
+    identities = {}
+    for obj in reachable_objects(database_roots(db)).values():
+        key = node_key(obj)
+        assert identities.setdefault(key, obj) is obj, f"{key}被加载成了两个对象"
+        edges = sorted(
+            (name, sorted(node_key(ref) for ref in direct_references(value)))
+            for name, value in obj.instance_attrs().items()
+        )
+        signature[key] = (obj.to_string(), edges)
+    return signature
+
+
+@pytest.fixture
+def saved_archive(tmp_path):
+    db = make_db(records=300, achievements=20)
+    path = str(tmp_path / "data")
+    Chunk(path, db).save_data(full=True)
+    Chunk.relase_connections()
+    DataObject.clear_loaded_objects()
+    return path, graph_signature(db)
+
+
+def load(path: str, resolver: str):
+    DataObject.clear_loaded_objects()
+    Chunk.relase_connections()
+    return Chunk(path).load_data(resolver=resolver)
+
+
+def test_breadth_first_and_depth_first_build_the_same_graph(saved_archive):
+    path, _ = saved_archive
+    breadth = graph_signature(load(path, "breadth_first"))
+    depth = graph_signature(load(path, "depth_first"))
+    assert breadth.keys() == depth.keys()
+    for key in breadth:
+        assert breadth[key] == depth[key], key
+
+
+def test_loaded_graph_matches_saved_graph(saved_archive):
+    path, saved = saved_archive
+    loaded = graph_signature(load(path, "breadth_first"))
+    assert {key: value[0] for key, value in loaded.items()} == {
+        key: value[0] for key, value in saved.items()
+    }
@@ -0,0 +1,184 @@
+"""
+随机抽人：抽100000次，卡方检验抽到的分布和应该的一样（等概率、按权重、不重复地抽）
+"""
+
+import itertools
+import math
+import random
+from collections import Counter
+from typing import Dict, Hashable, Iterable
+
+import pytest
+
+from utils.algorithm import AliasTable, RandomSelector
+from utils.classobjects import DEFAULT_CLASS_KEY
+from utils.classobjects.classobj import ClassObj
+
+from .helpers import make_db
+
+DRAWS = 100000
+"每个检验抽的次数"
+
+ALPHA = 1e-4
+"p值小于这个就算分布不对（随机数种子是固定的，结果不会变）"
+
+
+def chi_square_p(observed: Counter, expected: Dict[Hashable, float]) -> float:
+    """
+    卡方检验的p值（自由度是格子数减一，用Wilson–Hilferty近似）。
+
+    :param observed: 每一格抽到的次数
+    :param expected: 每一格的概率（概率是0的格子不能抽到）
+    :return: p值
+    """
+    assert set(observed) <= {cell for cell, p in expected.items() if p > 0}, "抽到了概率是0的"
+    total = sum(observed.values())
+    cells = [p for p in expected.values() if p > 0]
+    statistic = sum(
+        (observed[cell] - total * p) ** 2 / (total * p) for cell, p in expected.items() if p > 0
+    )
+    k = len(cells) - 1
+    z = ((statistic / k) ** (1 / 3) - (1 - 2 / (9 * k))) / math.sqrt(2 / (9 * k))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def normalized(weights: Dict[Hashable, float]) -> Dict[Hashable, float]:
+    total = sum(weights.values())
+    return {cell: w / total for cell, w in weights.items()}
+
+
+def ordered_pairs(weights: Dict[Hashable, float]) -> Dict[Hashable, float]:
+    "按权重不重复地抽两个，每种(第一个, 第二个)的概率"
+    total = sum(weights.values())
+    return {
+        (a, b): weights[a] / total * weights[b] / (total - weights[a])
+        for a, b in itertools.permutations(weights, 2)
+        if total - weights[a] > 0
+    }
+
+
+WEIGHTS = [1, 2, 3, 4, 0, 10, 0.5, 7, 0, 2.5]
+
+
+def test_alias_table_follows_weights():
+    table = AliasTable(WEIGHTS)
+    rng = random.Random(25)
+    observed = Counter(table.sample(rng) for _ in range(DRAWS))
+    assert chi_square_p(observed, normalized(dict(enumerate(WEIGHTS)))) > ALPHA
+
+
+def test_chi_square_detects_a_biased_sampler():
+    "检验本身要能发现偏了一点的分布，不然上面的测试什么都说明不了"
+    weights = dict(enumerate(WEIGHTS))
+    biased = {**weights, 0: 1.3}
+    table = AliasTable(list(biased.values()))
+    rng = random.Random(25)
+    observed = Counter(table.sample(rng) for _ in range(DRAWS))
+    assert chi_square_p(observed, normalized(weights)) < ALPHA
+
+
+def test_alias_table_rejects_bad_weights():
+    for weights in ([1, -1], [0, 0], []):
+        with pytest.raises(ValueError):
+            AliasTable(weights)
+
+
+def draws(selector: RandomSelector, count: int) -> Iterable[tuple]:
+    for _ in range(DRAWS):
+        yield tuple(selector.choose(count))
+
+
+def test_uniform_single_draws():
+    items = list(range(12))
+    selector = RandomSelector(items, rng=random.Random(1))
+    observed = Counter(picked for picked, in draws(selector, 1))
+    assert chi_square_p(observed, {i: 1 / len(items) for i in items}) > ALPHA
+
+
+def test_uniform_pairs_without_replacement():
+    items = list(range(6))
+    selector = RandomSelector(items, rng=random.Random(2))
+    observed = Counter(draws(selector, 2))
+    assert chi_square_p(observed, ordered_pairs({i: 1 for i in items})) > ALPHA
+
+
+def test_weighted_single_draws():
+    weights = dict(enumerate(WEIGHTS))
+    selector = RandomSelector(list(weights), weight=weights.get, rng=random.Random(3))
+    observed = Counter(picked for picked, in draws(selector, 1))
+    assert chi_square_p(observed, normalized(weights)) > ALPHA
+
+
+@pytest.mark.parametrize("weights", [[1, 2, 3, 4, 5], [20, 1, 1, 2, 0, 3]])
+def test_weighted_pairs_without_replacement(weights):
+    "第二组里第一个的权重超过一半，抽到它之后会用剩下的人重新建表"
+    weights = dict(enumerate(weights))
+    selector = RandomSelector(list(weights), weight=weights.get, rng=random.Random(4))
+    observed = Counter(draws(selector, 2))
+    assert chi_square_p(observed, ordered_pairs(weights)) > ALPHA
+
+
+def test_zero_weights_are_drawn_last_and_uniformly():
+    weights = {0: 1.0, 1: 0.0, 2: 0.0, 3: 0.0, 4: 2.0}
+    selector = RandomSelector(list(weights), weight=weights.get, rng=random.Random(5))
+    observed = Counter()
+    for picked in draws(selector, 3):
+        assert set(picked[:2]) == {0, 4}
+        observed[picked[2]] += 1
+    assert chi_square_p(observed, {1: 1 / 3, 2: 1 / 3, 3: 1 / 3}) > ALPHA
+
+
+def test_filters_and_includes():
+    items = list(range(20))
+    selector = RandomSelector(
+        items + [3, 5],
+        includes=[7],
+        excludes=[0, 1],
+        predicate=lambda i: i % 2 == 1,
+        rng=random.Random(6),
+    )
+    allowed = {3, 5, 9, 11, 13, 15, 17, 19}
+    assert selector.available == len(allowed) + 1
+    observed = Counter()
+    for picked in draws(selector, 3):
+        assert picked[0] == 7 and set(picked[1:]) <= allowed and len(set(picked)) == 3
+        observed.update(picked[1:])
+    assert chi_square_p(observed, {i: 1 / len(allowed) for i in allowed}) > ALPHA
+    with pytest.raises(ValueError):
+        selector.choose(0)
+    with pytest.raises(ValueError):
+        selector.choose(selector.available + 1)
+    assert sorted(selector.choose(selector.available)) == sorted(allowed | {7})
+
+
+class FakeClassObj(ClassObj):
+    "随机点名只用到班级"
+
+    def __init__(self, db):  # pylint: disable=super-init-not-called
+        self.classes = db.classes
+        self.target_class = db.classes[DEFAULT_CLASS_KEY]
+
+
+def test_deficit_mode_follows_scores():
+    obj = FakeClassObj(make_db())
+    students = list(obj.target_class.students.values())[:8]
+    for score, student in enumerate(students):
+        student.score = score
+    selector = obj.random_selector(students, mode="deficit")
+    selector.rng.seed(7)
+    observed = Counter(s.num for s in (selector.choose(1)[0] for _ in range(DRAWS)))
+    top = max(s.score for s in students)
+    expected = normalized({s.num: top - s.score + 1 for s in students})
+    assert chi_square_p(observed, expected) > ALPHA
+
+
+def test_choose_with_a_prebuilt_selector(monkeypatch):
+    obj = FakeClassObj(make_db())
+    students = list(obj.target_class.students.values())
+    selector = obj.random_selector(students[:10], [students[0]], [students[1]], "recency")
+    # 用构造好的抽取器，不再构造一个
+    monkeypatch.setattr(obj, "random_selector", None)
+    result = obj.random_choose_stu(selector.available, record=True, selector=selector)
+    assert len(result) == 9 and students[0] in result and students[1] not in result
+    assert [s.num for s in result] == sorted(s.num for s in result)
+    assert all(s.pick_count == 1 for s in result)
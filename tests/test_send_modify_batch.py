@@ -0,0 +1,226 @@
+"""
+批量发送点评：中途有一个失败就整批回滚，一键撤回的时候整批一起撤回（也是中途失败就整批不动）
+"""
+
+import math
+import random
+import types
+
+import pytest
+
+from utils.algorithm import OrderedKeyList, Stack
+from utils.classobjects import ScoreModification, Student
+from utils.classobjects.batch import ModifyBatch
+from utils.classobjects.classobj import ClassObj
+
+from .helpers import make_db
+
+
+class FakeClassObj(ClassObj):
+    "只有发送和撤回点评要用到的东西，界面相关的都记下来"
+
+    def __init__(self, db):  # pylint: disable=super-init-not-called
+        self.classes = db.classes
+        self.modify_templates = OrderedKeyList(db.templates)
+        self.class_obs = types.SimpleNamespace(opreation_record=Stack())
+        self.ui = []
+        self.journal = []
+
+    def journal_event(self, event, objects):
+        self.journal.append((event, len(objects)))
+
+    def insert_action_history_info(self, text, func, color, stepcount=0):
+        self.ui.append(text)
+
+
+def snapshot(cls) -> dict:
+    "班级里所有和分数有关的状态"
+    students = list(cls.students.values())
+    return {
+        "students": [
+            (
+                s.num,
+                s.score,
+                s.total_score,
+                s.highest_score,
+                s.lowest_score,
+                s.highest_score_cause_time,
+                s.lowest_score_cause_time,
+                len(s.history.entries),
+                s.history.highest(),
+                s.history.lowest(),
+            )
+            for s in students
+        ],
+        "modifications": [
+            (id(m), m.executed, m.execute_time) for s in students for m in s.history.values()
+        ],
+        "competition": [(rank, s.num) for rank, s in cls.rank_non_dumplicate],
+        "dense": [(rank, s.num) for rank, s in cls.rank_dumplicate],
+        "total": cls.total_score,
+        "aggregate": cls.recompute(),
+    }
+
+
+def scores_only(state: dict) -> dict:
+    "只看分数、最高最低分、排名和总分（撤回之后流水里还留着撤回了的记录）"
+    state = dict(state)
+    state["students"] = [s[:7] + s[8:] for s in state["students"]]
+    del state["modifications"]
+    return state
+
+
+@pytest.fixture
+def setup():
+    db = make_db(records=300)
+    obj = FakeClassObj(db)
+    cls = list(db.classes.values())[0]
+    return obj, cls
+
+
+def failing_at(monkeypatch, name: str, position: int, mode: str):
+    "让ScoreModification.execute/retract在第position次调用的时候失败（返回失败或者抛出异常）"
+    original = getattr(ScoreModification, name)
+    calls = [0]
+
+    def flaky(self):
+        calls[0] += 1
+        if calls[0] == position + 1:
+            if mode == "raise":
+                raise ValueError("模拟出错")
+            return False if name == "execute" else (False, "模拟失败")
+        return original(self)
+
+    monkeypatch.setattr(ScoreModification, name, flaky)
+    return lambda: monkeypatch.setattr(ScoreModification, name, original)
+
+
+def make_batch(obj, cls, rnd: random.Random, size: int):
+    "随机的一批点评，有的学生会收到好几条"
+    students = list(cls.students.values())
+    templates = list(obj.modify_templates.values())
+    return [
+        ScoreModification(rnd.choice(templates), rnd.choice(students)) for _ in range(size)
+    ]
+
+
+@pytest.mark.parametrize("mode", ["return", "raise"])
+@pytest.mark.parametrize("where", ["first", "middle", "last"])
+def test_failed_send_rolls_back_everything(setup, monkeypatch, mode, where):
+    obj, cls = setup
+    rnd = random.Random(hash((mode, where)) & 0xFFFF)
+    batch = make_batch(obj, cls, rnd, 40)
+    position = {"first": 0, "middle": 20, "last": 39}[where]
+    before = snapshot(cls)
+    restore = failing_at(monkeypatch, "execute", position, mode)
+    with pytest.raises(ClassObj.SendModifyError):
+        obj.send_modify_instance(batch, "测试")
+    restore()
+    assert snapshot(cls) == before
+    assert not any(m.executed for m in batch)
+    assert obj.class_obs.opreation_record.is_empty()
+    assert obj.ui == [] and obj.journal == []
+    # 回滚之后同一批可以重新发送
+    obj.send_modify_instance(batch, "重发")
+    assert all(m.executed for m in batch)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_failures_roll_back(setup, monkeypatch, seed):
+    obj, cls = setup
+    rnd = random.Random(seed)
+    for _ in range(5):
+        batch = make_batch(obj, cls, rnd, rnd.randint(1, 60))
+        before = snapshot(cls)
+        restore = failing_at(
+            monkeypatch, "execute", rnd.randrange(len(batch)), rnd.choice(["return", "raise"])
+        )
+        with pytest.raises(ClassObj.SendModifyError):
+            obj.send_modify_instance(batch)
+        restore()
+        assert snapshot(cls) == before
+        # 成功发送一批，让下一次从不一样的状态开始
+        obj.send_modify_instance(make_batch(obj, cls, rnd, rnd.randint(1, 10)))
+
+
+def test_invalid_targets_touch_nothing(setup):
+    obj, cls = setup
+    students = list(cls.students.values())
+    key = next(iter(obj.modify_templates.keys()))
+    before = snapshot(cls)
+    stranger = Student("不在班里", 999, 0, cls.key, {})
+    for targets in ([students[0], stranger], [students[0], None], [students[0], "学生"]):
+        with pytest.raises(ClassObj.SendModifyError):
+            obj.send_modify(key, targets)
+    with pytest.raises(ClassObj.SendModifyError):
+        obj.send_modify("不存在的模板", students[:3])
+    template = obj.modify_templates[key]
+    for mod in (math.nan, math.inf):
+        with pytest.raises(ClassObj.SendModifyError):
+            obj.send_modify_instance(
+                [ScoreModification(template, students[0]), ScoreModification(template, students[1], mod=mod)]
+            )
+    executed = ScoreModification(template, students[2])
+    obj.send_modify_instance(executed)
+    before = snapshot(cls)
+    with pytest.raises(ClassObj.SendModifyError):
+        obj.send_modify_instance([ScoreModification(template, students[3]), executed])
+    with pytest.raises(ClassObj.SendModifyError):
+        fresh = ScoreModification(template, students[3])
+        obj.send_modify_instance([fresh, fresh])
+    assert snapshot(cls) == before
+
+
+def test_send_pushes_one_undo_entry(setup):
+    obj, cls = setup
+    students = list(cls.students.values())
+    key = next(iter(obj.modify_templates.keys()))
+    sent = obj.send_modify(key, students, info="全班")
+    assert len(sent) == len(students)
+    assert obj.class_obs.opreation_record.size() == 1
+    assert isinstance(obj.class_obs.opreation_record.peek(), ModifyBatch)
+    assert len(obj.ui) == 1
+    assert obj.journal == [("send_modify", 2 * len(students))]
+
+
+def test_undo_whole_batch(setup):
+    obj, cls = setup
+    rnd = random.Random(1)
+    before = snapshot(cls)
+    batch = make_batch(obj, cls, rnd, 60)
+    obj.send_modify_instance(batch)
+    assert snapshot(cls) != before
+    assert obj.retract_lastest()[0]
+    assert not any(m.executed for m in batch)
+    assert scores_only(snapshot(cls)) == scores_only(before)
+    assert obj.class_obs.opreation_record.is_empty()
+
+
+@pytest.mark.parametrize("mode", ["return", "raise"])
+@pytest.mark.parametrize("position", [0, 17, 59])
+def test_failed_undo_changes_nothing(setup, monkeypatch, mode, position):
+    obj, cls = setup
+    before = snapshot(cls)
+    batch = obj.send_modify_instance(make_batch(obj, cls, random.Random(position), 60))
+    sent = snapshot(cls)
+    restore = failing_at(monkeypatch, "retract", position, mode)
+    success, _ = obj.retract_modify(batch, None, atomic=True)
+    restore()
+    assert not success
+    assert snapshot(cls) == sent
+    assert all(m.executed for m in batch)
+    # 没有出错的时候可以整批撤回
+    assert obj.retract_modify(batch, None, atomic=True)[0]
+    assert scores_only(snapshot(cls)) == scores_only(before)
+
+
+def test_undo_after_single_retract(setup):
+    obj, cls = setup
+    before = snapshot(cls)
+    batch = obj.send_modify_instance(make_batch(obj, cls, random.Random(2), 30))
+    # 先单独撤回一条，一键撤回的时候只撤回剩下的
+    assert obj.retract_modify(batch[5])[0]
+    assert obj.retract_lastest()[0]
+    assert not any(m.executed for m in batch)
+    assert scores_only(snapshot(cls)) == scores_only(before)
+    assert obj.retract_modify(batch, None, atomic=True) == (False, "这一批点评已经全部撤回过了")
@@ -0,0 +1,167 @@
+"""
+保存快照：所有对象都要在状态锁里转换，保存的同时改分数，存下来的数据也要互相对得上
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+
+from utils.classobjects import (
+    DEFAULT_CLASS_KEY,
+    Achievement,
+    AchievementTemplate,
+    Class,
+    Group,
+    ScoreModification,
+    ScoreModificationTemplate,
+    Student,
+)
+from utils.classobjects.basetype import ClassDataType
+from utils.classobjects.codec import decode_record, find_type
+from utils.classobjects.dataloader import Chunk, read_archive_rows
+from utils.classobjects.journal import ScoreJournal
+
+from .helpers import make_db
+
+
+def test_every_record_is_converted_under_the_state_lock(tmp_path, monkeypatch):
+    db = make_db(records=100, achievements=10)
+    chunk = Chunk(str(tmp_path / "data"), db)
+    converted = []
+    for dtype in (
+        Student,
+        ScoreModification,
+        Achievement,
+        ScoreModificationTemplate,
+        AchievementTemplate,
+        Class,
+        Group,
+    ):
+
+        def to_dict(self, _to_dict=dtype.to_dict):
+            converted.append((type(self).__name__, ClassDataType.state_lock._is_owned()))
+            return _to_dict(self)
+
+        monkeypatch.setattr(dtype, "to_dict", to_dict)
+    snapshot = chunk.take_snapshot(full=True)
+    names = {name for name, _ in converted}
+    assert {"ScoreModificationTemplate", "AchievementTemplate", "Student"} <= names
+    assert all(owned for _, owned in converted), [n for n, owned in converted if not owned]
+    monkeypatch.undo()
+    chunk.write_snapshot(snapshot)
+
+
+def stored_objects(path: str):
+    "读出存档里所有对象的to_dict结果，objects[数据类型名][uuid] = 字典"
+    objects = {}
+    for type_name, rows in read_archive_rows(path).items():
+        dtype = find_type(type_name)
+        objects[type_name] = {
+            uuid: decode_record(dtype, data) if isinstance(data, bytes) else json.loads(data)
+            for uuid, data in rows.items()
+        }
+    return objects
+
+
+def test_snapshot_stays_consistent_while_scores_change(tmp_path):
+    db = make_db(records=300)
+    chunk = Chunk(str(tmp_path / "data"), db).track_changes()
+    students = list(db.classes[DEFAULT_CLASS_KEY].students.values())
+    templates = list(db.templates.values())
+    edited = templates.pop()
+    with ClassDataType.state_lock:
+        edited.mod, edited.title = 0.0, "edit0"
+    # 分数和执行了的修改记录之和的差（默认数据里的初始分数）
+    offsets = {
+        s.num: round(s.score - sum(m.mod for m in s.history.values() if m.executed), 6)
+        for s in students
+    }
+    chunk.save_data()
+
+    stop = threading.Event()
+    mutations = [0]
+
+    def mutate():
+        i = 0
+        while not stop.is_set():
+            # 轮流改，同一个学生两次修改之间隔得够久，execute_time_key不会撞
+            ScoreModification(templates[i % len(templates)], students[i % len(students)]).execute()
+            if i % 7 == 0:
+                with ClassDataType.state_lock:
+                    edited.mod = float(i)
+                    time.sleep(0.0001)
+                    edited.title = f"edit{i}"
+            i += 1
+            mutations[0] += 1
+            time.sleep(0.0002)
+
+    thread = threading.Thread(target=mutate)
+    thread.start()
+    try:
+        for _ in range(8):
+            time.sleep(0.02)
+            snapshot = chunk.take_snapshot()
+            writer = threading.Thread(target=chunk.write_snapshot, args=(snapshot,))
+            writer.start()
+            writer.join()
+            stored = stored_objects(os.path.join(chunk.path, "Current"))
+            modifications = stored["ScoreModification"]
+            checked = 0
+            for student in stored["Student"].values():
+                history = [modifications[uuid] for _, uuid in student["history"]]
+                assert all(m["executed"] for m in history)
+                total = offsets[student["num"]] + sum(m["mod"] for m in history)
+                assert round(student["score"], 6) == round(total, 6), student["num"]
+                checked += 1
+            assert checked >= len(students)
+            template = stored["ScoreModificationTemplate"][str(edited.uuid)]
+            assert template["title"] == f"edit{int(template['modification'])}"
+    finally:
+        stop.set()
+        thread.join()
+    assert mutations[0] > 50
+
+
+def test_achievement_template_reuses_encoded_conditions():
+    template = copy.deepcopy(
+        next(t for t in make_db().achievements.values() if "others" in t.kwargs)
+    )
+    first = template.to_dict()["others"]
+    assert template.to_dict()["others"] is first
+    assert "_others_cache" not in copy.deepcopy(template).__dict__
+    template.other = list(template.other) + [len]
+    assert template.to_dict()["others"] != first
+
+
+def test_overlapping_snapshots_keep_later_journal_events(tmp_path, monkeypatch):
+    "两次保存的快照同时在排队：前一个写完丢掉日志之后，后一个的检查点也要对得上"
+    monkeypatch.setattr(ScoreJournal, "flush_interval", 0)
+    db = make_db(records=50)
+    chunk = Chunk(str(tmp_path / "data"), db)
+    chunk.save_data(full=True)
+    students = list(db.classes[DEFAULT_CLASS_KEY].students.values())
+    template = next(iter(db.templates.values()))
+
+    def event(student):
+        modification = ScoreModification(template, student)
+        modification.execute()
+        chunk.journal.append("send_modify", [modification, student])
+        return str(modification.uuid)
+
+    try:
+        saved = [event(students[3]), event(students[4])]
+        first = chunk.take_snapshot()
+        saved_by_second = event(students[0])
+        second = chunk.take_snapshot()
+        later = [event(students[1]), event(students[2])]
+        chunk.write_snapshot(first)
+        chunk.write_snapshot(second)
+        rows, _, count = chunk.journal.replay()
+        assert count == 2
+        replayed = {uuid for type_name, uuid in rows if type_name == "ScoreModification"}
+        assert replayed == set(later) and not replayed & {saved_by_second, *saved}
+    finally:
+        Chunk.relase_connections()
+        chunk.journal.close()
@@ -3,10 +3,14 @@
 """
 
 # try:
+from .aggregate import *
 from .datatypes import *
 from .high_precision import *
 from .keyorder import *
 from .numeric import *
+from .ranking import *
+from .segtree import *
+from .selector import *
 
 # except ImportError:
 #     from datatypes import *
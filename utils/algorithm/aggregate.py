@@ -0,0 +1,206 @@
+"""
+分数统计
+
+维护一组对象分数的人数、总分、最低分和最高分，改一个人的分数只要改一下总分，
+再在有序的分数列表里删掉旧的、插入新的（二分查找），不用每次都把所有人加一遍：
+
+- 人数、总分、平均分O(1)
+- 最低分、最高分O(1)（有序列表的两头）
+- 加人、减人、改分数O(log n)
+
+总分用和math.fsum一样的办法（几个互不重叠的浮点数部分和）精确地加减，一直加减下去也不会积累误差，
+结果和把所有人的分数用math.fsum加一遍一样（和按顺序sum相比可能差在最后一位）。
+recompute可以把每个人的分数重新读一遍、重新统计，并且报告对不上的地方。
+"""
+
+import math
+from bisect import bisect_left, insort
+from typing import Any, Callable, Dict, Generic, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+
+__all__ = ["ScoreAggregate"]
+
+_Item = TypeVar("_Item")
+
+
+class ScoreAggregate(Generic[_Item]):
+    "分数统计，见模块说明"
+
+    def __init__(
+        self,
+        items: Iterable[_Item] = (),
+        score: Callable[[_Item], float] = lambda item: item.score,
+    ):
+        """
+        构造一个分数统计。
+
+        :param items: 要统计的对象（同一个对象只算一次）
+        :param score: 取分数的函数
+        """
+        self.score = score
+        "取分数的函数"
+        self.members: Dict[int, Tuple[_Item, float]] = {}
+        "members[id(对象)] = (对象, 上次记下的分数)"
+        self.scores: List[float] = []
+        "所有人的分数，从小到大排"
+        self.total = 0.0
+        "总分"
+        self.partials: List[float] = []
+        "总分的精确部分和（见_accumulate）"
+        self.version = 0
+        "每次有改动加一"
+        self.verified_version = -1
+        "上次verify检查过的版本"
+        self.stale = False
+        "是否已经失效（比如成员列表被直接改了），失效了要重建"
+        for item in items:
+            if id(item) not in self.members:
+                value = self.score(item)
+                self.members[id(item)] = (item, value)
+                self.scores.append(value)
+        self.scores.sort()
+        for value in self.scores:
+            self._accumulate(value)
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __contains__(self, item: _Item) -> bool:
+        entry = self.members.get(id(item))
+        return entry is not None and entry[0] is item
+
+    def __iter__(self) -> Iterator[_Item]:
+        return (item for item, _ in self.members.values())
+
+    def add(self, item: _Item) -> None:
+        """
+        加入一个对象，已经在里面的不管。
+
+        :param item: 对象
+        """
+        if item in self:
+            return
+        value = self.score(item)
+        self.members[id(item)] = (item, value)
+        insort(self.scores, value)
+        self._accumulate(value)
+        self.version += 1
+
+    def remove(self, item: _Item) -> bool:
+        """
+        移除一个对象。
+
+        :param item: 对象
+        :return: 是否移除了（不在里面则为False）
+        """
+        if item not in self:
+            return False
+        _, value = self.members.pop(id(item))
+        del self.scores[bisect_left(self.scores, value)]
+        self._accumulate(-value)
+        self.version += 1
+        return True
+
+    def update(self, item: _Item) -> None:
+        """
+        对象的分数变了之后调用。
+
+        :param item: 对象，不在里面的不管
+        """
+        entry = self.members.get(id(item))
+        if entry is None or entry[0] is not item:
+            return
+        value = self.score(item)
+        if value == entry[1]:
+            return
+        del self.scores[bisect_left(self.scores, entry[1])]
+        insort(self.scores, value)
+        self.members[id(item)] = (item, value)
+        self._accumulate(value)
+        self._accumulate(-entry[1])
+        self.version += 1
+
+    def _accumulate(self, value: float) -> None:
+        # Shewchuk的精确求和（math.fsum用的也是这个），partials里的数互不重叠，加起来正好是总分
+        partials = self.partials
+        i = 0
+        for other in partials:
+            if abs(value) < abs(other):
+                value, other = other, value
+            high = value + other
+            low = other - (high - value)
+            if low:
+                partials[i] = low
+                i += 1
+            value = high
+        partials[i:] = [value]
+        self.total = math.fsum(partials)
+
+    def invalidate(self) -> None:
+        "标记失效，下次用之前要重建"
+        self.stale = True
+
+    @property
+    def count(self) -> int:
+        "人数"
+        return len(self.members)
+
+    @property
+    def minimum(self) -> Optional[float]:
+        "最低分，没有人则为None"
+        return self.scores[0] if self.scores else None
+
+    @property
+    def maximum(self) -> Optional[float]:
+        "最高分，没有人则为None"
+        return self.scores[-1] if self.scores else None
+
+    @property
+    def mean(self) -> float:
+        "平均分，没有人则为0"
+        return self.total / max(len(self.members), 1)
+
+    def recompute(self) -> Dict[str, Tuple[Any, Any]]:
+        """
+        把每个人的分数重新读一遍、重新统计，替换掉维护的值。
+
+        :return: 对不上的地方，{名字: (维护的值, 重新算的值)}，都对得上则为空
+        """
+        mismatches: Dict[str, Tuple[Any, Any]] = {}
+        changed = [
+            (item, recorded, self.score(item))
+            for item, recorded in self.members.values()
+            if self.score(item) != recorded
+        ]
+        for item, recorded, value in changed:
+            mismatches[f"score[{item!r}]"] = (recorded, value)
+            self.members[id(item)] = (item, value)
+        scores = sorted(value for _, value in self.members.values())
+        total = math.fsum(scores)
+        if scores != self.scores:
+            mismatches["scores"] = (self.scores, scores)
+        if self.total != total:
+            mismatches["total"] = (self.total, total)
+        self.scores = scores
+        self.partials = []
+        for value in scores:
+            self._accumulate(value)
+        if mismatches:
+            self.version += 1
+        return mismatches
+
+    def verify(self) -> None:
+        """
+        检查维护的值和重新算的对不对得上（同一个版本只检查一次），调试模式下用。
+
+        :raise AssertionError: 对不上（这时维护的值已经换成重新算的了）
+        """
+        if self.verified_version == self.version:
+            return
+        mismatches = self.recompute()
+        self.verified_version = self.version
+        if mismatches:
+            raise AssertionError(
+                "分数统计和重新计算的结果对不上："
+                + "，".join(f"{k}为{v[0]!r}，应为{v[1]!r}" for k, v in mismatches.items())
+            )
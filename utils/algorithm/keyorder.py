@@ -4,7 +4,7 @@
 
 import copy
 from abc import ABC
-from typing import Iterable, List, TypeVar, Union, Dict, Iterator, Tuple, Optional
+from typing import Any, Iterable, List, TypeVar, Union, Dict, Tuple, Optional
 from collections import OrderedDict
 
 try:
@@ -19,7 +19,7 @@ except ImportError:
             print(c)
 
 
-__all__ = ["SupportsKeyOrdering", "OrderedKeyList"]
+__all__ = ["SupportsKeyOrdering", "IndexedOrderedMap", "OrderedKeyList"]
 
 
 class SupportsKeyOrdering(ABC):
@@ -80,6 +80,15 @@ class SupportsKeyOrdering(ABC):
         你学废了吗？
     """
 
+    _key_renames = 0
+    "所有对象的key被改掉的次数（IndexedOrderedMap看到它变了就重建索引）"
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        "改key的时候记一下，构造的时候第一次设置key不算"
+        if name == "key" and getattr(self, "key", value) != value:
+            SupportsKeyOrdering._key_renames += 1
+        super().__setattr__(name, value)
+
 
 _Template = TypeVar("_Template", bound=SupportsKeyOrdering)
 """
@@ -95,57 +104,24 @@ _Template = TypeVar("_Template", bound=SupportsKeyOrdering)
 """
 
 
-class OrderedKeyList(list, Iterable[_Template]):
-    """有序的key列表，可以用方括号来根据SupportsKeyOrdering对象的key，索引值或者对象本身来获取对象
+class IndexedOrderedMap(list, Iterable[_Template]):
+    """按key建了索引的有序列表，用法和OrderedKeyList一样（OrderedKeyList就是它）
 
-    举个例子
+    以前按key找元素要从头到尾挨个比，判断在不在里面要先把所有key列出来，
+    添加的时候也要先把所有key列出来查重，一个一个添加n个元素就是O(n²)。
 
-    建立一个新的OrderedKeyList
-    >>> template = ScoreModificationTemplate("go_to_school_late_more", -2.0, "7:30后到校", "哥们为什么不睡死在家里？")
-    >>> # 这里有一个存在变量里面的模板，我们叫它template
-    >>> DEFAULT_SCORE_TEMPLATES = OrderedKeyList([
-    ...   ScoreModificationTemplate("go_to_school_early", 1.0, "7:20前到校", "早起的鸟儿有虫吃"),
-    ...   ScoreModificationTemplate("go_to_school_late", -1.0, "7:25后到校", "早起的虫儿被鸟吃"),
-    ...   template
-    ... ])
+    现在多存一个key到位置的dict：
 
-    获取里面的元素
-    >>> DEFAULT_SCORE_TEMPLATES[0]
-    ScoreModificationTemplate("go_to_school_early", 1.0, "7:20前到校", "早起的鸟儿有虫吃")
-    >>> DEFAULT_SCORE_TEMPLATES["go_to_school_early"]
-    ScoreModificationTemplate("go_to_school_early", 1.0, "7:20前到校", "早起的鸟儿有虫吃")
-    >>> DEFAULT_SCORE_TEMPLATES[template]
-    ScoreModificationTemplate("go_to_school_late_more", -2.0, "7:30后到校", "哥们为什么不睡死在家里？")
-    >>> DEFAULT_SCORE_TEMPLATES.keys()
-    ["go_to_school_early", "go_to_school_late", "go_to_school_late"]
-    >>> len(DEFAULT_SCORE_TEMPLATES)
-    3
-
-    添加元素
-    >>> DEFAULT_SCORE_TEMPLATES.append(ScoreModificationTemplate("Chinese_class_good", 2.0,"语文课堂表扬","王の表扬"))
-    >>> DEFAULT_SCORE_TEMPLATES.append(template) # 这里如果设置了不允许重复的话还往里面放同一个模板就会报错
-    Traceback (most recent call last):
-      File "<stdin>", line 1, in <module>
-        DEFAULT_SCORE_TEMPLATES.append(template)
-      File "<stdin>", line 166, in append
-        raise ValueError(F"模板的key（{getattr(v, self.keyattr)!r}）重复")
-    ValueError: 模板的key（'go_to_school_late_more'）重复
+    - 按key取值、判断在不在里面、查位置（index）、交换（swaps）、在末尾添加和删除：O(1)
+    - 在中间插入或者删除：列表本身要挪一下元素，这之后的位置等到下一次按key查位置的时候才重新登记（均摊），
+      查重只看key在不在索引里，不用等
+    - 排序、翻转、按切片修改：重建索引
 
+    迭代、按整数下标取值、pickle都和list一样（索引不跟着存，老存档里的OrderedKeyList照样能加载）。
 
-    交换里面的元素顺序
-    >>> DEFAULT_SCORE_TEMPLATES.swaps(0, 1)     # 交换索引0和1的元素，当然也可以填模板的key
-    OrderedKeyList([
-        ScoreModificationTemplate("go_to_school_late", -1.0, "7:25后到校", "早起的虫儿被鸟吃"),
-        ScoreModificationTemplate("go_to_school_early", 1.0, "7:20前到校", "早起的鸟儿有虫吃"),
-        ScoreModificationTemplate("go_to_school_late_more", -2.0, "7:30后到校", "哥们为什么不睡死在家里？")
-    ])
-
-    删掉/修改里面的元素
-    >>> del DEFAULT_SCORE_TEMPLATES["go_to_school_early"]    # 删除key为"go_to_school_early"的元素
-    >>> DEFAULT_SCORE_TEMPLATES.pop(0)                       # 删除索引为0的元素
-    >>> len(DEFAULT_SCORE_TEMPLATES)                         # 查看长度（现在只剩一个7:30以后到校的了）
-    1
-
+    元素的key是存在元素身上的，SupportsKeyOrdering的对象直接改了key，下一次用到的时候会自动重建索引；
+    别的对象（或者keyattr不是"key"）直接改了元素的key以后要调用reindex。
+    改key改得和别的元素重复了，按key找到的是前面那个（这样的列表pickle加载回来的时候会因为重复报错）
     """
 
     allow_dumplicate = False
@@ -157,21 +133,29 @@ class OrderedKeyList(list, Iterable[_Template]):
     keyattr = "key"
     'SupportsKeyOrdering的这个"Key"的属性名'
 
+    _index_attrs = ("_key_index", "_indexed", "_renames_seen")
+    "索引用的属性，不跟着pickle走"
+
     def __init__(
         self,
         objects: Union[
             Iterable[_Template],
             Dict[str, _Template],
             "OrderedDict[str, _Template]",
-            "OrderedKeyList[_Template]",
-        ],
+            "IndexedOrderedMap[_Template]",
+        ] = (),
     ):
-        """初始化OrderedKeyList
+        """初始化
 
-        :param templates: 模板列表
+        :param objects: 元素列表，或者key到元素的dict（key和元素的key不一致时以dict的为准）
         """
-
         super().__init__()
+        self._key_index: Dict[str, int] = {}
+        "key_index[key] = 位置，key总是和列表里的一致，位置只有前_indexed个是准的"
+        self._indexed = 0
+        "索引里位置已经登记好的元素数量"
+        self._renames_seen = SupportsKeyOrdering._key_renames
+        "建索引的时候SupportsKeyOrdering._key_renames的值"
         if isinstance(objects, (dict, OrderedDict)):
             for k, v in objects.items():
                 if getattr(v, self.keyattr) != k:
@@ -183,129 +167,223 @@ class OrderedKeyList(list, Iterable[_Template]):
                     )
                     setattr(v, self.keyattr, k)
                 self.append(v)
-        elif isinstance(objects, OrderedKeyList):
-            self.extend([t for t in objects])
         else:
-            keys = []
-            for v in objects:
-                if getattr(v, self.keyattr) in keys:
-                    if not self.allow_dumplicate:
-                        raise ValueError(
-                            f"模板的key（{getattr(v, self.keyattr)!r}）重复"
-                        )
-                    Logger.log(
-                        "W",
-                        f"模板的key（{getattr(v, self.keyattr)!r}）重复，"
-                        f"补充为{getattr(v, self.keyattr)!r}{self.dumplicate_suffix}",
-                        "OrderedKeyList.__init__",
-                    )
-                    setattr(
-                        v,
-                        self.keyattr,
-                        getattr(v, self.keyattr) + self.dumplicate_suffix,
-                    )
-                keys.append(getattr(v, self.keyattr))
-                self.append(v)
+            self.extend(list(objects))
+
+    # 索引
+
+    def _raw_index(self) -> Dict[str, int]:
+        "返回索引（位置不一定登记完了，只能用来看key在不在）"
+        index = self.__dict__.get("_key_index")
+        if (
+            index is None  # pickle加载的时候不经过__init__
+            or self._renames_seen != SupportsKeyOrdering._key_renames  # 有元素改了key
+        ):
+            self.reindex()
+            index = self._key_index
+            if len(index) < len(self):
+                Logger.log(
+                    "W",
+                    f"列表中有{len(self) - len(index)}个元素的key被改得和前面的重复了，按key只能找到前面的",
+                    "OrderedKeyList.reindex",
+                )
+        return index
+
+    def _positions(self) -> Dict[str, int]:
+        "返回位置登记完了的索引（没登记完的先补上）"
+        index = self._raw_index()
+        if len(index) < len(self):
+            # 有重复的key（元素改key改重复了），重新登记的时候要让前面的优先
+            self.reindex()
+            index = self._key_index
+        elif self._indexed < len(self):
+            keyattr = self.keyattr
+            for position in range(self._indexed, len(self)):
+                index[getattr(list.__getitem__(self, position), keyattr)] = position
+            self._indexed = len(self)
+        return index
+
+    def _shifted(self, position: int) -> None:
+        "这个位置以后的元素挪了位置，等下次查位置的时候重新登记"
+        self._indexed = min(self._indexed, position)
+
+    def reindex(self) -> None:
+        "重建索引（直接改了元素的key之后调用）"
+        index: Dict[str, int] = {}
+        for position, obj in enumerate(self):
+            index.setdefault(getattr(obj, self.keyattr), position)
+        self._key_index = index
+        self._indexed = len(self)
+        self._renames_seen = SupportsKeyOrdering._key_renames
+
+    def position(self, key: Union[str, _Template]) -> Optional[int]:
+        """找一个key或者元素的位置。
+
+        :param key: key或者元素本身
+        :return: 位置，不在里面则为None
+        """
+        index = self._positions()
+        try:
+            position = index.get(key)
+        except TypeError:  # 不能hash的东西不会是key
+            position = None
+        if position is not None:
+            if getattr(list.__getitem__(self, position), self.keyattr) == key:
+                return position
+            # 有元素的key被直接改掉了
+            self.reindex()
+            position = self._positions().get(key)
+            if position is not None:
+                return position
+        if not isinstance(key, str) and hasattr(key, self.keyattr):
+            index = self._positions()
+            try:
+                position = index.get(getattr(key, self.keyattr))
+            except TypeError:
+                position = None
+            if position is not None and list.__getitem__(self, position) is key:
+                return position
+            for position, obj in enumerate(self):
+                if obj is key:
+                    return position
+        return None
+
+    def _claim_key(self, obj: _Template, replacing: Optional[_Template] = None) -> None:
+        "检查元素的key有没有重复（replacing是要被替换掉的元素），允许重复的话改成不重复的"
+        index = self._raw_index()
+        released = None if replacing is None else getattr(replacing, self.keyattr)
+        while (
+            getattr(obj, self.keyattr) in index
+            and getattr(obj, self.keyattr) != released
+        ):
+            if not self.allow_dumplicate:  # 如果不允许重复直接抛出异常
+                raise ValueError(f"模板的key（{getattr(obj, self.keyattr)!r}）重复")
+            Logger.log(
+                "W",
+                f"模板的key（{getattr(obj, self.keyattr)!r}）重复，"
+                f"补充为{getattr(obj, self.keyattr)!r}{self.dumplicate_suffix}",
+                "OrderedKeyList.append",
+            )
+            setattr(
+                obj, self.keyattr, getattr(obj, self.keyattr) + self.dumplicate_suffix
+            )
+
+    # 取值、修改
 
-    def __getitem__(self, key: Union[int, str, _Template]) -> _Template:
+    def __getitem__(self, key: Union[int, slice, str, _Template]) -> _Template:
         "返回指定索引或key的模板"
-        if isinstance(key, int):
+        if isinstance(key, (int, slice)):
             return super().__getitem__(key)
-        else:
-            for obj in self:
-                if getattr(obj, self.keyattr) == key:
-                    return obj
-            for obj in self:
-                if obj is key:
-                    return obj
+        position = self.position(key)
+        if position is None:
             raise KeyError(f"列表中不存在key为{key!r}的模板")
+        return super().__getitem__(position)
 
-    def __setitem__(self, key: Union[int, str, _Template], value: _Template):
+    def get(self, key: Union[str, _Template], default: Any = None) -> Any:
+        "返回指定key的模板，不存在则返回default（和dict.get一样）"
+        position = self.position(key)
+        return default if position is None else super().__getitem__(position)
+
+    def __setitem__(self, key: Union[int, slice, str, _Template], value: _Template):
         "设置指定索引或key的模板"
-        if isinstance(key, int):
+        if isinstance(key, slice):
             super().__setitem__(key, value)
+            self.reindex()
+            return
+        if isinstance(key, int):
+            position = key + len(self) if key < 0 else key
+            old = super().__getitem__(key)
         else:
-            for i, obj in enumerate(self):
-                if getattr(obj, self.keyattr) == key:
-                    super().__setitem__(i, value)
+            position = self.position(key)
+            if position is None:
+                if (
+                    getattr(value, self.keyattr) == key
+                    and isinstance(value, SupportsKeyOrdering)
+                    and isinstance(key, str)
+                ):
+                    self.append(value)  # 如果key是字符串，并且value是模板，则直接添加到列表中
                     return
-                elif obj is key:
-                    super().__setitem__(i, value)
-            if (
-                getattr(value, self.keyattr) == key
-                and isinstance(value, SupportsKeyOrdering)
-                and isinstance(key, str)
-            ):
-                self.append(
-                    value
-                )  # 如果key是字符串，并且value是模板，则直接添加到列表中
-            else:
                 raise KeyError(f"列表中不存在key为{key!r}的模板")
-
-    def __delitem__(self, key: Union[int, str]):
+            old = super().__getitem__(position)
+        self._claim_key(value, old)
+        index = self._raw_index()
+        dumplicated = len(index) < len(self)
+        index.pop(getattr(old, self.keyattr), None)
+        super().__setitem__(position, value)
+        index[getattr(value, self.keyattr)] = position
+        if dumplicated:  # 被替换掉的key可能还有别的元素在用
+            self.reindex()
+
+    def __delitem__(self, key: Union[int, slice, str]):
         "删除指定索引或key的模板"
-        if isinstance(key, int):
+        if isinstance(key, slice):
             super().__delitem__(key)
+            self.reindex()
+            return
+        if isinstance(key, int):
+            position = key + len(self) if key < 0 else key
+            obj = super().__getitem__(key)
         else:
-            for i, obj in enumerate(self):
-                if getattr(obj, self.keyattr) == key:
-                    super().__delitem__(i)
-                    return
-            raise KeyError(f"列表中不存在key为{key!r}的模板")
-
-    def __len__(self) -> int:
-        "返回列表中模板的数量"
-        return super().__len__()
-
-    def __reversed__(self) -> Iterator[_Template]:
-        "返回列表的反向迭代器"
-        return super().__reversed__()
-
-    def __contains__(self, item: _Template) -> bool:
-        "判断列表中是否包含指定模板"
-        return (
-            super().__contains__(item)
-            or [getattr(obj, self.keyattr) for obj in self].count(item) > 0
-        )
+            position = self.position(key)
+            if position is None:
+                raise KeyError(f"列表中不存在key为{key!r}的模板")
+            obj = super().__getitem__(position)
+        index = self._raw_index()
+        dumplicated = len(index) < len(self)
+        index.pop(getattr(obj, self.keyattr), None)
+        super().__delitem__(position)
+        self._shifted(position)
+        if dumplicated:  # 删掉的key可能还有别的元素在用
+            self.reindex()
+
+    def __contains__(self, item: Union[str, _Template]) -> bool:
+        "判断列表中是否包含指定模板（或者key）"
+        if isinstance(item, str):
+            return item in self._raw_index()
+        try:
+            position = self._positions().get(getattr(item, self.keyattr, None))
+        except TypeError:
+            position = None
+        if position is not None and list.__getitem__(self, position) is item:
+            return True
+        return super().__contains__(item)
+
+    def index(self, item: Union[str, _Template], *args) -> int:
+        "返回指定模板（或者key）的位置，不存在则抛出ValueError"
+        position = self.position(item)
+        if position is not None and (
+            not args or position in range(len(self))[slice(*args)]
+        ):
+            return position
+        return super().index(item, *args)
 
     def swaps(self, lh: Union[int, str], rh: Union[int, str]):
         "交换指定索引或key的模板"
-        if isinstance(lh, str):
-            for i, obj in enumerate(self):
-                if getattr(obj, self.keyattr) == lh:
-                    lh = i
-                    break
-            else:
-                raise KeyError(f"列表中不存在key为{lh!r}的模板")
-        if isinstance(rh, str):
-            for i, obj in enumerate(self):
-                if getattr(obj, self.keyattr) == rh:
-                    lh = i
-                    break
+        positions = []
+        for key in (lh, rh):
+            if isinstance(key, int):
+                positions.append(key + len(self) if key < 0 else key)
             else:
-                raise KeyError(f"列表中不存在key为{rh!r}的模板")
-        self[lh], self[rh] = self[rh], self[lh]
+                position = self.position(key)
+                if position is None:
+                    raise KeyError(f"列表中不存在key为{key!r}的模板")
+                positions.append(position)
+        lh, rh = positions
+        left, right = super().__getitem__(lh), super().__getitem__(rh)
+        super().__setitem__(lh, right)
+        super().__setitem__(rh, left)
+        index = self._positions()
+        index[getattr(right, self.keyattr)] = lh
+        index[getattr(left, self.keyattr)] = rh
         return self
 
-    def __iter__(self) -> Iterator[_Template]:
-        "返回列表的迭代器"
-        return super().__iter__()
-
     def append(self, obj: _Template):
         "添加到列表"
-        if getattr(obj, self.keyattr) in self.keys():
-            if not self.allow_dumplicate:  # 如果不允许重复直接抛出异常
-                raise ValueError(f"模板的key（{getattr(obj, self.keyattr)!r}）重复")
-            print(
-                "W",
-                f"模板的key（{getattr(obj, self.keyattr)!r}）重复，"
-                f"补充为{getattr(obj, self.keyattr)!r}{self.dumplicate_suffix}",
-                "OrderedKeyList.append",
-            )
-            setattr(
-                obj, self.keyattr, getattr(obj, self.keyattr) + self.dumplicate_suffix
-            )
+        self._claim_key(obj)
         super().append(obj)
+        self._key_index[getattr(obj, self.keyattr)] = len(self) - 1
+        if self._indexed == len(self) - 1:
+            self._indexed += 1
         return self
 
     def extend(self, templates: Iterable[_Template]):
@@ -314,6 +392,42 @@ class OrderedKeyList(list, Iterable[_Template]):
             self.append(template)
         return self
 
+    def __iadd__(self, templates: Iterable[_Template]):
+        return self.extend(templates)
+
+    def insert(self, position: int, obj: _Template) -> None:
+        "插入到指定位置"
+        self._claim_key(obj)
+        super().insert(position, obj)
+        position = max(0, min(position + len(self) - 1 if position < 0 else position, len(self) - 1))
+        self._key_index[getattr(obj, self.keyattr)] = position
+        self._shifted(position)
+
+    def pop(self, position: Union[int, str] = -1) -> _Template:
+        "删掉并返回指定索引或key的模板"
+        obj = self[position]
+        del self[position]
+        return obj
+
+    def remove(self, obj: Union[str, _Template]) -> None:
+        "删掉指定模板（或者key）"
+        del self[self.index(obj)]
+
+    def clear(self) -> None:
+        "清空列表"
+        super().clear()
+        self.reindex()
+
+    def sort(self, *args, **kwargs) -> None:
+        "排序"
+        super().sort(*args, **kwargs)
+        self.reindex()
+
+    def reverse(self) -> None:
+        "翻转"
+        super().reverse()
+        self.reindex()
+
     def keys(self) -> List[str]:
         "返回列表中所有元素的key"
         return [getattr(obj, self.keyattr) for obj in self]
@@ -326,15 +440,15 @@ class OrderedKeyList(list, Iterable[_Template]):
         "返回列表中所有模板的key和模板"
         return [(getattr(obj, self.keyattr), obj) for obj in self]
 
-    def __copy__(self) -> "OrderedKeyList[_Template]":
+    def __copy__(self) -> "IndexedOrderedMap[_Template]":
         "返回列表的浅拷贝"
-        return OrderedKeyList(self)
+        return type(self)(list(self))
 
-    def __deepcopy__(self, memo: Optional[dict]) -> "OrderedKeyList[_Template]":
+    def __deepcopy__(self, memo: Optional[dict]) -> "IndexedOrderedMap[_Template]":
         "返回列表的深拷贝"
-        return OrderedKeyList([copy.deepcopy(obj, memo) for obj in self])
+        return type(self)([copy.deepcopy(obj, memo) for obj in self])
 
-    def copy(self) -> "OrderedKeyList[_Template]":
+    def copy(self) -> "IndexedOrderedMap[_Template]":
         "返回列表的拷贝"
         return self.__copy__()
 
@@ -342,6 +456,73 @@ class OrderedKeyList(list, Iterable[_Template]):
         "返回列表的字典表示"
         return dict(self.items())
 
+    # pickle的时候索引不用带着（元素是按list的方式存的，加载的时候会一个一个append回来）
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        for name in self._index_attrs:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: Optional[Dict[str, Any]]) -> None:
+        for name in self._index_attrs:
+            (state or {}).pop(name, None)
+        self.__dict__.update(state or {})
+
     def __repr__(self) -> str:
         "返回列表的表达式"
-        return f"OrderedKeyList({super().__repr__()})"
+        return f"{type(self).__name__}({super().__repr__()})"
+
+
+class OrderedKeyList(IndexedOrderedMap[_Template]):
+    """有序的key列表，可以用方括号来根据SupportsKeyOrdering对象的key，索引值或者对象本身来获取对象
+
+    举个例子
+
+    建立一个新的OrderedKeyList
+    >>> template = ScoreModificationTemplate("go_to_school_late_more", -2.0, "7:30后到校", "哥们为什么不睡死在家里？")
+    >>> # 这里有一个存在变量里面的模板，我们叫它template
+    >>> DEFAULT_SCORE_TEMPLATES = OrderedKeyList([
+    ...   ScoreModificationTemplate("go_to_school_early", 1.0, "7:20前到校", "早起的鸟儿有虫吃"),
+    ...   ScoreModificationTemplate("go_to_school_late", -1.0, "7:25后到校", "早起的虫儿被鸟吃"),
+    ...   template
+    ... ])
+
+    获取里面的元素
+    >>> DEFAULT_SCORE_TEMPLATES[0]
+    ScoreModificationTemplate("go_to_school_early", 1.0, "7:20前到校", "早起的鸟儿有虫吃")
+    >>> DEFAULT_SCORE_TEMPLATES["go_to_school_early"]
+    ScoreModificationTemplate("go_to_school_early", 1.0, "7:20前到校", "早起的鸟儿有虫吃")
+    >>> DEFAULT_SCORE_TEMPLATES[template]
+    ScoreModificationTemplate("go_to_school_late_more", -2.0, "7:30后到校", "哥们为什么不睡死在家里？")
+    >>> DEFAULT_SCORE_TEMPLATES.keys()
+    ["go_to_school_early", "go_to_school_late", "go_to_school_late"]
+    >>> len(DEFAULT_SCORE_TEMPLATES)
+    3
+
+    添加元素
+    >>> DEFAULT_SCORE_TEMPLATES.append(ScoreModificationTemplate("Chinese_class_good", 2.0,"语文课堂表扬","王の表扬"))
+    >>> DEFAULT_SCORE_TEMPLATES.append(template) # 这里如果设置了不允许重复的话还往里面放同一个模板就会报错
+    Traceback (most recent call last):
+      File "<stdin>", line 1, in <module>
+        DEFAULT_SCORE_TEMPLATES.append(template)
+      File "<stdin>", line 166, in append
+        raise ValueError(F"模板的key（{getattr(v, self.keyattr)!r}）重复")
+    ValueError: 模板的key（'go_to_school_late_more'）重复
+
+
+    交换里面的元素顺序
+    >>> DEFAULT_SCORE_TEMPLATES.swaps(0, 1)     # 交换索引0和1的元素，当然也可以填模板的key
+    OrderedKeyList([
+        ScoreModificationTemplate("go_to_school_late", -1.0, "7:25后到校", "早起的虫儿被鸟吃"),
+        ScoreModificationTemplate("go_to_school_early", 1.0, "7:20前到校", "早起的鸟儿有虫吃"),
+        ScoreModificationTemplate("go_to_school_late_more", -2.0, "7:30后到校", "哥们为什么不睡死在家里？")
+    ])
+
+    删掉/修改里面的元素
+    >>> del DEFAULT_SCORE_TEMPLATES["go_to_school_early"]    # 删除key为"go_to_school_early"的元素
+    >>> DEFAULT_SCORE_TEMPLATES.pop(0)                       # 删除索引为0的元素
+    >>> len(DEFAULT_SCORE_TEMPLATES)                         # 查看长度（现在只剩一个7:30以后到校的了）
+    1
+
+    """
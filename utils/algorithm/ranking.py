@@ -0,0 +1,248 @@
+"""
+排名索引
+
+按分数从高到低排好的索引，改一个人的分数只要在有序列表里删掉旧的位置、插入新的位置（二分查找），
+不用每次都把所有人重新排一遍：
+
+- 竞争排名（1, 2, 2, 4）= 1 + 分数比他高的人数，二分查找
+- 密集排名（1, 2, 2, 3）= 1 + 比他高的不同分数的个数，在去重的分数列表里二分查找
+- 前k名直接切片，第一名O(1)
+
+同分的按编号（学号）从小到大排。
+"""
+
+from bisect import bisect_left, insort
+from typing import (Any, Callable, Dict, Generic, Hashable, Iterable, Iterator, List,
+                    Optional, Tuple, TypeVar)
+
+
+__all__ = ["RankingIndex"]
+
+_Item = TypeVar("_Item")
+
+RankKey = Tuple[float, Any]
+"有序列表里的键，(-分数, 编号)"
+
+
+class RankingIndex(Generic[_Item]):
+    "排名索引，见模块说明"
+
+    def __init__(
+        self,
+        items: Iterable[_Item] = (),
+        score: Callable[[_Item], float] = lambda item: item.score,
+        ident: Callable[[_Item], Hashable] = lambda item: item.num,
+    ):
+        """
+        构造一个排名索引。
+
+        :param items: 要排名的对象
+        :param score: 取分数的函数
+        :param ident: 取编号的函数，编号在索引里不能重复，同分的时候按编号排
+        """
+        self.score = score
+        "取分数的函数"
+        self.ident = ident
+        "取编号的函数"
+        self.keys: List[RankKey] = []
+        "所有人的键，从高分到低分排"
+        self.items: Dict[Hashable, Tuple[RankKey, _Item]] = {}
+        "items[编号] = (键, 对象)"
+        self.score_counts: Dict[float, int] = {}
+        "score_counts[分数] = 这个分数的人数"
+        self.distinct: List[float] = []
+        "所有不同的分数取负，从小到大排（也就是分数从高到低）"
+        self.version = 0
+        "每次有改动加一，用来判断缓存的结果还能不能用"
+        self.stale = False
+        "是否已经失效（比如改了编号），失效了要重建"
+        self._cache: Dict[str, Tuple[int, Any]] = {}
+        for item in items:
+            key = (-self.score(item), self.ident(item))
+            self.items[key[1]] = (key, item)
+        self.keys = sorted(key for key, _ in self.items.values())
+        for key in self.keys:
+            self._count(-key[0], 1)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, item: _Item) -> bool:
+        entry = self.items.get(self.ident(item))
+        return entry is not None and entry[1] is item
+
+    def _count(self, score: float, delta: int) -> None:
+        count = self.score_counts.get(score, 0) + delta
+        if count > 0:
+            if count == delta:
+                insort(self.distinct, -score)
+            self.score_counts[score] = count
+        else:
+            del self.score_counts[score]
+            del self.distinct[bisect_left(self.distinct, -score)]
+
+    def _remove_key(self, key: RankKey) -> None:
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+            self._count(-key[0], -1)
+
+    def _insert_key(self, key: RankKey) -> None:
+        insort(self.keys, key)
+        self._count(-key[0], 1)
+
+    def add(self, item: _Item) -> None:
+        """
+        加入一个对象（编号已经有了的会替换掉原来的）。
+
+        :param item: 对象
+        """
+        ident = self.ident(item)
+        old = self.items.get(ident)
+        if old is not None:
+            self._remove_key(old[0])
+        key = (-self.score(item), ident)
+        self.items[ident] = (key, item)
+        self._insert_key(key)
+        self.version += 1
+
+    def remove(self, item: _Item) -> bool:
+        """
+        移除一个对象。
+
+        :param item: 对象
+        :return: 是否移除了（不在索引里则为False）
+        """
+        ident = self.ident(item)
+        old = self.items.get(ident)
+        if old is None or old[1] is not item:
+            return False
+        del self.items[ident]
+        self._remove_key(old[0])
+        self.version += 1
+        return True
+
+    def update(self, item: _Item) -> None:
+        """
+        对象的分数变了之后调用，把它挪到新的位置。
+
+        :param item: 对象，不在索引里的不管
+        """
+        ident = self.ident(item)
+        old = self.items.get(ident)
+        if old is None or old[1] is not item:
+            return
+        key = (-self.score(item), ident)
+        if key == old[0]:
+            return
+        self._remove_key(old[0])
+        self.items[ident] = (key, item)
+        self._insert_key(key)
+        self.version += 1
+
+    def invalidate(self) -> None:
+        "标记索引失效（改了编号之类的索引跟不上的改动），下次用之前要重建"
+        self.stale = True
+
+    def competition_rank(self, item: _Item) -> int:
+        """
+        竞争排名（同分同名次，下一个分数的名次跳过同分的人数：1, 2, 2, 4）。
+
+        :param item: 对象
+        :return: 名次
+        :raise KeyError: 不在索引里
+        """
+        key = self.items[self.ident(item)][0]
+        return bisect_left(self.keys, (key[0],)) + 1
+
+    def dense_rank(self, item: _Item) -> int:
+        """
+        密集排名（同分同名次，下一个分数的名次接着往下：1, 2, 2, 3）。
+
+        :param item: 对象
+        :return: 名次
+        :raise KeyError: 不在索引里
+        """
+        key = self.items[self.ident(item)][0]
+        return bisect_left(self.distinct, key[0]) + 1
+
+    @property
+    def distinct_count(self) -> int:
+        "有多少个不同的分数（也就是密集排名的最后一名）"
+        return len(self.distinct)
+
+    def top(self, k: int) -> List[_Item]:
+        """
+        分数最高的k个对象。
+
+        :param k: 数量
+        :return: 对象，从高分到低分
+        """
+        return [self.items[key[1]][1] for key in self.keys[:k]]
+
+    def first(self) -> Optional[_Item]:
+        "分数最高的对象，没有则为None"
+        return self.items[self.keys[0][1]][1] if self.keys else None
+
+    def __iter__(self) -> Iterator[_Item]:
+        "从高分到低分遍历"
+        items = self.items
+        return (items[key[1]][1] for key in self.keys)
+
+    def cached(self, name: str, build: Callable[["RankingIndex[_Item]"], Any]) -> Any:
+        """
+        按索引的版本缓存一个由它算出来的结果，索引没变就直接返回上次的。
+
+        :param name: 结果的名字
+        :param build: 计算结果的函数
+        :return: 结果
+        """
+        entry = self._cache.get(name)
+        if entry is not None and entry[0] == self.version:
+            return entry[1]
+        value = build(self)
+        self._cache[name] = (self.version, value)
+        return value
+
+    def competition_ranking(self) -> List[Tuple[int, _Item]]:
+        "所有人的竞争排名，[(名次, 对象)]，从高分到低分（有缓存，别改返回的列表）"
+        return self.cached("competition", RankingIndex._build_competition)
+
+    def dense_ranking(self) -> List[Tuple[int, _Item]]:
+        "所有人的密集排名，[(名次, 对象)]，从高分到低分（有缓存，别改返回的列表）"
+        return self.cached("dense", RankingIndex._build_dense)
+
+    def ascending(self) -> List[_Item]:
+        "所有人从低分到高分排（同分的还是按编号从小到大，有缓存，别改返回的列表）"
+        return self.cached("ascending", RankingIndex._build_ascending)
+
+    def _build_competition(self) -> List[Tuple[int, _Item]]:
+        result = []
+        last = None
+        rank = 0
+        for position, key in enumerate(self.keys, start=1):
+            if key[0] != last:
+                rank = position
+                last = key[0]
+            result.append((rank, self.items[key[1]][1]))
+        return result
+
+    def _build_dense(self) -> List[Tuple[int, _Item]]:
+        result = []
+        last = None
+        rank = 0
+        for key in self.keys:
+            if key[0] != last:
+                rank += 1
+                last = key[0]
+            result.append((rank, self.items[key[1]][1]))
+        return result
+
+    def _build_ascending(self) -> List[_Item]:
+        result: List[_Item] = []
+        end = len(self.keys)
+        while end > 0:
+            start = bisect_left(self.keys, (self.keys[end - 1][0],))
+            result.extend(self.items[key[1]][1] for key in self.keys[start:end])
+            end = start
+        return result
@@ -0,0 +1,164 @@
+"""
+前缀和线段树
+
+按顺序存一串变化量（比如每次加减分的分数），支持：
+
+- 改一个位置的变化量、在末尾追加：O(log n)（追加偶尔要把树扩大一倍，均摊O(1)）
+- 任意一段的和：O(log n)
+- 所有前缀和里的最大值、最小值以及第一次达到它们的位置：O(1)（存在根节点上）
+
+每个节点存这一段的和、段内前缀和的最大值和最小值（相对于段的开头）以及取到它们的位置，
+合并两段的时候右半段的前缀和要加上左半段的和。
+"""
+
+from typing import Iterable, List, Tuple
+
+
+__all__ = ["PrefixSumTree"]
+
+_INF = float("inf")
+
+
+class PrefixSumTree:
+    "前缀和线段树，见模块说明"
+
+    def __init__(self, values: Iterable[float] = ()):
+        """
+        构造一棵前缀和线段树。
+
+        :param values: 初始的变化量
+        """
+        self.values: List[float] = list(values)
+        "所有的变化量"
+        self.size = 1
+        "叶子的数量（2的幂，不小于变化量的数量）"
+        while self.size < len(self.values):
+            self.size *= 2
+        self.sums: List[float] = []
+        "sums[节点] = 这一段的和"
+        self.max_prefix: List[float] = []
+        "max_prefix[节点] = 这一段里前缀和的最大值"
+        self.max_index: List[int] = []
+        "max_index[节点] = 第一次取到最大值的位置"
+        self.min_prefix: List[float] = []
+        "min_prefix[节点] = 这一段里前缀和的最小值"
+        self.min_index: List[int] = []
+        "min_index[节点] = 第一次取到最小值的位置"
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def _build(self) -> None:
+        size = self.size
+        self.sums = [0.0] * (2 * size)
+        self.max_prefix = [-_INF] * (2 * size)
+        self.max_index = [-1] * (2 * size)
+        self.min_prefix = [_INF] * (2 * size)
+        self.min_index = [-1] * (2 * size)
+        for index, value in enumerate(self.values):
+            self._set_leaf(index, value)
+        for node in range(size - 1, 0, -1):
+            self._pull(node)
+
+    def _set_leaf(self, index: int, value: float) -> None:
+        node = self.size + index
+        self.sums[node] = value
+        self.max_prefix[node] = value
+        self.min_prefix[node] = value
+        self.max_index[node] = index
+        self.min_index[node] = index
+
+    def _pull(self, node: int) -> None:
+        left, right = 2 * node, 2 * node + 1
+        sums, max_prefix, min_prefix = self.sums, self.max_prefix, self.min_prefix
+        offset = sums[left]
+        sums[node] = offset + sums[right]
+        # 同样大的取左边的（第一次取到的位置）
+        candidate = offset + max_prefix[right]
+        if candidate > max_prefix[left]:
+            max_prefix[node] = candidate
+            self.max_index[node] = self.max_index[right]
+        else:
+            max_prefix[node] = max_prefix[left]
+            self.max_index[node] = self.max_index[left]
+        candidate = offset + min_prefix[right]
+        if candidate < min_prefix[left]:
+            min_prefix[node] = candidate
+            self.min_index[node] = self.min_index[right]
+        else:
+            min_prefix[node] = min_prefix[left]
+            self.min_index[node] = self.min_index[left]
+
+    def set(self, index: int, value: float) -> None:
+        """
+        修改一个位置的变化量。
+
+        :param index: 位置
+        :param value: 新的变化量
+        :raise IndexError: 位置超出范围
+        """
+        if not 0 <= index < len(self.values):
+            raise IndexError(f"位置{index}超出范围（共{len(self.values)}个）")
+        self.values[index] = value
+        self._set_leaf(index, value)
+        node = (self.size + index) // 2
+        while node:
+            self._pull(node)
+            node //= 2
+
+    def append(self, value: float) -> None:
+        """
+        在末尾追加一个变化量。
+
+        :param value: 变化量
+        """
+        self.values.append(value)
+        if len(self.values) > self.size:
+            self.size *= 2
+            self._build()
+        else:
+            self.set(len(self.values) - 1, value)
+
+    def range_sum(self, start: int, stop: int) -> float:
+        """
+        求[start, stop)这一段的和。
+
+        :param start: 开始位置（包含）
+        :param stop: 结束位置（不包含）
+        :return: 和
+        """
+        start = max(start, 0) + self.size
+        stop = min(stop, len(self.values)) + self.size
+        total = 0.0
+        while start < stop:
+            if start & 1:
+                total += self.sums[start]
+                start += 1
+            if stop & 1:
+                stop -= 1
+                total += self.sums[stop]
+            start //= 2
+            stop //= 2
+        return total
+
+    @property
+    def total(self) -> float:
+        "所有变化量的和"
+        return self.sums[1]
+
+    def highest(self) -> Tuple[float, int]:
+        """
+        所有前缀和（至少包含一个位置）里的最大值和第一次取到它的位置。
+
+        :return: (最大值, 位置)，没有变化量则为(-inf, -1)
+        """
+        return self.max_prefix[1], self.max_index[1]
+
+    def lowest(self) -> Tuple[float, int]:
+        """
+        所有前缀和（至少包含一个位置）里的最小值和第一次取到它的位置。
+
+        :return: (最小值, 位置)，没有变化量则为(inf, -1)
+        """
+        return self.min_prefix[1], self.min_index[1]
@@ -0,0 +1,184 @@
+"""
+随机抽人
+
+- 筛选条件（从哪些人里抽、必须包括的、必须排除的）在构造的时候过一遍，得到候选池，
+  之后每次抽都不用再把所有人筛一遍
+- 等概率不重复地抽k个：部分Fisher–Yates洗牌，只把前k个位置换成随机的，O(k)
+- 按权重抽：Vose的别名表（AliasTable），建表O(n)，抽一次O(1)。
+  不重复地抽的时候抽到已经抽过的就重抽，效果和每次只在剩下的人里按权重抽一样；
+  抽走的人的权重加起来超过一半之后用剩下的人重新建表，所以平均每抽一个最多重抽两次
+"""
+
+import random
+from typing import Callable, Generic, Iterable, List, Optional, Sequence, TypeVar
+
+
+__all__ = ["AliasTable", "RandomSelector"]
+
+_Item = TypeVar("_Item")
+
+
+class AliasTable:
+    "别名表：按权重随机抽一个位置，O(1)"
+
+    def __init__(self, weights: Sequence[float]):
+        """
+        构造一个别名表。
+
+        :param weights: 每个位置的权重（不能是负数，加起来要大于0）
+        :raise ValueError: 权重是负数或者加起来不大于0
+        """
+        count = len(weights)
+        total = float(sum(weights))
+        if any(w < 0 for w in weights):
+            raise ValueError("权重不能是负数")
+        if not total > 0:
+            raise ValueError("权重加起来要大于0")
+        self.total = total
+        "权重总和"
+        self.probability: List[float] = [0.0] * count
+        "probability[位置] = 抽到这一格的时候就是这个位置的概率（否则是alias里的）"
+        self.alias: List[int] = list(range(count))
+        "alias[位置] = 这一格另一半的位置"
+        scaled = [w * count / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # 剩下的（包括浮点误差留下来的）都是满的一格
+        for i in small + large:
+            self.probability[i] = 1.0
+
+    def __len__(self) -> int:
+        return len(self.probability)
+
+    def sample(self, rng: random.Random) -> int:
+        """
+        按权重抽一个位置。
+
+        :param rng: 随机数生成器
+        :return: 位置
+        """
+        column = rng.randrange(len(self.probability))
+        if rng.random() < self.probability[column]:
+            return column
+        return self.alias[column]
+
+
+class RandomSelector(Generic[_Item]):
+    "随机抽人，见模块说明"
+
+    def __init__(
+        self,
+        candidates: Iterable[_Item],
+        includes: Iterable[_Item] = (),
+        excludes: Iterable[_Item] = (),
+        predicate: Optional[Callable[[_Item], bool]] = None,
+        weight: Optional[Callable[[_Item], float]] = None,
+        rng: Optional[random.Random] = None,
+    ):
+        """
+        构造一个抽取器。
+
+        :param candidates: 从这些对象里抽（同一个对象只算一次）
+        :param includes: 必须包括的对象，每次都会放在结果的最前面
+        :param excludes: 必须排除的对象
+        :param predicate: 额外的筛选条件，返回False的不参与抽取
+        :param weight: 取权重的函数，不填则等概率
+        :param rng: 随机数生成器，不填则新建一个
+        :raise ValueError: 权重是负数
+        """
+        self.includes: List[_Item] = list(includes)
+        "必须包括的对象"
+        skipped = {id(item) for item in excludes}
+        skipped.update(id(item) for item in self.includes)
+        self.pool: List[_Item] = []
+        "候选池（筛选之后剩下的），等概率抽取的时候顺序会被打乱"
+        for item in candidates:
+            if id(item) in skipped or (predicate is not None and not predicate(item)):
+                continue
+            skipped.add(id(item))
+            self.pool.append(item)
+        self.weights: Optional[List[float]] = (
+            None if weight is None else [float(weight(item)) for item in self.pool]
+        )
+        "每个候选的权重（和pool一一对应），None为等概率"
+        if self.weights is not None and any(w < 0 for w in self.weights):
+            raise ValueError("权重不能是负数")
+        self.rng = rng if rng is not None else random.Random()
+        "随机数生成器"
+        self._table: Optional[AliasTable] = None
+        "权重大于0的候选的别名表，第一次按权重抽的时候才建"
+        self._positive: List[int] = []
+        "权重大于0的候选在pool里的位置，和_table一一对应"
+
+    @property
+    def available(self) -> int:
+        "最多能抽多少个（候选池的人数加上必须包括的人数）"
+        return len(self.pool) + len(self.includes)
+
+    def choose(self, count: int) -> List[_Item]:
+        """
+        不重复地抽count个（包括必须包括的）。
+
+        :param count: 要抽的数量
+        :return: 抽到的对象，必须包括的在最前面，剩下的按抽到的顺序
+        :raise ValueError: 要抽的数量小于必须包括的数量或者多于能抽的数量
+        """
+        if count < len(self.includes):
+            raise ValueError(
+                f"必选项的长度 ({len(self.includes)}) 大于了要选择的数量 ({count})"
+            )
+        if count > self.available:
+            raise ValueError(f"要选择的数量 ({count}) 多于可以选择的数量 ({self.available})")
+        k = count - len(self.includes)
+        if self.weights is None:
+            picked = self._uniform(k)
+        else:
+            picked = self._weighted(k)
+        return self.includes + picked
+
+    def _uniform(self, k: int) -> List[_Item]:
+        # 部分Fisher–Yates：第i个位置和[i, n)里随机一个位置换
+        pool, randrange = self.pool, self.rng.randrange
+        n = len(pool)
+        for i in range(k):
+            j = randrange(i, n)
+            pool[i], pool[j] = pool[j], pool[i]
+        return pool[:k]
+
+    def _weighted(self, k: int) -> List[_Item]:
+        weights = self.weights
+        if self._table is None:
+            self._positive = [p for p, w in enumerate(weights) if w > 0]
+            self._table = (
+                AliasTable([weights[p] for p in self._positive]) if self._positive else None
+            )
+        positions, table = self._positive, self._table
+        picked: List[int] = []
+        taken = set()
+        taken_weight = 0.0
+        while len(picked) < k and table is not None:
+            position = positions[table.sample(self.rng)]
+            if position in taken:
+                continue
+            taken.add(position)
+            picked.append(position)
+            taken_weight += weights[position]
+            if taken_weight > table.total / 2 and len(picked) < k:
+                # 抽走的权重太多了，重抽的概率会越来越大，用剩下的人重新建表
+                positions = [p for p in positions if p not in taken]
+                table = AliasTable([weights[p] for p in positions]) if positions else None
+                taken_weight = 0.0
+        if len(picked) < k:
+            # 权重大于0的都抽完了，剩下的在权重是0的里面等概率抽
+            rest = [p for p, w in enumerate(weights) if w == 0]
+            for i in range(k - len(picked)):
+                j = self.rng.randrange(i, len(rest))
+                rest[i], rest[j] = rest[j], rest[i]
+            picked.extend(rest[: k - len(picked)])
+        return [self.pool[p] for p in picked]
@@ -1,8 +1,13 @@
 
 import copy
-from uuid import UUID, uuid4
+import functools
+import threading
+import weakref
+from uuid import UUID, SafeUUID, uuid4
 from abc import ABC, abstractmethod
-from typing import TypeVar, Generic, Union, Optional
+from typing import TypeVar, Generic, Union, Optional, Callable, Any, Dict, Tuple
+from utils.basetypes import Base
+from .registry import uuid_registry
 
 
 
@@ -11,45 +16,191 @@ _DataType = TypeVar("_DataType")
 class ClassDataTypeUUID(UUID, Generic[_DataType]):
     """
     班级数据类型的唯一标识符。
+
+    同一个(数据类型, uuid)只会有一个实例（驻留在_interned里，没人用了会自动去掉），
+    从存档加载的时候每个对象的归档uuid、被好几个对象引用的uuid都不会重复构造；
+    分表用的首位十六进制在构造的时候就算好了，分表的时候不用每次都拼字符串。
+
+    两个ClassDataTypeUUID相等当且仅当uuid和数据类型都一样（防止不同类但UUID相同的情况），
+    和普通的UUID、字符串都不相等。
     """
 
-    def __init__(self, dt: _DataType, _uuid: Optional[UUID] = None):
-        super().__init__(int=_uuid.int if _uuid else uuid4().int)
-        self.dtype = dt
+    __slots__ = ("dtype", "shard_prefix")
+
+    _interned: "Dict[Any, weakref.WeakValueDictionary[int, ClassDataTypeUUID]]" = {}
+    "所有活着的实例，_interned[数据类型][uuid整数] = 实例（按数据类型分开，省掉每个实例一个(数据类型, uuid)元组）"
+
+    _intern_lock = threading.Lock()
+    "构造新实例时拿的锁，保证同一个(数据类型, uuid)只有一个实例"
+
+    def __new__(cls, dt: _DataType = None, _uuid: Optional[UUID] = None):
+        if dt is None and _uuid is None:
+            # 老存档pickle里的uuid（copyreg.__newobj__不带参数），之后__setstate__会填上int
+            obj = UUID.__new__(cls)
+            object.__setattr__(obj, "dtype", None)
+            return obj
+        return cls.interned(dt, _uuid.int if _uuid else uuid4().int)
+
+    def __init__(self, dt: _DataType = None, _uuid: Optional[UUID] = None):
+        # 在__new__里面已经构造好了（可能是之前就有的实例），这里什么都不做
+        pass
+
+    @classmethod
+    def interned(cls, dt: _DataType, value: int) -> "ClassDataTypeUUID[_DataType]":
+        """
+        返回(数据类型, uuid)对应的唯一实例，没有就构造一个。
+
+        :param dt: 数据类型
+        :param value: uuid的128位整数
+        :return: 实例
+        """
+        instances = cls._interned.get(dt)
+        if instances is not None:
+            obj = instances.get(value)
+            if obj is not None:
+                return obj
+        with cls._intern_lock:
+            instances = cls._interned.setdefault(dt, weakref.WeakValueDictionary())
+            obj = instances.get(value)
+            if obj is None:
+                obj = UUID.__new__(cls)
+                object.__setattr__(obj, "is_safe", SafeUUID.unknown)
+                obj._fill(dt, value)
+                instances[value] = obj
+        return obj
+
+    @classmethod
+    def parse(cls, dt: _DataType, value: str) -> "ClassDataTypeUUID[_DataType]":
+        """
+        从字符串（带不带横线都行）得到(数据类型, uuid)对应的实例。
 
+        :param dt: 数据类型
+        :param value: uuid字符串
+        :return: 实例
+        :raise ValueError: 字符串不是uuid
+        """
+        digits = value.replace("-", "")
+        if len(digits) == 32:
+            # 和UUID(hex)里面的解析一样，加载的时候每个对象都要来一次，省掉构造UUID
+            return cls.interned(dt, int(digits, 16))
+        return cls.interned(dt, UUID(digits).int)
+
+    def _fill(self, dt: _DataType, value: int) -> None:
+        object.__setattr__(self, "int", value)
+        object.__setattr__(self, "dtype", dt)
+        object.__setattr__(self, "shard_prefix", "%x" % (value >> 124))
+
+    def __setstate__(self, state: Any):
+        # 老存档pickle里的uuid只有int（UUID.__getstate__），数据类型找不回来了，
+        # 用到它的对象会在ClassDataType.__setstate__里换成驻留的实例
+        super().__setstate__(state)
+        self._fill(self.dtype, self.int)
+
+    def __reduce__(self):
+        # pickle和深拷贝都带上数据类型，加载的时候换成驻留的实例
+        return (ClassDataTypeUUID.interned, (self.dtype, self.int))
 
     def __repr__(self) -> str:
-        return f"ClassObjUUID(value={super(UUID, self).__repr__()}, dtype={self.dtype.__name__})"
+        return f"ClassObjUUID(value={super(UUID, self).__repr__()}, dtype={getattr(self.dtype, '__name__', None)})"
     
     def __setattr__(self, name, value): # 为了去掉UUID的限制
         return object.__setattr__(self, name, value)
     
     def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
         if self.__class__ != other.__class__:
             return False
-        if not super(UUID, self).__eq__(other):
-            return False
-        return True
+        return self.int == other.int and self.dtype is other.dtype
     
     def __getitem__(self, item):
-        return str(self).replace("-", "")[item]
+        if item == _SHARD_SLICE:
+            return self.shard_prefix
+        return self.hex[item]
     
     def __hash__(self) -> int:
-        return hash(self.dtype.__qualname__ + "_" + str(self)) # 防止不同类但UUID相同的情况
+        # 不同数据类型的同一个uuid哈希值一样也没关系，__eq__会区分开
+        return hash(self.int)
+
+
+_SHARD_SLICE = slice(None, 1, None)
+"uuid[:1]，分表（datas_x）的时候用"
+
 
+_Func = TypeVar("_Func", bound=Callable)
+
+
+def holds_state_lock(func: _Func) -> _Func:
+    """
+    装饰器：执行的时候拿着ClassDataType.state_lock（可重入）。
+
+    :param func: 会修改对象状态的函数
+    :return: 包装后的函数
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with ClassDataType.state_lock:
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def slot_names(cls: type) -> Tuple[str, ...]:
+    """
+    一个类（连同父类）所有存实例属性的__slots__，没有__slots__的类是空的。
+
+    :param cls: 类
+    :return: 属性名
+    """
+    names = _slot_names_cache.get(cls)
+    if names is None:
+        collected = []
+        for klass in reversed(cls.__mro__):
+            slots = klass.__dict__.get("__slots__", ())
+            for name in (slots,) if isinstance(slots, str) else slots:
+                if name not in ("__dict__", "__weakref__"):
+                    collected.append(name)
+        names = _slot_names_cache[cls] = tuple(collected)
+    return names
+
+
+_slot_names_cache: "weakref.WeakKeyDictionary[type, Tuple[str, ...]]" = weakref.WeakKeyDictionary()
+"slot_names的缓存"
 
 
 class ClassDataType(ABC):
     """
     所有班级数据类型的基类。
+
+    子类可以用__slots__（数量很多的分数修改记录和成就就是这样，见ScoreModification），
+    这时实例没有__dict__，要读写所有属性的地方用instance_attrs和update_attrs。
     """
 
+    __slots__ = ()
+
     chunk_type_name: str
     "该班级数据类型的数据库名称。"
 
     is_unrelated_dtype: bool
     "该班级数据类型是否与其它班级数据类型无关。"
 
+    _dirty: bool = True
+    "是否有还没保存的修改，新建的对象默认就是有修改的，保存进数据库之后才会清掉"
+
+    dirty_hook: Optional[Callable[["ClassDataType"], Any]] = None
+    "对象被标记为有修改时调用，由负责增量保存的Chunk装上（Chunk.track_changes）"
+
+    codec_fields: Tuple[Tuple[str, Any], ...] = ()
+    "二进制编码时按顺序写入的字段和字段类型（见codec.py），没写的字段会放在最后一起编码"
+
+    transient_attrs: Tuple[str, ...] = ()
+    "不跟着pickle和深拷贝走的属性（运行时的索引之类的），见__getstate__"
+
+    state_lock: threading.RLock = threading.RLock()
+    """改分数、发成就、结算这类会同时改好几个对象的操作拿着的锁（见holds_state_lock），
+    保存时拍快照（Chunk.take_snapshot）也要拿着它，这样快照里的点评、学生和成就是互相对得上的"""
+
     def __init__(self, uuid: Union[UUID, ClassDataTypeUUID] = None):
         if uuid is None:
             # 作为一个全新的对象被构建
@@ -59,7 +210,7 @@ class ClassDataType(ABC):
             # 是根据UUID从数据库中加载的对象，并且刚刚被初始化
             self._uuid = uuid
             self._loaded = False
-
+        uuid_registry.register(self)
 
     @property
     def uuid(self) -> ClassDataTypeUUID:
@@ -68,6 +219,7 @@ class ClassDataType(ABC):
         """
         if not hasattr(self, "_uuid"):
             self._uuid = ClassDataTypeUUID(self.__class__)
+            uuid_registry.register(self)
         return self._uuid
     
     @uuid.setter
@@ -81,18 +233,48 @@ class ClassDataType(ABC):
             self._loaded = False
         
         elif isinstance(value, str):
-            self._uuid = ClassDataTypeUUID(self.__class__, UUID(value.replace("-", "")))
+            self._uuid = ClassDataTypeUUID.parse(self.__class__, value)
             self._loaded = False
 
         elif value is None:
             self._uuid = None
             self._loaded = False
+            uuid_registry.unregister(self)
+            return
         
         else:
             raise TypeError(f"uuid.setter需要提供UUID，ClassDataTypeUUID或者str， 但提供了{type(value)}")
+        # 只有已经登记了的对象才换位置，from_dict临时构造的对象不用登记
+        uuid_registry.rekey(self)
+
+    @property
+    def is_dirty(self) -> bool:
+        """
+        该对象是否有还没保存的修改。
+        """
+        # 用__slots__的子类没有类属性里的默认值
+        return getattr(self, "_dirty", True)
+
+    def mark_dirty(self) -> None:
+        """
+        标记该对象有修改，下次增量保存的时候会被写入。
+
+        DataProperty的setter会自动调用，直接改普通属性或者容器的时候需要手动调用。
+        """
+        self._dirty = True
+        hook = ClassDataType.dirty_hook
+        if hook is not None:
+            hook(self)
+
+    def mark_clean(self) -> None:
+        """
+        标记该对象已经保存。
+        """
+        self._dirty = False
 
     def refresh_uuid(self):
         self.uuid = uuid4()
+        uuid_registry.register(self)
 
     @property
     def archive_uuid(self) -> ClassDataTypeUUID:
@@ -115,7 +297,7 @@ class ClassDataType(ABC):
             if value == str(None):
                 self._archive_uuid = None
             else:
-                self._archive_uuid = ClassDataTypeUUID(self.__class__, UUID(value.replace("-", "")))
+                self._archive_uuid = ClassDataTypeUUID.parse(self.__class__, value)
 
         elif value is None:
             self._archive_uuid = None
@@ -124,6 +306,68 @@ class ClassDataType(ABC):
             raise TypeError(f"archive_uuid.setter需要提供UUID，ClassDataTypeUUID或者str， 但提供了{type(value)}")
 
 
+    def instance_attrs(self) -> dict:
+        """
+        实例的所有属性（__dict__里的和__slots__里设置了的），没有__slots__的直接返回__dict__。
+        """
+        slots = slot_names(self.__class__)
+        if not slots:
+            return self.__dict__
+        attrs = dict(getattr(self, "__dict__", ()))
+        for name in slots:
+            try:
+                attrs[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return attrs
+
+    def update_attrs(self, attrs: dict) -> None:
+        """
+        把属性一次性设置到实例上（相当于self.__dict__.update(attrs)，__slots__里的也可以）。
+
+        :param attrs: 属性
+        """
+        slots = slot_names(self.__class__)
+        if not slots:
+            self.__dict__.update(attrs)
+            return
+        instance_dict = getattr(self, "__dict__", None)
+        for name, value in attrs.items():
+            if name in slots:
+                object.__setattr__(self, name, value)
+            elif instance_dict is not None:
+                instance_dict[name] = value
+            else:
+                # 改成__slots__之前的pickle里可能有现在已经不用的属性
+                Base.log(
+                    "D",
+                    f"{self.__class__.__name__}没有属性{name}，忽略",
+                    "ClassDataType.update_attrs",
+                )
+
+    def __getstate__(self) -> Any:
+        if not self.transient_attrs:
+            return self.instance_attrs()
+        state = self.instance_attrs().copy()
+        for name in self.transient_attrs:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: Any):
+        # 深拷贝和pickle加载都不经过__init__和uuid的setter，在这里登记
+        if isinstance(state, tuple):
+            state, slot_state = state
+            state = {**(state or {}), **(slot_state or {})}
+        if state:
+            for name in ("_uuid", "_archive_uuid"):
+                value = state.get(name)
+                if isinstance(value, ClassDataTypeUUID) and value.dtype is None:
+                    # 老存档pickle里的uuid没有带数据类型
+                    state = dict(state)
+                    state[name] = ClassDataTypeUUID.interned(self.__class__, value.int)
+            self.update_attrs(state)
+        uuid_registry.register(self)
+
     def copy(self) -> "ClassDataType":
         """
         返回该班级数据类型的副本。
@@ -136,7 +380,7 @@ class ClassDataType(ABC):
         """
         return (
             f"{self.__class__.__name__}"
-            f"({', '.join([f'{k}={v!r}' for k, v in self.__dict__.items() if not k.startswith('_')])})"
+            f"({', '.join([f'{k}={v!r}' for k, v in self.instance_attrs().items() if not k.startswith('_')])})"
         )
 
 
@@ -170,6 +414,24 @@ class ClassDataType(ABC):
         从字符串解析该班级数据类型，并加载至本身。
         """
 
+    def to_bytes(self) -> bytes:
+        """
+        将该班级数据类型转换为二进制数据（to_dict的结果按照codec_fields编码）。
+        """
+        from .codec import encode_record
+        return encode_record(self.__class__, self.to_dict())
+
+    def inst_from_data(self, data: Union[str, bytes]) -> "ClassDataType":
+        """
+        从数据库里存的数据加载至本身，json字符串（to_string）和二进制数据（to_bytes）都可以。
+        """
+        if isinstance(data, str):
+            return self.inst_from_string(data)
+        from .codec import decode_record
+        obj = self.from_dict(decode_record(self.__class__, data))
+        self.update_attrs(obj.instance_attrs())
+        return self
+
     @staticmethod
     @abstractmethod
     def new_dummy() -> "ClassDataType":
@@ -192,7 +454,8 @@ class DataProperty(property):
     def __set__(self, instance, value):
         if instance is None:
             return
-        return super().__set__(instance, value)
+        super().__set__(instance, value)
+        instance.mark_dirty()
 
     def __delete__(self, instance):
         if instance is None:
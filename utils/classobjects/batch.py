@@ -0,0 +1,135 @@
+"""
+批量发送点评
+
+ClassObj.send_modify_batch用到的东西：
+
+- StudentScoreState：一个学生和分数有关的所有状态，批量操作中途失败的时候用来原样恢复
+- ModifyBatch：一次批量发送的所有点评，撤回栈（ClassStatusObserver.opreation_record）里的一项，
+  一键撤回的时候要么全部撤回、要么一个都不撤回
+- ScoreChangeEvent：一批分数改动完成之后发出的一个事件（ClassObj.on_scores_changed），
+  写日志、压撤回栈、更新界面都只做一次，而不是每个学生一次
+"""
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .objects import Class, ScoreModification, Student
+
+
+class StudentScoreState(NamedTuple):
+    "一个学生和分数有关的所有状态"
+
+    score: float
+    "分数"
+    total_score: float
+    "总分"
+    highest_score: float
+    "最高分"
+    lowest_score: float
+    "最低分"
+    highest_score_cause_time: float
+    "最高分对应时间"
+    lowest_score_cause_time: float
+    "最低分对应时间"
+    history_length: int
+    "分数流水的长度"
+
+    @staticmethod
+    def capture(student: "Student") -> "StudentScoreState":
+        """
+        记下一个学生现在的状态。
+
+        :param student: 学生
+        :return: 状态
+        """
+        return StudentScoreState(
+            student.score,
+            student.total_score,
+            student.highest_score,
+            student.lowest_score,
+            student.highest_score_cause_time,
+            student.lowest_score_cause_time,
+            len(student.history.entries),
+        )
+
+    def restore(self, student: "Student") -> None:
+        """
+        把学生恢复到记下的状态（分数流水里后来追加的记录会被删掉）。
+
+        :param student: 学生
+        """
+        student.history.truncate(self.history_length)
+        # 先改分数（会通知排名和分数统计），再把分数的setter顺手改掉的总分、最高最低分改回来
+        student.score = self.score
+        student.total_score = self.total_score
+        student.highest_score = self.highest_score
+        student.lowest_score = self.lowest_score
+        student.highest_score_cause_time = self.highest_score_cause_time
+        student.lowest_score_cause_time = self.lowest_score_cause_time
+
+
+class ModifyBatch(List["ScoreModification"]):
+    "一次批量发送的所有点评，撤回栈里的一项（撤回的时候是一个整体）"
+
+    def __init__(self, modifications: Iterable["ScoreModification"] = (), info: Optional[str] = None):
+        """
+        构造一批点评。
+
+        :param modifications: 点评
+        :param info: 发送时的信息
+        """
+        super().__init__(modifications)
+        self.info = info
+        "发送时的信息"
+
+    @property
+    def students(self) -> List["Student"]:
+        "涉及到的学生（去重，按第一次出现的顺序）"
+        seen: Dict[int, "Student"] = {}
+        for m in self:
+            seen.setdefault(id(m.target), m.target)
+        return list(seen.values())
+
+    def capture(self) -> Tuple[List[Tuple["Student", StudentScoreState]], List[Tuple["ScoreModification", bool, Optional[str]]]]:
+        """
+        记下涉及到的学生和点评现在的状态。
+
+        :return: ([(学生, 状态)], [(点评, 是否已执行, 执行时间)])
+        """
+        return (
+            [(s, StudentScoreState.capture(s)) for s in self.students],
+            [(m, m.executed, m.execute_time) for m in self],
+        )
+
+    @staticmethod
+    def rollback(
+        state: Tuple[List[Tuple["Student", StudentScoreState]], List[Tuple["ScoreModification", bool, Optional[str]]]]
+    ) -> None:
+        """
+        恢复到capture记下的状态。
+
+        :param state: capture的返回值
+        """
+        students, modifications = state
+        for m, executed, execute_time in modifications:
+            m.executed = executed
+            m.execute_time = execute_time
+        for student, student_state in reversed(students):
+            student_state.restore(student)
+        for m, _, _ in modifications:
+            m.target.history.refresh(m)
+
+
+class ScoreChangeEvent(NamedTuple):
+    "一批分数改动完成之后发出的事件（见ClassObj.on_scores_changed）"
+
+    kind: str
+    "事件类型，比如\"send_modify\""
+    modifications: ModifyBatch
+    "这一批的点评"
+    students: List["Student"]
+    "分数变了的学生"
+    classes: List["Class"]
+    "分数变了的班级"
+    info: Optional[str] = None
+    "信息，会记在主界面的侧边栏的ListWidget里"
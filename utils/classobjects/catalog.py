@@ -0,0 +1,271 @@
+"""
+历史记录目录
+
+用户存档根目录下的catalog.db，每个历史记录一行：uuid、创建时间、班级、学生数、点评数、
+每个班级的总分和存档占用的字节数。列出历史记录的时候只读这张表，不用把存档加载出来。
+
+保存（Chunk.write_snapshot）、删除历史记录（Chunk.del_history）和结算（ClassObj.reset_scores）
+的时候在同一个事务里更新；旧的用户存档第一次打开时会从存档里重建一次（见Chunk.sync_catalog）。
+"""
+
+import os
+import json
+import sqlite3
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+CATALOG_FILE_NAME = "catalog.db"
+"历史记录目录的文件名，放在用户存档根目录"
+
+
+def catalog_key(history_uuid: Any) -> str:
+    """
+    历史记录uuid在目录里的写法，和Histories下面的文件夹名一样（不带横线）。
+
+    :param history_uuid: 历史记录uuid（ClassDataTypeUUID或者字符串）
+    :return: 目录里的uuid
+    """
+    return str(history_uuid).replace("-", "")
+
+
+class CatalogEntry(NamedTuple):
+    "历史记录目录里的一行"
+
+    uuid: str
+    "历史记录uuid（不带横线，见catalog_key）"
+    create_time: float
+    "创建（结算）时间"
+    class_keys: List[str]
+    "班级的key"
+    student_count: int
+    "学生数量"
+    modification_count: int
+    "点评数量（只算执行了的）"
+    class_scores: Dict[str, float]
+    "每个班级的总分，class_scores[班级key] = 总分"
+    byte_size: Optional[int] = None
+    "存档文件夹占用的字节数（不算共享对象库），None为还没保存到硬盘"
+
+
+def summarize_history(history_uuid: str, create_time: float, classes: Dict[str, Any]) -> CatalogEntry:
+    """
+    从内存里的班级生成一行目录。
+
+    :param history_uuid: 历史记录uuid
+    :param create_time: 创建时间
+    :param classes: 班级，classes[班级key] = 班级
+    :return: 目录行（byte_size为None）
+    """
+    student_count = 0
+    modification_count = 0
+    class_scores: Dict[str, float] = {}
+    for key, _class in classes.items():
+        total = 0.0
+        for student in _class.students.values():
+            student_count += 1
+            total += student.score
+            modification_count += sum(1 for m in student.history.values() if m.executed)
+        class_scores[key] = round(total, 6)
+    return CatalogEntry(
+        catalog_key(history_uuid), create_time, list(classes), student_count, modification_count,
+        class_scores,
+    )
+
+
+def summarize_records(
+    history_uuid: str, create_time: float, records: Iterable[Tuple[str, Dict[str, Any]]]
+) -> CatalogEntry:
+    """
+    从存档里读出来的数据（解码成字典，不构建对象）生成一行目录，重建目录的时候用。
+
+    :param history_uuid: 历史记录uuid
+    :param create_time: 创建时间
+    :param records: (数据类型名, 数据)
+    :return: 目录行（byte_size为None）
+    """
+    classes: Dict[str, Dict[str, Any]] = {}
+    students: Dict[str, Dict[str, Any]] = {}
+    for type_name, data in records:
+        if type_name == "Class":
+            classes[data["uuid"]] = data
+        elif type_name == "Student":
+            students[data["uuid"]] = data
+    class_scores: Dict[str, float] = {}
+    student_count = 0
+    modification_count = 0
+    for data in classes.values():
+        total = 0.0
+        for _, student_uuid in data["students"]:
+            student = students.get(student_uuid)
+            if student is None:
+                continue
+            student_count += 1
+            total += student["score"]
+            modification_count += len(student["history"])
+        class_scores[data["key"]] = round(total, 6)
+    return CatalogEntry(
+        catalog_key(history_uuid), create_time, list(class_scores), student_count, modification_count,
+        class_scores,
+    )
+
+
+def archive_size(path: str) -> int:
+    """
+    计算一个存档文件夹占用的字节数。
+
+    :param path: 存档文件夹
+    :return: 字节数，文件夹不存在则为0
+    """
+    return sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, _, files in os.walk(path)
+        for file in files
+    )
+
+
+class HistoryCatalog:
+    "一个用户存档的历史记录目录"
+
+    def __init__(self, root: str):
+        """
+        构造一个目录（文件要等到第一次写入才会创建）。
+
+        :param root: 用户存档根目录
+        """
+        self.root = root
+        "用户存档根目录"
+        self.file = os.path.join(root, CATALOG_FILE_NAME)
+        "目录文件"
+
+    @property
+    def exists(self) -> bool:
+        "目录文件是否存在"
+        return os.path.isfile(self.file)
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        打开目录，没有表就建表。
+
+        :return: 连接（自动提交模式，写入的时候自己BEGIN）
+        """
+        os.makedirs(self.root, exist_ok=True)
+        conn = sqlite3.connect(self.file, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS histories (
+                        uuid                text    primary key,  -- 历史记录uuid
+                        create_time         real,                 -- 创建时间
+                        class_keys          text,                 -- 班级key（json）
+                        student_count       integer,              -- 学生数量
+                        modification_count  integer,              -- 点评数量
+                        class_scores        text,                 -- 每个班级的总分（json）
+                        byte_size           integer               -- 存档大小，NULL为还没保存
+                )"""
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS histories_time ON histories (create_time)"
+        )
+        return conn
+
+    def update(
+        self, entries: Iterable[CatalogEntry] = (), removed: Iterable[str] = ()
+    ) -> None:
+        """
+        在一个事务里写入和删除目录行。
+
+        :param entries: 要写入的行（uuid一样的会被覆盖）
+        :param removed: 要删除的历史记录uuid
+        :raise sqlite3.Error: 写入失败，目录不变
+        """
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO histories VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        (
+                            e.uuid,
+                            e.create_time,
+                            json.dumps(e.class_keys),
+                            e.student_count,
+                            e.modification_count,
+                            json.dumps(e.class_scores),
+                            e.byte_size,
+                        )
+                        for e in entries
+                    ),
+                )
+                conn.executemany(
+                    "DELETE FROM histories WHERE uuid = ?", ((catalog_key(u),) for u in removed)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                raise
+        finally:
+            conn.close()
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[CatalogEntry]:
+        if not self.exists:
+            return []
+        conn = self.connect()
+        try:
+            return [
+                CatalogEntry(
+                    row[0], row[1], json.loads(row[2]), row[3], row[4], json.loads(row[5]), row[6]
+                )
+                for row in conn.execute(
+                    "SELECT uuid, create_time, class_keys, student_count, modification_count, "
+                    "class_scores, byte_size FROM histories " + sql,
+                    params,
+                )
+            ]
+        finally:
+            conn.close()
+
+    def page(self, offset: int = 0, limit: int = 50, newest_first: bool = True) -> List[CatalogEntry]:
+        """
+        按照创建时间分页读出目录。
+
+        :param offset: 跳过多少行
+        :param limit: 最多读多少行
+        :param newest_first: 是否新的在前面
+        :return: 目录行
+        """
+        return self._query(
+            f"ORDER BY create_time {'DESC' if newest_first else 'ASC'} LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+
+    def entries(self) -> List[CatalogEntry]:
+        "读出整个目录，按照创建时间从早到晚排"
+        return self._query("ORDER BY create_time")
+
+    def get(self, history_uuid: str) -> Optional[CatalogEntry]:
+        """
+        读出一个历史记录的目录行。
+
+        :param history_uuid: 历史记录uuid
+        :return: 目录行，没有则为None
+        """
+        rows = self._query("WHERE uuid = ?", (catalog_key(history_uuid),))
+        return rows[0] if rows else None
+
+    def count(self) -> int:
+        "目录里有多少个历史记录"
+        if not self.exists:
+            return 0
+        conn = self.connect()
+        try:
+            return conn.execute("SELECT count(*) FROM histories").fetchone()[0]
+        finally:
+            conn.close()
+
+    def saved_uuids(self) -> List[str]:
+        "已经保存到硬盘的历史记录的uuid，按照创建时间从早到晚排"
+        return [e.uuid for e in self._query("WHERE byte_size IS NOT NULL ORDER BY create_time")]
@@ -6,8 +6,10 @@ import time
 import copy
 import enum
 import errno
+import math
 import random
 import base64
+import sqlite3
 import pickle as pickle_orig
 import pickle
 import traceback
@@ -18,16 +20,21 @@ from typing import (Union, Callable, TypeVar, Optional,
 from PySide6.QtGui import QColor
 from PySide6.QtWidgets import QMessageBox
 
-from utils.algorithm import Mutex, OrderedKeyList
+from utils.algorithm import Mutex, OrderedKeyList, RandomSelector, Thread
 from utils.basetypes import Base
 from utils.functions.prompts import question_yes_no
 from utils.update_check import CORE_VERSION, CORE_VERSION_CODE, CLIENT_VERSION, CLIENT_VERSION_CODE
-from .basetype import ClassDataType, ClassDataTypeUUID
+from .basetype import ClassDataType, ClassDataTypeUUID, holds_state_lock
 from .objects import *
 from .classdataobj import *
 # from .observers import *
 from .default import *
-from .dataloader import UserDataBase, Chunk
+from .dataloader import UserDataBase, Chunk, SaveSnapshot, archive_layout
+from .catalog import CatalogEntry, catalog_key, summarize_history
+from .picklefile import load_pickle, dump_pickle
+from .registry import uuid_registry, uuid_int
+from .ledger import ScoreLedger
+from .batch import ModifyBatch, ScoreChangeEvent
 
 
 # 添加类型检查导入
@@ -44,6 +51,9 @@ class ClassObj(ClassDataObj, Base):
     _saving_task_mutex: Mutex = Mutex()
     "保存任务互斥锁"
 
+    _tracking_chunk: Optional[Chunk] = None
+    "接收修改标记的数据分组，用于增量保存"
+
     def __init__(self, user: str = default_user, save_path: Optional[str] = None):
         """
         构造一个新的用户班级对象。
@@ -57,6 +67,7 @@ class ClassObj(ClassDataObj, Base):
             save_path = os.path.join(os.getcwd(), "chunks", user)
 
         self.config_data(save_path)
+        Student.reset_parent_resolver = self.find_reset_parent
 
         self.target_class = None
         "目标班级"
@@ -170,29 +181,28 @@ class ClassObj(ClassDataObj, Base):
         if not silent:
             Base.log("I", "从" + path + "加载数据...", "MainThread.save_data")
         if method == "auto":
-            dirpath = os.path.dirname(path)
-            if os.path.exists(os.path.join(dirpath, "info.json")):
-                path = dirpath
-                method = "sqlite"
+            # path可以是存档根目录，也可以是根目录下的某个文件，两种存储方式（见StorageLayout）都认
+            for dirpath in (path, os.path.dirname(path)):
+                if os.path.isdir(dirpath) and (
+                    os.path.isfile(os.path.join(dirpath, "info.json"))
+                    or archive_layout(os.path.join(dirpath, "Current")) is not None
+                ):
+                    path = dirpath
+                    method = "sqlite"
+                    if not silent:
+                        Base.log(
+                            "I",
+                            f"检测到sqlite存档，存储方式：{Chunk.detect_layout(dirpath)}",
+                            "MainThread.load_data",
+                        )
+                    break
             else:
                 method = "pickle"
 
         try:
             if method == "pickle":
-                b = base64.b85decode(open(path, "r", encoding="utf-8").read())
-                f = open(path + ".tmp", "wb")
-                f.write(b)
-                f.close()
-                try:
-                    data = pickle.load(open(path + ".tmp", "rb"))
-                except AttributeError:
-                    data = pickle_orig.load(open(path + ".tmp", "rb"))
-                try:
-                    os.remove(path + ".tmp")
-                except (
-                    Exception
-                ) as unused:  # pylint: disable=unused-variable, broad-exception-caught
-                    pass
+                # v2直接从文件流式反序列化，旧的base85存档也是边读边解码
+                data = load_pickle(path)
                 if not silent:
                     Base.log(
                         "I", f"耗时：{time.time()-start:.2f}", "MainThread.load_data"
@@ -375,6 +385,7 @@ class ClassObj(ClassDataObj, Base):
                         self.classes[c].students[s].belongs_to_group = default_students[
                             s
                         ].belongs_to_group  # 恢复所属小组
+                        self.classes[c].students[s].mark_dirty()
 
         for _class in self.classes.values():
             for g in copy.deepcopy(_class.groups).keys():  # 重置小组信息
@@ -463,108 +474,13 @@ class ClassObj(ClassDataObj, Base):
                 OrderedKeyList(data.templates).to_dict()
             )
 
-            achievements = copy.deepcopy(self.achievement_templates)
-            for key, achievement in achievements.items():
-                for attr, default in [
-                    ("icon", None),
-                    ("when_triggered", "any"),
-                    (
-                        "further_info",
-                        "因为这是老版本迁移过来的存档，所以这条信息是空缺的",
-                    ),
-                    (
-                        "condition_info",
-                        "因为这是老版本迁移过来的存档，所以暂时没有详细条件信息",
-                    ),
-                ]:
-                    # 补齐老版本缺失的属性
-
-                    if not hasattr(achievement, attr):
-                        try:
-                            setattr(
-                                self.achievement_templates[key],
-                                attr,
-                                getattr(DEFAULT_ACHIEVEMENTS[key], attr),
-                            )
-                        except (AttributeError, KeyError):
-                            setattr(self.achievement_templates[key], attr, default)
-
             if not isinstance(self.modify_templates, OrderedKeyList):
                 self.modify_templates = OrderedKeyList(self.modify_templates)
                 # 因为老版本用的是dict，所以需要转换一下
 
-            templates = copy.deepcopy(self.modify_templates)
-
-            for key, template in templates.items():
-                for attr, default in [
-                    ("is_visible", True),
-                ]:
-                    if not hasattr(template, attr):
-                        try:
-                            setattr(
-                                self.modify_templates[key],
-                                attr,
-                                getattr(DEFAULT_SCORE_TEMPLATES[key], attr),
-                            )
-                        except (AttributeError, KeyError):
-                            setattr(self.modify_templates[key], attr, default)
-
-            for key_class, _class in self.classes.items():
-                for attr, default in [
-                    (
-                        "homework_rules",
-                        (
-                            (DEFAULT_CLASSES[key_class].homework_rules)
-                            if key_class in DEFAULT_CLASSES
-                            else {}
-                        ),
-                    ),
-                    (
-                        "cleaning_mapping",
-                        (
-                            getattr(
-                                _class,
-                                "cleaing_mapping",
-                                getattr(_class, "cleaning_mapping", {}),
-                            )
-                        ),
-                    ),
-                    # 因为以前的版本是写错了的，所以这里需要特殊处理
-                ]:
-                    if not hasattr(_class, attr):
-                        try:
-                            setattr(
-                                self.classes[key_class],
-                                attr,
-                                getattr(DEFAULT_CLASSES[key_class], attr),
-                            )
-                        except (AttributeError, KeyError):
-                            setattr(self.classes[key_class], attr, default)
-
-                for (
-                    key,
-                    student,
-                ) in _class.students.items():  # 性能优化点：当前为O(n^3)复杂度(?)
-                    for attr, default in [("last_reset_info", Student.new_dummy())]:
-                        if not hasattr(student, attr):
-                            try:
-                                setattr(student, attr, default)
-                            except (AttributeError, KeyError):
-                                setattr(student, attr, default)
-                if not hasattr(_class, "groups"):
-                    if _class.key in DEFAULT_CLASSES:
-                        _class.groups = copy.deepcopy(
-                            DEFAULT_CLASSES[_class.key].groups
-                        )
-                    else:
-                        _class.groups = {}
-                for key, group in _class.groups.items():
-                    index = 0
-                    for member in group.members:
-                        group.members[index] = self.classes[member.belongs_to].students[
-                            member.num
-                        ]
-                        index += 1
+            if data.schema_version is None:
+                # sqlite存档在Chunk.load_data里已经迁移过了（见migrations），只有pickle存档要在这里补
+                self.upgrade_legacy_objects()
 
             if "current_day_attendance" in data:
                 self.current_day_attendance = data.current_day_attendance
@@ -607,6 +523,112 @@ class ClassObj(ClassDataObj, Base):
 
         return data
 
+    def upgrade_legacy_objects(self) -> None:
+        """
+        给直接反序列化出来的老版本对象（pickle存档）补上缺失的属性，重新关联小组成员。
+
+        sqlite存档不走这里，改成了加载前对原始数据做一次的迁移（见migrations）。
+        """
+        achievements = copy.deepcopy(self.achievement_templates)
+        for key, achievement in achievements.items():
+            for attr, default in [
+                ("icon", None),
+                ("when_triggered", "any"),
+                (
+                    "further_info",
+                    "因为这是老版本迁移过来的存档，所以这条信息是空缺的",
+                ),
+                (
+                    "condition_info",
+                    "因为这是老版本迁移过来的存档，所以暂时没有详细条件信息",
+                ),
+            ]:
+                # 补齐老版本缺失的属性
+
+                if not hasattr(achievement, attr):
+                    try:
+                        setattr(
+                            self.achievement_templates[key],
+                            attr,
+                            getattr(DEFAULT_ACHIEVEMENTS[key], attr),
+                        )
+                    except (AttributeError, KeyError):
+                        setattr(self.achievement_templates[key], attr, default)
+
+        templates = copy.deepcopy(self.modify_templates)
+
+        for key, template in templates.items():
+            for attr, default in [
+                ("is_visible", True),
+            ]:
+                if not hasattr(template, attr):
+                    try:
+                        setattr(
+                            self.modify_templates[key],
+                            attr,
+                            getattr(DEFAULT_SCORE_TEMPLATES[key], attr),
+                        )
+                    except (AttributeError, KeyError):
+                        setattr(self.modify_templates[key], attr, default)
+
+        for key_class, _class in self.classes.items():
+            for attr, default in [
+                (
+                    "homework_rules",
+                    (
+                        (DEFAULT_CLASSES[key_class].homework_rules)
+                        if key_class in DEFAULT_CLASSES
+                        else {}
+                    ),
+                ),
+                (
+                    "cleaning_mapping",
+                    (
+                        getattr(
+                            _class,
+                            "cleaing_mapping",
+                            getattr(_class, "cleaning_mapping", {}),
+                        )
+                    ),
+                ),
+                # 因为以前的版本是写错了的，所以这里需要特殊处理
+            ]:
+                if not hasattr(_class, attr):
+                    try:
+                        setattr(
+                            self.classes[key_class],
+                            attr,
+                            getattr(DEFAULT_CLASSES[key_class], attr),
+                        )
+                    except (AttributeError, KeyError):
+                        setattr(self.classes[key_class], attr, default)
+
+            for (
+                key,
+                student,
+            ) in _class.students.items():  # 性能优化点：当前为O(n^3)复杂度(?)
+                for attr, default in [("last_reset_info", Student.new_dummy())]:
+                    if not hasattr(student, attr):
+                        try:
+                            setattr(student, attr, default)
+                        except (AttributeError, KeyError):
+                            setattr(student, attr, default)
+            if not hasattr(_class, "groups"):
+                if _class.key in DEFAULT_CLASSES:
+                    _class.groups = copy.deepcopy(
+                        DEFAULT_CLASSES[_class.key].groups
+                    )
+                else:
+                    _class.groups = {}
+            for key, group in _class.groups.items():
+                index = 0
+                for member in group.members:
+                    group.members[index] = self.classes[member.belongs_to].students[
+                        member.num
+                    ]
+                    index += 1
+                group.invalidate_aggregate()
+
     @staticmethod
     def save_data_strict(
         user: str,
@@ -624,11 +646,15 @@ class ClassObj(ClassDataObj, Base):
         *,
         path: str = os.path.abspath(f"chunks/{default_user}/"),
         mode: Literal["pickle", "sqlite"] = "sqlite",
+        full: bool = True,
+        chunk: Optional[Chunk] = None,
     ):
         """
         强制以指定数据保存存档。
 
         :param path: 文件路径
+        :param full: 是否完整保存所有对象，只在mode="sqlite"且提供了chunk时有意义
+        :param chunk: 用来保存的数据分组，不提供就新建一个（新建的分组总是完整保存）
         """
         with ClassObj._saving_task_mutex:
             Base.log("I", "保存数据到" + path + "...", "MainThread.save_data_strict")
@@ -668,9 +694,12 @@ class ClassObj(ClassDataObj, Base):
                 )
                 if mode == "sqlite":
                     path = os.path.dirname(path) if path.endswith(".datas") else path
-                    chunk = Chunk(path, database)
+                    if chunk is None:
+                        chunk = Chunk(path, database)
+                    else:
+                        chunk.bound_db = database
                     t = time.time()
-                    chunk.save_data()
+                    chunk.save_data(full=full)
                     Base.log(
                         "I",
                         f"写入文件完成 ({time.time()-t:.3f}s)",
@@ -685,28 +714,10 @@ class ClassObj(ClassDataObj, Base):
 
                 elif mode == "pickle":
                     t = time.time()
-                    b = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
-                    Base.log(
-                        "I",
-                        f"读取内存完成 ({time.time()-t:.3f}s)",
-                        "MainThread.save_data_strict",
-                    )
-
-                    t = time.time()
-                    b2 = base64.b85encode(b)
-                    Base.log(
-                        "I",
-                        f"编码完成 ({time.time()-t:.3f}s)",
-                        "MainThread.save_data_strict",
-                    )
-
-                    t = time.time()
-                    b = open(path, "wb")
-                    b.write(b2)
-                    b.close()
+                    size = dump_pickle(obj, path)
                     Base.log(
                         "I",
-                        f"写入文件完成 ({time.time()-t:.3f}s)",
+                        f"写入文件完成 ({time.time()-t:.3f}s，{size}字节)",
                         "MainThread.save_data_strict",
                     )
 
@@ -723,13 +734,26 @@ class ClassObj(ClassDataObj, Base):
                 Base.log_exc("保存存档" + path + "失败：", "Mainhread.save_data_strict")
                 raise
 
-    def save_data(self, path: str = None, mode: Literal["pickle", "sqlite"] = "sqlite"):
+    def save_data(
+        self,
+        path: str = None,
+        mode: Literal["pickle", "sqlite"] = "sqlite",
+        full: bool = False,
+    ):
         """保存当前存档。
 
+        保存到自己的存档路径时只会写入有修改的对象（第一次保存除外），
+        另存为其他路径时总是完整保存。
+
         :param path: 文件路径
+        :param mode: 保存方式
+        :param full: 是否强制完整保存所有对象
         """
         if path is None:
             path = self.save_path
+        chunk = None
+        if mode == "sqlite" and os.path.abspath(path) == os.path.abspath(self.save_path):
+            chunk = self.tracking_chunk
         return self.save_data_strict(
             default_user,
             time.time(),
@@ -745,8 +769,155 @@ class ClassObj(ClassDataObj, Base):
             self.current_day_attendance,
             path=path,
             mode=mode,
+            full=full,
+            chunk=chunk,
         )
 
+    def save_data_async(self, full: bool = False) -> Thread:
+        """
+        在后台保存当前存档，不会阻塞调用的线程（一般是UI线程）。
+
+        调用的线程里只拍一个快照（见Chunk.take_snapshot），增量保存时只持有状态锁几毫秒；
+        序列化之后的数据在工作线程里写入，完成或者失败时分别调用on_save_finished和on_save_failure。
+
+        :param full: 是否强制完整保存所有对象
+        :return: 写入数据的线程
+        """
+        chunk = self.tracking_chunk
+        chunk.bound_db = UserDataBase(
+            default_user,
+            time.time(),
+            CORE_VERSION,
+            CORE_VERSION_CODE,
+            self.last_reset,
+            self.history_data,
+            self.classes,
+            self.modify_templates,
+            self.achievement_templates,
+            self.last_start_time,
+            self.weekday_record,
+            self.current_day_attendance,
+        )
+        snapshot = chunk.take_snapshot(full=full)
+
+        def write():
+            # 不拿_saving_task_mutex：save_data_strict拿着它等这个快照写完的话会死锁
+            t = time.time()
+            try:
+                chunk.write_snapshot(snapshot)
+            except Exception:  # pylint: disable=broad-exception-caught
+                self.on_save_failure(sys.exc_info())
+            else:
+                Base.log(
+                    "I",
+                    f"后台保存到{chunk.path}完成 ({time.time() - t:.3f}s)",
+                    "MainThread.save_data_async",
+                )
+                self.on_save_finished(snapshot)
+
+        thread = Thread(target=write, name="SaveDataThread")
+        thread.start()
+        return thread
+
+    def on_save_finished(self, snapshot: "SaveSnapshot") -> None:
+        """
+        后台保存（见save_data_async）完成时在工作线程里执行的操作。
+
+        :param snapshot: 写入的快照
+        """
+
+    def on_save_failure(
+        self, exc_info: Tuple[Type[BaseException], BaseException, TracebackType]
+    ) -> None:
+        """
+        后台保存（见save_data_async）失败时在工作线程里执行的操作。
+
+        :param exc_info: 错误信息
+        """
+        Base.log_exc("后台保存失败", "MainThread.save_data_async", "E", exc=exc_info[1])
+
+    @property
+    def tracking_chunk(self) -> Chunk:
+        "接收修改标记的数据分组，第一次访问的时候创建"
+        path = self.save_path
+        path = os.path.dirname(path) if path.endswith(".datas") else path
+        if self._tracking_chunk is None or self._tracking_chunk.path != path:
+            self._tracking_chunk = Chunk(path).track_changes()
+        return self._tracking_chunk
+
+    def journal_event(self, event: str, objects: List[ClassDataType]) -> None:
+        """
+        把一次分数事件改到的对象追加到此周的分数事件日志里（见journal.py），
+        崩溃之后重新加载时会在上次保存的数据上重放。
+
+        写日志失败不影响操作本身，只记一条警告。
+
+        :param event: 事件名
+        :param objects: 改到的对象（点评、学生、成就、出勤信息等）
+        """
+        try:
+            chunk = self.tracking_chunk
+            chunk.journal.append(event, objects, chunk.codec)
+        except Exception:  # pylint: disable=broad-exception-caught
+            Base.log_exc_short(f"写入分数事件日志失败（{event}）", "MainThread.journal_event", "W")
+
+    def history_catalog(self, offset: int = 0, limit: int = 50) -> List[CatalogEntry]:
+        """
+        分页列出历史记录（新的在前面），只读历史记录目录，不加载存档。
+
+        :param offset: 跳过多少个
+        :param limit: 最多列出多少个
+        :return: 目录行
+        """
+        return self.tracking_chunk.catalog.page(offset, limit)
+
+    def get_history(self, history_uuid: str) -> Optional[History]:
+        """
+        获取一个历史记录，内存里没有的话从存档里懒加载（之后放进history_data）。
+
+        :param history_uuid: 历史记录uuid
+        :return: 历史记录，存档里也没有则为None
+        """
+        history_uuid = catalog_key(history_uuid)
+        for history in self.history_data.values():
+            if catalog_key(history.uuid) == history_uuid:
+                return history
+        chunk = self.tracking_chunk
+        if not chunk.archive_exists(
+            os.path.join(chunk.path, "Histories", history_uuid[:2], history_uuid[2:])
+        ):
+            return None
+        history = chunk.load_history(history_uuid, lazy=True)
+        self.history_data[history.time] = history
+        return history
+
+    def find_reset_parent(self, history_uuid: str, student_uuid: str) -> Optional[Student]:
+        """
+        找学生的上次重置信息（装在Student.reset_parent_resolver上，见Student.last_reset_info）。
+
+        :param history_uuid: 上次重置信息所在的历史记录uuid
+        :param student_uuid: 上次重置信息的uuid
+        :return: 学生，找不到则为None
+        """
+        history = self.get_history(history_uuid)
+        if history is None:
+            return None
+        student_key = uuid_int(student_uuid)
+        for _class in history.classes.values():
+            for student in _class.students.values():
+                if student.uuid.int == student_key:
+                    return student
+        return None
+
+    def migrate_storage_layout(self, target: Literal["sharded", "single"]) -> int:
+        """
+        转换当前用户存档的存储方式，之后的保存也会用新的存储方式。
+
+        :param target: 目标存储方式，见StorageLayout
+        :return: 转换了的存档文件夹数量
+        """
+        return self.tracking_chunk.migrate_layout(target)
+
     @property
     def database(self) -> UserDataBase:
         "返回一个新的数据库对象"
@@ -803,7 +974,8 @@ class ClassObj(ClassDataObj, Base):
         self.class_obs.stop()
         self.achievement_obs.stop()
         Base.log("I", "保存最后的数据....", "MainThread.stop")
-        self.save_data()
+        self.save_data(full=True)
+        self.tracking_chunk.journal.close()
 
     class ObserverError(RuntimeError):
         "侦测器出现错误"
@@ -1156,6 +1328,7 @@ class ClassObj(ClassDataObj, Base):
             self.classes[to_class].students[num] = Student(
                 name, num, init_score, to_class, {}
             )
+            self.classes[to_class].invalidate_indexes()
             Base.log("I", f"学生{name}新建完毕!", "MainThread.add_student")
             return True
         except Exception as e:  # pylint: disable=broad-exception-caught
@@ -1193,6 +1366,7 @@ class ClassObj(ClassDataObj, Base):
         try:
             orig = self.classes[from_class].students[stuobj.num]
             del self.classes[from_class].students[stuobj.num]
+            self.classes[from_class].invalidate_indexes()
             Base.log("I", f"学生{stuobj.name}删除完毕!", "MainThread.del_student")
             return orig
         except KeyError as e:  # pylint: disable=broad-exception-caught
@@ -1213,7 +1387,7 @@ class ClassObj(ClassDataObj, Base):
         extra_mod: Optional[Union[float]] = None,
         info: str = None,
     ) -> Optional[List[ScoreModification]]:
-        """发送点评。
+        """发送点评（按模板构造点评之后交给send_modify_batch）。
 
         :param key: 模板标识符
         :param send_to: 发送至的学生
@@ -1222,7 +1396,7 @@ class ClassObj(ClassDataObj, Base):
         :param extra_mod: 额外分数
         :param info: 信息，会记在主界面的侧边栏的ListWidget里
         :return: 发送的所有点评的实例
-        :raise SendModifyError: 发送点评出现错误
+        :raise SendModifyError: 发送点评出现错误（这时所有学生都没有被改动）
         """
 
         if isinstance(send_to, Student):
@@ -1248,94 +1422,22 @@ class ClassObj(ClassDataObj, Base):
 
         send_to: List[Student]
 
-        Base.log(
-            "I",
-            f"开始发送点评\n模板： {self.modify_templates[key].__repr__()}\n"
-            f"发送至：\n---------------------",
-            "MainThread.send_modify",
-        )
-        result = []
-        succeed: List[ScoreModification] = []
-
+        try:
+            template = self.modify_templates[key]
+        except (KeyError, IndexError) as e:
+            raise ClassObj.SendModifyError(f"找不到点评模板{key!r}") from e
         for stu in send_to:
-            a = ScoreModification(
-                self.modify_templates[key], stu, extra_title, extra_desc, extra_mod
+            if not isinstance(stu, Student):
+                raise ClassObj.SendModifyError(f"发送对象{stu!r}不是学生")
+        return list(
+            self.send_modify_batch(
+                [
+                    ScoreModification(template, stu, extra_title, extra_desc, extra_mod)
+                    for stu in send_to
+                ],
+                info,
             )
-            success = a.execute()
-            if not success:
-                for m in succeed:
-                    m.retract()
-                Base.log(
-                    "E",
-                    "---------------------\n发送失败，" f"总数:{len(send_to)}",
-                    "MainThread.send_modify",
-                )
-                raise ClassObj.SendModifyError(f"向学生{stu.name}发送点评出现错误")
-            Base.log("I", f"对象 -> {repr(stu)}")
-            succeed.append(a)
-            result.append(a)
-
-        Base.log(
-            "I",
-            f"---------------------\n发送完成，总数:{len(send_to)}",
-            "MainThread.send_modify",
         )
-        self.class_obs.opreation_record.push(succeed)
-        info_list: List[Tuple[str, Callable]] = []
-        index = 0
-        for s in succeed:
-            info_list.append(
-                (
-                    f"{s.target.name} {s.temp.title} {s.execute_time.rsplit('.')[0]} {s.mod:+.1f}",
-                    lambda s=s, index=index: self.history_window(
-                        s, index, None, False, None, False
-                    ),
-                    (
-                        (
-                            QColor(202, 255, 222)
-                            if s.mod > 0
-                            else (
-                                QColor(255, 202, 202)
-                                if s.mod < 0
-                                else QColor(201, 232, 255)
-                            )
-                        ),
-                        (
-                            QColor(232, 255, 232)
-                            if s.mod > 0
-                            else (
-                                QColor(255, 232, 232)
-                                if s.mod < 0
-                                else QColor(233, 244, 255)
-                            )
-                        ),
-                    ),
-                )
-            )
-            index += 1
-        self.insert_action_history_info(
-            "发送了点评"
-            + " "
-            + (
-                f"成功{len(succeed)}"
-                + f" [{succeed[0].target.num}号{'等' if len(succeed) > 1 else ''}] "
-                if len(succeed) != 0
-                else ""
-            )
-            + (
-                f"失败{len(send_to)-len(succeed)}"
-                + f" [{send_to[0].num}号{'等' if len(send_to) > 1 else ''}] "
-                if len(send_to) != len(succeed)
-                else ""
-            )
-            + f"<{a.title} {a.mod:.1f}分>"
-            + (" " + info if info is not None else ""),
-            lambda: self.list_view(
-                info_list, "点评记录" + (" " + info if info is not None else "")
-            ),
-            (127, 225, 195, 224, 255, 255),
-        )
-        return result.copy()
 
     def send_modify_instance(
         self,
@@ -1343,54 +1445,114 @@ class ClassObj(ClassDataObj, Base):
         info: str = None,
     ) -> Optional[List[ScoreModification]]:
         """
-        发送点评。
+        发送点评（直接交给send_modify_batch）。
 
         :param modify: 点评实例
         :param info: 信息，会记在主界面的侧边栏的ListWidget里
         :return: 发送的点评的实例
-        :raise SendModifyError: 发送点评出现错误
+        :raise SendModifyError: 发送点评出现错误（这时所有学生都没有被改动）
 
         """
         if isinstance(modify, ScoreModification):
             modify = [modify]
+        return list(self.send_modify_batch(modify, info))
+
+    def _check_modify_target(self, modify: ScoreModification) -> None:
+        "send_modify_batch里检查一条点评能不能发，不能发的抛出SendModifyError"
+        if not isinstance(modify, ScoreModification):
+            raise ClassObj.SendModifyError(f"{modify!r}不是点评")
+        if modify.executed:
+            raise ClassObj.SendModifyError(
+                f"发给{modify.target.name}的点评已经执行过了，如需重新执行请创建新的点评"
+            )
+        stu = modify.target
+        if not isinstance(stu, Student):
+            raise ClassObj.SendModifyError(f"发送对象{stu!r}不是学生")
+        _class = self.classes.get(stu.belongs_to)
+        if _class is None or _class.students.get(stu.num) is not stu:
+            raise ClassObj.SendModifyError(
+                f"学生{stu.name}（{stu.belongs_to} {stu.num}号）不在当前的班级数据里"
+            )
+        if not isinstance(modify.mod, (int, float)) or not math.isfinite(modify.mod):
+            raise ClassObj.SendModifyError(f"发给{stu.name}的点评分数{modify.mod!r}不对")
 
-        succeed: List[ScoreModification] = []
-        for m in modify:
-            success = m.execute()
-            if not success:
-                Base.log(
-                    "W",
-                    f"发送{m.target.name}的点评失败，已经撤回所有",
-                    "MainThread.send_modify_instance",
-                )
-                for m in succeed:
-                    m.retract()
-                Base.log(
-                    "E",
-                    f"---------------------\n发送失败，总数:{len(modify)}",
-                    "MainThread.send_modify_instance",
-                )
+    def send_modify_batch(
+        self,
+        modify: List[ScoreModification],
+        info: str = None,
+    ) -> ModifyBatch:
+        """
+        批量发送点评（send_modify和send_modify_instance都是调用这个）。
 
-                raise ClassObj.SendModifyError(f"向学生{m.target.name}发送点评出现错误")
+        先检查所有点评，再在一次加锁里全部执行，中途有一个失败就把所有学生恢复到发送前的样子；
+        全部成功之后只发出一个ScoreChangeEvent（见on_scores_changed），
+        撤回栈里也只压一项，一键撤回的时候整批一起撤回。
 
-            else:
-                Base.log(
-                    "I",
-                    f"发送了{m.target.name}的点评",
-                    "MainThread.send_modify_instance",
-                )
-                succeed.append(m)
-            lastest = m
+        :param modify: 还没执行的点评
+        :param info: 信息，会记在主界面的侧边栏的ListWidget里
+        :return: 这一批点评
+        :raise SendModifyError: 检查不通过或者执行失败（这时所有学生都没有被改动）
+        """
+        batch = ModifyBatch(modify, info)
+        if not batch:
+            raise ClassObj.SendModifyError("没有要发送的点评")
+        for m in batch:
+            self._check_modify_target(m)
+        if len({id(m) for m in batch}) != len(batch):
+            raise ClassObj.SendModifyError("同一条点评不能在一批里发送两次")
+
+        with ClassDataType.state_lock:
+            state = batch.capture()
+            for m in batch:
+                try:
+                    success = m.execute()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    # 调试模式下execute会直接抛出异常，一样要回滚
+                    Base.log_exc(f"向{m.target.name}发送点评出错:", "MainThread.send_modify_batch")
+                    success = False
+                if not success:
+                    ModifyBatch.rollback(state)
+                    Base.log(
+                        "E",
+                        f"向{m.target.name}发送点评失败，已经恢复了这一批的{len(batch)}个学生",
+                        "MainThread.send_modify_batch",
+                    )
+                    raise ClassObj.SendModifyError(f"向学生{m.target.name}发送点评出现错误")
 
+        students = batch.students
         Base.log(
             "I",
-            f"---------------------\n发送完成，总数:{len(modify)}",
-            "MainThread.send_modify",
+            f"发送点评完成，总数:{len(batch)}，"
+            f"学号：{', '.join(str(s.num) for s in students)}",
+            "MainThread.send_modify_batch",
+        )
+        self.on_scores_changed(
+            ScoreChangeEvent(
+                "send_modify",
+                batch,
+                students,
+                list({s.belongs_to: self.classes[s.belongs_to] for s in students}.values()),
+                info,
+            )
         )
-        self.class_obs.opreation_record.push(succeed)
+        return batch
+
+    def on_scores_changed(self, event: ScoreChangeEvent) -> None:
+        """
+        一批分数改动完成之后调用一次：写分数事件日志、压撤回栈、在侧边栏记一条。
+
+        排名和分数统计在改分数的时候已经跟着更新了（见Class.ranking），
+        成就由成就侦测器在下一帧检查；要在一批改完之后做点别的可以覆写这个方法。
+
+        :param event: 事件
+        """
+        batch = event.modifications
+        info = event.info
+        self.journal_event(event.kind, [*batch, *event.students])
+        self.class_obs.opreation_record.push(batch)
         info_list: List[Tuple[str, Callable]] = []
         index = 0
-        for s in succeed:
+        for s in batch:
             info_list.append(
                 (
                     f"{s.target.name} {s.temp.title} "
@@ -1422,29 +1584,16 @@ class ClassObj(ClassDataObj, Base):
             )
             index += 1
 
+        first = batch[0]
         self.insert_action_history_info(
             "发送了点评"
             + " "
+            + f"成功{len(batch)}"
+            + f" [{repr(first.target.num)}号{'等' if len(batch) > 1 else ''}] "
             + (
-                (
-                    f"成功{len(succeed)}"
-                    + f" [{repr(succeed[0].target.num)}号{'等' if len(succeed) > 1 else ''}] "
-                )
-                if len(succeed) != 0
-                else ""
-            )
-            + (
-                (
-                    f"失败{len(modify)-len(succeed)}"
-                    + f" [{repr(modify[0].target.num)}号{'等' if len(succeed) > 1 else ''}] "
-                )
-                if len(modify) != len(succeed)
-                else ""
-            )
-            + (
-                "<多项类型可能不一>"
-                if len(modify) > 1
-                else f"<{lastest.title} {lastest.mod:.1f}分>"
+                f"<{first.title} {first.mod:.1f}分>"
+                if all(m.title == first.title and m.mod == first.mod for m in batch)
+                else "<多项类型可能不一>"
             )
             + (" " + info if info is not None else ""),
             lambda: self.list_view(
@@ -1452,18 +1601,19 @@ class ClassObj(ClassDataObj, Base):
             ),
             (127, 225, 195, 224, 255, 255),
         )
-        return modify.copy()
 
     def retract_modify(
         self,
         modify: Union[List[ScoreModification], ScoreModification],
         info: str = None,
+        atomic: bool = False,
     ) -> Tuple[bool, str]:
         """撤回点评。
 
         :param modify: 撤回的点评
         :param info: 信息，会记在主界面的侧边栏的ListWidget里
-        :return: None
+        :param atomic: 是否要么全部撤回、要么一个都不撤回（撤回一整批的时候用，见ModifyBatch）
+        :return: 是否全部成功，执行信息
         """
         if isinstance(modify, ScoreModification):
             modify = [modify]
@@ -1475,20 +1625,25 @@ class ClassObj(ClassDataObj, Base):
         failure: List[ScoreModification] = []
         failure_result: List[str] = []
         return_result = "操作成功完成"
-        for m in modify:
-            success, result = m.retract()
-            if not success:
-                Base.log(
-                    "W", f"撤回{m.target.name}的点评失败", "MainThread.retract_modify"
-                )
-                failure.append(m)
-                failure_result.append(result)
-                return_result = result
-            else:
-                Base.log(
-                    "I", f"撤回了{m.target.name}的点评", "MainThread.retract_modify"
-                )
-                succeed.append(m)
+        with ClassDataType.state_lock:
+            if atomic:
+                return self._retract_atomic(ModifyBatch(modify), info)
+            for m in modify:
+                success, result = m.retract()
+                if not success:
+                    Base.log(
+                        "W", f"撤回{m.target.name}的点评失败", "MainThread.retract_modify"
+                    )
+                    failure.append(m)
+                    failure_result.append(result)
+                    return_result = result
+                else:
+                    Base.log(
+                        "I", f"撤回了{m.target.name}的点评", "MainThread.retract_modify"
+                    )
+                    succeed.append(m)
+        if succeed:
+            self.journal_event("retract_modify", [*succeed, *(m.target for m in succeed)])
         index = 0
         info_list = []
         if len(succeed):
@@ -1599,6 +1754,61 @@ class ClassObj(ClassDataObj, Base):
             )
         )
 
+    def _retract_atomic(self, batch: ModifyBatch, info: Optional[str]) -> Tuple[bool, str]:
+        "retract_modify(atomic=True)：先检查整批能不能撤回，撤回中途失败就恢复到撤回前"
+        # 单独撤回过的就不管了
+        batch = ModifyBatch([m for m in batch if m.executed], batch.info)
+        if not batch:
+            return False, "这一批点评已经全部撤回过了"
+        for m in batch:
+            if m.target.is_frozen or m not in m.target.history.values():
+                Base.log(
+                    "W", f"{m.target.name}的点评已经不能撤回了，整批都不撤回", "MainThread.retract_modify"
+                )
+                return False, f"{m.target.name}的点评不在本周历史中，整批都没有撤回"
+        state = batch.capture()
+        for m in batch:
+            try:
+                success, result = m.retract()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                Base.log_exc(f"撤回{m.target.name}的点评出错:", "MainThread.retract_modify")
+                success, result = False, str(e)
+            if not success:
+                ModifyBatch.rollback(state)
+                Base.log(
+                    "E",
+                    f"撤回{m.target.name}的点评失败，已经恢复了这一批的{len(batch)}个点评",
+                    "MainThread.retract_modify",
+                )
+                return False, f"撤回{m.target.name}的点评失败（{result}），整批都没有撤回"
+        students = batch.students
+        self.journal_event("retract_modify", [*batch, *students])
+        Base.log(
+            "I",
+            f"撤回点评完成，总数:{len(batch)}，学号：{', '.join(str(s.num) for s in students)}",
+            "MainThread.retract_modify",
+        )
+        self.insert_action_history_info(
+            "撤回了点评 "
+            f"成功{len(batch)} "
+            f"[{repr(batch[0].target.num)}号{'等' if len(batch) > 1 else ''}] "
+            + (" " + info if info is not None else ""),
+            lambda: self.list_view(
+                [
+                    (
+                        f"{s.target.name} {s.temp.title} {s.create_time.rsplit('.')[0]} {s.mod:+.1f}",
+                        lambda s=s, index=index: self.history_window(
+                            s, index, None, False, None, False
+                        ),
+                    )
+                    for index, s in enumerate(batch)
+                ],
+                "撤回记录" + (" " + info if info is not None else ""),
+            ),
+            (127, 192, 245, 224, 234, 255),
+        )
+        return True, "操作成功完成" if len(batch) == 1 else "操作全部成功完成"
+
     def retract_lastest(self) -> Tuple[bool, str]:
         """
         撤销上一步操作
@@ -1619,27 +1829,36 @@ class ClassObj(ClassDataObj, Base):
         for item in lastest:
             item: ScoreModification
             Base.log("I", f" -> {repr(item)}", "MainThread.retract_last")
-        result, info = self.retract_modify(lastest, "<一键撤回>")
+        result, info = self.retract_modify(
+            lastest, "<一键撤回>", isinstance(lastest, ModifyBatch)
+        )
         Base.log("I", "---------------------\n撤回完成", "MainThread.retract_last")
         return result, info
 
+    @holds_state_lock
     def reset_scores(self) -> Dict[str, Class]:
         "结算所有数据"
-        history = History(
-            copy.deepcopy(self.classes), 
-            self.weekday_record, 
-            time.time()
-        )
+        history = History({}, self.weekday_record, time.time())
         Base.log("W", "正在重置所有班级...", "ClassObjects.reset")
 
-        for _class in self.classes.values():
-            _class.reset()
+        # 重置前的班级冻结成一个版本放进历史记录（和重置后的共用没有变的东西），不再整个深拷贝
+        history.classes = {
+            key: _class.reset(archive=catalog_key(history.uuid))
+            for key, _class in self.classes.items()
+        }
 
         Base.log("I", "重置完成", "ClassObjects.reset")
         self.insert_action_history_info(
             "分数结算", self.show_all_history, (216, 112, 112, 255, 202, 202), 40
         )
         self.history_data[time.time()] = history
+        try:
+            # 还没保存，byte_size是None，保存的时候会填上
+            self.tracking_chunk.catalog.update(
+                [summarize_history(history.uuid, history.time, history.classes)]
+            )
+        except sqlite3.Error:
+            Base.log_exc_short("写入历史记录目录失败", "ClassObjects.reset", "W")
         self.class_obs.opreation_record.clear()
         self.last_reset = time.time()
         self.weekday_record = {}
@@ -1647,12 +1866,74 @@ class ClassObj(ClassDataObj, Base):
         ClassObj.get_archive_uuid = uuid.uuid4()
         return self.classes
 
+    random_choose_modes: Dict[str, str] = {
+        "uniform": "完全随机",
+        "deficit": "分数低的优先",
+        "recency": "很久没抽到的优先",
+    }
+    "随机点名的抽取方式，{方式: 显示的名字}，见random_choose_weight"
+
+    @staticmethod
+    def random_choose_weight(
+        mode: str, students: List[Student]
+    ) -> Optional[Callable[[Student], float]]:
+        """随机点名按什么权重抽
+
+        - uniform：等概率
+        - deficit：比这些学生里最高分低多少分，权重就多多少（最高分的权重是1）
+        - recency：离上次被抽到过了多少秒（还没被抽到过的从1970年算起，基本上一定先抽到）
+
+        :param mode: 抽取方式（random_choose_modes里的）
+        :param students: 候选的学生
+        :return: 取权重的函数，等概率则为None
+        :raises ValueError: 没有这种抽取方式
+        """
+        if mode == "uniform":
+            return None
+        if mode == "deficit":
+            top = max((s.score for s in students), default=0.0)
+            return lambda s: top - s.score + 1.0
+        if mode == "recency":
+            now = time.time()
+            return lambda s: max(now - s.last_pick_time, 0.0) + 1.0
+        raise ValueError(f"没有这种抽取方式：{mode!r}")
+
+    def random_selector(
+        self,
+        from_students: List[Student] = None,
+        includes: List[Student] = None,
+        excludes: List[Student] = None,
+        mode: str = "uniform",
+    ) -> RandomSelector[Student]:
+        """构造随机点名用的抽取器（筛选和权重只算一次，之后每次抽都是O(抽的人数)）
+
+        :param from_students: 从这些学生中选择，不填则为当前班级的所有学生
+        :param includes: 必须包含的学生
+        :param excludes: 必须排除的学生
+        :param mode: 抽取方式（random_choose_modes里的）
+        :return: 抽取器
+        """
+        stus = (
+            list(from_students)
+            if from_students
+            else list(self.classes[self.target_class.key].students.values())
+        )
+        return RandomSelector(
+            stus,
+            includes or [],
+            excludes or [],
+            weight=self.random_choose_weight(mode, stus),
+        )
+
     def random_choose_stu(
         self,
         count: int = 1,
         from_students: List[Student] = None,
         includes: List[Student] = None,
         excludes: List[Student] = None,
+        mode: str = "uniform",
+        record: bool = False,
+        selector: Optional[RandomSelector[Student]] = None,
     ) -> Union[List[Student], Student]:
         """随机选择学生
 
@@ -1660,33 +1941,21 @@ class ClassObj(ClassDataObj, Base):
         :param from_students: 从这些学生中选择
         :param includes: 必须包含的学生
         :param excludes: 必须排除的学生
+        :param mode: 抽取方式（random_choose_modes里的）
+        :param record: 是否记到学生被抽到的次数里（Student.record_pick）
+        :param selector: 已经构造好的抽取器（见random_selector），填了则不用上面的筛选条件和抽取方式
         :return: 学生列表
-        :raises ValueError: 要选择的数量小于1/必选项的长度大于了要选择的数量
+        :raises ValueError: 要选择的数量小于1/必选项的长度大于了要选择的数量/可以选择的学生不够
         """
-        stus = (
-            list(from_students)
-            if from_students
-            else list(self.classes[self.target_class.key].students.values())
-        )
         if count < 1:
             raise ValueError(f"要选择的数量 ({count}) 不能小于1")
-        if includes is None:
-            includes = []
-        if excludes is None:
-            excludes = []
-        if len(includes) > count:
-            raise ValueError(
-                f"必选项的长度 ({len(includes)}) 大于了要选择的数量 ({count})"
-            )
-        result = list(includes)
-        for _ in range(count - len(includes)):
-            while True:
-                stu = random.choice(
-                    list([s for s in stus if s not in excludes and s not in includes])
-                )
-                if stu not in result:
-                    result.append(stu)
-                    break
+        if selector is None:
+            selector = self.random_selector(from_students, includes, excludes, mode)
+        result = selector.choose(count)
+        if record:
+            pick_time = time.time()
+            for stu in result:
+                stu.record_pick(pick_time)
         result.sort(key=lambda s: s.num)
         return result if len(result) > 1 else result[0]
 
@@ -1812,83 +2081,106 @@ class ClassObj(ClassDataObj, Base):
         "Achievement",
         "AchievementTemplate",
     ]:
+        """
+        按uuid找此周的对象。
 
-        def find_in_modify(uuid: str):
-            for _class in self.classes.values():
-                for student in _class.students.values():
-                    for modify in student.history.values():
-                        if modify.uuid == uuid:
-                            return modify
-            raise ValueError(f"找不到对应的分数记录，uuid: {uuid}")
-
-        def find_in_modify_template(uuid: str):
-            for template in self.modify_templates:
-                if template.uuid == uuid:
-                    return template
-            raise ValueError(f"找不到对应的分数模板，uuid: {uuid}")
-
-        def find_in_achievement(uuid: str):
+        先查全局的登记表（registry.py），查到了再确认一下它确实在此周的数据里（都是字典查找），
+        登记表里没有（比如从旧的pickle存档加载出来的对象）的话再挨个扫一遍，找到了顺便登记上。
+
+        :param uuid: 对象uuid（ClassDataTypeUUID或者字符串）
+        :param find_class: 对象种类，"any"为按照点评、分数模板、成就、成就模板、学生、小组的顺序找
+        :return: 对象
+        :raise ValueError: 找不到
+        """
+
+        def in_values(mapping, key, obj) -> bool:
+            # 分数模板是OrderedKeyList，没有get
+            try:
+                if mapping[key] is obj:
+                    return True
+            except (KeyError, IndexError, ValueError, TypeError):
+                pass
+            if isinstance(mapping, ScoreLedger):
+                # 同一个时间戳可能有好几条，流水可以直接按对象查
+                return mapping.position_of(obj) is not None
+            return any(v is obj for v in mapping.values())
+
+        def is_current_student(student) -> bool:
+            _class = self.classes.get(student.belongs_to)
+            if _class is None:
+                return False
+            return in_values(_class.students, student.num, student)
+
+        def scan_modify():
             for _class in self.classes.values():
                 for student in _class.students.values():
-                    for achievement in student.achievements.values():
-                        if achievement.uuid == uuid:
-                            return achievement
-            raise ValueError(f"找不到对应的成就，uuid: {uuid}")
-
-        def find_in_achievement_template(uuid: str):
-            for template in self.achievement_templates.values():
-                if template.uuid == uuid:
-                    return template
-            raise ValueError(f"找不到对应的成就模板，uuid: {uuid}")
-
-        def find_in_student(uuid: str):
+                    yield from student.history.values()
+
+        def scan_achievement():
             for _class in self.classes.values():
                 for student in _class.students.values():
-                    if student.uuid == uuid:
-                        return student
-            raise ValueError(f"找不到对应的学生，uuid: {uuid}")
+                    yield from student.achievements.values()
 
-        def find_in_group(uuid: str):
+        def scan_student():
             for _class in self.classes.values():
-                for group in _class.groups.values():
-                    if group.uuid == uuid:
-                        return group
-            raise ValueError(f"找不到对应的小组，uuid: {uuid}")
-
-        if find_class == "modify":
-            return find_in_modify(uuid)
-        elif find_class == "modify_template":
-            return find_in_modify_template(uuid)
-        elif find_class == "achievement":
-            return find_in_achievement(uuid)
-        elif find_class == "achievement_template":
-            return find_in_achievement_template(uuid)
-        elif find_class == "student":
-            return find_in_student(uuid)
-        elif find_class == "group":
-            return find_in_group(uuid)
-        else:
-            try:
-                return find_in_modify(uuid)
-            except ValueError:
-                try:
-                    return find_in_modify_template(uuid)
-                except ValueError:
-                    try:
-                        return find_in_achievement(uuid)
-                    except ValueError:
-                        try:
-                            return find_in_achievement_template(uuid)
-                        except ValueError:
-                            try:
-                                return find_in_student(uuid)
-                            except ValueError:
-                                try:
-                                    return find_in_group(uuid)
-                                except ValueError as e:
-                                    raise ValueError(
-                                        f"找不到对应的数据，uuid: {uuid}"
-                                    ) from e
-
-
+                yield from _class.students.values()
 
+        def scan_group():
+            for _class in self.classes.values():
+                yield from _class.groups.values()
+
+        # find_class: (数据类型名, 找不到时的名字, 确认在此周数据里, 挨个扫)
+        kinds = {
+            "modify": (
+                "ScoreModification",
+                "分数记录",
+                lambda m: in_values(m.target.history, m.execute_time_key, m)
+                and is_current_student(m.target),
+                scan_modify,
+            ),
+            "modify_template": (
+                "ScoreModificationTemplate",
+                "分数模板",
+                lambda t: in_values(self.modify_templates, t.key, t),
+                lambda: iter(self.modify_templates.values()),
+            ),
+            "achievement": (
+                "Achievement",
+                "成就",
+                lambda a: in_values(a.target.achievements, a.time_key, a)
+                and is_current_student(a.target),
+                scan_achievement,
+            ),
+            "achievement_template": (
+                "AchievementTemplate",
+                "成就模板",
+                lambda t: in_values(self.achievement_templates, t.key, t),
+                lambda: iter(self.achievement_templates.values()),
+            ),
+            "student": ("Student", "学生", is_current_student, scan_student),
+            "group": (
+                "Group",
+                "小组",
+                lambda g: g.belongs_to in self.classes
+                and in_values(self.classes[g.belongs_to].groups, g.key, g),
+                scan_group,
+            ),
+        }
+        targets = list(kinds) if find_class == "any" else [find_class]
+        number = uuid_int(uuid)
+
+        for kind in targets:
+            type_name, _, is_current, _ = kinds[kind]
+            for obj in uuid_registry.candidates(uuid, (type_name,)):
+                if is_current(obj):
+                    return obj
+
+        for kind in targets:
+            type_name, name, _, scan = kinds[kind]
+            for obj in scan():
+                if obj.uuid is not None and obj.uuid.int == number:
+                    uuid_registry.register(obj, None, replace=True)
+                    return obj
+            if find_class != "any":
+                raise ValueError(f"找不到对应的{name}，uuid: {uuid}")
+        raise ValueError(f"找不到对应的数据，uuid: {uuid}")
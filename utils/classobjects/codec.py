@@ -0,0 +1,355 @@
+"""
+对象数据的二进制编码
+
+和to_string出来的json相比：字段名不用每次都写，uuid只占16字节，数字用struct定长存，
+Class里面的作业规则也不用再套一层json字符串。
+
+编码的输入输出都是ClassDataType.to_dict的格式（uuid是字符串，容器是list/dict），
+所以from_dict拿到的东西和json.loads(to_string())出来的基本一样（元组会变成列表）。
+
+一条记录的格式：
+    版本号(B) 字段数量(B) 按照codec_fields顺序的各个字段 不在codec_fields里的其它字段(value)
+
+字段类型（codec_fields里面写的）：
+    "uuid"：标志(B)，1后面跟16字节，0为None，2后面跟一个str（不是标准格式uuid的字符串，比如"None"）
+    "str"：长度(I) + UTF-8，长度为0xFFFFFFFF是None，0xFFFFFFFE则后面跟一个value（不是字符串的时候）
+    "value"：类型标签(B) + 内容，可以是None/bool/int/float/str/list/dict
+    ("list", 元素类型)：数量(I) + 元素
+    ("pairs", 类型1, 类型2)：数量(I) + 每一对，解码出来是[[a, b], ...]
+    ("map", 键类型, 值类型)：数量(I) + 每一对，解码出来是dict
+    ("record", 数据类型名)：嵌套的另一个对象的记录（见Class.homework_rules）
+"""
+
+import struct
+from uuid import UUID
+from typing import Any, Callable, Dict, List, Literal, Tuple, Type, Union
+
+from .basetype import ClassDataType
+
+
+ObjectCodec = Literal["json", "binary"]
+"对象数据的编码方式，json为to_string的结果，binary为这个模块的编码"
+
+CODEC_VERSION = 1
+"当前的二进制编码版本，写在每条记录的第一个字节"
+
+FieldKind = Union[str, Tuple[Any, ...]]
+"字段类型，见模块说明"
+
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+_HEADER = struct.Struct("<BB")
+
+_NONE_LEN = 0xFFFFFFFF
+_VALUE_LEN = 0xFFFFFFFE
+
+# value的类型标签
+_T_NONE, _T_FALSE, _T_TRUE, _T_INT, _T_FLOAT, _T_STR, _T_LIST, _T_DICT, _T_BIGINT = range(9)
+
+_Encoder = Callable[[bytearray, Any], None]
+_Decoder = Callable[[memoryview, int], Tuple[Any, int]]
+
+
+def _enc_value(out: bytearray, value: Any) -> None:
+    if value is None:
+        out.append(_T_NONE)
+    elif value is True:
+        out.append(_T_TRUE)
+    elif value is False:
+        out.append(_T_FALSE)
+    elif isinstance(value, int):
+        if -(2 ** 63) <= value < 2 ** 63:
+            out.append(_T_INT)
+            out += _I64.pack(value)
+        else:
+            data = str(value).encode()
+            out.append(_T_BIGINT)
+            out += _U32.pack(len(data))
+            out += data
+    elif isinstance(value, float):
+        out.append(_T_FLOAT)
+        out += _F64.pack(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out.append(_T_STR)
+        out += _U32.pack(len(data))
+        out += data
+    elif isinstance(value, (list, tuple)):
+        out.append(_T_LIST)
+        out += _U32.pack(len(value))
+        for item in value:
+            _enc_value(out, item)
+    elif isinstance(value, dict):
+        out.append(_T_DICT)
+        out += _U32.pack(len(value))
+        for k, v in value.items():
+            _enc_value(out, k)
+            _enc_value(out, v)
+    elif isinstance(value, UUID):
+        _enc_value(out, str(value))
+    else:
+        raise TypeError(f"无法编码的数据类型：{type(value)}")
+
+
+def _dec_value(buf: memoryview, pos: int) -> Tuple[Any, int]:
+    tag = buf[pos]
+    pos += 1
+    if tag == _T_NONE:
+        return None, pos
+    if tag == _T_TRUE:
+        return True, pos
+    if tag == _T_FALSE:
+        return False, pos
+    if tag == _T_INT:
+        return _I64.unpack_from(buf, pos)[0], pos + 8
+    if tag == _T_FLOAT:
+        return _F64.unpack_from(buf, pos)[0], pos + 8
+    if tag == _T_STR or tag == _T_BIGINT:
+        length = _U32.unpack_from(buf, pos)[0]
+        pos += 4
+        text = str(buf[pos:pos + length], "utf-8")
+        return (text if tag == _T_STR else int(text)), pos + length
+    if tag == _T_LIST:
+        count = _U32.unpack_from(buf, pos)[0]
+        pos += 4
+        result = []
+        for _ in range(count):
+            item, pos = _dec_value(buf, pos)
+            result.append(item)
+        return result, pos
+    if tag == _T_DICT:
+        count = _U32.unpack_from(buf, pos)[0]
+        pos += 4
+        result = {}
+        for _ in range(count):
+            k, pos = _dec_value(buf, pos)
+            result[k], pos = _dec_value(buf, pos)
+        return result, pos
+    raise ValueError(f"未知的类型标签：{tag}")
+
+
+def _enc_str(out: bytearray, value: Any) -> None:
+    if value is None:
+        out += _U32.pack(_NONE_LEN)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out += _U32.pack(len(data))
+        out += data
+    else:
+        out += _U32.pack(_VALUE_LEN)
+        _enc_value(out, value)
+
+
+def _dec_str(buf: memoryview, pos: int) -> Tuple[Any, int]:
+    length = _U32.unpack_from(buf, pos)[0]
+    pos += 4
+    if length == _NONE_LEN:
+        return None, pos
+    if length == _VALUE_LEN:
+        return _dec_value(buf, pos)
+    return str(buf[pos:pos + length], "utf-8"), pos + length
+
+
+def _enc_uuid(out: bytearray, value: Any) -> None:
+    if value is None:
+        out.append(0)
+        return
+    if isinstance(value, UUID):
+        out.append(1)
+        out += value.bytes
+        return
+    # to_dict里的uuid都是str(uuid)出来的标准格式，直接按十六进制转，比UUID(value)快得多
+    if (
+        isinstance(value, str)
+        and len(value) == 36
+        and value[8] == value[13] == value[18] == value[23] == "-"
+        and value == value.lower()
+    ):
+        try:
+            raw = bytes.fromhex(value.replace("-", ""))
+        except ValueError:
+            raw = b""
+        if len(raw) == 16:  # 别的位置也有"-"或者空格的话会不够16字节
+            out.append(1)
+            out += raw
+            return
+    # 不是标准格式的就原样存字符串，保证解码出来一模一样
+    out.append(2)
+    _enc_str(out, value)
+
+
+def _dec_uuid(buf: memoryview, pos: int) -> Tuple[Any, int]:
+    flag = buf[pos]
+    pos += 1
+    if flag == 1:
+        h = buf[pos:pos + 16].hex()
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}", pos + 16
+    if flag == 0:
+        return None, pos
+    return _dec_str(buf, pos)
+
+
+_compiled: Dict[Any, Tuple[_Encoder, _Decoder]] = {}
+"编译好的字段编解码函数，_compiled[字段类型] = (编码, 解码)"
+
+
+def find_type(type_name: str) -> Type[ClassDataType]:
+    "按照chunk_type_name找到对应的数据类型"
+    pending = list(ClassDataType.__subclasses__())
+    while pending:
+        cls = pending.pop()
+        if getattr(cls, "chunk_type_name", None) == type_name:
+            return cls
+        pending.extend(cls.__subclasses__())
+    raise KeyError(f"找不到数据类型{type_name}")
+
+
+def _compile(kind: FieldKind) -> Tuple[_Encoder, _Decoder]:
+    "把字段类型编译成编码和解码函数"
+    try:
+        return _compiled[kind]
+    except KeyError:
+        pass
+    if kind == "uuid":
+        result = (_enc_uuid, _dec_uuid)
+    elif kind == "str":
+        result = (_enc_str, _dec_str)
+    elif kind == "value":
+        result = (_enc_value, _dec_value)
+    elif kind[0] == "list":
+        enc_item, dec_item = _compile(kind[1])
+
+        def enc_list(out: bytearray, value: Any) -> None:
+            out += _U32.pack(len(value))
+            for item in value:
+                enc_item(out, item)
+
+        def dec_list(buf: memoryview, pos: int) -> Tuple[Any, int]:
+            count = _U32.unpack_from(buf, pos)[0]
+            pos += 4
+            result = []
+            for _ in range(count):
+                item, pos = dec_item(buf, pos)
+                result.append(item)
+            return result, pos
+
+        result = (enc_list, dec_list)
+    elif kind[0] in ("pairs", "map"):
+        enc_a, dec_a = _compile(kind[1])
+        enc_b, dec_b = _compile(kind[2])
+        as_dict = kind[0] == "map"
+
+        def enc_pairs(out: bytearray, value: Any) -> None:
+            out += _U32.pack(len(value))
+            for a, b in (value.items() if as_dict else value):
+                enc_a(out, a)
+                enc_b(out, b)
+
+        def dec_pairs(buf: memoryview, pos: int) -> Tuple[Any, int]:
+            count = _U32.unpack_from(buf, pos)[0]
+            pos += 4
+            pairs = []
+            for _ in range(count):
+                a, pos = dec_a(buf, pos)
+                b, pos = dec_b(buf, pos)
+                pairs.append([a, b])
+            return (dict(pairs) if as_dict else pairs), pos
+
+        result = (enc_pairs, dec_pairs)
+    elif kind[0] == "record":
+        type_name = kind[1]
+
+        # 被引用的类型可能还没定义，用到的时候再去找
+        def enc_record(out: bytearray, value: Any) -> None:
+            _encode_into(out, find_type(type_name), value)
+
+        def dec_record(buf: memoryview, pos: int) -> Tuple[Any, int]:
+            return _decode_from(buf, pos, find_type(type_name))
+
+        result = (enc_record, dec_record)
+    else:
+        raise ValueError(f"未知的字段类型：{kind!r}")
+    _compiled[kind] = result
+    return result
+
+
+_schemas: Dict[type, Tuple[List[Tuple[str, _Encoder, _Decoder]], frozenset]] = {}
+"编译好的数据类型字段列表，_schemas[数据类型] = ([(字段名, 编码, 解码)], 字段名集合)"
+
+
+def _schema(
+    dtype: Type[ClassDataType],
+) -> Tuple[List[Tuple[str, _Encoder, _Decoder]], frozenset]:
+    "获取一个数据类型编译好的字段列表"
+    try:
+        return _schemas[dtype]
+    except KeyError:
+        pass
+    schema = [(name, *_compile(kind)) for name, kind in dtype.codec_fields]
+    if len(schema) > 255:
+        raise ValueError(f"{dtype.__qualname__}的字段太多了")
+    _schemas[dtype] = (schema, frozenset(["type", *(name for name, _ in dtype.codec_fields)]))
+    return _schemas[dtype]
+
+
+def _encode_into(out: bytearray, dtype: Type[ClassDataType], data: Dict[str, Any]) -> None:
+    schema, names = _schema(dtype)
+    out += _HEADER.pack(CODEC_VERSION, len(schema))
+    for name, enc, _ in schema:
+        enc(out, data[name])
+    # 没写进codec_fields的字段（比如成就模板的各种条件）放在最后一起存
+    extra = {k: v for k, v in data.items() if k not in names}
+    _enc_value(out, extra or None)
+
+
+def _decode_from(
+    buf: memoryview, pos: int, dtype: Type[ClassDataType]
+) -> Tuple[Dict[str, Any], int]:
+    version, count = _HEADER.unpack_from(buf, pos)
+    pos += 2
+    if version > CODEC_VERSION:
+        raise ValueError(f"数据的编码版本({version})比当前程序支持的({CODEC_VERSION})新")
+    schema, _ = _schema(dtype)
+    if count > len(schema):
+        raise ValueError(f"数据的字段比{dtype.__qualname__}当前的多，可能是新版本程序保存的")
+    data: Dict[str, Any] = {"type": dtype.chunk_type_name}
+    # 字段只会往后加，旧数据少的字段from_dict自己处理
+    for name, _, dec in schema[:count]:
+        data[name], pos = dec(buf, pos)
+    extra, pos = _dec_value(buf, pos)
+    if extra:
+        data.update(extra)
+    return data, pos
+
+
+def encode_record(dtype: Type[ClassDataType], data: Dict[str, Any]) -> bytes:
+    """
+    把to_dict的结果编码成二进制。
+
+    :param dtype: 数据类型
+    :param data: to_dict的结果
+    :return: 编码后的数据
+    """
+    out = bytearray()
+    _encode_into(out, dtype, data)
+    return bytes(out)
+
+
+def decode_record(dtype: Type[ClassDataType], data: bytes) -> Dict[str, Any]:
+    """
+    把encode_record的结果解码成to_dict的格式。
+
+    :param dtype: 数据类型
+    :param data: 编码后的数据
+    :return: 可以传给from_dict的字典
+    :raise ValueError: 数据损坏或者版本不支持
+    """
+    buf = memoryview(data)
+    try:
+        result, pos = _decode_from(buf, 0, dtype)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"{dtype.__qualname__}的二进制数据已损坏") from e
+    if pos != len(buf):
+        raise ValueError(f"{dtype.__qualname__}的二进制数据末尾有多余的内容")
+    return result
@@ -10,16 +10,27 @@ import time
 import json
 import shutil
 import sqlite3
-from typing import (Union, TypeVar, Generic, Literal, Dict,
-                    Any, Type, Optional, Tuple, List, Iterable)
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import (Union, TypeVar, Generic, Literal, Dict, Set, Iterator,
+                    Any, Type, Optional, Tuple, List, Iterable, Callable)
 from utils.consts import runtime_flags
 from utils.basetypes import Base, Object
 from utils.functions.prompts import question_yes_no
 from utils.classobjects import *
-from utils.algorithm import Mutex
+from utils.algorithm import Mutex, Thread
 from .basetype import ClassDataType, ClassDataTypeUUID
 from .classdataobj import ClassDataObj
 from .classdataobj import *
+from .codec import ObjectCodec, encode_record, decode_record, find_type
+from .journal import ScoreJournal, JournalRows, JOURNAL_FILE_NAME
+from .objectcache import ObjectCache, estimate_size
+from .registry import uuid_registry
+from .catalog import (HistoryCatalog, CatalogEntry, summarize_history, summarize_records,
+                      archive_size)
+from .migrations import (Migration, SCHEMA_VERSION_KEY, apply_migrations, latest_schema_version,
+                         pending_migrations, read_schema_version, write_schema_version)
 
 # 数据加载器
 
@@ -34,6 +45,101 @@ class StringObjectDataKind(Generic[_NT], str):
     "对象数据类型, ObjectDataKind[Student]代表这个字符串可以加载出一个学牲"
 
 
+StorageLayout = Literal["sharded", "single"]
+"""存档的存储方式。
+"sharded"：每个数据类型一个<类型名>.db，每个里面16张datas_x表，索引是单独的json文件；
+"single"：一个archive.db，对象都在objects表里，索引放在meta表里"""
+
+ARCHIVE_FILE_NAME = "archive.db"
+"单文件存储的数据库文件名"
+
+INDEX_FILE_NAMES = (
+    "info.json",
+    "classes.json",
+    "weekdays.json",
+    "current_day_attendance.json",
+    "templates.json",
+    "achievements.json",
+)
+"每个存档文件夹里的json索引，单文件存储时作为meta表的key"
+
+BLOB_STORE_FILE_NAME = "blobs.db"
+"共享对象库的文件名，放在用户存档的根目录"
+
+BLOB_REF_PREFIX = b"\x00"
+"""对象数据引用的第一个字节，后面跟着共享对象库里的哈希。
+json数据是文本，二进制编码的第一个字节是版本号，都不会是这个"""
+
+BLOB_QUERY_SIZE = 500
+"每次从共享对象库里查多少个哈希"
+
+
+def archive_layout(path: str) -> Optional[StorageLayout]:
+    """
+    判断一个存档文件夹的存储方式。
+
+    :param path: 存档文件夹（Current或者某个历史记录的文件夹）
+    :return: 存储方式，文件夹不存在或者是空的则为None
+    """
+    if os.path.isfile(os.path.join(path, ARCHIVE_FILE_NAME)):
+        return "single"
+    if not os.path.isdir(path):
+        return None
+    for file in os.listdir(path):
+        if file.endswith(".db") or file == "info.json":
+            return "sharded"
+    return None
+
+
+def ensure_codec_column(conn: sqlite3.Connection, table: str) -> None:
+    """
+    给旧版本建的表加上codec列（旧的行都是json，留NULL就行）。
+
+    :param conn: 数据库连接
+    :param table: 表名
+    """
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if columns and "codec" not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN codec text")
+
+
+def connect_archive(path: str, readonly: bool = False) -> sqlite3.Connection:
+    """
+    打开一个存档文件夹的archive.db（单文件存储）。
+
+    非只读的连接会开WAL，设置synchronous=NORMAL，并且在没有表的时候建表。
+
+    :param path: 存档文件夹
+    :param readonly: 是否只读打开
+    :return: 连接
+    """
+    file = os.path.abspath(os.path.join(path, ARCHIVE_FILE_NAME))
+    if readonly:
+        return sqlite3.connect(f"file:{file}?mode=ro", uri=True, check_same_thread=False)
+    conn = sqlite3.connect(file, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS objects (
+                    uuid   text       primary key,    -- 数据UUID
+                    type   text       not null,       -- 数据类型名（chunk_type_name）
+                    class  text,                      -- 数据的Python类名
+                    data   text,                      -- 数据
+                    codec  text                       -- 数据的编码方式，NULL为json
+            )"""
+    )
+    ensure_codec_column(conn, "objects")
+    conn.execute("CREATE INDEX IF NOT EXISTS objects_type ON objects (type)")
+    conn.execute("CREATE INDEX IF NOT EXISTS objects_class ON objects (class)")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS meta (
+                    key    text       primary key,    -- 索引名（原来的文件名）
+                    value  text                       -- json内容
+            )"""
+    )
+    return conn
+
+
 class UserDataBase(Object):
     "用户数据库"
 
@@ -81,6 +187,8 @@ class UserDataBase(Object):
         self.last_start_time = last_start_time or time.time()
         self.weekday_record = weekday_record or {}
         self.current_day_attendance = current_day_attendance or {}
+        self.schema_version: Optional[int] = None
+        "数据的存档结构版本（见migrations），从sqlite存档加载的是迁移之后的版本，其他来源为None"
         self.loaded = user is not None  # 任一参数非空即视为已加载
 
     def set(
@@ -146,10 +254,9 @@ class DataObject:
     cur_list: Dict[str, sqlite3.Cursor] = {}
     "连接列表，conn_list[数据类型名称]=光标"
 
-    loaded_object_list: Dict[
-        Tuple[ClassDataTypeUUID[History], str, ClassDataTypeUUID[ClassDataType]], ClassDataType
-    ] = {}
-    "加载目标列表"
+    loaded_object_list: ObjectCache = ObjectCache()
+    """加载出来的对象的缓存，loaded_object_list[(历史记录uuid, 数据类型名, 对象uuid)] = 对象。
+    有大小限制（LRU），此周的对象固定在里面，见objectcache.py"""
 
     load_tasks: List[Tuple[ClassDataTypeUUID[History], str, ClassDataTypeUUID[ClassDataType]]] = []
     "加载任务列表"
@@ -161,7 +268,7 @@ class DataObject:
 
     @staticmethod
     def clear_loaded_objects():
-        "清空加载对象列表"
+        "清空加载对象缓存"
         DataObject.loaded_object_list.clear()
 
     @staticmethod
@@ -284,6 +391,196 @@ class DataObject:
             )
             self.relase_connections()
 
+    @staticmethod
+    def save_batch(
+        objects: Iterable[ClassDataType],
+        path: str,
+        max_retry: int = 3,
+        progress_callback: Optional[Callable[[int], Any]] = None,
+        layout: StorageLayout = "sharded",
+        codec: ObjectCodec = "json",
+        blob_store: Optional[str] = None,
+    ) -> int:
+        """
+        批量保存对象。
+
+        分片存储时按照(数据类型, uuid首位)分到对应的数据库和datas_x表里，
+        每个.db文件只开一个BEGIN IMMEDIATE事务，每张表只用一次executemany，
+        比一个一个DataObject.save（每个对象一次SELECT再一次UPDATE/INSERT）快得多；
+        单文件存储时所有对象都在archive.db的objects表里，只有一个事务。
+
+        :param objects: 要保存的对象
+        :param path: 存档路径（Current或者某个历史记录的文件夹）
+        :param max_retry: 每个数据库最大重试次数
+        :param progress_callback: 每提交完一个数据库就调用一次，参数为这次写入的对象数量
+        :param layout: 存储方式
+        :param codec: 对象数据的编码方式，"json"为to_string，"binary"为to_bytes
+        :param blob_store: 共享对象库的路径，提供了就把数据存到共享对象库里，存档里只写引用（见save_rows）
+        :return: 保存的对象数量
+        :raise ValueError: 数据库中已经存在uuid相同但类型不同的对象
+        :raise sqlite3.Error: 重试max_retry次后仍然失败
+        """
+        return DataObject.save_rows(
+            (
+                (
+                    str(obj.uuid),
+                    obj.chunk_type_name,
+                    obj.__class__.__qualname__,
+                    obj.to_bytes() if codec == "binary" else obj.to_string(),
+                )
+                for obj in objects
+            ),
+            path,
+            max_retry,
+            progress_callback,
+            layout,
+            blob_store,
+        )
+
+    @staticmethod
+    def save_rows(
+        rows: Iterable[Tuple[str, str, str, Union[str, bytes]]],
+        path: str,
+        max_retry: int = 3,
+        progress_callback: Optional[Callable[[int], Any]] = None,
+        layout: StorageLayout = "sharded",
+        blob_store: Optional[str] = None,
+    ) -> int:
+        """
+        批量写入已经序列化好的数据（见save_batch），编码方式按照数据是str还是bytes来判断。
+
+        提供了blob_store的时候，数据按内容的哈希写进共享对象库（已经有的不会重复写），
+        存档里的data列只放引用，内容没变的对象在所有历史记录里只占一份空间。
+        共享对象库先提交，存档后提交，中途失败最多留下没人引用的数据，下次collect_blobs的时候清掉。
+
+        :param rows: (uuid, 数据类型名, 类名, 数据)的可迭代对象
+        :param path: 存档路径
+        :param max_retry: 每个数据库最大重试次数
+        :param progress_callback: 每提交完一个数据库就调用一次，参数为这次写入的对象数量
+        :param layout: 存储方式
+        :param blob_store: 共享对象库的路径
+        :return: 保存的对象数量
+        :raise ValueError: 数据库中已经存在uuid相同但类型不同的对象
+        :raise sqlite3.Error: 重试max_retry次后仍然失败
+        """
+        shards: Dict[str, Dict[str, List[tuple]]] = {}
+        blobs: Dict[bytes, Union[str, bytes]] = {}
+        for uuid, type_name, class_name, data in rows:
+            if blob_store is not None:
+                ref = blob_ref(type_name, data)
+                blobs[ref] = data
+                data = ref
+            if layout == "single":
+                shards.setdefault(ARCHIVE_FILE_NAME, {}).setdefault("", []).append(
+                    (uuid, type_name, class_name, data, record_codec(data))
+                )
+            else:
+                shards.setdefault(type_name, {}).setdefault(uuid[:1], []).append(
+                    (uuid, type_name, data, record_codec(data))
+                )
+        if blobs:
+            write_blobs(blob_store, blobs)
+
+        total = 0
+        for type_name, tables in shards.items():
+            retry = max_retry
+            while True:
+                if layout == "single":
+                    conn = connect_archive(path)
+                else:
+                    conn = sqlite3.connect(
+                        os.path.join(path, f"{type_name}.db"),
+                        check_same_thread=False,
+                        isolation_level=None,  # 事务自己管，不让sqlite3模块偷偷开
+                    )
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    if layout == "sharded":  # 单文件存储的表在connect_archive里面建好了
+                        for i in range(16):
+                            conn.execute(
+                                f"""CREATE TABLE IF NOT EXISTS datas_{i:01x} (
+                                                    uuid   text       primary key,    -- 数据UUID
+                                                    class  text,                      -- 数据类型
+                                                    data   text,                      -- 数据
+                                                    codec  text                       -- 数据的编码方式，NULL为json
+                                            )"""
+                            )
+                            ensure_codec_column(conn, f"datas_{i:01x}")
+                    for prefix, rows in tables.items():
+                        if layout == "single":
+                            table = "objects"
+                            cursor = conn.executemany(
+                                """
+                                INSERT INTO objects (uuid, type, class, data, codec)
+                                VALUES (?, ?, ?, ?, ?)
+                                ON CONFLICT(uuid) DO UPDATE
+                                SET class = excluded.class, data = excluded.data,
+                                    codec = excluded.codec
+                                WHERE objects.type = excluded.type
+                            """,
+                                rows,
+                            )
+                        else:
+                            table = f"datas_{prefix}"
+                            cursor = conn.executemany(
+                                f"""
+                                INSERT INTO datas_{prefix} (uuid, class, data, codec)
+                                VALUES (?, ?, ?, ?)
+                                ON CONFLICT(uuid) DO UPDATE
+                                SET class = excluded.class, data = excluded.data,
+                                    codec = excluded.codec
+                                WHERE datas_{prefix}.class = excluded.class
+                            """,
+                                rows,
+                            )
+                        if cursor.rowcount != -1 and cursor.rowcount < len(rows):
+                            # 有行因为类型不一致没被更新
+                            raise ValueError(
+                                f"在{type_name if layout == 'single' else type_name + '.db'}"
+                                f"的{table}中，"
+                                "有uuid相同但类型不同的对象已经存在！\n"
+                                "如果你看见了这个错误，你可能碰见了"
+                                "1/340282366920938463463374607431768211456的概率"
+                                "（不知道该恭喜你还是感到遗憾）"
+                            )
+                    conn.execute("COMMIT")
+                    count = sum(len(rows) for rows in tables.values())
+                    total += count
+                    DataObject.saved_objects += count
+                    if progress_callback is not None:
+                        progress_callback(count)
+                    break
+                except sqlite3.Error as e:
+                    try:
+                        conn.execute("ROLLBACK")
+                    except sqlite3.Error:
+                        pass
+                    retry -= 1
+                    if retry <= 0:
+                        Base.log_exc(
+                            f"批量保存{type_name}时出现错误，重试{max_retry}次后仍然失败",
+                            "DataObject.save_rows",
+                            "E",
+                            exc=e,
+                        )
+                        raise
+                    Base.log_exc_short(
+                        f"批量保存{type_name}时出现错误，0.1秒后重试",
+                        "DataObject.save_rows",
+                        "W",
+                        exc=e,
+                    )
+                    time.sleep(0.1)
+                except Exception:
+                    try:
+                        conn.execute("ROLLBACK")
+                    except sqlite3.Error:
+                        pass
+                    raise
+                finally:
+                    conn.close()
+        return total
+
 
 _LT = TypeVar("_LT")
 
@@ -319,6 +616,600 @@ def spilt_list(
 _DT = TypeVar("_DT")
 
 
+def blob_store_of(path: str) -> str:
+    """
+    获取一个存档文件夹所属的用户的共享对象库。
+
+    :param path: 存档文件夹（Current或者Histories/<xx>/<剩下的>）
+    :return: 共享对象库的路径（不一定存在）
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(os.path.dirname(path))
+    if os.path.basename(parent) == "Histories":
+        return os.path.join(os.path.dirname(parent), BLOB_STORE_FILE_NAME)
+    return os.path.join(os.path.dirname(path), BLOB_STORE_FILE_NAME)
+
+
+def connect_blob_store(file: str, readonly: bool = False) -> sqlite3.Connection:
+    """
+    打开共享对象库。
+
+    历史记录里的对象数据按内容的哈希只存一份在这里，存档文件夹里的data列只放引用（见blob_ref）。
+
+    :param file: 共享对象库的路径
+    :param readonly: 是否只读打开
+    :return: 连接
+    """
+    file = os.path.abspath(file)
+    if readonly:
+        return sqlite3.connect(f"file:{file}?mode=ro", uri=True, check_same_thread=False)
+    conn = sqlite3.connect(file, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS blobs (
+                    hash   blob       primary key,    -- 数据的哈希（见blob_ref）
+                    data   text,                      -- 数据
+                    codec  text                       -- 数据的编码方式
+            )"""
+    )
+    return conn
+
+
+def blob_ref(type_name: str, data: Union[str, bytes]) -> bytes:
+    """
+    计算一条对象数据在共享对象库里的引用。
+
+    哈希里带上了数据类型名和编码方式，内容一样但是类型不一样的数据不会混在一起。
+
+    :param type_name: 数据类型名
+    :param data: 数据
+    :return: 引用（BLOB_REF_PREFIX + 20字节的BLAKE2b）
+    """
+    h = hashlib.blake2b(type_name.encode("utf-8"), digest_size=20)
+    if isinstance(data, str):
+        h.update(b"\x00j")
+        h.update(data.encode("utf-8"))
+    else:
+        h.update(b"\x00b")
+        h.update(data)
+    return BLOB_REF_PREFIX + h.digest()
+
+
+def is_blob_ref(data: Union[str, bytes, None]) -> bool:
+    """
+    判断数据库里的一条数据是不是共享对象库的引用。
+
+    :param data: 数据
+    :return: 是否为引用
+    """
+    return isinstance(data, bytes) and data[:1] == BLOB_REF_PREFIX
+
+
+def read_blobs(conn: sqlite3.Connection, refs: Iterable[bytes]) -> Dict[bytes, Union[str, bytes]]:
+    """
+    从共享对象库里一次性查出这些引用的数据。
+
+    :param conn: 共享对象库的连接
+    :param refs: 引用
+    :return: result[引用] = 数据，查不到的引用不会出现在里面
+    """
+    refs = list(set(refs))
+    result: Dict[bytes, Union[str, bytes]] = {}
+    for i in range(0, len(refs), BLOB_QUERY_SIZE):
+        part = refs[i:i + BLOB_QUERY_SIZE]
+        result.update(
+            conn.execute(
+                f"SELECT hash, data FROM blobs WHERE hash IN ({', '.join('?' * len(part))})",
+                part,
+            )
+        )
+    return result
+
+
+def write_blobs(file: str, blobs: Dict[bytes, Union[str, bytes]]) -> int:
+    """
+    把数据写进共享对象库，已经有的跳过。
+
+    :param file: 共享对象库的路径
+    :param blobs: blobs[引用] = 数据
+    :return: 新写入的数量
+    :raise sqlite3.Error: 写入失败
+    """
+    conn = connect_blob_store(file)
+    try:
+        before = conn.total_changes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO blobs (hash, data, codec) VALUES (?, ?, ?)",
+                ((ref, data, record_codec(data)) for ref, data in blobs.items()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            raise
+        return conn.total_changes - before
+    finally:
+        conn.close()
+
+
+def iter_archive_records(
+    path: str, resolve_blobs: bool = True
+) -> Iterator[Tuple[str, str, str, Union[str, bytes]]]:
+    """
+    遍历一个存档文件夹里的所有对象，两种存储方式都可以。
+
+    :param path: 存档文件夹
+    :param resolve_blobs: 是否把共享对象库的引用换成真正的数据（找不到数据的对象会被跳过），
+        为False时原样返回引用
+    :return: (uuid, 数据类型名, 类名, 数据)的迭代器
+    """
+    records = _iter_stored_records(path)
+    if not resolve_blobs:
+        yield from records
+        return
+    conn: Optional[sqlite3.Connection] = None
+
+    def resolve(
+        batch: List[Tuple[str, str, str, Union[str, bytes]]]
+    ) -> Iterator[Tuple[str, str, str, Union[str, bytes]]]:
+        nonlocal conn
+        refs = [record[3] for record in batch if is_blob_ref(record[3])]
+        if refs and conn is None:
+            conn = connect_blob_store(blob_store_of(path), readonly=True)
+        blobs = read_blobs(conn, refs) if refs else {}
+        for uuid, type_name, class_name, data in batch:
+            if is_blob_ref(data):
+                if data not in blobs:
+                    continue
+                data = blobs[data]
+            yield uuid, type_name, class_name, data
+
+    try:
+        batch: List[Tuple[str, str, str, Union[str, bytes]]] = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= BLOB_QUERY_SIZE:
+                yield from resolve(batch)
+                batch = []
+        yield from resolve(batch)
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def _iter_stored_records(path: str) -> Iterator[Tuple[str, str, str, Union[str, bytes]]]:
+    "遍历一个存档文件夹里的所有行，数据原样返回（见iter_archive_records）"
+    if archive_layout(path) == "single":
+        conn = connect_archive(path, readonly=True)
+        try:
+            yield from conn.execute("SELECT uuid, type, class, data FROM objects")
+        finally:
+            conn.close()
+        return
+    for file in sorted(os.listdir(path)):
+        if not file.endswith(".db") or file == ARCHIVE_FILE_NAME:
+            continue
+        conn = sqlite3.connect(
+            f"file:{os.path.abspath(os.path.join(path, file))}?mode=ro", uri=True
+        )
+        try:
+            for i in range(16):
+                try:
+                    rows = conn.execute(
+                        f"SELECT uuid, class, data FROM datas_{i:01x}"
+                    ).fetchall()
+                except sqlite3.OperationalError:  # 这张表没建
+                    continue
+                for uuid, class_name, data in rows:
+                    yield uuid, file[:-3], class_name, data
+        finally:
+            conn.close()
+
+
+def read_archive_rows(path: str) -> Dict[str, Dict[str, str]]:
+    """
+    把一个存档文件夹里所有对象的数据一次性读出来。
+
+    给ProcessPoolExecutor的子进程用的，所以只用标准库，不碰日志和全局状态，
+    每个子进程自己开只读连接，读完就关。
+
+    :param path: 存档文件夹（Current或者Histories/<xx>/<剩下的>）
+    :return: rows[数据类型名][uuid] = 数据（共享对象库的引用已经换成了数据）
+    """
+    rows: Dict[str, Dict[str, str]] = {}
+    for uuid, type_name, _, data in iter_archive_records(path):
+        rows.setdefault(type_name, {})[uuid] = data
+    return rows
+
+
+def read_archive_indexes(path: str) -> Dict[str, str]:
+    """
+    读出一个存档文件夹里的所有json索引（原始字符串），两种存储方式都可以。
+
+    :param path: 存档文件夹
+    :return: indexes[索引名] = json内容
+    """
+    if archive_layout(path) == "single":
+        conn = connect_archive(path, readonly=True)
+        try:
+            return dict(conn.execute("SELECT key, value FROM meta"))
+        finally:
+            conn.close()
+    indexes = {}
+    for file in os.listdir(path):
+        if file.endswith(".json"):
+            with open(os.path.join(path, file), "r", encoding="utf-8") as f:
+                indexes[file] = f.read()
+    return indexes
+
+
+def record_codec(data: Union[str, bytes]) -> Literal["json", "binary", "blob"]:
+    """
+    判断数据库里的一条数据是用什么编码的（json存的是文本，二进制存的是blob）。
+
+    :param data: 数据
+    :return: 编码方式，"blob"为共享对象库的引用（见blob_ref）
+    """
+    if isinstance(data, str):
+        return "json"
+    return "blob" if data[:1] == BLOB_REF_PREFIX else "binary"
+
+
+def convert_archive(path: str, target: StorageLayout) -> bool:
+    """
+    把一个存档文件夹转换成另一种存储方式。
+
+    按行原样复制（uuid、类名、数据和json索引都不动，数据的编码方式和共享对象库的引用也不变），
+    不需要构建对象，所以可以来回转换。
+    分数事件日志（journal.bin）会原样移动到新的文件夹里。
+    先写到旁边的临时文件夹里，写完再替换掉原来的文件夹，中途出错的话原来的数据不受影响。
+
+    :param path: 存档文件夹
+    :param target: 目标存储方式
+    :return: 是否真的转换了（已经是目标存储方式或者没有数据则为False）
+    """
+    layout = archive_layout(path)
+    if layout is None or layout == target:
+        return False
+    temp_path = path.rstrip("/\\") + ".migrating"
+    old_path = path.rstrip("/\\") + ".old"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    indexes = read_archive_indexes(path)
+    try:
+        if target == "single":
+            conn = connect_archive(temp_path)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT INTO objects (uuid, type, class, data, codec) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (uuid, type_name, class_name, data, record_codec(data))
+                        for uuid, type_name, class_name, data in iter_archive_records(path, False)
+                    ),
+                )
+                conn.executemany(
+                    "INSERT INTO meta (key, value) VALUES (?, ?)", indexes.items()
+                )
+                conn.execute("COMMIT")
+                # 收尾成一个文件，不留-wal和-shm
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+        else:
+            shards: Dict[str, Dict[str, List[Tuple[str, str, str]]]] = {}
+            for uuid, type_name, class_name, data in iter_archive_records(path, False):
+                shards.setdefault(type_name, {}).setdefault(uuid[:1], []).append(
+                    (uuid, class_name, data, record_codec(data))
+                )
+            for type_name, tables in shards.items():
+                conn = sqlite3.connect(os.path.join(temp_path, f"{type_name}.db"))
+                try:
+                    for i in range(16):
+                        conn.execute(
+                            f"""CREATE TABLE IF NOT EXISTS datas_{i:01x} (
+                                            uuid   text       primary key,    -- 数据UUID
+                                            class  text,                      -- 数据类型
+                                            data   text,                      -- 数据
+                                            codec  text                       -- 数据的编码方式，NULL为json
+                                    )"""
+                        )
+                    for prefix, rows in tables.items():
+                        conn.executemany(
+                            f"INSERT INTO datas_{prefix} (uuid, class, data, codec) VALUES (?, ?, ?, ?)",
+                            rows,
+                        )
+                    conn.commit()
+                finally:
+                    conn.close()
+            for name, content in indexes.items():
+                with open(os.path.join(temp_path, name), "w", encoding="utf-8") as f:
+                    f.write(content)
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    os.replace(path, old_path)
+    if os.path.isfile(os.path.join(old_path, JOURNAL_FILE_NAME)):
+        # 分数事件日志和存储方式无关，原样带过去
+        os.replace(
+            os.path.join(old_path, JOURNAL_FILE_NAME), os.path.join(temp_path, JOURNAL_FILE_NAME)
+        )
+    os.replace(temp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return True
+
+
+def migrate_archive_rows(path: str, migrations: List[Migration]) -> int:
+    """
+    对一个存档文件夹里的原始数据跑一遍迁移（见migrations），改动了的行原样按照原来的编码写回去。
+
+    共享对象库里的数据被改了的话，这一行会改成直接存数据，不再引用共享对象库
+    （没人引用的共享数据之后collect_blobs会清掉）。
+    每个数据库文件在一个事务里写完。
+
+    :param path: 存档文件夹
+    :param migrations: 要跑的迁移
+    :return: 改动了的行数
+    """
+    type_names = {t for m in migrations for t in m.type_names}
+    changed: List[Tuple[str, str, Union[str, bytes]]] = []
+    for uuid, type_name, _, data in iter_archive_records(path):
+        if type_name not in type_names:
+            continue
+        if isinstance(data, str):
+            d = json.loads(data)
+            if apply_migrations(migrations, type_name, d):
+                changed.append((uuid, type_name, json.dumps(d)))
+        else:
+            dtype = find_type(type_name)
+            d = decode_record(dtype, data)
+            if apply_migrations(migrations, type_name, d):
+                changed.append((uuid, type_name, encode_record(dtype, d)))
+    if not changed:
+        return 0
+    if archive_layout(path) == "single":
+        conn = connect_archive(path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "UPDATE objects SET data = ?, codec = ? WHERE uuid = ? AND type = ?",
+                ((data, record_codec(data), uuid, type_name) for uuid, type_name, data in changed),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return len(changed)
+    by_type: Dict[str, List[Tuple[str, str, Union[str, bytes]]]] = {}
+    for row in changed:
+        by_type.setdefault(row[1], []).append(row)
+    for type_name, rows in by_type.items():
+        conn = sqlite3.connect(os.path.join(path, f"{type_name}.db"))
+        try:
+            for prefix in {uuid[:1] for uuid, _, _ in rows}:
+                ensure_codec_column(conn, f"datas_{prefix}")
+            for uuid, _, data in rows:
+                conn.execute(
+                    f"UPDATE datas_{uuid[:1]} SET data = ?, codec = ? WHERE uuid = ?",
+                    (data, record_codec(data), uuid),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+    return len(changed)
+
+
+class ReferenceResolver:
+    """
+    广度优先的引用解析器。
+
+    装到ClassDataObj.LoadUUID上以后，LoadUUID不会马上去查数据库，
+    而是先返回一个放进缓存的空对象（和原来一样先浅层加载，防止无限递归），
+    等到resolve()的时候再一层一层地把所有还没加载的uuid按数据类型用
+    WHERE uuid IN (...)一次性查出来（见Chunk.fetch_rows），反序列化的时候引用到的新uuid就是下一层。
+
+    注意：LoadUUID返回的对象在resolve()之前还是空的，不要去读它的属性
+    """
+
+    max_query_params: int = 500
+    "每次IN查询最多带的参数数量（SQLite默认上限是999）"
+
+    def __init__(
+        self,
+        chunk: "Chunk",
+        history_uuid: Optional[ClassDataTypeUUID[History]],
+        path: str,
+        failures: Optional[list] = None,
+        rows: Optional[Dict[str, Dict[str, str]]] = None,
+    ):
+        """
+        构造一个解析器。
+
+        :param chunk: 所在的数据分组
+        :param history_uuid: 历史记录uuid，None为此周
+        :param path: 历史记录所在的文件夹
+        :param failures: 加载失败的对象id会放到这里面
+        :param rows: 预先读好的数据（read_archive_rows的返回值），提供了就不查数据库
+        """
+        self.chunk = chunk
+        self.history_uuid = history_uuid
+        self.path = path
+        self.failures = failures if failures is not None else []
+        self.rows = rows
+        self.pending: Dict[
+            Tuple[Optional[ClassDataTypeUUID[History]], str, str],
+            Tuple[Type[ClassDataType], ClassDataType],
+        ] = {}
+        "等待加载的对象，pending[缓存id] = (数据类型, 空对象)"
+        self.queries = 0
+        "查询数据库的次数"
+
+    def load(
+        self,
+        uuid: Optional[ClassDataTypeUUID[_DT]],
+        data_type: Type[ClassDataType],
+        history_uuid: Optional[ClassDataTypeUUID[History]] = None,
+    ) -> _DT:
+        """
+        登记一个要加载的对象，返回它（还没加载完的）实例。
+
+        :param uuid: 对象uuid
+        :param data_type: 数据类型
+        :param history_uuid: 历史记录uuid，不填就是解析器自己的
+        :return: 对象，在resolve()之后才是完整的
+        """
+        DataObject.loaded_objects += 1
+        if uuid is None:
+            if "noticed_uuid_is_none" not in runtime_flags:
+                Base.log("D", "加载时遇到uuid为None，将会直接返回None", "ReferenceResolver.load")
+                runtime_flags["noticed_uuid_is_none"] = True
+            return None
+        _id = (history_uuid or self.history_uuid, data_type.chunk_type_name, uuid)
+        try:
+            return DataObject.loaded_object_list[_id]
+        except KeyError:
+            with uuid_registry.paused():
+                obj = data_type.new_dummy()
+            obj.archive_uuid = _id[0]
+            obj.uuid = _id[2]
+            DataObject.loaded_object_list[_id] = obj
+            DataObject.load_tasks.append(_id)
+            self.pending[_id] = (data_type, obj)
+            return obj
+
+    def _fetch(self, type_name: str, uuids: List[str]) -> Dict[str, str]:
+        "一次性查出一种数据类型里这些uuid的数据"
+        if self.rows is not None:
+            type_rows = self.rows.get(type_name, {})
+            return {uuid: type_rows[uuid] for uuid in uuids if uuid in type_rows}
+        self.queries += 1
+        return self.chunk.fetch_rows(self.history_uuid, self.path, type_name, uuids)
+
+    def resolve(self) -> None:
+        "把所有登记了的对象逐层加载完"
+        with uuid_registry.paused():
+            self._resolve()
+
+    def _resolve(self) -> None:
+        while self.pending:
+            level = self.pending
+            self.pending = {}
+            groups: Dict[str, List[str]] = {}
+            for _id in level:
+                groups.setdefault(_id[1], []).append(str(_id[2]))
+
+            datas: Dict[Tuple[str, str], str] = {}
+            for type_name, uuids in groups.items():
+                for uuid, data in self._fetch(type_name, uuids).items():
+                    datas[(type_name, uuid)] = data
+
+            for _id, (data_type, obj) in level.items():
+                data = datas.get((_id[1], str(_id[2])))
+                DataObject.load_tasks.remove(_id)
+                if data is None:
+                    Base.log(
+                        "W",
+                        f"数据不存在，将会返回默认\n数据：{data_type.__qualname__}({_id[2]})",
+                        "ReferenceResolver.resolve",
+                    )
+                    self.failures.append(_id)
+                    continue
+                obj.inst_from_data(data)   # 这里面的LoadUUID会登记下一层
+                DataObject.loaded_object_list.resize(_id, estimate_size(obj, data))
+                uuid_registry.register(obj, _id[0], replace=True)
+
+
+class LazyHistoryLoader:
+    """
+    历史记录的懒加载器。
+
+    Chunk.load_history(lazy=True)只读了索引，真正的班级和每日记录
+    要等History.classes/weekdays第一次被访问的时候才通过这个加载器去读数据库，
+    加载出来的对象和平常一样放在DataObject.loaded_object_list里面，不再用的时候调用release()。
+    """
+
+    def __init__(
+        self,
+        chunk: "Chunk",
+        history_uuid: ClassDataTypeUUID[History],
+        path: str,
+        class_uuids: List[Tuple[str, str]],
+        weekday_uuids: Dict[str, Dict[float, str]],
+        resolver: Literal["breadth_first", "depth_first"] = "breadth_first",
+    ):
+        """
+        构造一个加载器。
+
+        :param chunk: 所在的数据分组
+        :param history_uuid: 历史记录uuid
+        :param path: 历史记录所在的文件夹
+        :param class_uuids: classes.json的内容
+        :param weekday_uuids: weekdays.json的内容
+        :param resolver: 引用的加载方式，见Chunk.load_history
+        """
+        self.chunk = chunk
+        self.history_uuid = history_uuid
+        self.path = path
+        self.class_uuids = class_uuids
+        self.weekday_uuids = weekday_uuids
+        self.resolver = resolver
+
+    def load(self) -> Tuple[Dict[str, Class], Dict[str, Dict[float, DayRecord]]]:
+        """
+        加载这个历史记录的班级和每日记录。
+
+        :return: (班级, 每日记录)
+        """
+        failures = []
+        start_time = time.time()
+        start_obj = DataObject.loaded_objects
+        # 加载完把LoadUUID换回去，不然别的地方再调用就跑到这个历史记录里面去了
+        load_uuid, resolver = ClassDataObj.LoadUUID, self.chunk.resolver
+        try:
+            class_list, weekday_list = self.chunk.load_history_objects(
+                self.history_uuid,
+                self.path,
+                self.class_uuids,
+                self.weekday_uuids,
+                self.resolver,
+                failures,
+            )
+        finally:
+            ClassDataObj.LoadUUID, self.chunk.resolver = load_uuid, resolver
+
+        classes = {_class.key: _class for _class in class_list}
+        weekdays: Dict[str, Dict[float, DayRecord]] = {}
+        for target_class, weekday in weekday_list:
+            weekdays.setdefault(target_class, {})[weekday.utc] = weekday
+        total_time = time.time() - start_time
+        Base.log(
+            "I",
+            f"历史记录{self.history_uuid}按需加载完成，"
+            f"总数据处理数：{DataObject.loaded_objects - start_obj}, "
+            f"警告数量：{len(failures)}, 耗时：{total_time:.3f}s",
+            "LazyHistoryLoader.load",
+        )
+        return classes, weekdays
+
+    def release(self) -> None:
+        "把这个历史记录加载过的对象从缓存里删掉，并关闭它的数据库连接"
+        DataObject.loaded_object_list.release_history(self.history_uuid)
+        uuid_registry.release_archive(self.history_uuid)
+        for key in [
+            key for key in Chunk.database_connections if key[0] == self.history_uuid
+        ]:
+            try:
+                Chunk.database_connections.pop(key).close()
+            except sqlite3.Error:
+                pass
+        Base.log("D", f"历史记录{self.history_uuid}已释放", "LazyHistoryLoader.release")
+
+
 class Chunk:
     "数据分组"
 
@@ -333,144 +1224,389 @@ class Chunk:
     save_task_mutex: Mutex = Mutex()
     "保存任务互斥锁"
 
+    history_load_workers: int = 1
+    """完整加载多个历史记录时读数据库用的进程数，0为按CPU核心数自动决定，1为不开子进程。
+    主要耗时在主进程的对象构建上，子进程只能分担读库的那一部分，
+    而且Windows上每个子进程都要重新导入一遍程序，所以默认不开"""
+
+    min_parallel_histories: int = 4
+    "历史记录少于这个数量时不开进程池（开进程本身也要时间）"
 
+    codec: ObjectCodec = "binary"
+    """保存对象数据时用的编码方式（见codec.py），读取的时候两种都认。
+    二进制编码比json小一半左右，旧版本的程序读不了"""
 
-    def __init__(self, path: str, bound_database: Optional[UserDataBase] = None):
+    dedup_histories: bool = True
+    """保存历史记录时是否把对象数据放进共享对象库（见DataObject.save_rows），
+    每次结算都会把模板、班级和没变的学生再存一遍，放进共享对象库的话内容一样的只存一份"""
+
+    tracked_types: Tuple[Type[ClassDataType], ...] = (Student, ScoreModification, Achievement)
+    """增量保存时只写有修改的对象的类型。
+    其它类型（班级、小组、模板、出勤之类）数量很少，而且经常在界面里面被直接改属性，每次都完整写入"""
+
+    def __init__(
+        self,
+        path: str,
+        bound_database: Optional[UserDataBase] = None,
+        layout: Optional[StorageLayout] = None,
+    ):
         self.path = path
         self.bound_db = bound_database or UserDataBase()
+        self.layout: StorageLayout = layout or self.detect_layout(path)
+        "保存时使用的存储方式，读取时会按照每个存档文件夹实际的存储方式来读"
         self.is_saving = False
+        self.resolver: Optional[ReferenceResolver] = None
+        "当前使用的引用解析器，深度优先加载时为None"
+        self.tracking = False
+        "是否在接收对象的修改标记（见track_changes）"
+        self.synced = False
+        "数据库里的Current是否和内存里没标记修改的对象一致，完整保存成功一次之后才是True"
+        self.dirty_objects: Set[ClassDataType] = set()
+        "有修改还没保存的对象，save_data保存当前周的时候取走"
+        self.written_indexes: Dict[str, str] = {}
+        "上次写入的json索引内容，written_indexes[存档文件夹/索引名] = 内容"
+        self.taken_snapshots = 0
+        "拍过的快照数量，也是下一个快照的序号"
+        self.written_snapshots = 0
+        "写入完了（不管成功失败）的快照数量，快照要按照序号依次写入，不然旧的数据会盖掉新的"
+        self.snapshot_order = threading.Condition()
+        "等待轮到自己的快照写入时用的条件变量"
+        self.journal_rows: JournalRows = {}
+        "加载此周时盖在数据库上面的分数事件日志数据（见load_data），后台压缩完之后清空"
         os.makedirs(
             self.path if not path.endswith(".datas") else os.path.dirname(self.path),
             exist_ok=True,
         )
 
-    def get_object_rdata(
-        self,
-        history_uuid: Optional[ClassDataTypeUUID[History]],
-        uuid: ClassDataTypeUUID[_DT],
-        data_type: str,
-    ) -> StringObjectDataKind[_DT]:
+    def track_changes(self) -> "Chunk":
         """
-        获取对象数据。
+        让这个分组接收对象的修改标记（ClassDataType.mark_dirty），
+        完整保存过一次之后，save_data就只会写有修改的对象。
 
-        :param history_uuid: 历史记录uuid，None为此周（还未重置的存档
-        :param uuid: 对象uuid
-        :param data_type: 数据类型名
-        :return: 对象数据
-        :raise ValueError: 数据不存在
+        同一时间只有一个分组能接收修改标记，后调用的会顶掉前面的。
+
+        :return: 自己
         """
-        try:
-            conn = self.database_connections[(history_uuid, data_type)]
-        except KeyError:
-            conn = sqlite3.connect(
-                os.path.join(self.path, f"{data_type}.db"), check_same_thread=False
-            )
-            self.database_connections[(history_uuid, data_type)] = conn
-        result = conn.execute(
-            f"SELECT data FROM datas_{uuid[:1]} WHERE uuid = ?", (str(uuid),)
-        ).fetchone()
-        if result is None:
-            raise ValueError("数据不存在")
-        return result[0]
+        ClassDataType.dirty_hook = self._on_dirty
+        self.tracking = True
+        return self
 
-    def load_history(
-        self,
-        history_uuid: Optional[ClassDataTypeUUID[History]] = None,
-        request_uuid: Optional[ClassDataTypeUUID[Type[None]]] = None,
-    ) -> History:
+    def _on_dirty(self, obj: ClassDataType) -> None:
+        "对象被标记修改时的回调"
+        self.dirty_objects.add(obj)
+
+    @property
+    def journal(self) -> ScoreJournal:
+        "此周（Current）的分数事件日志"
+        return ScoreJournal.open(os.path.join(self.path, "Current"))
+
+    @property
+    def catalog(self) -> HistoryCatalog:
+        "此用户存档的历史记录目录"
+        return HistoryCatalog(self.path)
+
+    def sync_catalog(self, drop_unsaved: bool = False) -> int:
         """
-        加载历史记录。
+        对照Histories文件夹修正历史记录目录。
 
-        :param history_uuid: 历史记录uuid
-        :param request_uuid: 请求uuid，只是用来做数据加载的标识的
-        :return: 历史记录
-        :raise FileNotFoundError: 历史记录不存在
+        目录里没有的存档（旧版本的用户存档，或者保存到一半退出了）会从存档里读一遍数据补上，
+        只解码班级和学生的数据，不构建对象；文件夹已经没有了的行会被删掉。
+
+        :param drop_unsaved: 是否也删掉还没保存的行（见ClassObj.reset_scores），刚加载的时候用
+        :return: 补上和删掉的行数
         """
-        failures = []
-        start_time = time.time()
-        start_obj = DataObject.loaded_objects
-        
+        with Chunk.save_task_mutex:
+            return self._sync_catalog(drop_unsaved)
+
+    def _sync_catalog(self, drop_unsaved: bool = False) -> int:
+        "修正历史记录目录，要拿着save_task_mutex调用，见sync_catalog"
+        catalog = self.catalog
+        known = {e.uuid: e for e in catalog.entries()}
+        on_disk: Dict[str, str] = {}
+        histories_path = os.path.join(self.path, "Histories")
+        if os.path.isdir(histories_path):
+            for dir_1 in os.listdir(histories_path):
+                for dir_2 in os.listdir(os.path.join(histories_path, dir_1)):
+                    on_disk[dir_1 + dir_2] = os.path.join(histories_path, dir_1, dir_2)
+        added: List[CatalogEntry] = []
+        for history_uuid, path in on_disk.items():
+            entry = known.get(history_uuid)
+            if entry is not None and entry.byte_size is not None:
+                continue
+            if archive_layout(path) is None:
+                continue
+            try:
+                info = json.loads(read_archive_indexes(path).get("info.json", "{}"))
+                records = (
+                    (
+                        type_name,
+                        json.loads(data) if isinstance(data, str)
+                        else decode_record(Class if type_name == "Class" else Student, data),
+                    )
+                    for _, type_name, _, data in iter_archive_records(path)
+                    if type_name in ("Class", "Student")
+                )
+                added.append(
+                    summarize_records(
+                        history_uuid, info.get("create_time") or 0.0, records
+                    )._replace(byte_size=archive_size(path))
+                )
+            except Exception:  # pylint: disable=broad-exception-caught
+                Base.log_exc_short(
+                    f"读取历史记录{history_uuid}失败，没有加进目录", "Chunk.sync_catalog", "W"
+                )
+        removed = [
+            history_uuid
+            for history_uuid, entry in known.items()
+            if history_uuid not in on_disk and (entry.byte_size is not None or drop_unsaved)
+        ]
+        if added or removed or not catalog.exists:
+            catalog.update(added, removed)
+        if added or removed:
+            Base.log(
+                "I",
+                f"历史记录目录已修正，补上了{len(added)}个，删掉了{len(removed)}个",
+                "Chunk.sync_catalog",
+            )
+        return len(added) + len(removed)
 
-        def _load_object(
-            uuid: Optional[ClassDataTypeUUID[_DT]],
-            data_type: ClassDataType,
-            history_uuid: ClassDataTypeUUID[History] = history_uuid,
-        ) -> _DT:
-            DataObject.loaded_objects += 1
-            _id = (history_uuid, data_type.chunk_type_name, uuid)
-            if uuid is None:
-                if "noticed_uuid_is_none" not in runtime_flags:
-                    Base.log("D", "加载时遇到uuid为None，将会直接返回None", "Chunk.load_history._load_object")
-                    runtime_flags["noticed_uuid_is_none"] = True
-                return None
+    @staticmethod
+    def detect_layout(path: str) -> StorageLayout:
+        """
+        判断一个用户存档的存储方式。
 
-            DataObject.load_tasks.append(_id)
+        先看根目录info.json里记的storage_layout，没有的话看Current文件夹，
+        都没有（新存档或者旧版本的存档）就是"sharded"
+
+        :param path: 用户存档的根目录
+        :return: 存储方式
+        """
+        try:
+            with open(os.path.join(path, "info.json"), "r", encoding="utf-8") as f:
+                layout = json.load(f).get("storage_layout")
+            if layout in ("sharded", "single"):
+                return layout
+        except (OSError, ValueError, AttributeError):
+            pass
+        return archive_layout(os.path.join(path, "Current")) or "sharded"
+
+    @staticmethod
+    def archive_exists(path: str) -> bool:
+        """
+        判断存档文件夹里是否有完整保存过的数据（有info.json索引）。
+
+        :param path: 存档文件夹
+        :return: 是否存在
+        """
+        if archive_layout(path) == "single":
             try:
-                # 尝试直接从缓存中获取
-                obj = DataObject.loaded_object_list[_id]
-                DataObject.load_tasks.remove(_id)
-                return obj
+                return "info.json" in read_archive_indexes(path)
+            except sqlite3.Error:
+                return False
+        return os.path.isfile(os.path.join(path, "info.json"))
 
-            except KeyError:
-                # 如果不存在的话就从数据库读取
-                try:
-                    # 从连接池获取连接
-                    conn = self.database_connections[
-                        (history_uuid, data_type.chunk_type_name)
-                    ]
-                except KeyError:
-                    # 如果没连接就直接开一个新的连接放连接池，不用反复开开关关的节约性能
-                    # （加载完记得relase_connections，清理内存）
-                    conn = sqlite3.connect(
-                        os.path.join(path, f"{data_type.chunk_type_name}.db"),
-                        check_same_thread=False,
-                    )
+    @staticmethod
+    def read_index(path: str, name: str) -> Any:
+        """
+        读取存档文件夹里的一个json索引，两种存储方式都可以。
 
-                    self.database_connections[
-                        (history_uuid, data_type.chunk_type_name)
-                    ] = conn
+        :param path: 存档文件夹
+        :param name: 索引名（原来的文件名，比如"classes.json"）
+        :return: 索引内容
+        :raise FileNotFoundError: 索引不存在
+        """
+        if archive_layout(path) == "single":
+            conn = connect_archive(path, readonly=True)
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = ?", (name,)).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                raise FileNotFoundError(f"索引{name}不存在")
+            return json.loads(row[0])
+        with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _dump_index(
+        self, data: Any, path: str, name: str, only_if_changed: bool = False, **kwargs
+    ) -> bool:
+        """
+        写入json索引，按照self.layout写到文件或者meta表里。
+
+        :param data: 内容
+        :param path: 存档文件夹
+        :param name: 索引名（原来的文件名）
+        :param only_if_changed: 内容和上次写入的一样并且索引还在的话就跳过
+        :param kwargs: 传给json.dumps的参数
+        :return: 是否真的写入了
+        """
+        content = json.dumps(data, **kwargs)
+        key = os.path.join(path, name)
+        if self.layout == "single":
+            conn = connect_archive(path)
+            try:
+                if (
+                    only_if_changed
+                    and self.written_indexes.get(key) == content
+                    and conn.execute("SELECT 1 FROM meta WHERE key = ?", (name,)).fetchone()
+                ):
+                    return False
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (name, content),
+                )
+            finally:
+                conn.close()
+        else:
+            if (
+                only_if_changed
+                and self.written_indexes.get(key) == content
+                and os.path.isfile(key)
+            ):
+                return False
+            with open(key, "w", encoding="utf-8") as f:
+                f.write(content)
+        self.written_indexes[key] = content
+        return True
+
+    def fetch_rows(
+        self,
+        history_uuid: Optional[ClassDataTypeUUID[History]],
+        path: str,
+        type_name: str,
+        uuids: List[str],
+    ) -> Dict[str, str]:
+        """
+        从存档文件夹里一次性查出一种数据类型里这些uuid的数据，两种存储方式都可以。
+
+        连接会放进连接池（database_connections），单文件存储的key是(历史记录uuid, "archive.db")，
+        共享对象库的key是(None, "blobs.db")，加载完记得relase_connections。
+        共享对象库的引用会换成真正的数据，找不到数据的当作查不到。
+        此周的数据如果在journal_rows里有，以日志里的为准
+
+        :param history_uuid: 历史记录uuid，None为此周
+        :param path: 存档文件夹
+        :param type_name: 数据类型名
+        :param uuids: uuid列表
+        :return: result[uuid] = 数据，查不到的uuid不会出现在里面
+        """
+        single = (history_uuid, ARCHIVE_FILE_NAME) in self.database_connections
+        if not single and (history_uuid, type_name) not in self.database_connections:
+            single = archive_layout(path) == "single"
+        key = (history_uuid, ARCHIVE_FILE_NAME if single else type_name)
+        try:
+            conn = self.database_connections[key]
+        except KeyError:
+            # 如果没连接就直接开一个新的连接放连接池，不用反复开开关关的节约性能
+            if single:
+                conn = connect_archive(path)
+            else:
+                conn = sqlite3.connect(
+                    os.path.join(path, f"{type_name}.db"), check_same_thread=False
+                )
+            self.database_connections[key] = conn
 
+        groups: Dict[str, List[str]] = {}
+        if single:
+            groups["objects"] = list(uuids)
+        else:
+            for uuid in uuids:
+                groups.setdefault(f"datas_{uuid[:1]}", []).append(uuid)
+        size = ReferenceResolver.max_query_params
+        result: Dict[str, str] = {}
+        for table, table_uuids in groups.items():
+            for i in range(0, len(table_uuids), size):
+                part = table_uuids[i:i + size]
+                # 同样长度的查询SQL文本是一样的，sqlite3会复用预编译好的语句
                 try:
-                    result = conn.execute(
-                        f"SELECT data FROM datas_{uuid[:1]} WHERE uuid = ?", (str(uuid),)
-                    ).fetchone()
+                    if single:
+                        rows = conn.execute(
+                            "SELECT uuid, data FROM objects "
+                            f"WHERE type = ? AND uuid IN ({', '.join('?' * len(part))})",
+                            (type_name, *part),
+                        ).fetchall()
+                    else:
+                        rows = conn.execute(
+                            f"SELECT uuid, data FROM {table} "
+                            f"WHERE uuid IN ({', '.join('?' * len(part))})",
+                            part,
+                        ).fetchall()
                 except sqlite3.Error:
+                    continue
+                result.update(rows)
+        refs = [data for data in result.values() if is_blob_ref(data)]
+        if refs:
+            key = (None, BLOB_STORE_FILE_NAME)
+            if key not in self.database_connections:
+                self.database_connections[key] = connect_blob_store(
+                    os.path.join(self.path, BLOB_STORE_FILE_NAME)
+                )
+            blobs = read_blobs(self.database_connections[key], refs)
+            for uuid, data in list(result.items()):
+                if is_blob_ref(data):
+                    if data in blobs:
+                        result[uuid] = blobs[data]
+                    else:
+                        del result[uuid]
+        if history_uuid is None and self.journal_rows:
+            for uuid in uuids:
+                row = self.journal_rows.get((type_name, uuid))
+                if row is not None:
+                    result[uuid] = row[1]
+        return result
 
-                    Base.log(
-                        "W",
-                        f"数据不存在，将会返回默认\n数据：{data_type.__qualname__}({uuid})",
-                        "Chunk.load_history",
-                    )
-                    DataObject.load_tasks.remove(_id)
-                    failures.append(_id)
-                    obj = data_type.new_dummy()
-                    obj.archive_uuid = _id[0]
-                    obj.uuid = _id[2]
-                    return obj
+    def get_object_rdata(
+        self,
+        history_uuid: Optional[ClassDataTypeUUID[History]],
+        uuid: ClassDataTypeUUID[_DT],
+        data_type: str,
+    ) -> StringObjectDataKind[_DT]:
+        """
+        获取对象数据。
 
-                if result is None:
-                    Base.log(
-                        "W",
-                        f"数据不存在，将会返回默认\n数据：{data_type.__qualname__}({uuid})",
-                        "Chunk.load_history",
-                    )
-                    DataObject.load_tasks.remove(_id)
-                    failures.append(_id)
-                    obj = data_type.new_dummy()
-                    obj.archive_uuid = _id[0]
-                    obj.uuid = _id[2]
-                    return obj
+        :param history_uuid: 历史记录uuid，None为此周（还未重置的存档
+        :param uuid: 对象uuid
+        :param data_type: 数据类型名
+        :return: 对象数据
+        :raise ValueError: 数据不存在
+        """
+        if history_uuid is None:
+            path = os.path.join(self.path, "Current")
+        else:
+            path = os.path.join(
+                self.path, "Histories", history_uuid[:2], history_uuid[2:]
+            )
+        result = self.fetch_rows(history_uuid, path, data_type, [str(uuid)])
+        if str(uuid) not in result:
+            raise ValueError("数据不存在")
+        return result[str(uuid)]
 
-                obj_shallow_loaded = data_type.new_dummy()
-                # 先浅层加载一下，防止触发无限递归
-                DataObject.loaded_object_list[_id] = obj_shallow_loaded
-                # 再深层处理，这样就不用担心了
-                DataObject.loaded_object_list[_id].inst_from_string(result[0])
-                obj = DataObject.loaded_object_list[_id]
-                DataObject.load_tasks.remove(_id)
-                return obj
+    def load_history(
+        self,
+        history_uuid: Optional[ClassDataTypeUUID[History]] = None,
+        request_uuid: Optional[ClassDataTypeUUID[Type[None]]] = None,
+        resolver: Literal["breadth_first", "depth_first"] = "breadth_first",
+        lazy: bool = False,
+        rows: Optional[Dict[str, Dict[str, str]]] = None,
+    ) -> History:
+        """
+        加载历史记录。
+
+        :param history_uuid: 历史记录uuid
+        :param request_uuid: 请求uuid，只是用来做数据加载的标识的
+        :param resolver: 引用的加载方式，"breadth_first"为逐层批量查询（ReferenceResolver），
+            "depth_first"为原来的一个uuid查一次然后递归
+        :param lazy: 是否懒加载，为True时只读info.json和索引，
+            班级和每日记录等到第一次访问History.classes/weekdays时才加载（对此周无效）
+        :param rows: 预先读好的数据（见read_archive_rows），只在breadth_first时有效
+        :return: 历史记录
+        :raise FileNotFoundError: 历史记录不存在
+        """
+        failures = []
+        start_time = time.time()
+        start_obj = DataObject.loaded_objects
 
-        ClassDataObj.LoadUUID = _load_object
         if history_uuid is None:
             path = os.path.join(self.path, "Current")
         else:
@@ -479,7 +1615,7 @@ class Chunk:
             )
         if not os.path.isdir(path):
             raise FileNotFoundError("历史记录不存在")
-        info = json.load(open(os.path.join(path, "info.json"), "r", encoding="utf-8"))
+        info = self.read_index(path, "info.json")
         if "python_version" in info:
             data_python_ver = info["python_version"]
             current_ver = [
@@ -516,35 +1652,46 @@ class Chunk:
                 "历史记录的Python版本信息缺失，可能存在兼容性问题",
                 "Chunk.load_history",
             )
-        class_uuids = json.load(
-            open(os.path.join(path, "classes.json"), "r", encoding="utf-8")
-        )
-        weekday_uuids: Dict[str, Dict[float, ClassDataTypeUUID[DayRecord]]] = json.load(
-            open(os.path.join(path, "weekdays.json"), "r", encoding="utf-8")
+        class_uuids = self.read_index(path, "classes.json")
+        weekday_uuids: Dict[str, Dict[float, ClassDataTypeUUID[DayRecord]]] = (
+            self.read_index(path, "weekdays.json")
         )
         index = 0
         for item in weekday_uuids:
             if len(item) <= 2:
                 weekday_uuids[index] = [DEFAULT_CLASS_KEY, *item]
             index += 1
+        if lazy and history_uuid is not None:
+            history = History(
+                {},
+                {},
+                info["create_time"],
+                loader=LazyHistoryLoader(
+                    self, history_uuid, path, class_uuids, weekday_uuids, resolver
+                ),
+            )
+            history.uuid = history_uuid
+            history.archive_uuid = history_uuid
+            Base.log("D", f"历史记录{history_uuid}的索引已读取，数据将在访问时加载", "Chunk.load_history")
+            return history
+
+        class_list, weekday_list = self.load_history_objects(
+            history_uuid, path, class_uuids, weekday_uuids, resolver, failures, rows
+        )
+
         classes = {}
-        for _, class_uuid in class_uuids:
-            _class: Class = ClassDataObj.LoadUUID(class_uuid, Class)
+        for _class in class_list:
             classes[_class.key] = _class
 
-        for target_class, item in weekday_uuids.items():
-            for time_key, weekday_uuid in item.items():
-                weekday: DayRecord = ClassDataObj.LoadUUID(weekday_uuid, DayRecord)
-                if target_class not in self.bound_db.weekday_record:
-                    self.bound_db.weekday_record[target_class] = {}
-                self.bound_db.weekday_record[target_class][weekday.utc] = weekday
+        for target_class, weekday in weekday_list:
+            if target_class not in self.bound_db.weekday_record:
+                self.bound_db.weekday_record[target_class] = {}
+            self.bound_db.weekday_record[target_class][weekday.utc] = weekday
 
         history = History(
             classes,
             self.bound_db.weekday_record,
-            json.load(open(os.path.join(path, "info.json"), "r", encoding="utf-8"))[
-                "create_time"
-            ],
+            info["create_time"],
         )
         history.uuid = history_uuid
         history.archive_uuid = history_uuid
@@ -553,69 +1700,343 @@ class Chunk:
         Base.log("I", f"历史记录{history_uuid}加载完成，总数据处理数：{total_obj}, 警告数量：{len(failures)}, 耗时：{total_time:.3f}s, 平均速度：{total_obj/max(total_time, 0.001):.3f}个/秒")
         return history
 
-    def del_history(self, history_uuid: str) -> bool:
+    def load_history_objects(
+        self,
+        history_uuid: Optional[ClassDataTypeUUID[History]],
+        path: str,
+        class_uuids: List[Tuple[str, str]],
+        weekday_uuids: Dict[str, Dict[float, str]],
+        resolver: Literal["breadth_first", "depth_first"] = "breadth_first",
+        failures: Optional[list] = None,
+        rows: Optional[Dict[str, Dict[str, str]]] = None,
+    ) -> Tuple[List[Class], List[Tuple[str, DayRecord]]]:
         """
-        删除历史记录
+        按照索引加载一个历史记录里面的班级和每日记录。
+
+        调用完以后ClassDataObj.LoadUUID会留在这个历史记录上
+
+        :param history_uuid: 历史记录uuid，None为此周
+        :param path: 历史记录所在的文件夹
+        :param class_uuids: classes.json的内容
+        :param weekday_uuids: weekdays.json的内容
+        :param resolver: 引用的加载方式，见load_history
+        :param failures: 加载失败的对象id会放到这里面
+        :param rows: 预先读好的数据（见read_archive_rows），只在breadth_first时有效
+        :return: (班级列表, [(班级key, 每日记录)])
         """
-        try:
-            shutil.rmtree(
-                os.path.join(self.path, "Histories", history_uuid[:2], history_uuid[2:])
+        failures = failures if failures is not None else []
+
+        def _load_object(
+            uuid: Optional[ClassDataTypeUUID[_DT]],
+            data_type: ClassDataType,
+            history_uuid: ClassDataTypeUUID[History] = history_uuid,
+        ) -> _DT:
+            DataObject.loaded_objects += 1
+            _id = (history_uuid, data_type.chunk_type_name, uuid)
+            if uuid is None:
+                if "noticed_uuid_is_none" not in runtime_flags:
+                    Base.log("D", "加载时遇到uuid为None，将会直接返回None", "Chunk.load_history._load_object")
+                    runtime_flags["noticed_uuid_is_none"] = True
+                return None
+
+            DataObject.load_tasks.append(_id)
+            try:
+                # 尝试直接从缓存中获取
+                obj = DataObject.loaded_object_list[_id]
+                DataObject.load_tasks.remove(_id)
+                return obj
+
+            except KeyError:
+                # 如果不存在的话就从数据库读取（连接放在连接池里，加载完记得relase_connections）
+                result = self.fetch_rows(
+                    history_uuid, path, data_type.chunk_type_name, [str(uuid)]
+                ).get(str(uuid))
+                if result is None:
+                    Base.log(
+                        "W",
+                        f"数据不存在，将会返回默认\n数据：{data_type.__qualname__}({uuid})",
+                        "Chunk.load_history",
+                    )
+                    DataObject.load_tasks.remove(_id)
+                    failures.append(_id)
+                    obj = data_type.new_dummy()
+                    obj.archive_uuid = _id[0]
+                    obj.uuid = _id[2]
+                    return obj
+
+                with uuid_registry.paused():
+                    obj = data_type.new_dummy()
+                    # 先浅层加载一下，防止触发无限递归
+                    DataObject.loaded_object_list[_id] = obj
+                    # 再深层处理，这样就不用担心了
+                    obj.inst_from_data(result)
+                DataObject.loaded_object_list.resize(_id, estimate_size(obj, result))
+                uuid_registry.register(obj, _id[0], replace=True)
+                DataObject.load_tasks.remove(_id)
+                return obj
+
+        if resolver == "breadth_first":
+            self.resolver = ReferenceResolver(self, history_uuid, path, failures, rows)
+            ClassDataObj.LoadUUID = self.resolver.load
+        else:
+            self.resolver = None
+            ClassDataObj.LoadUUID = _load_object
+        class_list: List[Class] = [
+            ClassDataObj.LoadUUID(class_uuid, Class) for _, class_uuid in class_uuids
+        ]
+        weekday_list: List[Tuple[str, DayRecord]] = [
+            (target_class, ClassDataObj.LoadUUID(weekday_uuid, DayRecord))
+            for target_class, item in weekday_uuids.items()
+            for weekday_uuid in item.values()
+        ]
+        self.resolve_pending()
+        return class_list, weekday_list
+
+    def load_histories(
+        self,
+        history_uuids: List[str],
+        request_uuid: Optional[ClassDataTypeUUID[Type[None]]] = None,
+        resolver: Literal["breadth_first", "depth_first"] = "breadth_first",
+        lazy: bool = False,
+        workers: Optional[int] = None,
+    ) -> Dict[float, History]:
+        """
+        加载多个历史记录。
+
+        完整加载（lazy=False, resolver="breadth_first"）并且历史记录够多的时候，
+        会用ProcessPoolExecutor让子进程各自读一个历史记录文件夹里的所有数据（read_archive_rows），
+        主进程只负责inst_from_data和对象之间的连接（对象图没法跨进程传）。
+
+        :param history_uuids: 历史记录uuid列表
+        :param request_uuid: 请求uuid，见load_history
+        :param resolver: 引用的加载方式，见load_history
+        :param lazy: 是否懒加载，见load_history
+        :param workers: 子进程数量，None则使用Chunk.history_load_workers
+        :return: 历史记录，histories[创建时间] = 历史记录，按时间排序
+        """
+        workers = self.history_load_workers if workers is None else workers
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(history_uuids))
+        futures: Dict[str, Future] = {}
+        pool: Optional[ProcessPoolExecutor] = None
+        if (
+            not lazy
+            and resolver == "breadth_first"
+            and workers > 1
+            and len(history_uuids) >= self.min_parallel_histories
+        ):
+            Base.log(
+                "I",
+                f"使用{workers}个进程读取{len(history_uuids)}个历史记录",
+                "Chunk.load_histories",
             )
-            return True
-        except Exception as unused:  # pylint: disable=broad-exception-caught
+            pool = ProcessPoolExecutor(max_workers=workers)
+            for history_uuid in history_uuids:
+                futures[history_uuid] = pool.submit(
+                    read_archive_rows,
+                    os.path.join(
+                        self.path, "Histories", history_uuid[:2], history_uuid[2:]
+                    ),
+                )
+
+        histories: Dict[float, History] = {}
+        try:
+            for history_uuid in history_uuids:
+                rows = None
+                if history_uuid in futures:
+                    try:
+                        rows = futures[history_uuid].result()
+                    except Exception as e:  # pylint: disable=broad-exception-caught
+                        # 子进程读不出来就让主进程自己查数据库，真不存在的话下面会报错
+                        Base.log_exc_short(
+                            f"子进程读取历史记录{history_uuid}失败，改为直接读取",
+                            "Chunk.load_histories",
+                            "W",
+                            exc=e,
+                        )
+                try:
+                    h = self.load_history(
+                        history_uuid, request_uuid, resolver, lazy=lazy, rows=rows
+                    )
+                    while h.time in histories:
+                        h.time += 0.001
+                    histories[h.time] = h
+                except FileNotFoundError as e:
+                    Base.log_exc(
+                        f"历史记录{history_uuid}加载失败，将跳过", "Chunk.load_histories", "E", e
+                    )
+        finally:
+            if pool is not None:
+                for future in futures.values():
+                    future.cancel()
+                pool.shutdown()
+        return dict(sorted(histories.items(), key=lambda i: i[0]))
+
+    def resolve_pending(self) -> None:
+        """
+        把最近一次load_history之后通过ClassDataObj.LoadUUID登记的对象全部加载完。
+
+        深度优先加载的时候LoadUUID本来就是立即加载的，这里什么都不做
+        """
+        if self.resolver is not None:
+            self.resolver.resolve()
+
+    def del_history(self, history_uuid: str, collect: bool = True) -> bool:
+        """
+        删除历史记录，之后清理共享对象库里没有被其他存档引用的数据（见collect_blobs）
+
+        历史记录目录里有但是存档不在的（还没保存，或者存档被删掉了），只删目录里的行。
+
+        :param history_uuid: 历史记录uuid（目录里的格式，见catalog_key）
+        :param collect: 是否马上清理共享对象库，一次删很多个的时候可以全部删完再调用collect_blobs
+        :return: 是否删除成功
+        """
+        path = os.path.join(self.path, "Histories", history_uuid[:2], history_uuid[2:])
+        try:
+            with Chunk.save_task_mutex:
+                on_disk = os.path.isdir(path)
+                if on_disk:
+                    shutil.rmtree(path)
+                elif self.catalog.get(history_uuid) is None:
+                    Base.log("W", f"要删除的历史记录{history_uuid}不存在", "Chunk.del_history")
+                    return False
+                try:
+                    self.catalog.update(removed=[history_uuid])
+                except sqlite3.Error:
+                    if not on_disk:
+                        raise
+                    # 下次加载的时候sync_catalog会把它删掉
+                    Base.log_exc_short("从历史记录目录里删除失败", "Chunk.del_history", "W")
+        except Exception:  # pylint: disable=broad-exception-caught
+            Base.log_exc_short(f"删除历史记录{history_uuid}失败", "Chunk.del_history", "W")
             return False
+        uuid_registry.release_archive(history_uuid)
+        if collect:
+            self.collect_blobs()
+        return True
 
-    def load_data(self, load_all: bool = False) -> UserDataBase:
+    def collect_blobs(self) -> int:
+        """
+        标记-清除共享对象库：扫一遍所有存档文件夹里的引用，删掉没有被引用的数据。
+
+        和保存用同一个锁，不会把正在保存的历史记录的数据删掉；
+        扫描的时候出了任何错误（比如读不了某个存档）就整个放弃，宁可多留也不误删。
+
+        :return: 删除的数据数量
+        """
+        file = os.path.join(self.path, BLOB_STORE_FILE_NAME)
+        if not os.path.isfile(file):
+            return 0
+        with Chunk.save_task_mutex:
+            t = time.time()
+            # 连接池里可能还有删掉的历史记录的连接
+            self.relase_connections()
+            paths = [os.path.join(self.path, "Current")]
+            histories_path = os.path.join(self.path, "Histories")
+            if os.path.isdir(histories_path):
+                for dir_1 in os.listdir(histories_path):
+                    for dir_2 in os.listdir(os.path.join(histories_path, dir_1)):
+                        paths.append(os.path.join(histories_path, dir_1, dir_2))
+            try:
+                live: Set[bytes] = set()
+                for path in paths:
+                    if archive_layout(path) is None:
+                        continue
+                    for _, _, _, data in iter_archive_records(path, False):
+                        if is_blob_ref(data):
+                            live.add(data)
+            except Exception:  # pylint: disable=broad-exception-caught
+                Base.log_exc("扫描存档时出现错误，放弃清理共享对象库", "Chunk.collect_blobs", "W")
+                return 0
+            conn = connect_blob_store(file)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("CREATE TEMP TABLE live (hash blob primary key)")
+                conn.executemany("INSERT INTO live (hash) VALUES (?)", ((ref,) for ref in live))
+                removed = conn.execute(
+                    "DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM live)"
+                ).rowcount
+                conn.execute("DROP TABLE live")
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                Base.log_exc("清理共享对象库失败", "Chunk.collect_blobs", "W")
+                return 0
+            finally:
+                conn.close()
+            Base.log(
+                "I",
+                f"共享对象库清理完成，{len(live)}个数据还在使用，删除了{removed}个，"
+                f"耗时{time.time() - t:.3f}s",
+                "Chunk.collect_blobs",
+            )
+            return removed
+
+    def load_data(
+        self,
+        load_all: bool = False,
+        resolver: Literal["breadth_first", "depth_first"] = "breadth_first",
+        lazy_histories: bool = True,
+        workers: Optional[int] = None,
+    ) -> UserDataBase:
         """
         加载数据。
 
         :return: 对象数据
         :param load_all: 是否加载所有数据
+        :param resolver: 引用的加载方式，见load_history
+        :param lazy_histories: 历史记录是否懒加载（只读索引，访问的时候再加载）
+        :param workers: 完整加载历史记录时的子进程数量，见load_histories
         """
         req_uuid = uuid.uuid4()
-        current_record = self.load_history(None, req_uuid)
+        self.migrate_schema()
+        # 上次保存之后的分数事件还在日志里，盖在数据库上面一起加载，加载完再在后台写回数据库
+        journal_rows, journal_offset, journal_records = self.journal.replay()
+        journal_generation = self.journal.generation
+        self.journal_rows = journal_rows
+        if journal_records:
+            Base.log(
+                "I",
+                f"从分数事件日志重放了{journal_records}条记录，涉及{len(journal_rows)}个对象",
+                "Chunk.load_data",
+            )
+        current_record = self.load_history(None, req_uuid, resolver)
+        try:
+            self.sync_catalog(drop_unsaved=True)
+        except sqlite3.Error:
+            Base.log_exc_short("修正历史记录目录失败", "Chunk.load_data", "W")
 
         templates = []
         achievements = []
         current_day_attendance = {}
 
         # 有个细节，这里的LoadUUID是刚刚加载完这周的，所以不用填默认参数
-        template_uuids = json.load(
-            open(
-                os.path.join(self.path, "Current", "templates.json"),
-                "r",
-                encoding="utf-8",
-            )
-        )
+        current_path = os.path.join(self.path, "Current")
+        template_uuids = self.read_index(current_path, "templates.json")
 
         for _, template_uuid in template_uuids:
             templates.append(
                 ClassDataObj.LoadUUID(template_uuid, ScoreModificationTemplate)
             )
 
-        achievement_uuids = json.load(
-            open(
-                os.path.join(self.path, "Current", "achievements.json"),
-                "r",
-                encoding="utf-8",
-            )
-        )
+        achievement_uuids = self.read_index(current_path, "achievements.json")
         for _, achievement_uuid in achievement_uuids:
             achievements.append(
                 ClassDataObj.LoadUUID(achievement_uuid, AchievementTemplate)
             )
 
-        current_day_attendance_uuids = json.load(
-            open(
-                os.path.join(self.path, "Current", "current_day_attendance.json"),
-                "r",
-                encoding="utf-8",
-            )
+        current_day_attendance_uuids = self.read_index(
+            current_path, "current_day_attendance.json"
         )
         for target_class, history_uuid in current_day_attendance_uuids:
             current_day_attendance[target_class] = ClassDataObj.LoadUUID(
                 history_uuid, AttendanceInfo
             )
+        self.resolve_pending()
 
         info = json.load(
             open(os.path.join(self.path, "info.json"), "r", encoding="utf-8")
@@ -628,19 +2049,17 @@ class Chunk:
         self.bound_db.last_start_time = info["last_start_time"]
         histories = {}
         if load_all:
-            for history_uuid in info["histories"]:
-                try:
-                    h = self.load_history(history_uuid, req_uuid)
-                    while h.time in histories:
-                        h.time += 0.001
-                    histories[h.time] = h
-                except FileNotFoundError as e:
-                    Base.log_exc(
-                        f"历史记录{history_uuid}加载失败，将跳过", "Chunk.load_data", "E", e
-                    )
-            h2 = sorted(histories.items(), key=lambda i: i[0])
-            histories = dict(h2)
-        return UserDataBase(
+            histories = self.load_histories(
+                info["histories"], req_uuid, resolver, lazy=lazy_histories, workers=workers
+            )
+        if journal_rows:
+            Thread(
+                target=self.compact_journal,
+                args=(journal_rows, journal_offset, journal_generation),
+                name="JournalCompaction",
+                daemon=True,
+            ).start()
+        database = UserDataBase(
             info["user"],
             info["save_time"],
             info["version"],
@@ -654,6 +2073,127 @@ class Chunk:
             current_record.weekdays,
             current_day_attendance
         )
+        database.schema_version = info.get(SCHEMA_VERSION_KEY, 0)
+        return database
+
+    def compact_journal(self, rows: JournalRows, offset: int, generation: int) -> int:
+        """
+        把重放出来的日志数据写回此周的数据库，然后丢掉offset之前的日志。
+
+        load_data重放了日志之后会在后台线程里调用这个，写的是序列化好的数据，不用构建对象。
+        如果在这之前已经保存过了（日志被丢掉过），数据库里的已经比重放结果新，直接跳过。
+
+        :param rows: 重放结果
+        :param offset: 重放到的位置
+        :param generation: 重放时日志的generation
+        :return: 写入的对象数量
+        """
+        with Chunk.save_task_mutex:
+            if self.journal.generation != generation:
+                Base.log("I", "重放之后已经保存过，跳过日志压缩", "Chunk.compact_journal")
+                self.journal_rows = {}
+                return 0
+            try:
+                t = time.time()
+                current_path = os.path.join(self.path, "Current")
+                count = DataObject.save_rows(
+                    (
+                        (uuid, type_name, class_name, data)
+                        for (type_name, uuid), (class_name, data) in rows.items()
+                    ),
+                    current_path,
+                    layout=archive_layout(current_path) or self.layout,
+                )
+                self.journal.discard_until(offset)
+                if self.journal_rows is rows:
+                    self.journal_rows = {}
+                Base.log(
+                    "I",
+                    f"分数事件日志压缩完成，写回了{count}个对象，耗时{time.time() - t:.3f}s",
+                    "Chunk.compact_journal",
+                )
+                return count
+            except Exception:  # pylint: disable=broad-exception-caught
+                # 日志还在，下次加载的时候再试
+                Base.log_exc("压缩分数事件日志失败", "Chunk.compact_journal", "W")
+                return 0
+
+    def migrate_layout(self, target: StorageLayout) -> int:
+        """
+        把整个用户存档（此周和所有历史记录）转换成另一种存储方式（见convert_archive），
+        可以再用原来的存储方式调用一次转换回去。
+
+        :param target: 目标存储方式
+        :return: 转换了的存档文件夹数量
+        """
+        with Chunk.save_task_mutex, self.journal.lock:
+            # 连接池里的连接还指着旧的文件
+            self.relase_connections()
+            t = time.time()
+            count = 0
+            for path in self.archive_paths():
+                if convert_archive(path, target):
+                    count += 1
+            self.layout = target
+            self.written_indexes.clear()
+            # 下次保存的时候完整写一遍
+            self.synced = False
+            info_file = os.path.join(self.path, "info.json")
+            if os.path.isfile(info_file):
+                with open(info_file, "r", encoding="utf-8") as f:
+                    info = json.load(f)
+                info["storage_layout"] = target
+                with open(info_file, "w", encoding="utf-8") as f:
+                    json.dump(info, f, indent=4)
+            Base.log(
+                "I",
+                f"存储方式已转换为{target}，共{count}个存档文件夹，耗时{time.time() - t:.3f}s",
+                "Chunk.migrate_layout",
+            )
+            return count
+
+    def archive_paths(self) -> List[str]:
+        "此周和所有历史记录的存档文件夹"
+        paths = [os.path.join(self.path, "Current")]
+        histories_path = os.path.join(self.path, "Histories")
+        if os.path.isdir(histories_path):
+            for dir_1 in os.listdir(histories_path):
+                for dir_2 in os.listdir(os.path.join(histories_path, dir_1)):
+                    paths.append(os.path.join(histories_path, dir_1, dir_2))
+        return paths
+
+    def migrate_schema(self) -> int:
+        """
+        存档结构版本比最新的旧的话，对此周和所有历史记录跑一遍还没跑过的迁移（见migrations），
+        都写完之后再更新info.json里的版本号，中途出错的话下次加载重新跑（迁移都是幂等的）。
+
+        版本已经是最新的时候只读一下info.json。
+
+        :return: 改动了的行数
+        """
+        version = read_schema_version(self.path)
+        if version is None:
+            return 0
+        migrations = pending_migrations(version)
+        if not migrations:
+            return 0
+        with Chunk.save_task_mutex:
+            # 连接池里的连接可能还缓存着旧的数据
+            self.relase_connections()
+            t = time.time()
+            count = 0
+            for path in self.archive_paths():
+                if archive_layout(path) is not None:
+                    count += migrate_archive_rows(path, migrations)
+            write_schema_version(self.path, migrations[-1].version)
+            Base.log(
+                "I",
+                f"存档结构从版本{version}迁移到了{migrations[-1].version}"
+                f"（{'，'.join(m.name for m in migrations)}），"
+                f"改动了{count}行，耗时{time.time() - t:.3f}s",
+                "Chunk.migrate_schema",
+            )
+            return count
 
     @staticmethod
     def relase_connections(clear_dataobj_connections: bool = True) -> None:
@@ -671,419 +2211,547 @@ class Chunk:
         save_only_if_not_exist: bool = True,
         clear_current: bool = False,
         clear_histories: bool = False,
+        full: bool = False,
     ) -> None:
         """
-        保存数据。
+        保存数据，等于take_snapshot之后马上write_snapshot。
+
+        调用过track_changes并且完整保存成功过一次之后，
+        当前周只会写有修改的对象（见tracked_types）和内容变了的json索引。
+        保存成功之后，开始保存之前写进分数事件日志的记录会被丢掉（已经在存档里了）。
 
         :param save_history: 是否保存历史记录
         :param save_only_if_not_exist: 是否只保存不存在的数据
         :param clear_current: 是否清理当前数据
         :param clear_histories: 是否清理历史数据
+        :param full: 是否强制完整保存所有对象（用于恢复数据之类的场合）
+        """
+        self.write_snapshot(
+            self.take_snapshot(
+                save_history, save_only_if_not_exist, clear_current, clear_histories, full
+            )
+        )
+
+    def take_snapshot(
+        self,
+        save_history: bool = True,
+        save_only_if_not_exist: bool = True,
+        clear_current: bool = False,
+        clear_histories: bool = False,
+        full: bool = False,
+    ) -> "SaveSnapshot":
+        """
+        保存的第一阶段：拿着ClassDataType.state_lock把要写的对象全部转成to_dict的结果。
+
+        快照里只有普通的数据，拍完之后对象再怎么改都不会影响这次保存；
+        增量保存的时候只有被标记修改的对象，拿锁的时间一般只有几毫秒。
+        参数见save_data。
+
+        :return: 快照，交给write_snapshot写入（可以在别的线程里）
+        """
+        t = time.time()
+        # 看哪些历史记录要保存要读文件系统，放在锁外面
+        history_tasks: List[Tuple[ClassDataTypeUUID[History], History]] = []
+        if save_history:
+            for v in list(self.bound_db.history_data.values()):
+                if not (
+                    save_only_if_not_exist
+                    and not clear_histories
+                    and self.archive_exists(
+                        os.path.join(self.path, "Histories", v.uuid[:2], v.uuid[2:])
+                    )
+                ):
+                    history_tasks.append((v.uuid, v))
+        with ClassDataType.state_lock:
+            lock_time = time.time()
+            incremental = (
+                self.tracking
+                and self.synced
+                and not full
+                and not clear_current
+                and not clear_histories
+                and archive_layout(os.path.join(self.path, "Current")) == self.layout
+                and self.archive_exists(os.path.join(self.path, "Current"))
+            )
+            # 先把修改集合换掉再收集对象，之后新标记的修改会留到下一次
+            dirty_objects, self.dirty_objects = self.dirty_objects, set()
+            snapshot = SaveSnapshot(
+                self.taken_snapshots, incremental, clear_histories, self.journal.tell(), dirty_objects
+            )
+            # 模板之类的对象在每个存档里都有，同一个对象只转换一次
+            records: Dict[int, SnapshotRecord] = {}
+            try:
+                history = History(self.bound_db.classes, self.bound_db.weekday_record)
+                snapshot.parts.append(
+                    self._snapshot_part(None, history, clear_current, incremental, records)
+                )
+                for history_uuid, v in history_tasks:
+                    snapshot.parts.append(
+                        self._snapshot_part(
+                            history_uuid, v, clear_histories, False, records
+                        )
+                    )
+            except Exception as e:
+                if self.tracking:
+                    # 有些对象的标记已经清掉了，下次完整保存
+                    self.synced = False
+                    self.dirty_objects.update(dirty_objects)
+                raise e
+            self.taken_snapshots += 1
+            snapshot.info = {
+                "uuid": (
+                    str(snapshot.parts[-1].uuid) if snapshot.parts[-1].uuid else None
+                ),
+                "user": self.bound_db.user,
+                "create_time": time.time(),
+                "save_time": self.bound_db.save_time,
+                "version": self.bound_db.version,
+                "version_code": self.bound_db.version_code,
+                "last_start_time": self.bound_db.last_start_time,
+                "last_reset": self.bound_db.last_reset,
+                "histories": [],  # 写入的时候按照文件夹重新列一遍
+                "storage_layout": self.layout,
+                "python_version": (
+                    sys.version_info.major,
+                    sys.version_info.minor,
+                    sys.version_info.micro,
+                ),
+            }
+            snapshot.lock_time = time.time() - lock_time
+        Base.log(
+            "I",
+            f"保存快照完成（{'增量' if incremental else '完整'}保存，"
+            f"{len(dirty_objects)}个对象有修改标记，共{len(records)}个对象），"
+            f"耗时{time.time() - t:.3f}s，其中持有锁{snapshot.lock_time * 1000:.1f}ms",
+            "Chunk.take_snapshot",
+        )
+        return snapshot
+
+    def _snapshot_part(
+        self,
+        uuid: Optional[ClassDataTypeUUID[History]],
+        current_history: History,
+        clear: bool,
+        only_dirty: bool,
+        records: Dict[int, "SnapshotRecord"],
+    ) -> "SnapshotPart":
+        """
+        给一个存档文件夹拍快照，要拿着ClassDataType.state_lock调用。
+
+        :param uuid: 历史记录的UUID，None则为当前周
+        :param current_history: 历史记录
+        :param clear: 是否清理存档文件夹
+        :param only_dirty: 是否只要有修改标记的对象
+        :param records: 已经转换过的对象，records[id(对象)] = 记录
+        :return: 快照的一部分
         """
+        t = time.time()
+        if uuid:
+            path = os.path.join(self.path, "Histories", uuid[:2], uuid[2:])
+        else:
+            path = os.path.join(self.path, "Current")
+        part = SnapshotPart(uuid, path, clear, only_dirty)
+        modify_templates: List[ScoreModificationTemplate] = list(
+            self.bound_db.templates.values()
+        )
+        day_records: List[DayRecord] = []
+        achivement_templates: List[AchievementTemplate] = list(
+            self.bound_db.achievements.values()
+        )
+
+        for c, records_of_class in current_history.weekdays.items():
+            for r in records_of_class.values():
+                day_records.append(r)
+
+        students: List[Student] = []
+        modifies: List[ScoreModification] = []
+        achievements: List[Achievement] = []
+        groups: List[Group] = []
+        classes: List[Class] = []
+
+        for _class in current_history.classes.values():
+            for homework_rule in _class.homework_rules:
+                for template in homework_rule.rule_mapping.values():
+                    modify_templates.append(template)
+            classes.append(_class)
+            for student in _class.students.values():
+                students.append(student)
+                modifies.extend(student.history.values())
+                achievements.extend(student.achievements.values())
+                if student.has_last_reset_info and student.last_reset_archive is None:
+                    # 老存档里上次重置信息和学生存在同一个存档里，照老样子一起存；
+                    # 重置时冻结的版本本来就在它的历史记录里，只存指针（见Student.to_dict）
+                    parent = student.last_reset_info
+                    students.append(parent)
+                    modifies.extend(parent.history.values())
+                    achievements.extend(parent.achievements.values())
+
+            groups.extend(_class.groups.values())
+        if uuid is not None:
+            part.catalog_entry = summarize_history(
+                uuid, current_history.time, current_history.classes
+            )
+        save_groups: List[Tuple[str, List[ClassDataType]]] = [
+            ("班级信息", classes),
+            ("学生信息", students),
+            ("小组信息", groups),
+            ("分数修改记录", modifies),
+            ("成就记录", achievements),
+            ("分数修改模板", modify_templates),
+            ("成就模板", achivement_templates),
+            ("每日记录", day_records),
+            ("当前出勤", list(self.bound_db.current_day_attendance.values())),
+        ]
+        part.total_objects = sum(len(objects) for _, objects in save_groups)
+        # 按类型缓存是不是tracked_types，数据类型都有ABCMeta，逐个isinstance在锁里太慢
+        tracked: Dict[type, bool] = {}
+        for name, objects in save_groups:
+            if only_dirty:
+                kept = []
+                for o in objects:
+                    is_tracked = tracked.get(type(o))
+                    if is_tracked is None:
+                        is_tracked = tracked[type(o)] = isinstance(o, self.tracked_types)
+                    if o.is_dirty or not is_tracked:
+                        kept.append(o)
+                objects = kept
+            if self.tracking and uuid is None:
+                # 转换之前清掉标记，保存失败的话write_snapshot会把它们放回去
+                for o in objects:
+                    o.mark_clean()
+            rows: List[SnapshotRecord] = []
+            for o in objects:
+                record = records.get(id(o))
+                if record is None:
+                    record = records[id(o)] = [
+                        str(o.uuid), o.chunk_type_name, o.__class__.__qualname__, type(o), o.to_dict()
+                    ]
+                rows.append(record)
+            part.groups.append((name, rows))
+
+        part.indexes = [
+            (
+                "info.json",
+                {
+                    "uuid": str(uuid) if uuid else None,
+                    "create_time": current_history.time,
+                    "save_time": self.bound_db.save_time,
+                    "version": self.bound_db.version,
+                    "version_code": self.bound_db.version_code,
+                    "last_start_time": self.bound_db.last_start_time,
+                    "last_reset": self.bound_db.last_reset,
+                    "user": self.bound_db.user,
+                    "total_objects": part.total_objects,  # 这个可以在后面用来做加载进度条
+                    "python_version": (
+                        sys.version_info.major,
+                        sys.version_info.minor,
+                        sys.version_info.micro,
+                    ),
+                },
+                False,
+                {"indent": 4},
+            ),
+            (
+                "classes.json",
+                [(c.key, str(c.uuid)) for c in current_history.classes.values()],
+                only_dirty,
+                {"indent": 4},
+            ),
+            (
+                "weekdays.json",
+                {
+                    _class: {k: str(v.uuid) for k, v in item.items()}
+                    for _class, item in current_history.weekdays.items()
+                },
+                only_dirty,
+                {"indent": 4},
+            ),
+            (
+                "current_day_attendance.json",
+                [
+                    (a.target_class, str(a.uuid))
+                    for a in self.bound_db.current_day_attendance.values()
+                ],
+                only_dirty,
+                {},
+            ),
+            (
+                "templates.json",
+                [(t.key, str(t.uuid)) for t in self.bound_db.templates.values()],
+                only_dirty,
+                {"indent": 4},
+            ),
+            (
+                "achievements.json",
+                [(a.key, str(a.uuid)) for a in self.bound_db.achievements.values()],
+                only_dirty,
+                {"indent": 4},
+            ),
+        ]
+        Base.log(
+            "D",
+            f"历史记录中的{uuid}的数据汇总完成，耗时{time.time() - t: .5f}秒",
+            "Chunk.take_snapshot",
+        )
+        return part
+
+    def write_snapshot(self, snapshot: "SaveSnapshot") -> None:
+        """
+        保存的第二阶段：把快照编码之后写进数据库，不碰活的对象，可以放在工作线程里。
+
+        失败的话快照里的修改标记会放回去，下一次保存完整写一遍。
+        比它先拍的快照还没写完的话会等它们写完，所以拍了的快照都要写入。
+
+        :param snapshot: take_snapshot拍的快照
+        :raise Exception: 写入失败
+        """
+        with self.snapshot_order:
+            self.snapshot_order.wait_for(lambda: self.written_snapshots >= snapshot.seq)
+        try:
+            self._write_snapshot(snapshot)
+        finally:
+            with self.snapshot_order:
+                self.written_snapshots = max(self.written_snapshots, snapshot.seq + 1)
+                self.snapshot_order.notify_all()
+
+    def _write_snapshot(self, snapshot: "SaveSnapshot") -> None:
+        "写入快照，见write_snapshot"
         with Chunk.save_task_mutex:
             Chunk.loading_info["total_percentage"] = 0.0
+            journal_offset = snapshot.journal_offset
 
             try:
                 if self.is_saving:
                     Base.log("W", "当前分块正在处理数据", "Chunk.save")
                 self.is_saving = True
-                Base.log("I", "开始保存数据", "Chunk.save")
-                if clear_histories:
-                    shutil.rmtree(self.path, ignore_errors=True)
+                Base.log(
+                    "I",
+                    f"开始保存数据（{'增量' if snapshot.incremental else '完整'}保存，"
+                    f"{len(snapshot.dirty_objects)}个对象有修改标记）",
+                    "Chunk.save",
+                )
+                if snapshot.clear_histories:
+                    with self.journal.lock:
+                        # 日志文件跟着一起删掉，先当作全部丢掉，之后的位置才接得上
+                        try:
+                            self.journal.discard_until(self.journal.tell())
+                        except OSError:
+                            Base.log_exc_short("清理分数事件日志失败", "Chunk.save", "W")
+                        shutil.rmtree(self.path, ignore_errors=True)
+                    journal_offset = 0
                 os.makedirs(self.path, exist_ok=True)
                 os.makedirs(os.path.join(self.path, "Histories"), exist_ok=True)
-                history = History(self.bound_db.classes, self.bound_db.weekday_record)
-                save_tasks: List[Tuple[str, History, bool]] = [
-                    (None, history, clear_current)
-                ]
-                if save_history:
-                    for v in self.bound_db.history_data.values():
-                        if save_only_if_not_exist:
-                            if not os.path.isfile(
-                                os.path.join(
-                                    self.path,
-                                    "Histories",
-                                    v.uuid[:2],
-                                    v.uuid[2:],
-                                    "info.json",
-                                )
-                            ):
-                                os.makedirs(
-                                    os.path.join(
-                                        self.path, "Histories", v.uuid[:2], v.uuid[2:]
-                                    ),
-                                    exist_ok=True,
-                                )
-                                save_tasks.append((v.uuid, v, clear_histories))
-                        else:
-                            os.makedirs(
-                                os.path.join(
-                                    self.path, "Histories", v.uuid[:2], v.uuid[2:]
-                                ),
-                                exist_ok=True,
-                            )
-                            save_tasks.append((v.uuid, v, clear_histories))
-                i = 0
-                total_history_count = len(save_tasks)
+                total_history_count = len(snapshot.parts)
                 history_percentage = 100 / total_history_count
 
-                def save_part(
-                    uuid: Optional[ClassDataTypeUUID], current_history: History, clear: bool, index: int
-                ) -> None:
+                def save_part(part: SnapshotPart, index: int) -> None:
                     """
-                    保存历史记录的一部分。
+                    写入快照里的一个存档文件夹。
 
-                    :param uuid: 历史记录的UUID，None则为当前周
-                    :param current_history: 历史记录
-                    :param clear: 是否清理历史记录
+                    :param part: 快照的一部分
                     :param index: 当前保存的历史记录索引
                     """
                     Chunk.loading_info["history_stage"] = f"保存历史记录（{index}/{total_history_count}）"
-                    if uuid:
-                        path = os.path.join(self.path, "Histories", uuid[:2], uuid[2:])
-                    else:
-                        path = os.path.join(self.path, "Current")
+                    uuid, path, clear = part.uuid, part.path, part.clear
+                    if archive_layout(path) not in (None, self.layout):
+                        # 存储方式换了，旧的数据在下面会完整重写一遍
+                        Base.log(
+                            "I",
+                            f"{uuid}的存储方式不是{self.layout}，将会清空后重新保存",
+                            "Chunk.save",
+                        )
+                        clear = True
                     if clear:
-                        shutil.rmtree(path, ignore_errors=True)
+                        if uuid is None and os.path.isdir(path):
+                            # 日志里还有这次保存之后的事件，不能跟着删
+                            with self.journal.lock:
+                                for file in os.listdir(path):
+                                    if file == JOURNAL_FILE_NAME:
+                                        continue
+                                    file = os.path.join(path, file)
+                                    if os.path.isdir(file):
+                                        shutil.rmtree(file, ignore_errors=True)
+                                    else:
+                                        os.remove(file)
+                        else:
+                            shutil.rmtree(path, ignore_errors=True)
                     os.makedirs(path, exist_ok=True)
                     total_saved_objects = 0
-                    t = time.time()
-                    modify_templates: List[ScoreModificationTemplate] = list(
-                        self.bound_db.templates.values()
-                    )
-                    day_records: List[DayRecord] = []
-                    achivement_templates: List[AchievementTemplate] = list(
-                        self.bound_db.achievements.values()
+                    object_percentage = history_percentage / max(
+                        sum(len(rows) for _, rows in part.groups), 1
                     )
-
-                    for c, records in current_history.weekdays.items():
-                        for r in records.values():
-                            day_records.append(r)
-                        
-                    students: List[Student] = []
-                    modifies: List[ScoreModification] = []
-                    achievements: List[Achievement] = []
-                    groups: List[Group] = []
-                    classes: List[Class] = []
-
-                    for _class in current_history.classes.values():
-                        for homework_rule in _class.homework_rules:
-                            for template in homework_rule.rule_mapping.values():
-                                modify_templates.append(template)
-                        classes.append(_class)
-                        for student in _class.students.values():
-                            students.append(student)
-                            s = student
-                            for _ in range(
-                                Student.last_reset_info_keep_turns
-                            ):  # 保留最近几次的重置信息
-                                # TODO: 把这个废性能的方法改一下，last_reset_info改成动态查询
-                                if s._last_reset_info:
-                                    students.append(student.last_reset_info)
-                                    modifies.extend(
-                                        student.last_reset_info.history.values()
-                                    )
-                                    achievements.extend(
-                                        student.last_reset_info.achievements.values()
-                                    )
-                                    s = s.last_reset_info
-                            modifies.extend(student.history.values())
-                            achievements.extend(student.achievements.values())
-                            i = 0
-                            while student.last_reset_info:
-                                students.append(student.last_reset_info)
-                                modifies.extend(student.last_reset_info.history.values())
-                                achievements.extend(
-                                    student.last_reset_info.achievements.values()
+                    for name, rows in part.groups:
+                        t = time.time()
+                        saved = [0]
+                        Chunk.loading_info["current_saving_obj_name"] = name
+                        Chunk.loading_info["current_saving_obj_total"] = max(len(rows), 1)
+                        Chunk.loading_info["current_saving_obj_current"] = 0
+
+                        def on_progress(count: int, saved: List[int] = saved) -> None:
+                            saved[0] += count
+                            Chunk.loading_info["current_saving_obj_current"] = saved[0]
+                            Chunk.loading_info["total_percentage"] += object_percentage * count
+
+                        total_saved_objects += DataObject.save_rows(
+                            (
+                                (
+                                    obj_uuid,
+                                    type_name,
+                                    class_name,
+                                    (
+                                        encode_record(dtype, data)
+                                        if self.codec == "binary"
+                                        else json.dumps(data)
+                                    ),
                                 )
-                                i += 1
-                                student.last_reset_info = None
-                                if i > Student.last_reset_info_keep_turns:
-                                    break
-
-                        groups.extend(_class.groups.values())
-                    Base.log(
-                        "D",
-                        f"历史记录中的{uuid}的数据汇总完成，耗时{time.time() - t: .5f}秒",
-                        "Chunk.save",
-                    )
-                    total_objects = len(classes) + len(students) + len(groups) + len(modifies) + len(achievements) \
-                                    + len(modify_templates) + len(day_records) + len(achivement_templates) \
-                                    + len(self.bound_db.current_day_attendance)
-                    object_percentage = history_percentage / total_objects
-                    t = time.time()
-                    c = 0
-                    total = max(len(classes), 1)
-                    Chunk.loading_info["current_saving_obj_name"] = "班级信息"
-                    Chunk.loading_info["current_saving_obj_total"] = total
-                    for _class in classes:
-                        Chunk.loading_info["current_saving_obj_current"] = c
-                        Chunk.loading_info["total_percentage"] += object_percentage
-                        DataObject(_class, self).save(path)
-                        c += 1
-                        total_saved_objects += 1
-                    c = max(1, c)
-                    Base.log(
-                        "D",
-                        f"历史记录中的{uuid}的班级保存完成，"
-                        f"耗时{time.time() - t: .5f}秒，共{c}个，"
-                        f"速率{c / (time.time() - t if (time.time() - t) > 0 else 1): .3f}个/秒",
-                        "Chunk.save",
-                    )
-                    t = time.time()
-                    c = 0
-                    total = max(len(students), 1)
-                    Chunk.loading_info["current_saving_obj_name"] = "学生信息"
-                    Chunk.loading_info["current_saving_obj_total"] = total
-                    for student in students:
-                        Chunk.loading_info["current_saving_obj_current"] = c
-                        Chunk.loading_info["total_percentage"] += object_percentage
-                        DataObject(student, self).save(path)
-                        c += 1
-                        total_saved_objects += 1
-                    c = max(1, c)
-                    Base.log(
-                        "D",
-                        f"历史记录中的{uuid}的学生保存完成，"
-                        f"耗时{time.time() - t: .5f}秒，共{c}个，"
-                        f"速率{c / (time.time() - t if (time.time() - t) > 0 else 1): .3f}个/秒",
-                        "Chunk.save",
-                    )
-                    t = time.time()
-                    c = 0
-                    total = max(len(groups), 1)
-                    Chunk.loading_info["current_saving_obj_name"] = "小组信息"
-                    Chunk.loading_info["current_saving_obj_total"] = total
-                    for group in groups:
-                        Chunk.loading_info["current_saving_obj_current"] = c
-                        Chunk.loading_info["total_percentage"] += object_percentage
-                        DataObject(group, self).save(path)
-                        c += 1
-                        total_saved_objects += 1
-                    c = max(1, c)
-                    Base.log(
-                        "D",
-                        f"历史记录中的{uuid}的小组保存完成，"
-                        f"耗时{time.time() - t: .5f}秒，共{c}个，"
-                        f"速率{c / (time.time() - t if (time.time() - t) > 0 else 1): .3f}个/秒",
-                        "Chunk.save",
-                    )
-                    t = time.time()
-                    c = 0
-                    total = max(len(modifies), 1)
-                    self.relase_connections()
-                    Chunk.loading_info["current_saving_obj_name"] = "分数修改记录"
-                    Chunk.loading_info["current_saving_obj_total"] = total
-                    for modify in modifies:
-                        Chunk.loading_info["current_saving_obj_current"] = c
-                        Chunk.loading_info["total_percentage"] += object_percentage
-                        DataObject(modify, self).save(path)
-                        c += 1
-                        total_saved_objects += 1
-                    c = max(1, c)
-                    Base.log(
-                        "D",
-                        f"历史记录中的{uuid}的分数修改记录保存完成，"
-                        f"耗时{time.time() - t: .5f}秒，共{c}个，"
-                        f"速率{c / (time.time() - t if (time.time() - t) > 0 else 1): .3f}个/秒",
-                        "Chunk.save",
-                    )
-                    t = time.time()
-                    c = 0
-                    total = max(len(day_records), 1)
-                    Chunk.loading_info["current_saving_obj_name"] = "成就记录"
-                    Chunk.loading_info["current_saving_obj_total"] = total
-                    for achievement in achievements:
-                        Chunk.loading_info["current_saving_obj_current"] = c
-                        Chunk.loading_info["total_percentage"] += object_percentage
-                        DataObject(achievement, self).save(path)
-                        c += 1
-                        total_saved_objects += 1
-                    c = max(1, c)
-                    Base.log(
-                        "D",
-                        f"历史记录中的{uuid}的成就记录保存完成，"
-                        f"耗时{time.time() - t: .5f}秒，共{c}个，"
-                        f"速率{c / (time.time() - t if (time.time() - t) > 0 else 1): .3f}个/秒",
-                        "Chunk.save",
-                    )
-                    t = time.time()
-                    c = 0
-                    Chunk.loading_info["current_saving_obj_name"] = "分数修改模板"
-                    Chunk.loading_info["current_saving_obj_total"] = total
-                    for template in modify_templates:
-                        Chunk.loading_info["current_saving_obj_current"] = c
-                        Chunk.loading_info["total_percentage"] += object_percentage
-                        DataObject(template, self).save(path)
-                        c += 1
-                        total_saved_objects += 1
-                    c = max(1, c)
-                    Base.log(
-                        "D",
-                        f"历史记录中的{uuid}的分数修改模板保存完成，"
-                        f"耗时{time.time() - t: .5f}秒，共{c}个，"
-                        f"速率{c / (time.time() - t if (time.time() - t) > 0 else 1): .3f}个/秒",
-                        "Chunk.save",
-                    )
-                    t = time.time()
-                    c = 0
-                    total = max(len(achivement_templates), 1)
-                    Chunk.loading_info["current_saving_obj_name"] = "成就模板"
-                    Chunk.loading_info["current_saving_obj_total"] = total
-                    for template in achivement_templates:
-                        Chunk.loading_info["current_saving_obj_current"] = c
-                        Chunk.loading_info["total_percentage"] += object_percentage
-                        DataObject(template, self).save(path)
-                        c += 1
-                        total_saved_objects += 1
-                    c = max(1, c)
-                    Base.log(
-                        "D",
-                        f"历史记录中的{uuid}的成就模板保存完成，"
-                        f"耗时{time.time() - t: .5f}秒，共{c}个，"
-                        f"速率{c / (time.time() - t if (time.time() - t) > 0 else 1): .3f}个/秒",
-                        "Chunk.save",
-                    )
-                    t = time.time()
-                    c = 0
-                    total = max(len(day_records), 1)
-                    Chunk.loading_info["current_saving_obj_name"] = "每日记录"
-                    Chunk.loading_info["current_saving_obj_total"] = total
-                    for record in day_records:
-                        Chunk.loading_info["current_saving_obj_current"] = c
-                        Chunk.loading_info["total_percentage"] += object_percentage
-                        DataObject(record, self).save(path)
-                        c += 1
-                        total_saved_objects += 1
-                    c = max(1, c)
-                    Base.log(
-                        "D",
-                        f"历史记录中的{uuid}的每日记录保存完成，"
-                        f"耗时{time.time() - t: .5f}秒，共{c}个，"
-                        f"速率{c / (time.time() - t if (time.time() - t) > 0 else 1): .3f}个/秒",
-                        "Chunk.save",
-                    )
-                    t = time.time()
-                    c = 0
-                    total = max(len(self.bound_db.current_day_attendance.values()), 1)
-                    Chunk.loading_info["current_saving_obj_name"] = "当前出勤"
-                    Chunk.loading_info["current_saving_obj_total"] = total
-                    for attendance_info in self.bound_db.current_day_attendance.values():
-                        Chunk.loading_info["current_saving_obj_current"] = c
-                        Chunk.loading_info["total_percentage"] += object_percentage
-                        DataObject(attendance_info, self).save(path)
-                        total_saved_objects += 1
-                        c += 1
-                    Base.log(
-                        "D",
-                        f"历史记录中的{uuid}的当前出勤保存完成，"
-                        f"时间耗时{time.time() - t}秒",
-                        "Chunk.save",
-                    )
+                                for obj_uuid, type_name, class_name, dtype, data in rows
+                            ),
+                            path,
+                            progress_callback=on_progress,
+                            layout=self.layout,
+                            blob_store=(
+                                os.path.join(self.path, BLOB_STORE_FILE_NAME)
+                                if uuid is not None and self.dedup_histories
+                                else None
+                            ),
+                        )
+                        c = max(1, len(rows))
+                        Base.log(
+                            "D",
+                            f"历史记录中的{uuid}的{name}保存完成，"
+                            f"耗时{time.time() - t: .5f}秒，共{c}个，"
+                            f"速率{c / (time.time() - t if (time.time() - t) > 0 else 1): .3f}个/秒",
+                            "Chunk.save",
+                        )
 
                     DataObject.relase_connections()
                     DataObject.cur_list = {}
                     Base.log("D", "当前数据库连接已关闭", "Chunk.save")
                     Base.log("D", "保存基本信息", "Chunk.save")
-                    json.dump(
-                        {
-                            "uuid": str(uuid) if uuid else None,
-                            "create_time": current_history.time,
-                            "save_time": self.bound_db.save_time,
-                            "version": self.bound_db.version,
-                            "version_code": self.bound_db.version_code,
-                            "last_start_time": self.bound_db.last_start_time,
-                            "last_reset": self.bound_db.last_reset,
-                            "user": self.bound_db.user,
-                            "total_objects": total_saved_objects,  # 这个可以在后面用来做加载进度条
-                            "python_version": (
-                                sys.version_info.major,
-                                sys.version_info.minor,
-                                sys.version_info.micro,
-                            ),
-                        },
-                        open(os.path.join(path, "info.json"), "w", encoding="utf-8"),
-                        indent=4,
-                    )
-                    json.dump(
-                        [(c.key, str(c.uuid)) for c in current_history.classes.values()],
-                        open(os.path.join(path, "classes.json"), "w", encoding="utf-8"),
-                        indent=4,
-                    )
-
-                    json.dump(
-                        {
-                            _class: {k: str(v.uuid) for k, v in item.items()}
-                            for _class, item in current_history.weekdays.items()
-                            
-                        },
-                        open(os.path.join(path, "weekdays.json"), "w", encoding="utf-8"),
-                        indent=4,
-                    )
-                    json.dump(
-                        [(a.target_class, str(a.uuid)) for a in self.bound_db.current_day_attendance.values()],
-                        open(os.path.join(path, "current_day_attendance.json"), "w", encoding="utf-8"),             
-                    )
-
-                    json.dump(
-                        [(t.key, str(t.uuid)) for t in self.bound_db.templates.values()],
-                        open(os.path.join(path, "templates.json"), "w", encoding="utf-8"),
-                        indent=4,
-                    )
-
-                    json.dump(
-                        [(a.key, str(a.uuid)) for a in self.bound_db.achievements.values()],
-                        open(
-                            os.path.join(path, "achievements.json"), "w", encoding="utf-8"
-                        ),
-                        indent=4,
-                    )
+                    for index_name, data, only_if_changed, kwargs in part.indexes:
+                        self._dump_index(data, path, index_name, only_if_changed, **kwargs)
 
                     Base.log(
-                        "I", f"{uuid}的存档信息保存完成({index}/{total})", "Chunk.save"
+                        "I",
+                        f"{uuid}的存档信息保存完成({index}/{total_history_count})，"
+                        f"写入了{total_saved_objects}/{part.total_objects}个对象",
+                        "Chunk.save",
                     )
 
-                i = 1
-                for uuid, current_history, clear in save_tasks:
-                    save_part(uuid, current_history, clear, i)
-                    i += 1
+                catalog_exists = self.catalog.exists
+                for i, part in enumerate(snapshot.parts, 1):
+                    os.makedirs(part.path, exist_ok=True)
+                    save_part(part, i)
 
                 Base.log("D", "所有数据保存完成", "Chunk.save")
 
-                history_uuids = []
-                for dir_1 in os.listdir(os.path.join(self.path, "Histories")):
-                    for dir_2 in os.listdir(os.path.join(self.path, "Histories", dir_1)):
-                        history_uuids.append(dir_1 + dir_2)
+                # 存档都写完了再一起更新目录，目录里有的历史记录一定是完整的
+                self.catalog.update(
+                    part.catalog_entry._replace(byte_size=archive_size(part.path))
+                    for part in snapshot.parts
+                    if part.catalog_entry is not None
+                )
+                if not catalog_exists and not snapshot.clear_histories:
+                    # 旧版本的用户存档，第一次保存的时候把以前的历史记录补进目录
+                    self._sync_catalog()
+                history_uuids = self.catalog.saved_uuids()
+                schema_version = read_schema_version(self.path)
+                if schema_version is None or (
+                    snapshot.clear_histories and not snapshot.incremental
+                ):
+                    # 新存档，或者所有数据都是刚刚按照现在的格式重写的
+                    schema_version = latest_schema_version()
 
                 json.dump(
-                    {
-                        "uuid": str(uuid) if uuid else None,
-                        "user": self.bound_db.user,
-                        "create_time": time.time(),
-                        "save_time": self.bound_db.save_time,
-                        "version": self.bound_db.version,
-                        "version_code": self.bound_db.version_code,
-                        "last_start_time": self.bound_db.last_start_time,
-                        "last_reset": self.bound_db.last_reset,
-                        "histories": history_uuids,
-                        "python_version": (
-                            sys.version_info.major,
-                            sys.version_info.minor,
-                            sys.version_info.micro,
-                        ),
-                    },
+                    dict(
+                        snapshot.info,
+                        histories=history_uuids,
+                        **{SCHEMA_VERSION_KEY: schema_version},
+                    ),
                     open(os.path.join(self.path, "info.json"), "w", encoding="utf-8"),
                     indent=4,
                 )
             except Exception as e:
                 self.relase_connections()
                 self.is_saving = False
+                if self.tracking:
+                    # 不知道写到哪里了，下次完整保存
+                    self.synced = False
+                    self.dirty_objects.update(snapshot.dirty_objects)
                 raise e
 
             else:
                 self.relase_connections()
                 self.is_saving = False
+                if self.tracking and (self.synced or not snapshot.incremental):
+                    # 拍快照之后有别的保存失败了的话，增量保存补不回来，还是要等下次完整保存
+                    self.synced = True
+                try:
+                    self.journal.discard_until(journal_offset)
+                except OSError:
+                    Base.log_exc_short("清理分数事件日志失败", "Chunk.save", "W")
 
             finally:
                 self.relase_connections()
                 self.is_saving = False
+
+
+SnapshotRecord = List[Any]
+"快照里的一个对象，[uuid, 数据类型名, 类名, 数据类型, to_dict的结果]"
+
+
+class SnapshotPart:
+    "快照里的一个存档文件夹"
+
+    def __init__(
+        self,
+        uuid: Optional[ClassDataTypeUUID[History]],
+        path: str,
+        clear: bool,
+        only_dirty: bool,
+    ):
+        self.uuid = uuid
+        "历史记录的UUID，None为当前周"
+        self.path = path
+        "存档文件夹"
+        self.clear = clear
+        "写入之前是否清空存档文件夹"
+        self.only_dirty = only_dirty
+        "是否只有有修改标记的对象"
+        self.groups: List[Tuple[str, List[SnapshotRecord]]] = []
+        "要写入的对象，groups = [(分组名, [记录, ...]), ...]"
+        self.indexes: List[Tuple[str, Any, bool, Dict[str, Any]]] = []
+        "要写入的json索引，indexes = [(索引名, 内容, 是否只在变了的时候写, json.dumps的参数), ...]"
+        self.total_objects = 0
+        "这个存档文件夹里一共有多少个对象（包括这次没写的）"
+        self.catalog_entry: Optional[CatalogEntry] = None
+        "历史记录目录里的行（当前周为None），写入之后填上存档大小"
+
+
+class SaveSnapshot:
+    "保存用的快照（见Chunk.take_snapshot），里面只有普通的数据，不引用会被修改的对象"
+
+    def __init__(
+        self,
+        seq: int,
+        incremental: bool,
+        clear_histories: bool,
+        journal_offset: int,
+        dirty_objects: Set[ClassDataType],
+    ):
+        self.seq = seq
+        "快照的序号，同一个分组的快照按照序号依次写入"
+        self.incremental = incremental
+        "是否为增量保存"
+        self.clear_histories = clear_histories
+        "写入之前是否清空整个用户存档"
+        self.journal_offset = journal_offset
+        "拍快照时分数事件日志的位置，写入成功之后丢掉这之前的记录"
+        self.dirty_objects = dirty_objects
+        "拍快照时取走的修改标记，写入失败的时候放回去"
+        self.parts: List[SnapshotPart] = []
+        "每个存档文件夹的快照，第一个是当前周"
+        self.info: Dict[str, Any] = {}
+        "用户存档根目录的info.json"
+        self.lock_time = 0.0
+        "拍快照时持有ClassDataType.state_lock的时间（秒）"
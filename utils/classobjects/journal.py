@@ -0,0 +1,345 @@
+"""
+分数事件日志（预写日志）
+
+每次发送/撤回点评、获得成就、修改出勤的时候，把这次改到的对象序列化后追加到Current/journal.bin里，
+崩溃之后重新加载时在上次保存的数据上重放一遍，不用等自动保存把所有东西重写一遍才算数。
+
+文件格式：
+    文件头 b"CMJ\\x01"，后面是一条一条的记录：
+    长度(I) CRC32(I) 内容
+内容：
+    版本号(B) 时间(d) 事件名(str) 对象数量(H) 每个对象
+每个对象：
+    数据类型名(str) 类名(str) uuid(str) 编码(B，0为json，1为binary) 数据长度(I) 数据
+其中str为长度(H) + UTF-8。
+
+追加的记录先放在内存里，flush_interval秒之内的记录攒在一起写一次、fsync一次；
+读的时候遇到长度不够或者CRC对不上的记录（写到一半断电了）就从那里截断，前面的照常重放。
+
+对外给出的位置（sync、tell、replay返回的，discard_until接受的）都是逻辑位置：
+之前丢掉了的记录的长度加上在现在的文件里的位置。丢掉前面的记录之后文件是重写过的，
+文件里的位置会往前挪，逻辑位置不会，所以好几个快照的检查点可以按顺序各自丢掉自己之前的记录。
+"""
+
+import os
+import time
+import zlib
+import struct
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from utils.basetypes import Base
+from .basetype import ClassDataType
+from .codec import ObjectCodec
+
+
+JOURNAL_FILE_NAME = "journal.bin"
+"日志的文件名，放在Current文件夹里"
+
+JOURNAL_MAGIC = b"CMJ\x01"
+"日志的文件头"
+
+JOURNAL_VERSION = 1
+"当前的日志记录版本，写在每条记录内容的第一个字节"
+
+JournalRows = Dict[Tuple[str, str], Tuple[str, Union[str, bytes]]]
+"重放结果，rows[(数据类型名, uuid)] = (类名, 数据)，同一个对象只留最后一次的数据"
+
+_RECORD_HEADER = struct.Struct("<II")
+_PAYLOAD_HEADER = struct.Struct("<Bd")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
+_CODECS: Tuple[ObjectCodec, ...] = ("json", "binary")
+
+
+def _pack_str(out: bytearray, value: str) -> None:
+    data = value.encode("utf-8")
+    out += _U16.pack(len(data))
+    out += data
+
+
+def _unpack_str(data: memoryview, pos: int) -> Tuple[str, int]:
+    (length,) = _U16.unpack_from(data, pos)
+    pos += 2
+    return str(data[pos:pos + length], "utf-8"), pos + length
+
+
+def encode_journal_record(
+    event: str, objects: Iterable[ClassDataType], codec: ObjectCodec = "json"
+) -> bytes:
+    """
+    把一次事件改到的对象编码成一条日志记录（包括长度和CRC）。
+
+    :param event: 事件名，比如"send_modify"
+    :param objects: 改到的对象，重复的只写一次
+    :param codec: 对象数据的编码方式
+    :return: 记录
+    """
+    unique: Dict[Tuple[str, str], ClassDataType] = {}
+    for obj in objects:
+        unique[(obj.chunk_type_name, str(obj.uuid))] = obj
+    payload = bytearray(_PAYLOAD_HEADER.pack(JOURNAL_VERSION, time.time()))
+    _pack_str(payload, event)
+    payload += _U16.pack(len(unique))
+    for (type_name, uuid), obj in unique.items():
+        data = obj.to_bytes() if codec == "binary" else obj.to_string().encode("utf-8")
+        _pack_str(payload, type_name)
+        _pack_str(payload, obj.__class__.__qualname__)
+        _pack_str(payload, uuid)
+        payload.append(_CODECS.index(codec))
+        payload += _U32.pack(len(data))
+        payload += data
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + bytes(payload)
+
+
+def decode_journal_payload(
+    payload: Union[bytes, memoryview]
+) -> Tuple[str, float, List[Tuple[str, str, str, Union[str, bytes]]]]:
+    """
+    解码一条日志记录的内容（不包括长度和CRC）。
+
+    :param payload: 内容
+    :return: (事件名, 时间, [(数据类型名, 类名, uuid, 数据), ...])，json数据是str，二进制数据是bytes
+    :raise ValueError: 内容损坏或者版本不认识
+    """
+    data = memoryview(payload)
+    try:
+        version, event_time = _PAYLOAD_HEADER.unpack_from(data, 0)
+        if version != JOURNAL_VERSION:
+            raise ValueError(f"不支持的日志记录版本：{version}")
+        event, pos = _unpack_str(data, _PAYLOAD_HEADER.size)
+        (count,) = _U16.unpack_from(data, pos)
+        pos += 2
+        rows = []
+        for _ in range(count):
+            type_name, pos = _unpack_str(data, pos)
+            class_name, pos = _unpack_str(data, pos)
+            uuid, pos = _unpack_str(data, pos)
+            codec = _CODECS[data[pos]]
+            (length,) = _U32.unpack_from(data, pos + 1)
+            pos += 5
+            if pos + length > len(data):
+                raise ValueError("对象数据超出了记录的长度")
+            raw = bytes(data[pos:pos + length])
+            pos += length
+            rows.append(
+                (type_name, class_name, uuid, raw.decode("utf-8") if codec == "json" else raw)
+            )
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"日志记录损坏：{e}") from e
+    if pos != len(data):
+        raise ValueError("日志记录的结尾有多余的数据")
+    return event, event_time, rows
+
+
+class ScoreJournal:
+    "一个存档的分数事件日志"
+
+    journals: Dict[str, "ScoreJournal"] = {}
+    "已经打开的日志，journals[Current文件夹的绝对路径] = 日志，同一个文件只能有一个对象在写"
+
+    flush_interval: float = 0.2
+    "追加之后最多等多久写入硬盘（秒），这段时间里的记录一起fsync，为0则每次追加都马上写入"
+
+    @staticmethod
+    def open(path: str) -> "ScoreJournal":
+        """
+        获取一个存档文件夹的日志，没有打开过就新建一个对象（文件要等到第一次写入才会创建）。
+
+        :param path: 存档文件夹（Current）
+        :return: 日志
+        """
+        path = os.path.abspath(path)
+        journal = ScoreJournal.journals.get(path)
+        if journal is None:
+            journal = ScoreJournal.journals.setdefault(path, ScoreJournal(path))
+        return journal
+
+    def __init__(self, path: str):
+        self.path = path
+        "存档文件夹"
+        self.file = os.path.join(path, JOURNAL_FILE_NAME)
+        "日志文件"
+        self.lock = threading.RLock()
+        "读写文件和待写入记录时用的锁"
+        self.pending: List[bytes] = []
+        "还没写入硬盘的记录"
+        self.timer: Optional[threading.Timer] = None
+        "等着写入的定时器"
+        self.appended_records = 0
+        "追加了的记录数量"
+        self.synced_records = 0
+        "写入硬盘了的记录数量"
+        self.generation = 0
+        "每丢掉一次记录（见discard_until）加一，用来判断重放出来的数据是不是已经被保存过了"
+        self.base = 0
+        "已经丢掉了的记录的总长度（不算文件头），逻辑位置 = base + 在文件里的位置"
+
+    def append(
+        self, event: str, objects: Iterable[ClassDataType], codec: ObjectCodec = "json"
+    ) -> None:
+        """
+        追加一条记录，flush_interval秒之后和这段时间里的其他记录一起写入。
+
+        对象在调用的时候就序列化好了，之后再改不会影响这条记录。
+
+        :param event: 事件名
+        :param objects: 改到的对象
+        :param codec: 对象数据的编码方式
+        """
+        record = encode_journal_record(event, objects, codec)
+        with self.lock:
+            self.pending.append(record)
+            self.appended_records += 1
+            if self.flush_interval <= 0:
+                self.sync()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self._on_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _on_timer(self) -> None:
+        "定时器到点"
+        try:
+            self.sync()
+        except OSError:
+            Base.log_exc_short("写入分数事件日志失败，下次追加的时候再试", "ScoreJournal.sync", "W")
+
+    def sync(self) -> int:
+        """
+        把待写入的记录全部写进文件并且fsync。
+
+        :return: 写完之后文件结束的逻辑位置，save_data用它作为检查点（这个位置之前的记录已经在保存的数据里了）
+        :raise OSError: 写入失败，记录会留着下次再写
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending:
+                try:
+                    return self.base + os.path.getsize(self.file)
+                except OSError:
+                    return self.base
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.file, "ab") as f:
+                if f.tell() == 0:
+                    f.write(JOURNAL_MAGIC)
+                f.write(b"".join(self.pending))
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            self.synced_records += len(self.pending)
+            self.pending.clear()
+            return self.base + size
+
+    def tell(self) -> int:
+        """
+        获取所有已经追加了的记录（包括还没写入的）结束的位置，不写文件。
+
+        save_data在拍快照的时候用它作为检查点，之后discard_until会先把待写入的记录写进去再丢。
+
+        :return: 逻辑位置
+        """
+        with self.lock:
+            try:
+                size = os.path.getsize(self.file)
+            except OSError:
+                size = 0
+            if self.pending and size == 0:
+                size = len(JOURNAL_MAGIC)
+            return self.base + size + sum(len(record) for record in self.pending)
+
+    def replay(self) -> Tuple[JournalRows, int, int]:
+        """
+        读出日志里所有完整的记录。
+
+        写到一半的记录（长度不够或者CRC对不上）和它后面的内容会被截断掉。
+
+        :return: (重放结果, 最后一条完整记录结束的逻辑位置, 记录数量)
+        """
+        with self.lock:
+            self.sync()
+            try:
+                with open(self.file, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return {}, self.base, 0
+            if not data.startswith(JOURNAL_MAGIC):
+                if len(data) >= len(JOURNAL_MAGIC):
+                    # 连文件头都不对，留着给人看，不去碰它
+                    Base.log(
+                        "E",
+                        f"分数事件日志{self.file}的文件头不正确，已改名为{JOURNAL_FILE_NAME}.corrupt",
+                        "ScoreJournal.replay",
+                    )
+                    os.replace(self.file, self.file + ".corrupt")
+                else:
+                    os.remove(self.file)
+                return {}, self.base, 0
+            rows: JournalRows = {}
+            view = memoryview(data)
+            pos = len(JOURNAL_MAGIC)
+            count = 0
+            while pos + _RECORD_HEADER.size <= len(data):
+                length, crc = _RECORD_HEADER.unpack_from(view, pos)
+                end = pos + _RECORD_HEADER.size + length
+                if end > len(data):
+                    break
+                payload = view[pos + _RECORD_HEADER.size:end]
+                if zlib.crc32(payload) != crc:
+                    break
+                try:
+                    _, _, objects = decode_journal_payload(payload)
+                except ValueError:
+                    break
+                for type_name, class_name, uuid, obj_data in objects:
+                    rows[(type_name, uuid)] = (class_name, obj_data)
+                pos = end
+                count += 1
+            if pos != len(data):
+                Base.log(
+                    "W",
+                    f"分数事件日志在{pos}字节处有不完整的记录，"
+                    f"截断掉后面的{len(data) - pos}字节（重放了{count}条记录）",
+                    "ScoreJournal.replay",
+                )
+                with open(self.file, "r+b") as f:
+                    f.truncate(pos)
+                    f.flush()
+                    os.fsync(f.fileno())
+            return rows, self.base + pos, count
+
+    def discard_until(self, offset: int) -> None:
+        """
+        丢掉offset之前的记录（它们已经写进存档了），之后追加的记录保留。
+
+        :param offset: 检查点，sync、tell或者replay返回的逻辑位置（已经丢掉了的就什么都不做）
+        """
+        with self.lock:
+            self.sync()
+            try:
+                with open(self.file, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            self.generation += 1
+            offset = min(max(offset - self.base, len(JOURNAL_MAGIC)), len(data))
+            self.base += offset - len(JOURNAL_MAGIC)
+            if offset == len(data):
+                os.remove(self.file)
+                return
+            temp_file = self.file + ".tmp"
+            with open(temp_file, "wb") as f:
+                f.write(JOURNAL_MAGIC + data[offset:])
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.file)
+
+    def close(self) -> None:
+        "写入剩下的记录，从journals里移除"
+        with self.lock:
+            self.sync()
+            if ScoreJournal.journals.get(self.path) is self:
+                del ScoreJournal.journals[self.path]
@@ -0,0 +1,355 @@
+"""
+学生的分数流水（Student.history）
+
+以前Student.history是以执行时间戳（毫秒）为key的dict：同一毫秒里执行的两条点评会撞到同一个key上，
+后一条把前一条顶掉；撤回的时候还要把整个dict从头到尾重放一遍才能算出新的最高分和最低分。
+
+现在换成只追加的流水：
+
+- 每一条都有一个单调递增、不会重复的序号，同时保留执行时间戳
+- 每一条对分数的变化量（已执行的是mod，撤回了的是0）放在前缀和线段树（PrefixSumTree）里，
+  撤回之后的最高分、最低分和任意时间段的加减分总和都是O(log n)
+- 线段树第一次用到的时候才建，从存档加载的时候里面还是空的点评对象（见ReferenceResolver），不能马上去读
+
+为了兼容以前的代码和老存档，流水本身可以当成dict用（key是执行时间戳）：
+values()/items()按执行顺序给出所有记录（包括时间戳重复的），history[时间戳]是这个时间戳最后一条，
+history[时间戳] = 点评是追加一条；pickle里老的dict格式在Student.__setstate__里会转成流水。
+"""
+
+from bisect import bisect_left
+from typing import (Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple,
+                    TYPE_CHECKING, Union)
+
+from utils.algorithm import PrefixSumTree
+
+if TYPE_CHECKING:
+    from .objects.scoremod import ScoreModification
+
+
+class LedgerValues:
+    "流水里所有的记录，按执行顺序（ScoreLedger.values的返回值，判断在不在里面是O(1)的）"
+
+    __slots__ = ("ledger",)
+
+    def __init__(self, ledger: "ScoreLedger"):
+        self.ledger = ledger
+
+    def __len__(self) -> int:
+        return len(self.ledger)
+
+    def __iter__(self) -> Iterator["ScoreModification"]:
+        return self.ledger.entries_iter()
+
+    def __reversed__(self) -> Iterator["ScoreModification"]:
+        return self.ledger.entries_iter(reverse=True)
+
+    def __contains__(self, item: Any) -> bool:
+        return self.ledger.position_of(item) is not None
+
+    def __repr__(self) -> str:
+        return f"LedgerValues({list(self)!r})"
+
+
+class ScoreLedger:
+    "学生的分数流水，见模块说明"
+
+    def __init__(self, entries: Iterable[Tuple[int, "ScoreModification"]] = ()):
+        """
+        构造一条流水。
+
+        :param entries: 按执行顺序的(执行时间戳, 点评)
+        """
+        self.entries: List[Optional["ScoreModification"]] = []
+        "所有记录，按执行顺序，删掉了的是None"
+        self.times: List[int] = []
+        "每条记录的执行时间戳"
+        self.seqs: List[int] = []
+        "每条记录的序号"
+        self.next_seq = 1
+        "下一条记录的序号"
+        self.removed = 0
+        "删掉了的记录数"
+        self.positions: Dict[int, int] = {}
+        "positions[id(点评)] = 这个点评最后一条记录的位置"
+        self.last_by_time: Dict[int, int] = {}
+        "last_by_time[执行时间戳] = 这个时间戳最后一条记录的位置"
+        self.time_index: List[int] = []
+        "到每条记录为止最大的执行时间戳（单调不减，按时间段查询的时候二分用）"
+        self._tree: Optional[PrefixSumTree] = None
+        "分数变化量的线段树，用到的时候才建"
+        for time_key, modification in entries:
+            self.append(modification, time_key)
+
+    @staticmethod
+    def coerce(history: Union["ScoreLedger", Mapping[int, "ScoreModification"], None]) -> "ScoreLedger":
+        """
+        把老的dict格式（或者None）转换成流水，已经是流水的原样返回。
+
+        :param history: 历史记录
+        :return: 流水
+        """
+        if isinstance(history, ScoreLedger):
+            return history
+        return ScoreLedger((history or {}).items())
+
+    # 流水本身的接口
+
+    @staticmethod
+    def delta_of(modification: "ScoreModification") -> float:
+        "一条记录对分数的变化量"
+        return modification.mod if modification.executed else 0.0
+
+    def append(self, modification: "ScoreModification", time_key: Optional[int] = None) -> int:
+        """
+        追加一条记录。
+
+        :param modification: 点评
+        :param time_key: 执行时间戳，不填则用点评的execute_time_key
+        :return: 序号
+        """
+        if time_key is None:
+            time_key = modification.execute_time_key
+        seq = self.next_seq
+        self.next_seq += 1
+        self.positions[id(modification)] = len(self.entries)
+        self.last_by_time[time_key] = len(self.entries)
+        self.entries.append(modification)
+        self.times.append(time_key)
+        self.seqs.append(seq)
+        self.time_index.append(
+            max(time_key, self.time_index[-1]) if self.time_index else time_key
+        )
+        if self._tree is not None:
+            self._tree.append(self.delta_of(modification))
+        return seq
+
+    def truncate(self, length: int) -> None:
+        """
+        删掉某个位置之后的所有记录，只在批量操作失败回滚的时候用（平时流水只追加）。
+
+        :param length: 保留的记录数（按位置算，包括删掉了的）
+        """
+        if length >= len(self.entries):
+            return
+        self.removed -= sum(1 for m in self.entries[length:] if m is None)
+        for lst in (self.entries, self.times, self.seqs, self.time_index):
+            del lst[length:]
+        self._reindex()
+        self._tree = None
+
+    def _reindex(self) -> None:
+        self.positions = {}
+        self.last_by_time = {}
+        for position, (time_key, modification) in enumerate(zip(self.times, self.entries)):
+            if modification is not None:
+                self.positions[id(modification)] = position
+                self.last_by_time[time_key] = position
+
+    def position_of(self, modification: Any) -> Optional[int]:
+        """
+        一个点评在流水里最后一条记录的位置。
+
+        :param modification: 点评
+        :return: 位置，不在流水里则为None
+        """
+        position = self.positions.get(id(modification))
+        if position is not None and self.entries[position] is modification:
+            return position
+        return None
+
+    def seq_of(self, modification: Any) -> Optional[int]:
+        """
+        一个点评在流水里最后一条记录的序号。
+
+        :param modification: 点评
+        :return: 序号，不在流水里则为None
+        """
+        position = self.position_of(modification)
+        return None if position is None else self.seqs[position]
+
+    def entries_iter(self, reverse: bool = False) -> Iterator["ScoreModification"]:
+        """
+        按执行顺序遍历所有记录。
+
+        :param reverse: 是否从最近的开始
+        """
+        entries = reversed(self.entries) if reverse else iter(self.entries)
+        return (m for m in entries if m is not None)
+
+    @property
+    def tree(self) -> PrefixSumTree:
+        "分数变化量的线段树（第一次用的时候建）"
+        if self._tree is None:
+            self._tree = PrefixSumTree(
+                0.0 if m is None else self.delta_of(m) for m in self.entries
+            )
+        return self._tree
+
+    def refresh(self, modification: "ScoreModification") -> None:
+        """
+        一条记录的执行状态或者分数变了之后调用（比如撤回之后），更新线段树。
+
+        :param modification: 点评，不在流水里的不管
+        """
+        position = self.position_of(modification)
+        if position is not None and self._tree is not None:
+            self._tree.set(position, self.delta_of(modification))
+
+    def invalidate(self) -> None:
+        "记录被直接改了的时候调用，下次用线段树的时候重建"
+        self._tree = None
+
+    def highest(self) -> Tuple[float, int]:
+        """
+        按顺序执行所有记录的过程中分数最高的时候（从0分开始）。
+
+        :return: (最高分, 达到最高分的那条记录的执行时间戳)，没有高过0分则为(0.0, 0)
+        """
+        value, position = self.tree.highest()
+        if value > 0:
+            return value, self.times[position]
+        return 0.0, 0
+
+    def lowest(self) -> Tuple[float, int]:
+        """
+        按顺序执行所有记录的过程中分数最低的时候（从0分开始）。
+
+        :return: (最低分, 达到最低分的那条记录的执行时间戳)，没有低过0分则为(0.0, 0)
+        """
+        value, position = self.tree.lowest()
+        if value < 0:
+            return value, self.times[position]
+        return 0.0, 0
+
+    def sum_between(self, start: float, stop: float) -> float:
+        """
+        一段时间里的加减分总和。
+
+        :param start: 开始的执行时间戳（包含）
+        :param stop: 结束的执行时间戳（不包含）
+        :return: 总和
+        """
+        # 记录是按执行顺序追加的，系统时间往回调过的话按到那时为止最大的时间戳算
+        return self.tree.range_sum(
+            bisect_left(self.time_index, start), bisect_left(self.time_index, stop)
+        )
+
+    @property
+    def total(self) -> float:
+        "所有记录的加减分总和"
+        return self.tree.total
+
+    # 兼容dict的接口（key是执行时间戳）
+
+    def __len__(self) -> int:
+        return len(self.entries) - self.removed
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[int]:
+        return (t for t, m in zip(self.times, self.entries) if m is not None)
+
+    def __reversed__(self) -> Iterator[int]:
+        return (
+            t for t, m in zip(reversed(self.times), reversed(self.entries)) if m is not None
+        )
+
+    def _last_position(self, time_key: Any) -> Optional[int]:
+        try:
+            return self.last_by_time.get(time_key)
+        except TypeError:
+            return None
+
+    def __getitem__(self, time_key: Any) -> "ScoreModification":
+        position = self._last_position(time_key)
+        if position is None:
+            raise KeyError(time_key)
+        return self.entries[position]
+
+    def get(self, time_key: Any, default: Any = None) -> Any:
+        "和dict.get一样"
+        position = self._last_position(time_key)
+        return default if position is None else self.entries[position]
+
+    def __contains__(self, time_key: Any) -> bool:
+        return self._last_position(time_key) is not None
+
+    def __setitem__(self, time_key: int, modification: "ScoreModification") -> None:
+        # 以前会把同一个时间戳的顶掉，现在是追加一条
+        self.append(modification, time_key)
+
+    def __delitem__(self, time_key: Any) -> None:
+        positions = [
+            p for p, t in enumerate(self.times)
+            if t == time_key and self.entries[p] is not None
+        ]
+        if not positions:
+            raise KeyError(time_key)
+        for position in positions:
+            self.positions.pop(id(self.entries[position]), None)
+            self.entries[position] = None
+            self.removed += 1
+            if self._tree is not None:
+                self._tree.set(position, 0.0)
+        del self.last_by_time[time_key]
+
+    _missing = object()
+
+    def pop(self, time_key: Any, default: Any = _missing) -> Any:
+        "删掉一个时间戳的所有记录，返回最后一条（和dict.pop一样）"
+        position = self._last_position(time_key)
+        if position is None:
+            if default is ScoreLedger._missing:
+                raise KeyError(time_key)
+            return default
+        modification = self.entries[position]
+        del self[time_key]
+        return modification
+
+    def keys(self) -> List[int]:
+        "所有记录的执行时间戳（按执行顺序，可能有重复的）"
+        return list(self)
+
+    def values(self) -> LedgerValues:
+        "所有记录（按执行顺序）"
+        return LedgerValues(self)
+
+    def items(self) -> Iterator[Tuple[int, "ScoreModification"]]:
+        "所有的(执行时间戳, 记录)（按执行顺序）"
+        return (
+            (t, m) for t, m in zip(self.times, self.entries) if m is not None
+        )
+
+    def update(self, other: Union["ScoreLedger", Mapping[int, "ScoreModification"]]) -> None:
+        "把另一条流水（或者老的dict）里的记录追加到后面"
+        for time_key, modification in list(other.items()):
+            self.append(modification, time_key)
+
+    def copy(self) -> "ScoreLedger":
+        "复制一条流水（记录本身不复制）"
+        return ScoreLedger(self.items())
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, ScoreLedger):
+            return list(self.items()) == list(other.items())
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"ScoreLedger({list(self.items())!r})"
+
+    # pickle和深拷贝的时候线段树不用带着
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_tree"] = None
+        del state["positions"], state["last_by_time"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._reindex()
@@ -0,0 +1,195 @@
+"""
+存档结构迁移
+
+以前每次加载（ClassObj.config_data）都要把所有模板、班级和学生过一遍，用hasattr补老版本缺的属性，
+存档越大越慢，而且补完之后下次加载还要再补一遍。
+
+现在每一步迁移都在这里注册成一个版本号，只改存档里的原始数据（to_dict的格式），不构建对象：
+- 用户存档根目录的info.json里记着schema_version，比最新版本旧的话，
+  Chunk.migrate_schema会对此周和所有历史记录跑一遍还没跑过的迁移，写回数据库之后更新版本号
+- 每一步都要是幂等的（已经是新格式的数据不会被改），中途断电下次再跑一遍也没关系
+- 加载的时候只剩一个版本号的比较
+
+新增迁移：写一个接收数据字典、返回有没有改动的函数，用@migration注册，版本号往上加一。
+"""
+
+import os
+import json
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+SCHEMA_VERSION_KEY = "schema_version"
+"info.json里记录存档结构版本的键"
+
+
+class Migration(NamedTuple):
+    "一步迁移"
+
+    version: int
+    "迁移之后的版本号"
+    name: str
+    "迁移的名字，写日志用"
+    type_names: Tuple[str, ...]
+    "要处理的数据类型名（chunk_type_name）"
+    step: Callable[[Dict[str, Any]], bool]
+    "迁移函数，直接修改传进去的数据字典，返回是否改动了"
+
+
+MIGRATIONS: List[Migration] = []
+"注册了的迁移，按照版本号从小到大排"
+
+
+def migration(version: int, name: str, *type_names: str):
+    """
+    装饰器：注册一步迁移。
+
+    :param version: 迁移之后的版本号，不能和已有的重复
+    :param name: 迁移的名字
+    :param type_names: 要处理的数据类型名
+    :return: 装饰器
+    """
+
+    def decorator(func: Callable[[Dict[str, Any]], bool]):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"存档结构版本{version}已经有迁移了")
+        MIGRATIONS.append(Migration(version, name, type_names, func))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return func
+
+    return decorator
+
+
+def latest_schema_version() -> int:
+    "最新的存档结构版本"
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def pending_migrations(version: int) -> List[Migration]:
+    """
+    获取一个版本之后还需要跑的迁移。
+
+    :param version: 存档当前的结构版本
+    :return: 迁移，按照版本号从小到大排
+    """
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def read_schema_version(root: str) -> Optional[int]:
+    """
+    读取用户存档的结构版本。
+
+    :param root: 用户存档根目录
+    :return: 版本号，没有info.json（新存档）则为None，info.json里没有记录（加这个功能之前的存档）则为0
+    """
+    try:
+        with open(os.path.join(root, "info.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+    except FileNotFoundError:
+        return None
+    return int(info.get(SCHEMA_VERSION_KEY, 0))
+
+
+def write_schema_version(root: str, version: int) -> None:
+    """
+    更新用户存档info.json里的结构版本（其他内容不动）。
+
+    :param root: 用户存档根目录
+    :param version: 版本号
+    """
+    file = os.path.join(root, "info.json")
+    with open(file, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    info[SCHEMA_VERSION_KEY] = version
+    with open(file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=4)
+    os.replace(file + ".tmp", file)
+
+
+def apply_migrations(
+    migrations: List[Migration], type_name: str, data: Dict[str, Any]
+) -> bool:
+    """
+    对一条数据跑一遍迁移。
+
+    :param migrations: 要跑的迁移
+    :param type_name: 数据类型名
+    :param data: 数据字典，会被直接修改
+    :return: 是否改动了
+    """
+    changed = False
+    for m in migrations:
+        if type_name in m.type_names and m.step(data):
+            changed = True
+    return changed
+
+
+def _default_of(defaults: Any, key: Any) -> Any:
+    "从默认数据（dict或者OrderedKeyList）里找同一个key的对象，没有则为None"
+    try:
+        return defaults[key] if key is not None else None
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def _fill_missing(data: Dict[str, Any], fields: Dict[str, Any]) -> bool:
+    "把data里没有的键用fields里的值补上，返回是否补了"
+    missing = [k for k in fields if k not in data]
+    for k in missing:
+        data[k] = fields[k]
+    return bool(missing)
+
+
+@migration(1, "补齐成就模板的图标、触发时机和说明", "AchievementTemplate")
+def _achievement_template_fields(data: Dict[str, Any]) -> bool:
+    from utils.classobjects import DEFAULT_ACHIEVEMENTS
+
+    defaults = {
+        "icon": None,
+        "when_triggered": ["any"],
+        "further_info": "因为这是老版本迁移过来的存档，所以这条信息是空缺的",
+        "condition_info": "因为这是老版本迁移过来的存档，所以暂时没有详细条件信息",
+    }
+    if all(k in data for k in defaults):
+        return False
+    template = _default_of(DEFAULT_ACHIEVEMENTS, data.get("key"))
+    for k in defaults:
+        if template is not None and hasattr(template, k):
+            defaults[k] = getattr(template, k)
+    return _fill_missing(data, defaults)
+
+
+@migration(2, "补齐分数修改模板的is_visible", "ScoreModificationTemplate")
+def _score_template_visibility(data: Dict[str, Any]) -> bool:
+    from utils.classobjects import DEFAULT_SCORE_TEMPLATES
+
+    if "is_visible" in data:
+        return False
+    template = _default_of(DEFAULT_SCORE_TEMPLATES, data.get("key"))
+    data["is_visible"] = getattr(template, "is_visible", True)
+    return True
+
+
+@migration(3, "修正班级的cleaing_mapping拼写，补齐小组和作业规则", "Class")
+def _class_fields(data: Dict[str, Any]) -> bool:
+    changed = False
+    if "cleaing_mapping" in data:
+        # 以前的版本把cleaning拼错了
+        misspelled = data.pop("cleaing_mapping")
+        data.setdefault("cleaning_mapping", misspelled)
+        changed = True
+    changed = _fill_missing(
+        data, {"cleaning_mapping": [], "groups": [], "homework_rules": []}
+    ) or changed
+    rules = data["homework_rules"]
+    if any(isinstance(rule, str) for _, rule in rules):
+        # 以前的存档里作业规则是套在里面的json字符串
+        data["homework_rules"] = [
+            (n, json.loads(rule) if isinstance(rule, str) else rule) for n, rule in rules
+        ]
+        changed = True
+    return changed
+
+
+@migration(4, "补齐学生的上次重置信息", "Student")
+def _student_last_reset_info(data: Dict[str, Any]) -> bool:
+    return _fill_missing(data, {"last_reset_info": None})
@@ -0,0 +1,284 @@
+"""
+加载出来的对象的缓存
+
+DataObject.loaded_object_list以前是一个普通的dict，加载过的所有历史记录的对象会一直留到程序退出，
+翻几十个历史记录内存就只涨不降。现在换成这里的ObjectCache：
+
+- 按照对象数量和估计的字节数限制大小，超出之后淘汰最久没用过的对象（LRU）
+- 缓存id的第一项就是历史记录uuid，可以单独释放一个历史记录，也可以固定（pin）某个历史记录
+  （默认固定Current，也就是None），固定的对象不会被淘汰，也不算进限制
+- 所有对象另外用弱引用记着，被淘汰了但还被别的对象引用着（还在对象图里）的对象
+  再次加载时会拿到同一个实例，不会出现同一个对象加载出两份的情况
+
+接口和dict差不多，dataloader里原来的用法基本不用改。
+"""
+
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterator, Optional, Set, Tuple
+
+from .basetype import ClassDataType
+
+
+CacheKey = Tuple[Optional[Hashable], str, Any]
+"缓存id，(历史记录uuid, 数据类型名, 对象uuid)，历史记录uuid为None则为此周"
+
+DATA_SIZE_FACTOR = 5
+"加载出来的对象（连同里面的字符串、字典）大概是原数据长度的几倍，用tracemalloc量的分数修改记录和学生"
+
+
+def estimate_size(obj: ClassDataType, data: Any = None) -> int:
+    """
+    估计一个对象占用的内存。
+
+    有序列化的数据的话按照数据长度估计（见DATA_SIZE_FACTOR），
+    否则只算对象本身和它的__dict__。
+
+    :param obj: 对象
+    :param data: 加载这个对象用的数据（json字符串或者二进制）
+    :return: 字节数
+    """
+    if data is not None:
+        return DATA_SIZE_FACTOR * len(data)
+    return sys.getsizeof(obj) + sys.getsizeof(getattr(obj, "__dict__", None))
+
+
+class ObjectCache:
+    "加载出来的对象的缓存，见模块说明"
+
+    def __init__(
+        self,
+        max_objects: int = 500000,
+        max_bytes: int = 512 * 1024 * 1024,
+        pinned_histories: Optional[Set[Optional[Hashable]]] = None,
+    ):
+        """
+        构造一个缓存。
+
+        :param max_objects: 最多缓存多少个没固定的对象
+        :param max_bytes: 没固定的对象最多占用多少字节（估计值，见estimate_size）
+        :param pinned_histories: 固定的历史记录uuid，默认只固定此周（None）
+        """
+        self.max_objects = max_objects
+        "最多缓存多少个没固定的对象"
+        self.max_bytes = max_bytes
+        "没固定的对象最多占用多少字节"
+        self.pinned_histories: Set[Optional[Hashable]] = (
+            {None} if pinned_histories is None else set(pinned_histories)
+        )
+        "固定的历史记录uuid"
+        self.lock = threading.RLock()
+        "读写缓存用的锁"
+        self.entries: "OrderedDict[CacheKey, Tuple[ClassDataType, int]]" = OrderedDict()
+        "没固定的对象，entries[缓存id] = (对象, 估计大小)，按照最近使用的顺序排，最前面的最先淘汰"
+        self.pinned: Dict[CacheKey, ClassDataType] = {}
+        "固定的对象"
+        self.weak: "weakref.WeakValueDictionary[CacheKey, ClassDataType]" = (
+            weakref.WeakValueDictionary()
+        )
+        "所有放进来过并且还活着的对象（包括被淘汰了的）"
+        self.history_keys: Dict[Optional[Hashable], Set[CacheKey]] = {}
+        "每个历史记录在缓存里的对象，history_keys[历史记录uuid] = {缓存id, ...}"
+        self.total_bytes = 0
+        "没固定的对象的估计大小之和"
+        self.hits = 0
+        "命中次数"
+        self.revived = 0
+        "命中次数里面，对象已经被淘汰但还活着（从弱引用里找回来）的次数"
+        self.misses = 0
+        "未命中次数"
+        self.evictions = 0
+        "淘汰的对象数量"
+
+    def __getitem__(self, key: CacheKey) -> ClassDataType:
+        with self.lock:
+            obj = self.pinned.get(key)
+            if obj is not None:
+                self.hits += 1
+                return obj
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            obj = self.weak.get(key)
+            if obj is None:
+                self.misses += 1
+                raise KeyError(key)
+            # 被淘汰了但还在对象图里，放回去，免得加载出第二个实例
+            self.hits += 1
+            self.revived += 1
+            self._insert(key, obj, estimate_size(obj))
+            return obj
+
+    def __setitem__(self, key: CacheKey, obj: ClassDataType) -> None:
+        self.put(key, obj)
+
+    def __delitem__(self, key: CacheKey) -> None:
+        with self.lock:
+            if not self._remove(key) and key not in self.weak:
+                raise KeyError(key)
+            self.weak.pop(key, None)
+
+    def __contains__(self, key: CacheKey) -> bool:
+        with self.lock:
+            return key in self.pinned or key in self.entries or key in self.weak
+
+    def __len__(self) -> int:
+        return len(self.pinned) + len(self.entries)
+
+    def __iter__(self) -> Iterator[CacheKey]:
+        with self.lock:
+            return iter(list(self.pinned) + list(self.entries))
+
+    def get(self, key: CacheKey, default: Any = None) -> Any:
+        "和dict.get一样，但是不算命中/未命中"
+        with self.lock:
+            obj = self.pinned.get(key)
+            if obj is None:
+                entry = self.entries.get(key)
+                obj = entry[0] if entry is not None else self.weak.get(key)
+            return default if obj is None else obj
+
+    def put(self, key: CacheKey, obj: ClassDataType, size: Optional[int] = None) -> None:
+        """
+        放入一个对象，超出限制的话淘汰最久没用过的对象。
+
+        :param key: 缓存id
+        :param obj: 对象
+        :param size: 估计大小，不填就用estimate_size(obj)
+        """
+        with self.lock:
+            self._remove(key)
+            self._insert(key, obj, estimate_size(obj) if size is None else size)
+
+    def resize(self, key: CacheKey, size: int) -> None:
+        """
+        更新一个对象的估计大小（比如对象加载完之后按照数据长度重新估计）。
+
+        :param key: 缓存id
+        :param size: 估计大小
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            self.total_bytes += size - entry[1]
+            self.entries[key] = (entry[0], size)
+            self._evict()
+
+    def _insert(self, key: CacheKey, obj: ClassDataType, size: int) -> None:
+        self.weak[key] = obj
+        self.history_keys.setdefault(key[0], set()).add(key)
+        if key[0] in self.pinned_histories:
+            self.pinned[key] = obj
+            return
+        self.entries[key] = (obj, size)
+        self.total_bytes += size
+        self._evict()
+
+    def _remove(self, key: CacheKey) -> bool:
+        "把一个对象的强引用删掉（弱引用留着），返回它在不在缓存里"
+        if self.pinned.pop(key, None) is not None:
+            self._forget(key)
+            return True
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+            self._forget(key)
+            return True
+        return False
+
+    def _forget(self, key: CacheKey) -> None:
+        keys = self.history_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.history_keys[key[0]]
+
+    def _evict(self) -> None:
+        "淘汰最久没用过的对象，直到数量和大小都在限制以内"
+        while self.entries and (
+            len(self.entries) > self.max_objects or self.total_bytes > self.max_bytes
+        ):
+            key, (_, size) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self._forget(key)
+            self.evictions += 1
+
+    def pin(self, history_uuid: Optional[Hashable]) -> None:
+        """
+        固定一个历史记录，它已经在缓存里的和之后放进来的对象都不会被淘汰。
+
+        :param history_uuid: 历史记录uuid，None为此周
+        """
+        with self.lock:
+            self.pinned_histories.add(history_uuid)
+            for key in list(self.history_keys.get(history_uuid, ())):
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.total_bytes -= entry[1]
+                    self.pinned[key] = entry[0]
+
+    def unpin(self, history_uuid: Optional[Hashable]) -> None:
+        """
+        取消固定一个历史记录，它的对象变回可以被淘汰的。
+
+        :param history_uuid: 历史记录uuid，None为此周
+        """
+        with self.lock:
+            self.pinned_histories.discard(history_uuid)
+            for key in list(self.history_keys.get(history_uuid, ())):
+                obj = self.pinned.pop(key, None)
+                if obj is not None:
+                    size = estimate_size(obj)
+                    self.entries[key] = (obj, size)
+                    self.total_bytes += size
+            self._evict()
+
+    def release_history(self, history_uuid: Optional[Hashable]) -> int:
+        """
+        把一个历史记录的对象全部移出缓存（包括弱引用）。
+
+        :param history_uuid: 历史记录uuid，None为此周
+        :return: 移出的对象数量
+        """
+        with self.lock:
+            keys = self.history_keys.pop(history_uuid, set())
+            for key in keys:
+                if self.pinned.pop(key, None) is None:
+                    entry = self.entries.pop(key, None)
+                    if entry is not None:
+                        self.total_bytes -= entry[1]
+            for key in [key for key in list(self.weak.keys()) if key[0] == history_uuid]:
+                self.weak.pop(key, None)
+            return len(keys)
+
+    def clear(self) -> None:
+        "清空缓存（计数器保留）"
+        with self.lock:
+            self.entries.clear()
+            self.pinned.clear()
+            self.weak.clear()
+            self.history_keys.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取缓存的统计信息。
+
+        :return: 统计信息，给调试窗口显示用
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "revived": self.revived,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "objects": len(self.entries),
+                "pinned": len(self.pinned),
+                "alive": len(self.weak),
+                "bytes": self.total_bytes,
+            }
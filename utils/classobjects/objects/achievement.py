@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import json
+import sys
 from typing import (Literal, TYPE_CHECKING, Dict, Any)
 from ..classdataobj import ClassDataObj
-from ..basetype import ClassDataType
+from ..basetype import ClassDataType, holds_state_lock
 from utils.basetypes import Base
 
 
@@ -13,11 +14,35 @@ if TYPE_CHECKING:
 
 
 class Achievement(ClassDataType):
-    "一个真实被达成的成就"
+    "一个真实被达成的成就（和ScoreModification一样用__slots__）"
+
+    __slots__ = (
+        "_uuid",
+        "_archive_uuid",
+        "_loaded",
+        "_dirty",
+        "time",
+        "time_key",
+        "temp",
+        "target",
+        "sound",
+        "__weakref__",
+    )
 
     chunk_type_name: Literal["Achievement"] = "Achievement"
     "类型名"
 
+    codec_fields = (
+        ("uuid", "uuid"),
+        ("archive_uuid", "uuid"),
+        ("time", "value"),
+        ("time_key", "value"),
+        ("template", "uuid"),
+        ("target", "uuid"),
+        ("sound", "value"),
+    )
+    "二进制编码时按顺序写入的字段（见codec.py）"
+
     is_unrelated_data_type = False
     "是否是与其他班级数据类型无关联的数据类型"
 
@@ -60,15 +85,21 @@ class Achievement(ClassDataType):
         self.target = target
         self.sound = self.temp.sound
         self.archive_uuid = ClassDataObj.get_archive_uuid()
+        self._dirty = True
 
+    @holds_state_lock
     def give(self):
         "发放成就"
+        if self.target.is_frozen:
+            Base.log("W", "目标是重置前冻结的版本，不能发放成就", "Achievement.give")
+            return
         Base.log(
             "I",
             f"发放成就：target={repr(self.target)}, "
             f"time={repr(self.time)}, key={self.time_key}",
         )
         self.target.achievements[self.time_key] = self
+        self.target.mark_dirty()
 
     def delete(self):
         "删除成就"
@@ -79,27 +110,28 @@ class Achievement(ClassDataType):
         )
         del self
 
-    def to_string(self):
+    def to_dict(self) -> dict:
+        "将成就对象转换为字典。"
+        return {
+            "type": self.chunk_type_name,
+            "time": self.time,
+            "time_key": self.time_key,
+            "template": str(self.temp.uuid),
+            "target": str(self.target.uuid),
+            "sound": self.sound,
+            "uuid": str(self.uuid),
+            "archive_uuid": str(self.archive_uuid),
+        }
+
+    def to_string(self) -> str:
         "将成就对象转换为字符串。"
-        return json.dumps(
-            {
-                "type": self.chunk_type_name,
-                "time": self.time,
-                "time_key": self.time_key,
-                "template": str(self.temp.uuid),
-                "target": str(self.target.uuid),
-                "sound": self.sound,
-                "uuid": str(self.uuid),
-                "archive_uuid": str(self.archive_uuid),
-            }
-        )
+        return json.dumps(self.to_dict())
 
     @staticmethod
-    def from_string(string: str):
-        "从字符串加载成就对象。"
+    def from_dict(d: dict):
+        "从字典加载成就对象。"
         from .achievementtemp import AchievementTemplate
         from .student import Student
-        d: Dict[str, Any] = json.loads(string)
         if d["type"] != Achievement.chunk_type_name:
             raise ValueError(
                 f"类型不匹配：{d['type']} != {Achievement.chunk_type_name}"
@@ -110,13 +142,18 @@ class Achievement(ClassDataType):
             reach_time=d["time"],
             reach_time_key=d["time_key"],
         )
-        obj.sound = d["sound"]
+        obj.sound = sys.intern(d["sound"]) if isinstance(d["sound"], str) else d["sound"]
         obj.uuid = d["uuid"]
         obj.archive_uuid = d["archive_uuid"]
         return obj
 
+    @staticmethod
+    def from_string(string: str):
+        "从字符串加载成就对象。"
+        return Achievement.from_dict(json.loads(string))
+
     def inst_from_string(self, string: str):
         "将字符串加载与本身。"
         obj = self.from_string(string)
-        self.__dict__.update(obj.__dict__)
+        self.update_attrs(obj.instance_attrs())
         return self
\ No newline at end of file
@@ -25,9 +25,18 @@ class AchievementTemplate(ClassDataType):
         chunk_type_name: Literal["AchievementTemplate"] = "AchievementTemplate"
         "类型名"
 
+        codec_fields = (
+            ("uuid", "uuid"),
+            ("archive_uuid", "uuid"),
+        )
+        "二进制编码时按顺序写入的字段（见codec.py）"
+
         is_unrelated_data_type = True
         "是否是与其他班级数据类型无关联的数据类型"
 
+        transient_attrs = ("_others_cache",)
+        "条件函数pickle结果的缓存（见_encode_others）不跟着存档和深拷贝走"
+
         dummy: "AchievementTemplate" = None
         "空的成就模板"
 
@@ -313,7 +322,9 @@ class AchievementTemplate(ClassDataType):
                 return False
             try:
                 if hasattr(self, "score_rank_down_limit"):
-                    lowest_rank = max(*([i[0] for i in class_obs.rank_dumplicate]))
+                    # 用班级的排名索引，不用每次检查都把全班排两遍
+                    ranking = class_obs.target_class.ranking
+                    lowest_rank = ranking.distinct_count
                     l = (
                         (lowest_rank + self.score_rank_down_limit + 1)
                         if self.score_rank_down_limit < 0
@@ -324,15 +335,7 @@ class AchievementTemplate(ClassDataType):
                         if self.score_rank_up_limit < 0
                         else self.score_rank_up_limit
                     )
-                    if not (
-                        l
-                        <= [
-                            i[0]
-                            for i in class_obs.rank_dumplicate
-                            if i[1].num == student.num
-                        ][0]
-                        <= r
-                    ):
+                    if not l <= ranking.dense_rank(ranking.items[student.num][1]) <= r:
                         return False
             except (
                 KeyError,
@@ -584,20 +587,46 @@ class AchievementTemplate(ClassDataType):
             return_str += "\n" * 2 + self.condition_info
             return return_str
 
-        def to_string(self):
-            "从字符串加载成就模板对象。"
+        def to_dict(self) -> dict:
+            "将成就模板对象转换为字典。"
             obj = {"type": self.chunk_type_name}
             obj.update(self.kwargs)
             if "others" in obj:
-                obj["others"] = base64.b64encode(pickle.dumps(obj["others"])).decode()
+                obj["others"] = self._encode_others(obj["others"])
             obj["uuid"] = str(self.uuid)
             obj["archive_uuid"] = str(self.archive_uuid)
-            return json.dumps(obj)
+            return obj
+
+        def _encode_others(self, others) -> str:
+            """
+            把条件函数pickle成字符串。
+
+            pickle函数比转换其它所有对象加起来还慢，拍快照的时候又要拿着状态锁做，
+            所以函数没换过的话直接用上一次的结果。
+
+            :param others: 条件函数的列表
+            :return: base64编码的pickle结果
+            """
+            functions = tuple(others) if isinstance(others, (list, tuple)) else (others,)
+            cached = self.__dict__.get("_others_cache")
+            if (
+                cached is not None
+                and len(cached[0]) == len(functions)
+                and all(a is b for a, b in zip(cached[0], functions))
+            ):
+                return cached[1]
+            encoded = base64.b64encode(pickle.dumps(others)).decode()
+            # 留着函数的引用，免得id被别的对象复用
+            self._others_cache = (functions, encoded)
+            return encoded
+
+        def to_string(self) -> str:
+            "将成就模板对象转换为字符串。"
+            return json.dumps(self.to_dict())
 
         @staticmethod
-        def from_string(string: str):
-            "从字符串加载成就模板对象。"
-            d: Dict[str, Any] = json.loads(string)
+        def from_dict(d: dict):
+            "从字典加载成就模板对象。"
             if d["type"] != AchievementTemplate.chunk_type_name:
                 raise ValueError(
                     f"类型不匹配：{d['type']} != {AchievementTemplate.chunk_type_name}"
@@ -624,6 +653,11 @@ class AchievementTemplate(ClassDataType):
             obj.active = True
             return obj
 
+        @staticmethod
+        def from_string(string: str):
+            "从字符串加载成就模板对象。"
+            return AchievementTemplate.from_dict(json.loads(string))
+
         def inst_from_string(self, string: str):
             "将字符串加载与本身。"
             obj = self.from_string(string)
@@ -16,6 +16,20 @@ class AttendanceInfo(ClassDataType):
     chunk_type_name: Literal["AttendanceInfo"] = "AttendanceInfo"
     "类型名"
 
+    codec_fields = (
+        ("uuid", "uuid"),
+        ("archive_uuid", "uuid"),
+        ("target_class", "str"),
+        ("is_early", ("list", "uuid")),
+        ("is_late", ("list", "uuid")),
+        ("is_late_more", ("list", "uuid")),
+        ("is_absent", ("list", "uuid")),
+        ("is_leave", ("list", "uuid")),
+        ("is_leave_early", ("list", "uuid")),
+        ("is_leave_late", ("list", "uuid")),
+    )
+    "二进制编码时按顺序写入的字段（见codec.py）"
+
     is_unrelated_data_type = False
     "是否是与其他班级数据类型无关联的数据类型"
 
@@ -85,29 +99,30 @@ class AttendanceInfo(ClassDataType):
         self.archive_uuid = ClassDataObj.get_archive_uuid()
         "存档UUID"
 
+    def to_dict(self) -> dict:
+        "将出勤信息对象转换为字典。"
+        return {
+            "type": self.chunk_type_name,
+            "target_class": self.target_class,
+            "is_early": [str(s.uuid) for s in self.is_early],
+            "is_late": [str(s.uuid) for s in self.is_late],
+            "is_late_more": [str(s.uuid) for s in self.is_late_more],
+            "is_absent": [str(s.uuid) for s in self.is_absent],
+            "is_leave": [str(s.uuid) for s in self.is_leave],
+            "is_leave_early": [str(s.uuid) for s in self.is_leave_early],
+            "is_leave_late": [str(s.uuid) for s in self.is_leave_late],
+            "uuid": str(self.uuid),
+            "archive_uuid": str(self.archive_uuid),
+        }
+
     def to_string(self) -> str:
         "将考勤记录对象转为字符串。"
-        return json.dumps(
-            {
-                "type": self.chunk_type_name,
-                "target_class": self.target_class,
-                "is_early": [str(s.uuid) for s in self.is_early],
-                "is_late": [str(s.uuid) for s in self.is_late],
-                "is_late_more": [str(s.uuid) for s in self.is_late_more],
-                "is_absent": [str(s.uuid) for s in self.is_absent],
-                "is_leave": [str(s.uuid) for s in self.is_leave],
-                "is_leave_early": [str(s.uuid) for s in self.is_leave_early],
-                "is_leave_late": [str(s.uuid) for s in self.is_leave_late],
-                "uuid": str(self.uuid),
-                "archive_uuid": str(self.archive_uuid),
-            }
-        )
+        return json.dumps(self.to_dict())
 
     @staticmethod
-    def from_string(string: str) -> "AttendanceInfo":
-        "从字符串加载出勤信息对象。"
+    def from_dict(d: dict) -> "AttendanceInfo":
+        "从字典加载出勤信息对象。"
         from .student import Student
-        d = json.loads(string)
         if d["type"] != AttendanceInfo.chunk_type_name:
             raise ValueError(
                 f"类型不匹配：{d['type']} != {AttendanceInfo.chunk_type_name}"
@@ -130,6 +145,11 @@ class AttendanceInfo(ClassDataType):
         obj.archive_uuid = d["archive_uuid"]
         return obj
 
+    @staticmethod
+    def from_string(string: str) -> "AttendanceInfo":
+        "从字符串加载出勤信息对象。"
+        return AttendanceInfo.from_dict(json.loads(string))
+
     def is_normal(self, target_class: Class) -> List[Student]:
         "正常出勤的学生，没有缺席"
         return [
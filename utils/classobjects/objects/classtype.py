@@ -4,10 +4,10 @@ import copy
 import json
 from typing import (Literal, Optional, TYPE_CHECKING, 
                     Tuple, Union, List, Dict)
-from utils.consts import inf
-from utils.algorithm import OrderedKeyList
+from utils.algorithm import OrderedKeyList, RankingIndex, ScoreAggregate
+from utils.consts import debug
 from ..classdataobj import ClassDataObj
-from ..basetype import ClassDataType
+from ..basetype import ClassDataType, holds_state_lock
 from utils.basetypes import Base
 
 if TYPE_CHECKING:
@@ -22,6 +22,22 @@ class Class(ClassDataType):
         chunk_type_name: Literal["Class"] = "Class"
         "类型名"
 
+        transient_attrs = ("_ranking", "_aggregate")
+        "学生排名的索引和分数统计不跟着存档和深拷贝走，用的时候再建（见_student_index）"
+
+        codec_fields = (
+            ("uuid", "uuid"),
+            ("archive_uuid", "uuid"),
+            ("key", "str"),
+            ("name", "str"),
+            ("owner", "str"),
+            ("students", ("pairs", "value", "uuid")),
+            ("groups", ("pairs", "value", "uuid")),
+            ("cleaning_mapping", "value"),
+            ("homework_rules", ("pairs", "value", ("record", "HomeworkRule"))),
+        )
+        "二进制编码时按顺序写入的字段（见codec.py）"
+
         is_unrelated_data_type = False
         "是否是与其他班级数据类型无关联的数据类型"
 
@@ -85,7 +101,7 @@ class Class(ClassDataType):
         @property
         def total_score(self):
             "班级总分"
-            return sum([s.score for s in self.students.values()])
+            return self.aggregate.total
 
         @property
         def student_count(self):
@@ -95,21 +111,67 @@ class Class(ClassDataType):
         @property
         def student_total_score(self):
             "学生总分（好像写过了）"
-            return sum([s.score for s in self.students.values()])
+            return self.aggregate.total
 
         @property
         def student_avg_score(self):
             "学生平均分"
             # Tip:避免除以零错误
-            return self.student_total_score / max(self.student_count, 1)
+            return self.aggregate.mean
+
+        def _student_index(self, attr: str, build):
+            """取一个跟着学生分数更新的索引（第一次用的时候建立，之后学生改分数的时候更新，见Student.score）。
+
+            学生有增删（人数对不上）、换了整个学生字典或者改了学号的时候会重建
+
+            :param attr: 存索引的属性名，存的是(索引, 建立时的学生字典)
+            :param build: 用学生建立索引的函数"""
+            entry = self.__dict__.get(attr)
+            if (
+                entry is None
+                or entry[0].stale
+                or entry[1] is not self.students
+                or len(entry[0]) != len(self.students)
+            ):
+                old = entry[0] if entry is not None else None
+                index = build(self.students.values())
+                for s in self.students.values():
+                    s.watch_score(index, old)
+                entry = (index, self.students)
+                self.__dict__[attr] = entry
+            return entry[0]
+
+        @property
+        def ranking(self) -> RankingIndex["Student"]:
+            "学生排名的索引（见_student_index）"
+            return self._student_index("_ranking", RankingIndex)
+
+        @property
+        def aggregate(self) -> ScoreAggregate["Student"]:
+            "学生分数的统计（总分、平均分、最高最低分，见_student_index），调试模式下每次有改动都会核对一遍"
+            aggregate = self._student_index("_aggregate", ScoreAggregate)
+            if debug:
+                aggregate.verify()
+            return aggregate
+
+        def recompute(self) -> Dict[str, tuple]:
+            """重新计算学生分数的统计，核对维护的值。
+
+            :return: 对不上的地方，见ScoreAggregate.recompute"""
+            return self._student_index("_aggregate", ScoreAggregate).recompute()
+
+        def invalidate_indexes(self) -> None:
+            "标记学生排名和分数统计需要重建（增删学生之后调用）"
+            for attr in ("_ranking", "_aggregate"):
+                entry = self.__dict__.get(attr)
+                if entry is not None:
+                    entry[0].invalidate()
 
         @property
         def stu_score_ord(self):
-            "学生分数排序，这个不常用"
-            return dict(
-                enumerate(
-                    sorted(list(self.students.values()), key=lambda a: a.score), start=1
-                )
+            "学生分数排序，这个不常用（有缓存，别改返回的字典）"
+            return self.ranking.cached(
+                "stu_score_ord", lambda r: dict(enumerate(r.ascending(), start=1))
             )
 
         @property
@@ -127,22 +189,7 @@ class Class(ClassDataType):
                 (5, Student(name="某个学生", score=9,   ...)),
                 (7, Student(name="某个学生", score=1,   ...))
             ]"""
-            stu_list = self.students.values()
-            stu_list = sorted(stu_list, key=lambda s: s.score, reverse=True)
-            stu_list2: List[Tuple[int, Student]] = []
-            last = inf
-            last_ord = 0
-            cur_ord = 0
-            for stu in stu_list:
-                cur_ord += 1
-                if stu.score == last:
-                    _ord = last_ord
-                else:
-                    _ord = cur_ord
-                    last_ord = cur_ord
-                stu_list2.append((_ord, stu))
-                last = stu.score
-            return stu_list2
+            return list(self.ranking.competition_ranking())
 
         @property
         def rank_dumplicate(self):
@@ -159,30 +206,48 @@ class Class(ClassDataType):
                 (4, Student(name="某个学生", score=9,   ...)),
                 (5, Student(name="某个学生", score=1,   ...))
             ]"""
-            stu_list = self.students.values()
-            stu_list = sorted(stu_list, key=lambda s: s.score, reverse=True)
-            stu_list2: List[Tuple[int, Student]] = []
-            last = inf
-            last_ord = 0
-            for stu in stu_list:
-                if stu.score != last:
-                    last_ord += 1
-                    last = stu.score
-                stu_list2.append((last_ord, stu))
-                
-            return stu_list2
-
-        def reset(self) -> "Class":
-            "重置班级"
-            class_orig = copy.deepcopy(self)
+            return list(self.ranking.dense_ranking())
+
+        @holds_state_lock
+        def reset(self, archive: Optional[str] = None) -> "Class":
+            """重置班级
+
+            重置前的班级、学生、小组会冻结成一个版本返回（和重置后的共用没有变的东西，不用深拷贝），
+            重置后的学生的last_reset_info指向自己冻结的版本
+
+            :param archive: 冻结的版本要放进的历史记录的uuid
+            :return: 重置前的班级（冻结的版本）"""
             Base.log("W", f" -> 重置班级：{self.name} ({self.key})")
+            frozen_students: Dict[int, Student] = {}
             for s in self.students.values():
-                s.reset()
+                s.reset(archive=archive)
+                frozen_students[id(s)] = s.last_reset_info
+            class_orig = self.freeze(frozen_students)
             self.refresh_uuid()
             return class_orig
 
-        def to_string(self) -> str:
-            "将班级对象转换为字符串。"
+        def freeze(self, students: Dict[int, Student]) -> "Class":
+            """把班级冻结成一个版本，学生、小组和值日安排里的学生换成冻结的版本。
+
+            :param students: students[id(学生)] = 冻结的版本，不在里面的学生不换
+            :return: 冻结的版本（uuid和现在的一样）"""
+            frozen = copy.copy(self)    # 排名索引和分数统计（transient_attrs）不跟着走
+            frozen.students = {
+                k: students.get(id(s), s) for k, s in self.students.items()
+            }
+            frozen.groups = {k: g.freeze(students) for k, g in self.groups.items()}
+            if hasattr(self, "cleaning_mapping"):
+                frozen.cleaning_mapping = {
+                    day: {role: [students.get(id(s), s) for s in members]
+                          for role, members in mapping.items()}
+                    for day, mapping in self.cleaning_mapping.items()
+                }
+            # 作业规则以后可能会改，而且很小，直接复制
+            frozen.homework_rules = copy.deepcopy(self.homework_rules)
+            return frozen
+
+        def to_dict(self) -> dict:
+            "将班级对象转换为字典。"
             if hasattr(self, "cleaing_mapping") and not hasattr(
                 self, "cleaning_mapping"
             ):
@@ -192,33 +257,34 @@ class Class(ClassDataType):
                         int, Dict[Literal["member", "leader"], List[Student]]
                     ]
                 ] = getattr(self, "cleaing_mapping")
-            return json.dumps(
-                {
-                    "type": self.chunk_type_name,
-                    "key": self.key,
-                    "name": self.name,
-                    "owner": self.owner,
-                    "students": [(s.num, str(s.uuid)) for s in self.students.values()],
-                    "groups": [(g.key, str(g.uuid)) for g in self.groups.values()],
-                    "cleaning_mapping": [
-                        (k, [(t, [str(_s.uuid) for _s in s]) for t, s in v.items()])
-                        for k, v in self.cleaning_mapping.items()
-                    ],
-                    "homework_rules": [
-                        (n, h.to_string()) for n, h in self.homework_rules.items()
-                    ],
-                    "uuid": str(self.uuid),
-                    "archive_uuid": str(self.archive_uuid),
-                }
-            )
+            return {
+                "type": self.chunk_type_name,
+                "key": self.key,
+                "name": self.name,
+                "owner": self.owner,
+                "students": [(s.num, str(s.uuid)) for s in self.students.values()],
+                "groups": [(g.key, str(g.uuid)) for g in self.groups.values()],
+                "cleaning_mapping": [
+                    (k, [(t, [str(_s.uuid) for _s in s]) for t, s in v.items()])
+                    for k, v in self.cleaning_mapping.items()
+                ],
+                "homework_rules": [
+                    (n, h.to_dict()) for n, h in self.homework_rules.items()
+                ],
+                "uuid": str(self.uuid),
+                "archive_uuid": str(self.archive_uuid),
+            }
+
+        def to_string(self) -> str:
+            "将班级对象转换为字符串。"
+            return json.dumps(self.to_dict())
 
         @staticmethod
-        def from_string(string: str) -> "Class":
-            "从字符串加载班级对象。"
+        def from_dict(d: dict) -> "Class":
+            "从字典加载班级对象。"
             from .student import Student
             from .group import Group
             from .homeworkrule import HomeworkRule
-            d = json.loads(string)
             if d["type"] != Class.chunk_type_name:
                 raise ValueError(f"类型不匹配：{d['type']} != {Class.chunk_type_name}")
             obj = Class(
@@ -239,7 +305,8 @@ class Class(ClassDataType):
                     for k, v in d["cleaning_mapping"]
                 },
                 homework_rules={
-                    n: HomeworkRule.from_string(h)
+                    # 以前的存档里作业规则是套在里面的json字符串
+                    n: HomeworkRule.from_dict(h) if isinstance(h, dict) else HomeworkRule.from_string(h)
                     for n, h in d["homework_rules"]
                 },
             )
@@ -247,6 +314,11 @@ class Class(ClassDataType):
             obj.archive_uuid = d["archive_uuid"]
             return obj
 
+        @staticmethod
+        def from_string(string: str) -> "Class":
+            "从字符串加载班级对象。"
+            return Class.from_dict(json.loads(string))
+
         def inst_from_string(self, string: str):
             "将字符串加载与本身。"
             obj = self.from_string(string)
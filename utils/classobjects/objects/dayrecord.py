@@ -15,6 +15,16 @@ class DayRecord(ClassDataType):
         chunk_type_name: Literal["DayRecord"] = "DayRecord"
         "类型名"
 
+        codec_fields = (
+            ("uuid", "uuid"),
+            ("archive_uuid", "uuid"),
+            ("target_class", "uuid"),
+            ("weekday", "value"),
+            ("utc", "value"),
+            ("attendance_info", "uuid"),
+        )
+        "二进制编码时按顺序写入的字段（见codec.py）"
+
         is_unrelated_data_type = False
         "是否是与其他班级数据类型无关联的数据类型"
 
@@ -49,28 +59,29 @@ class DayRecord(ClassDataType):
             self.target_class = target_class
             self.archive_uuid = ClassDataObj.get_archive_uuid()
 
-        def to_string(self):
-            "将每日记录对象转为字符串。"
+        def to_dict(self) -> dict:
+            "将每日记录对象转换为字典。"
             if isinstance(self.target_class, dict):
                 self.target_class = self.target_class[self.target_class.keys()[0]]
-            return json.dumps(
-                {
-                    "type": self.chunk_type_name,
-                    "target_class": str(self.target_class.uuid),
-                    "weekday": self.weekday,
-                    "utc": self.utc,
-                    "attendance_info": str(self.attendance_info.uuid),
-                    "uuid": str(self.uuid),
-                    "archive_uuid": str(self.archive_uuid),
-                }
-            )
+            return {
+                "type": self.chunk_type_name,
+                "target_class": str(self.target_class.uuid),
+                "weekday": self.weekday,
+                "utc": self.utc,
+                "attendance_info": str(self.attendance_info.uuid),
+                "uuid": str(self.uuid),
+                "archive_uuid": str(self.archive_uuid),
+            }
+
+        def to_string(self) -> str:
+            "将每日记录对象转为字符串。"
+            return json.dumps(self.to_dict())
 
         @staticmethod
-        def from_string(string: str) -> "DayRecord":
-            "从字符串加载每日记录对象。"
+        def from_dict(d: dict) -> "DayRecord":
+            "从字典加载每日记录对象。"
             from .classtype import Class
             from .attendanceinfo import AttendanceInfo
-            d = json.loads(string)
             if d["type"] != DayRecord.chunk_type_name:
                 raise ValueError(
                     f"类型不匹配：{d['type']} != {DayRecord.chunk_type_name}"
@@ -85,6 +96,11 @@ class DayRecord(ClassDataType):
             obj.archive_uuid = d["archive_uuid"]
             return obj
 
+        @staticmethod
+        def from_string(string: str) -> "DayRecord":
+            "从字符串加载每日记录对象。"
+            return DayRecord.from_dict(json.loads(string))
+
         def inst_from_string(self, string: str):
             "将字符串加载与本身。"
             obj = self.from_string(string)
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import copy
 import json
-from typing import (Literal, TYPE_CHECKING, List)
+from typing import (Any, Dict, Literal, TYPE_CHECKING, List, Tuple)
+from utils.algorithm import ScoreAggregate
+from utils.consts import debug
 from ..classdataobj import ClassDataObj
 from ..basetype import ClassDataType
 
@@ -15,12 +18,27 @@ class Group(ClassDataType):
     chunk_type_name: Literal["Group"] = "Group"
     "类型名"
 
+    codec_fields = (
+        ("uuid", "uuid"),
+        ("archive_uuid", "uuid"),
+        ("key", "str"),
+        ("name", "str"),
+        ("leader", "uuid"),
+        ("members", ("list", "uuid")),
+        ("belongs_to", "str"),
+        ("further_desc", "str"),
+    )
+    "二进制编码时按顺序写入的字段（见codec.py）"
+
     is_unrelated_data_type = False
     "是否是与其他班级数据类型无关联的数据类型"
 
     dummy: "Group" = None
     "空小组"
 
+    transient_attrs = ("_aggregate",)
+    "组员分数的统计不跟着存档和深拷贝走，用的时候再建（见aggregate）"
+
     @staticmethod
     def new_dummy():
         "创建一个空的小组"
@@ -62,31 +80,105 @@ class Group(ClassDataType):
         self.archive_uuid = ClassDataObj.get_archive_uuid()
         "归档uuid"
 
+    @property
+    def aggregate(self) -> ScoreAggregate["Student"]:
+        """组员分数的统计（第一次用的时候建立，之后组员改分数的时候更新，见Student.score），
+        调试模式下每次有改动都会核对一遍
+
+        换了整个members列表或者人数对不上的时候会重建，
+        直接改了members里的元素的话要调用invalidate_aggregate（或者用add_member、remove_member）"""
+        entry: Tuple[ScoreAggregate[Student], List[Student]] = self.__dict__.get("_aggregate")
+        if (
+            entry is None
+            or entry[0].stale
+            or entry[1] is not self.members
+            or len(entry[0]) != len(self.members)
+        ):
+            old = entry[0] if entry is not None else None
+            if old is not None:
+                for s in old:
+                    s.unwatch_score(old)
+            aggregate = ScoreAggregate(self.members)
+            for s in self.members:
+                s.watch_score(aggregate)
+            entry = (aggregate, self.members)
+            self._aggregate = entry
+        if debug:
+            entry[0].verify()
+        return entry[0]
+
+    def invalidate_aggregate(self) -> None:
+        "标记组员分数的统计需要重建（直接改了members之后调用）"
+        entry = self.__dict__.get("_aggregate")
+        if entry is not None:
+            entry[0].invalidate()
+
+    def recompute(self) -> Dict[str, Tuple[Any, Any]]:
+        """重新计算组员分数的统计，核对维护的值。
+
+        :return: 对不上的地方，见ScoreAggregate.recompute"""
+        entry = self.__dict__.get("_aggregate")
+        if entry is None:
+            self.aggregate  # pylint: disable=pointless-statement
+            entry = self._aggregate
+        return entry[0].recompute()
+
+    def freeze(self, students: Dict[int, Student]) -> "Group":
+        """把小组冻结成一个版本（班级重置的时候用），组长和组员换成他们冻结的版本。
+
+        :param students: students[id(学生)] = 冻结的版本，不在里面的学生不换
+        :return: 冻结的版本（uuid和现在的一样）"""
+        frozen = copy.copy(self)    # 组员分数的统计（transient_attrs）不跟着走
+        frozen.leader = students.get(id(self.leader), self.leader)
+        frozen.members = [students.get(id(s), s) for s in self.members]
+        return frozen
+
+    def add_member(self, student: Student) -> None:
+        """加入一个组员（已经在组里的不管）。
+
+        :param student: 学生"""
+        if any(s is student for s in self.members):
+            return
+        aggregate = self.aggregate
+        self.members.append(student)
+        aggregate.add(student)
+        student.watch_score(aggregate)
+
+    def remove_member(self, student: Student) -> bool:
+        """移除一个组员。
+
+        :param student: 学生
+        :return: 是否移除了（不在组里则为False）"""
+        for index, s in enumerate(self.members):
+            if s is student:
+                break
+        else:
+            return False
+        aggregate = self.aggregate
+        del self.members[index]
+        aggregate.remove(student)
+        student.unwatch_score(aggregate)
+        return True
+
     @property
     def total_score(self):
         "查看小组的总分。"
-        return round(sum([s.score for s in self.members]), 1)
+        return round(self.aggregate.total, 1)
 
     @property
     def average_score(self):
         "查看小组的平均分。"
-        return round(sum([s.score for s in self.members]) / len(self.members), 2)
+        aggregate = self.aggregate
+        # 和以前一样，没有组员的时候会除以零
+        return round(aggregate.total / len(aggregate), 2)
 
     @property
     def average_score_without_lowest(self):
         "查看小组去掉最低分后的平均分。"
+        aggregate = self.aggregate
         return (
-            (
-                round(
-                    (
-                        sum([s.score for s in self.members])
-                        - min(*[s.score for s in self.members])
-                    )
-                    / (len(self.members) - 1),
-                    2,
-                )
-            )
-            if len(self.members) > 1
+            round((aggregate.total - aggregate.minimum) / (len(aggregate) - 1), 2)
+            if len(aggregate) > 1
             else 0.0
         )
 
@@ -96,44 +188,50 @@ class Group(ClassDataType):
         "查看一个学生是否在这个小组。"
         return any([s.num == student.num for s in self.members])
 
-    def to_string(self):
+    def to_dict(self) -> dict:
+        "将小组对象转换为字典。"
+        return {
+            "type": self.chunk_type_name,
+            "key": self.key,
+            "name": self.name,
+            "leader": str(self.leader.uuid),
+            "members": [str(s.uuid) for s in self.members],
+            "belongs_to": self.belongs_to,
+            "further_desc": self.further_desc,
+            "uuid": str(self.uuid),
+            "archive_uuid": str(self.archive_uuid),
+        }
+
+    def to_string(self) -> str:
         "将小组对象转化为字符串。"
-        return json.dumps(
-            {
-                "type": self.chunk_type_name,
-                "key": self.key,
-                "name": self.name,
-                "leader": str(self.leader.uuid),
-                "members": [str(s.uuid) for s in self.members],
-                "belongs_to": self.belongs_to,
-                "further_desc": self.further_desc,
-                "uuid": str(self.uuid),
-                "archive_uuid": str(self.archive_uuid),
-            }
-        )
+        return json.dumps(self.to_dict())
 
     @staticmethod
-    def from_string(string: str):
-        "将字符串转化为小组对象。"
+    def from_dict(d: dict):
+        "从字典加载小组对象。"
         from .student import Student
-        string = json.loads(string)
-        if string["type"] != Group.chunk_type_name:
+        if d["type"] != Group.chunk_type_name:
             raise TypeError(
-                f"类型不匹配：{string['type']} != {Group.chunk_type_name}"
+                f"类型不匹配：{d['type']} != {Group.chunk_type_name}"
             )
         obj = Group(
-            key=string["key"],
-            name=string["name"],
-            leader=ClassDataObj.LoadUUID(string["leader"], Student),
-            members=[ClassDataObj.LoadUUID(s, Student) for s in string["members"]],
-            belongs_to=string["belongs_to"],
-            further_desc=string["further_desc"],
+            key=d["key"],
+            name=d["name"],
+            leader=ClassDataObj.LoadUUID(d["leader"], Student),
+            members=[ClassDataObj.LoadUUID(s, Student) for s in d["members"]],
+            belongs_to=d["belongs_to"],
+            further_desc=d["further_desc"],
         )
-        obj.uuid = string["uuid"]
-        obj.archive_uuid = string["archive_uuid"]
+        obj.uuid = d["uuid"]
+        obj.archive_uuid = d["archive_uuid"]
 
         return obj
 
+    @staticmethod
+    def from_string(string: str):
+        "将字符串转化为小组对象。"
+        return Group.from_dict(json.loads(string))
+
     def inst_from_string(self, string: str):
         "将字符串转化为小组对象。"
         obj = Group.from_string(string)
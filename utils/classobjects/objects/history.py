@@ -9,6 +9,7 @@ from ..classdataobj import ClassDataObj
 if TYPE_CHECKING:
     from .classtype import Class
     from .dayrecord import DayRecord
+    from ..dataloader import LazyHistoryLoader
 
 
 class History(ClassDataType):
@@ -17,6 +18,15 @@ class History(ClassDataType):
     chunk_type_name: Literal["History"] = "History"
     "类型名"
 
+    codec_fields = (
+        ("uuid", "uuid"),
+        ("archive_uuid", "uuid"),
+        ("classes", ("map", "value", "uuid")),
+        ("time", "value"),
+        ("weekdays", "value"),
+    )
+    "二进制编码时按顺序写入的字段（见codec.py）"
+
     is_unrelated_data_type = False
     "是否是与其他班级数据类型无关联的数据类型"
 
@@ -25,7 +35,17 @@ class History(ClassDataType):
         classes: Dict[str, Class],
         weekdays: Dict[str, Dict[float, DayRecord]],
         save_time: Optional[float] = None,
+        loader: Optional[LazyHistoryLoader] = None,
     ):
+        """
+        构建一个历史记录。
+
+        :param classes: 班级
+        :param weekdays: 每日记录
+        :param save_time: 保存时间
+        :param loader: 懒加载器，提供了的话classes和weekdays会在第一次访问时才加载，
+            这时前两个参数会被忽略
+        """
         self.classes = dict(classes)
         self.time = save_time or time.time()
         weekdays = weekdays.copy()
@@ -36,32 +56,108 @@ class History(ClassDataType):
         self.uuid = self.archive_uuid = ClassDataObj.get_archive_uuid()
         # IMPORTANT: 这里的对象uuid和归档uuid是一样的
 
+        if loader is not None:
+            self._classes = None
+            self._weekdays = None
+        self._loader = loader
+
+    @property
+    def classes(self) -> Dict[str, Class]:
+        "班级，懒加载的历史记录会在第一次访问时从存档读取"
+        if self._classes is None:
+            self.load()
+        return self._classes
+
+    @classes.setter
+    def classes(self, value: Dict[str, Class]):
+        self._classes = value
+
+    @property
+    def weekdays(self) -> Dict[str, Dict[float, DayRecord]]:
+        "每日记录，懒加载的历史记录会在第一次访问时从存档读取"
+        if self._weekdays is None:
+            self.load()
+        return self._weekdays
+
+    @weekdays.setter
+    def weekdays(self, value: Dict[str, Dict[float, DayRecord]]):
+        self._weekdays = value
+
+    @property
+    def loaded(self) -> bool:
+        "班级和每日记录是否已经在内存里"
+        return self._classes is not None and self._weekdays is not None
+
+    def load(self) -> "History":
+        "把班级和每日记录加载进内存（已经加载过就什么都不做）"
+        if not self.loaded:
+            if self._loader is None:
+                self._classes = self._classes if self._classes is not None else {}
+                self._weekdays = self._weekdays if self._weekdays is not None else {}
+            else:
+                self._classes, self._weekdays = self._loader.load()
+        return self
+
+    def unload(self) -> bool:
+        """
+        释放班级和每日记录占用的内存，下次访问的时候会重新从存档读取。
+
+        只有懒加载的历史记录才能释放（不然释放了就找不回来了）
+
+        :return: 是否释放了
+        """
+        if self._loader is None:
+            return False
+        self._classes = None
+        self._weekdays = None
+        self._loader.release()
+        return True
+
+    def __getstate__(self):
+        # 序列化（pickle、deepcopy）的时候带上完整数据，加载器不跟着走
+        state = self.__dict__.copy()
+        state["_classes"] = self.classes
+        state["_weekdays"] = self.weekdays
+        state["_loader"] = None
+        return state
+
+    def __setstate__(self, state: dict):
+        # 旧版本的存档里面classes和weekdays是直接放在__dict__里面的
+        if "classes" in state:
+            state["_classes"] = state.pop("classes")
+        if "weekdays" in state:
+            state["_weekdays"] = state.pop("weekdays")
+        state.setdefault("_loader", None)
+        super().__setstate__(state)
+
     def __repr__(self):
         return f"<History object at time {self.time:.3f}>"
 
-    def to_string(self):
-        "将历史记录转换为字符串。"
+    def to_dict(self) -> dict:
+        "将历史记录转换为字典。"
         for _class, item in self.weekdays.items():
             if isinstance(item, list):
                 self.weekdays[_class] = {d.utc: d for d in item}
 
-        return json.dumps(
-            {
-                "classes": {k: str(v.uuid) for k, v in self.classes.items()},
-                "time": self.time,
-                "weekdays": [[(_class, time_key, str(day.uuid)) for time_key, day in item.items()] \
-                                for _class, item in self.weekdays.items()],
-                "uuid": str(self.uuid),
-                "archive_uuid": self.archive_uuid,
-            }
-        )
+        return {
+            "type": self.chunk_type_name,
+            "classes": {k: str(v.uuid) for k, v in self.classes.items()},
+            "time": self.time,
+            "weekdays": [[(_class, time_key, str(day.uuid)) for time_key, day in item.items()] \
+                            for _class, item in self.weekdays.items()],
+            "uuid": str(self.uuid),
+            "archive_uuid": str(self.archive_uuid),
+        }
+
+    def to_string(self) -> str:
+        "将历史记录转换为字符串。"
+        return json.dumps(self.to_dict())
 
     @staticmethod
-    def from_string(s: str) -> "History":
-        "从字符串加载历史记录。"
+    def from_dict(d: dict) -> "History":
+        "从字典加载历史记录。"
         from .classtype import Class
         from .dayrecord import DayRecord
-        d = json.loads(s)
         if d["type"] != History.chunk_type_name:
             raise ValueError(
                 f"类型不匹配：{d['type']} != {History.chunk_type_name}"
@@ -73,7 +169,13 @@ class History(ClassDataType):
             weekdays={},
             save_time=d["time"],
         )
-        for _class, time_key, day_uuid in d["weekdays"]:
+        # to_dict按班级分了组（[[(班级, 时间, uuid), ...], ...]），也认不分组的老格式
+        entries = [
+            entry
+            for item in d["weekdays"]
+            for entry in (item if not item or isinstance(item[0], (list, tuple)) else [item])
+        ]
+        for _class, time_key, day_uuid in entries:
             if _class not in obj.weekdays:
                 obj.weekdays[_class] = {}
             obj.weekdays[_class][time_key] = ClassDataObj.LoadUUID(day_uuid, DayRecord)
@@ -85,6 +187,11 @@ class History(ClassDataType):
         )
         return obj
 
+    @staticmethod
+    def from_string(s: str) -> "History":
+        "从字符串加载历史记录。"
+        return History.from_dict(json.loads(s))
+
     def inst_from_string(self, string: str):
         "将字符串加载与本身。"
         obj = self.from_string(string)
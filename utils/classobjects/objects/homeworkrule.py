@@ -14,6 +14,16 @@ class HomeworkRule(ClassDataType, SupportsKeyOrdering):
     chunk_type_name: Literal["HomeworkRule"] = "HomeworkRule"
     "类型名"
 
+    codec_fields = (
+        ("uuid", "uuid"),
+        ("archive_uuid", "uuid"),
+        ("key", "str"),
+        ("subject_name", "str"),
+        ("ruler", "value"),
+        ("rule_mapping", ("map", "value", "uuid")),
+    )
+    "二进制编码时按顺序写入的字段（见codec.py）"
+
     is_unrelated_data_type = False
     "是否是与其他班级数据类型无关联的数据类型"
 
@@ -46,26 +56,27 @@ class HomeworkRule(ClassDataType, SupportsKeyOrdering):
         self.rule_mapping = rule_mapping
         self.archive_uuid = ClassDataObj.get_archive_uuid()
 
-    def to_string(self):
+    def to_dict(self) -> dict:
+        "将作业规则对象转换为字典。"
+        return {
+            "type": self.chunk_type_name,
+            "key": self.key,
+            "subject_name": self.subject_name,
+            "ruler": self.ruler,
+            "rule_mapping": dict(
+                [(n, str(t.uuid)) for n, t in self.rule_mapping.items()]
+            ),
+            "uuid": str(self.uuid),
+            "archive_uuid": str(self.archive_uuid),
+        }
+
+    def to_string(self) -> str:
         "将作业规则对象转为字符串。"
-        return json.dumps(
-            {
-                "type": self.chunk_type_name,
-                "key": self.key,
-                "subject_name": self.subject_name,
-                "ruler": self.ruler,
-                "rule_mapping": dict(
-                    [(n, str(t.uuid)) for n, t in self.rule_mapping.items()]
-                ),
-                "uuid": str(self.uuid),
-                "archive_uuid": str(self.archive_uuid),
-            }
-        )
+        return json.dumps(self.to_dict())
 
     @staticmethod
-    def from_string(s: str):
-        "从字符串加载作业规则对象。"
-        d = json.loads(s)
+    def from_dict(d: dict):
+        "从字典加载作业规则对象。"
         if d["type"] != HomeworkRule.chunk_type_name:
             raise ValueError(
                 f"类型不匹配：{d['type']} != "
@@ -84,6 +95,11 @@ class HomeworkRule(ClassDataType, SupportsKeyOrdering):
         obj.archive_uuid = d["archive_uuid"]
         return obj
 
+    @staticmethod
+    def from_string(s: str):
+        "从字符串加载作业规则对象。"
+        return HomeworkRule.from_dict(json.loads(s))
+
     def inst_from_string(self, string: str):
         "将字符串加载与本身。"
         obj = self.from_string(string)
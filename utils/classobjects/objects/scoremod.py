@@ -1,11 +1,12 @@
 from __future__ import annotations
 import json
+import sys
 import time
 import traceback
 from typing import Literal, Optional, TYPE_CHECKING, Tuple
 from utils.consts import debug
 from ..classdataobj import ClassDataObj
-from ..basetype import ClassDataType
+from ..basetype import ClassDataType, holds_state_lock
 from utils.basetypes import Base
 from .scoremodtemplate import ScoreModificationTemplate # 可以直接导入，这个没有依赖
 
@@ -14,11 +15,48 @@ if TYPE_CHECKING:
 
 
 class ScoreModification(ClassDataType):
-    "分数修改记录。"
+    """
+    分数修改记录。
+
+    一年下来会有几十万条，所以用__slots__（没有__dict__），
+    标题和描述是驻留了的字符串，和模板、和同一个模板的其他记录共用一份。
+    """
+
+    __slots__ = (
+        "_uuid",
+        "_archive_uuid",
+        "_loaded",
+        "_dirty",
+        "temp",
+        "title",
+        "desc",
+        "mod",
+        "target",
+        "execute_time",
+        "create_time",
+        "executed",
+        "execute_time_key",
+        "__weakref__",
+    )
 
     chunk_type_name: Literal["ScoreModification"] = "ScoreModification"
     "类型名"
 
+    codec_fields = (
+        ("uuid", "uuid"),
+        ("archive_uuid", "uuid"),
+        ("template", "uuid"),
+        ("target", "uuid"),
+        ("title", "str"),
+        ("mod", "value"),
+        ("desc", "str"),
+        ("executed", "value"),
+        ("create_time", "value"),
+        ("execute_time", "value"),
+        ("execute_time_key", "value"),
+    )
+    "二进制编码时按顺序写入的字段（见codec.py）"
+
     is_unrelated_data_type = False
     "是否是与其他班级数据类型无关联的数据类型"
 
@@ -63,12 +101,12 @@ class ScoreModification(ClassDataType):
         if title == self.temp.title or title is None:
             self.title = self.temp.title
         else:
-            self.title = title
+            self.title = sys.intern(title)
 
         if desc == self.temp.desc or desc is None:
             self.desc = self.temp.desc
         else:
-            self.desc = desc
+            self.desc = sys.intern(desc)
 
         if mod == self.temp.mod or mod is None:
             self.mod = self.temp.mod
@@ -80,6 +118,7 @@ class ScoreModification(ClassDataType):
         self.executed = executed
         self.archive_uuid = ClassDataObj.get_archive_uuid()
         self.execute_time_key = 0
+        self._dirty = True
 
     def __repr__(self):
         return (
@@ -90,6 +129,7 @@ class ScoreModification(ClassDataType):
             f"executed={repr(self.executed)})"
         )
 
+    @holds_state_lock
     def execute(self) -> bool:
         "执行当前的操作"
         if self.executed:
@@ -99,6 +139,9 @@ class ScoreModification(ClassDataType):
                 "ScoreModification.execute",
             )
             return False
+        if self.target.is_frozen:
+            Base.log("W", "目标是重置前冻结的版本，不能执行", "ScoreModification.execute")
+            return False
 
         try:
             self.execute_time = Base.gettime()
@@ -113,7 +156,8 @@ class ScoreModification(ClassDataType):
 
             self.target.score += self.mod
             self.executed = True
-            self.target.history[self.execute_time_key] = self
+            self.target.history.append(self, self.execute_time_key)
+            self.mark_dirty()
             return True
 
         except (
@@ -138,75 +182,39 @@ class ScoreModification(ClassDataType):
             )
             return False
 
+    @holds_state_lock
     def retract(self) -> Tuple[bool, str]:
         """撤销执行的操作
 
         :return: 是否执行成功（bool: 结果, str: 成功/失败原因）
         """
-        if self not in self.target.history.values():
+        history = self.target.history
+        if self.target.is_frozen or self not in history.values():
             Base.log("W", "当前操作未执行，无法撤回", "ScoreModification.retract")
             return False, "并不在本周历史中"
         if self.executed:
             try:
-                if self.mod < 0:
-                    findscore = 0.0
-                    lowestscore = 0.0
-                    lowesttimekey = 0
-                    # 重新计算最高分和最低分
-                    for i in self.target.history:
-                        tmp: ScoreModification = self.target.history[i]
-
-                        if (
-                            tmp.execute_time_key != self.execute_time_key
-                            and tmp.executed
-                        ):  # 排除自身
-                            findscore += tmp.mod
-
-                        if (
-                            lowestscore > findscore
-                            and tmp.execute_time_key != self.execute_time_key
-                        ):
-                            lowesttimekey = tmp.execute_time_key
-                            lowestscore = findscore
-
-                    if self.execute_time_key == lowesttimekey:
-                        lowestscore = 0
-
-                    if self.target.lowest_score_cause_time != lowesttimekey:
-                        self.target.lowest_score_cause_time = lowesttimekey
-
-                    if self.target.lowest_score != lowestscore:
-                        self.target.lowest_score = lowestscore
-
-                else:
-                    findscore = 0.0
-                    highestscore = 0.0
-                    highesttimekey = 0
-                    for i in self.target.history:
-                        tmp: ScoreModification = self.target.history[i]
-                        if (
-                            tmp.execute_time_key != self.execute_time_key
-                            and tmp.executed
-                        ):
-                            findscore += tmp.mod
-
-                        if (
-                            highestscore < findscore
-                            and tmp.execute_time_key != self.execute_time_key
-                        ):
-                            highesttimekey = tmp.execute_time_key
-                            highestscore = findscore
-                    if self.execute_time_key == highesttimekey:
-                        highestscore = 0
-                    if self.target.highest_score_cause_time != highesttimekey:
-                        self.target.highest_score_cause_time = highesttimekey
-
-                    if self.target.highest_score != highestscore:
-                        self.target.highest_score = highestscore
+                # 流水里这一条的变化量变成0，再从线段树上直接读出新的最高分和最低分，
+                # 不用把整个历史重放一遍
+                self.executed = False
+                history.refresh(self)
+                highestscore, highesttimekey = history.highest()
+                lowestscore, lowesttimekey = history.lowest()
+                self.executed = True
+
+                if self.target.highest_score_cause_time != highesttimekey:
+                    self.target.highest_score_cause_time = highesttimekey
+                if self.target.highest_score != highestscore:
+                    self.target.highest_score = highestscore
+                if self.target.lowest_score_cause_time != lowesttimekey:
+                    self.target.lowest_score_cause_time = lowesttimekey
+                if self.target.lowest_score != lowestscore:
+                    self.target.lowest_score = lowestscore
 
                 self.target.score -= self.mod
                 self.executed = False
                 self.execute_time = None
+                self.mark_dirty()
                 del self
                 return True, "操作成功完成"
             except (
@@ -218,6 +226,8 @@ class ScoreModification(ClassDataType):
                 OverflowError,
                 ZeroDivisionError,
             ) as exception:
+                # 不知道线段树停在了哪一步，下次用的时候按执行状态重建
+                history.invalidate()
                 if debug:
                     raise exception
                 Base.log(
@@ -233,30 +243,31 @@ class ScoreModification(ClassDataType):
             Base.log("W", "操作并未执行，无需撤回", "ScoreModification.retract")
             return False, "操作并未执行, 无需撤回"
 
-    def to_string(self):
+    def to_dict(self) -> dict:
+        "将分数修改记录对象转换为字典。"
+        return {
+            "type": self.chunk_type_name,
+            "template": str(self.temp.uuid),
+            "target": str(self.target.uuid),
+            "title": self.title,
+            "mod": self.mod,
+            "desc": self.desc,
+            "executed": self.executed,
+            "create_time": self.create_time,
+            "execute_time": self.execute_time,
+            "execute_time_key": self.execute_time_key,
+            "uuid": str(self.uuid),
+            "archive_uuid": str(self.archive_uuid),
+        }
+
+    def to_string(self) -> str:
         "将分数修改记录对象转为字符串。"
-        return json.dumps(
-            {
-                "type": self.chunk_type_name,
-                "template": str(self.temp.uuid),
-                "target": str(self.target.uuid),
-                "title": self.title,
-                "mod": self.mod,
-                "desc": self.desc,
-                "executed": self.executed,
-                "create_time": self.create_time,
-                "execute_time": self.execute_time,
-                "execute_time_key": self.execute_time_key,
-                "uuid": str(self.uuid),
-                "archive_uuid": str(self.archive_uuid),
-            }
-        )
+        return json.dumps(self.to_dict())
 
     @staticmethod
-    def from_string(string: str):
-        "将字符串转换为分数修改对象。"
+    def from_dict(d: dict):
+        "从字典加载分数修改记录对象。"
         from .student import Student
-        d = json.loads(string)
         if d["type"] != ScoreModification.chunk_type_name:
             raise ValueError(
                 f"类型不匹配：{d['type']} != "
@@ -277,8 +288,13 @@ class ScoreModification(ClassDataType):
         obj.execute_time_key = d["execute_time_key"]
         return obj
 
+    @staticmethod
+    def from_string(string: str):
+        "将字符串转换为分数修改对象。"
+        return ScoreModification.from_dict(json.loads(string))
+
     def inst_from_string(self, string: str):
         "将字符串加载与本身。"
         obj = self.from_string(string)
-        self.__dict__.update(obj.__dict__)
+        self.update_attrs(obj.instance_attrs())
         return self
\ No newline at end of file
@@ -1,6 +1,7 @@
 
 from __future__ import annotations
 import json
+import sys
 from typing import Literal
 from ..basetype import ClassDataType
 from ..classdataobj import ClassDataObj
@@ -12,6 +13,18 @@ class ScoreModificationTemplate(ClassDataType, SupportsKeyOrdering):
         chunk_type_name: Literal["ScoreModificationTemplate"] = "ScoreModificationTemplate"
         "类型名"
 
+        codec_fields = (
+            ("uuid", "uuid"),
+            ("archive_uuid", "uuid"),
+            ("key", "str"),
+            ("modification", "value"),
+            ("title", "str"),
+            ("description", "str"),
+            ("cant_replace", "value"),
+            ("is_visible", "value"),
+        )
+        "二进制编码时按顺序写入的字段（见codec.py）"
+
         is_unrelated_data_type = True
         "是否是与其他班级数据类型无关联的数据类型"
 
@@ -21,7 +34,7 @@ class ScoreModificationTemplate(ClassDataType, SupportsKeyOrdering):
         @staticmethod
         def new_dummy():
             "返回一个空的分数加减操作模板"
-            return ScoreModificationTemplate("dummy", 0, "dummy")
+            return ScoreModificationTemplate("dummy", 0.0, "dummy")
 
         def __init__(
             self,
@@ -44,8 +57,8 @@ class ScoreModificationTemplate(ClassDataType, SupportsKeyOrdering):
             """
             self.key = key
             self.mod = modification
-            self.title = title
-            self.desc = description
+            self.title = sys.intern(title)    # 和用这个模板的分数修改记录共用一份
+            self.desc = sys.intern(description)
             self.cant_replace = cant_replace
             self.is_visible = is_visible
             self.archive_uuid = ClassDataObj.get_archive_uuid()
@@ -61,44 +74,50 @@ class ScoreModificationTemplate(ClassDataType, SupportsKeyOrdering):
                 f"is_visible={self.is_visible.__repr__()})"
             )
 
-        def to_string(self):
+        def to_dict(self) -> dict:
+            "将分数加减模板对象转换为字典。"
+            return {
+                "type": self.chunk_type_name,
+                "key": self.key,
+                "modification": self.mod,
+                "title": self.title,
+                "description": self.desc,
+                "cant_replace": self.cant_replace,
+                "is_visible": self.is_visible,
+                "uuid": str(self.uuid),
+                "archive_uuid": str(self.archive_uuid),
+            }
+
+        def to_string(self) -> str:
             "将分数修改记录对象转为字符串。"
-            return json.dumps(
-                {
-                    "type": self.chunk_type_name,
-                    "key": self.key,
-                    "modification": self.mod,
-                    "title": self.title,
-                    "description": self.desc,
-                    "cant_replace": self.cant_replace,
-                    "is_visible": self.is_visible,
-                    "uuid": str(self.uuid),
-                    "archive_uuid": str(self.archive_uuid),
-                }
-            )
+            return json.dumps(self.to_dict())
 
         @staticmethod
-        def from_string(string: str):
-            "将字符串转化为分数加减模板对象。"
-            string = json.loads(string)
-            if string["type"] != ScoreModificationTemplate.chunk_type_name:
+        def from_dict(d: dict):
+            "从字典加载分数加减模板对象。"
+            if d["type"] != ScoreModificationTemplate.chunk_type_name:
                 raise TypeError(
-                    f"类型不匹配：{string['type']} != "
+                    f"类型不匹配：{d['type']} != "
                     f"{ScoreModificationTemplate.chunk_type_name}"
                 )
             obj = ScoreModificationTemplate(
-                key=string["key"],
-                modification=string["modification"],
-                title=string["title"],
-                description=string["description"],
-                cant_replace=string["cant_replace"],
-                is_visible=string["is_visible"],
+                key=d["key"],
+                modification=d["modification"],
+                title=d["title"],
+                description=d["description"],
+                cant_replace=d["cant_replace"],
+                is_visible=d["is_visible"],
             )
-            obj.uuid = string["uuid"]
-            obj.archive_uuid = string["archive_uuid"]
+            obj.uuid = d["uuid"]
+            obj.archive_uuid = d["archive_uuid"]
 
             return obj
 
+        @staticmethod
+        def from_string(string: str):
+            "将字符串转化为分数加减模板对象。"
+            return ScoreModificationTemplate.from_dict(json.loads(string))
+
         def inst_from_string(self, string: str):
             "将字符串加载与本身。"
             obj = self.from_string(string)
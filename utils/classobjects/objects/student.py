@@ -3,14 +3,16 @@ import time
 import json
 import copy
 from typing import (
-    Tuple, List, Any, Union,
+    Tuple, List, Any, Union, Callable,
     Dict, Any, Literal, Optional, TYPE_CHECKING)
 from ..classdataobj import ClassDataObj
-from ..basetype import ClassDataType, DataProperty
+from ..basetype import ClassDataType, DataProperty, holds_state_lock
+from ..ledger import ScoreLedger
 from utils.basetypes import Base
 from utils.algorithm import SupportsKeyOrdering
 
 if TYPE_CHECKING:
+    from utils.algorithm import RankingIndex, ScoreAggregate
     from .group import Group
     from .achievement import Achievement
     from .scoremod import ScoreModification
@@ -23,6 +25,29 @@ class Student(ClassDataType, SupportsKeyOrdering):
         chunk_type_name: Literal["Student"] = "Student"
         "类型名"
 
+        codec_fields = (
+            ("uuid", "uuid"),
+            ("archive_uuid", "uuid"),
+            ("name", "str"),
+            ("num", "value"),
+            ("score", "value"),
+            ("belongs_to", "str"),
+            ("history", ("pairs", "value", "uuid")),
+            ("last_reset", "value"),
+            ("achievements", ("pairs", "value", "uuid")),
+            ("highest_score", "value"),
+            ("lowest_score", "value"),
+            ("highest_score_cause_time", "value"),
+            ("lowest_score_cause_time", "value"),
+            ("belongs_to_group", "value"),
+            ("total_score", "value"),
+            ("last_reset_info", "uuid"),
+            ("last_reset_archive", "uuid"),
+            ("pick_count", "value"),
+            ("last_pick_time", "value"),
+        )
+        "二进制编码时按顺序写入的字段（见codec.py）"
+
         is_unrelated_data_type = False
         "是否是与其他班级数据类型无关联的数据类型"
 
@@ -30,11 +55,37 @@ class Student(ClassDataType, SupportsKeyOrdering):
         "记录分数的数据类型（还没做完别乱改）"
 
         last_reset_info_keep_turns = 2
-        "在存档中上次重置信息的轮数"
+        "在存档中上次重置信息的轮数（已经不用了，上次重置信息现在存在它自己的历史记录里，只留一个指针）"
+
+        last_reset_archive: Optional[str] = None
+        "上次重置信息所在的历史记录uuid，None为和自己在同一个存档里（老存档）"
+
+        pick_count: int = 0
+        "被随机点名抽到的次数（重置分数的时候不清零）"
+
+        last_pick_time: float = 0.0
+        "上次被随机点名抽到的时间戳（秒），0为还没有抽到过"
+
+        is_frozen: bool = False
+        "是否是冻结的版本（重置前的状态，见freeze），冻结的版本上的点评不能再执行和撤回"
+
+        _last_reset_ref: Optional[Tuple[str, str]] = None
+        "从存档加载出来、还没找过的上次重置信息，(历史记录uuid, 学生uuid)"
+
+        reset_parent_resolver: Optional[Callable[[str, str], Optional["Student"]]] = None
+        """按(历史记录uuid, 学生uuid)找上次重置信息的函数，第一次访问last_reset_info的时候才调用
+        （ClassObj构造的时候装上，见ClassObj.find_reset_parent）"""
 
         dummy: "Student" = None
         "空学生"
 
+        _score_watchers: Tuple[Union["RankingIndex[Student]", "ScoreAggregate[Student]"], ...] = ()
+        """要跟着分数更新的索引和统计（班级的排名和分数统计、小组的分数统计，见Class.ranking），
+        改分数的时候调用它们的update，改学号的时候调用invalidate"""
+
+        transient_attrs = ("_score_watchers",)
+        "排名索引和分数统计不跟着存档和深拷贝走"
+
         @staticmethod
         def new_dummy():
             "返回一个空学生"
@@ -46,7 +97,7 @@ class Student(ClassDataType, SupportsKeyOrdering):
             num: int,
             score: float,
             belongs_to: str,
-            history: Dict[Any, ScoreModification] = None,
+            history: Union[ScoreLedger, Dict[Any, ScoreModification]] = None,
             last_reset: Optional[float] = None,
             highest_score: float = 0.0,
             lowest_score: float = 0.0,
@@ -64,7 +115,7 @@ class Student(ClassDataType, SupportsKeyOrdering):
             :param num: 学号
             :param score: 当前分数
             :param belongs_to: 所属班级
-            :param history: 历史记录
+            :param history: 历史记录（流水，老的dict格式会转换成流水）
             :param last_reset: 上次重置时间
             :param highest_score: 最高分
             :param lowest_score: 最低分
@@ -88,8 +139,8 @@ class Student(ClassDataType, SupportsKeyOrdering):
             "分数上次重置的时间"
             self._highest_score_cause_time = highest_score_cause_time
             self._lowest_score_cause_time = lowest_score_cause_time
-            self.history: Dict[int, ScoreModification] = history or {}
-            "历史记录， key为时间戳（utc*1000）"
+            self.history: ScoreLedger = ScoreLedger.coerce(history)
+            "历史记录（分数流水，见ledger.py），可以当成key为时间戳（utc*1000）的dict用"
             self.achievements: Dict[int, Achievement] = achievements or {}
             "所获得的所有成就， key为时间戳（utc*1000）"
             self.belongs_to_group = belongs_to_group
@@ -112,7 +163,19 @@ class Student(ClassDataType, SupportsKeyOrdering):
 
         @DataProperty
         def last_reset_info(self):
-            "上次重置的信息"
+            "上次重置的信息（重置前冻结的那个版本）"
+            if self._last_reset_info is None and self._last_reset_ref is not None:
+                resolver = Student.reset_parent_resolver
+                if resolver is not None:
+                    archive, uuid = self._last_reset_ref
+                    self._last_reset_info = resolver(archive, uuid)
+                    if self._last_reset_info is None:
+                        Base.log(
+                            "D",
+                            f"{self.name}的上次重置信息（{archive}/{uuid}）找不到了",
+                            "Student.last_reset_info",
+                        )
+                    self._last_reset_ref = None
             return (
                 self._last_reset_info
                 if self._last_reset_info is not None
@@ -122,6 +185,12 @@ class Student(ClassDataType, SupportsKeyOrdering):
         @last_reset_info.setter
         def last_reset_info(self, value):
             self._last_reset_info = value
+            self._last_reset_ref = None
+
+        @property
+        def has_last_reset_info(self) -> bool:
+            "有没有上次重置的信息（不会为了判断去加载历史记录）"
+            return self._last_reset_info is not None or self._last_reset_ref is not None
 
         @DataProperty
         def highest_score(self):
@@ -213,6 +282,9 @@ class Student(ClassDataType, SupportsKeyOrdering):
                 # Base.log("E", "更改学号失败：学号过大了，不合理", "Student.name.setter")
                 # raise DataBase.OpreationError(f"请求更改的学号{val}过大了, 无法设置")
             self._num = val
+            for watcher in self._score_watchers:
+                # 排名索引是按学号记的，学号变了就重建
+                watcher.invalidate()
             Base.log("D", "更改完成！", "Student.name.setter")
 
         @num.deleter
@@ -233,6 +305,8 @@ class Student(ClassDataType, SupportsKeyOrdering):
                 self.highest_score = self.score
             if self.score < self.lowest_score:
                 self.lowest_score = self.score
+            for watcher in self._score_watchers:
+                watcher.update(self)
 
         @score.deleter
         def score(self):
@@ -273,18 +347,17 @@ class Student(ClassDataType, SupportsKeyOrdering):
 
         def reset_score(
             self,
-        ) -> Tuple[float, float, float, Dict[int, ScoreModification]]:
+        ) -> Tuple[float, float, float, ScoreLedger]:
             """重置学生分数。
 
-            :return: Tuple[当前分数, 历史最高分, 历史最低分,
-            Dict[分数变动时间utc*1000, 分数变动记录], Dict[成就达成时间utc*1000, 成就]"""
+            :return: Tuple[当前分数, 历史最高分, 历史最低分, 重置前的分数流水]"""
             Base.log("W", f"  -> 重置{self.name} ({self.num})的分数")
 
             returnval = (
                 float(self.score),
                 float(self.highest_score),
                 float(self.lowest_score),
-                dict(self.history),
+                self.history,
             )
             self.score = 0.0
             self.highest_score = 0.0
@@ -292,7 +365,7 @@ class Student(ClassDataType, SupportsKeyOrdering):
             self.highest_score_cause_time = 0.0
             self.lowest_score_cause_time = 0.0
             self.last_reset = time.time()
-            self.history: Dict[int, ScoreModification] = dict()
+            self.history = ScoreLedger()
             self.achievements = dict()
             return returnval
 
@@ -303,24 +376,28 @@ class Student(ClassDataType, SupportsKeyOrdering):
             Base.log("W", f"  -> 重置{self.name} ({self.num})的成就")
             returnval = dict(self.achievements)
             self.achievements = dict()
+            self.mark_dirty()
             return returnval
 
-        def reset(self, reset_achievments: bool = True) -> Tuple[
+        @holds_state_lock
+        def reset(self, reset_achievments: bool = True, archive: Optional[str] = None) -> Tuple[
             float,
             float,
             float,
-            Dict[int, ScoreModification],
+            ScoreLedger,
             Optional[Dict[int, Achievement]],
         ]:
             """
             重置学生分数和成就。
-            这个操作会更新学生的last_reset_info属性，以记录重置前的分数和成就。
+            这个操作会更新学生的last_reset_info属性，以记录重置前的分数和成就
+            （重置前的状态冻结成一个版本，见freeze，不再深拷贝）。
 
             :param reset_achievments: 是否重置成就
+            :param archive: 冻结的版本要放进的历史记录的uuid
             :return: Tuple[当前分数, 历史最高分, 历史最低分,
-            Dict[分数变动时间utc*1000, 分数变动记录], Dict[成就达成时间utc*1000, 成就]
+            重置前的分数流水, Dict[成就达成时间utc*1000, 成就]
             """
-            self.last_reset_info = copy.deepcopy(self)
+            self.freeze_reset_info(archive)
             score, highest, lowest, history = self.reset_score()
             achievements = None
             if reset_achievments:
@@ -328,6 +405,45 @@ class Student(ClassDataType, SupportsKeyOrdering):
             self.refresh_uuid()
             return (score, highest, lowest, history, achievements)
 
+        def freeze(self) -> "Student":
+            """
+            把学生现在的状态冻结成一个版本（重置的时候用）。
+
+            冻结的版本是浅拷贝：分数流水、成就这些容器直接拿过去，不复制，
+            所以之后自己不能再往这些容器里面改东西，要换成新的（reset_score就是这么做的）。
+            流水里的点评和成就的target会指到冻结的版本上，存档的时候和它们一起归到历史记录里；
+            冻结的版本标记为is_frozen，上面的点评不能再撤回（和以前深拷贝的时候一样，不在本周历史中）。
+
+            :return: 冻结的版本（uuid和现在的一样）
+            """
+            frozen = copy.copy(self)    # 排名索引和分数统计（transient_attrs）不跟着走
+            frozen.is_frozen = True
+            for modification in frozen.history.values():
+                modification.target = frozen
+            for achievement in frozen.achievements.values():
+                achievement.target = frozen
+            return frozen
+
+        def freeze_reset_info(self, archive: Optional[str] = None) -> "Student":
+            """
+            冻结现在的状态，当作上次重置的信息，之后要马上重置分数和成就。
+
+            :param archive: 冻结的版本要放进的历史记录的uuid
+            :return: 冻结的版本
+            """
+            frozen = self.freeze()
+            self.last_reset_info = frozen
+            self.last_reset_archive = None if archive is None else str(archive)
+            return frozen
+
+        def record_pick(self, pick_time: Optional[float] = None) -> None:
+            """记下被随机点名抽到了一次（见ClassObj.random_choose_stu）。
+
+            :param pick_time: 抽到的时间戳（秒），不填则为现在"""
+            self.pick_count += 1
+            self.last_pick_time = time.time() if pick_time is None else pick_time
+            self.mark_dirty()
+
         def get_group(self, class_obs: ClassStatusObserver) -> Group:
             """获取学生所在小组。
 
@@ -340,47 +456,49 @@ class Student(ClassDataType, SupportsKeyOrdering):
 
             :param class_obs: 班级侦测器
             :return: 排名"""
-            if self._belongs_to != class_obs.class_id:
-                raise ValueError(
-                    "但是从理论层面来讲"
-                    f"你不应该把{repr(class_obs.class_id)}的侦测器"
-                    f"给一个{repr(self._belongs_to)}的学生"
-                )
-
-            else:
-                ranking_data: List[Tuple[int, "Student"]] = (
-                    class_obs.rank_non_dumplicate
-                )
-                for index, student in ranking_data:
-                    if student.num == self.num:
-                        return index
-            raise ValueError(
-                f"你确定这个学生({self.belongs_to})在这个班({class_obs.class_id})？"
-            )
+            return self._ranking_in(class_obs)
 
         def get_non_dumplicated_ranking(self, class_obs: ClassStatusObserver) -> int:
             """获取学生在班级中计算非重复名次的排名。
 
             :param class_obs: 班级侦测器
             :return: 排名"""
+            return self._ranking_in(class_obs)
+
+        def _ranking_in(self, class_obs: ClassStatusObserver) -> int:
+            # 两个方法以前都是在rank_non_dumplicate里按学号找的，结果一样，都是竞争排名
             if self._belongs_to != class_obs.class_id:
                 raise ValueError(
                     "但是从理论层面来讲"
                     f"你不应该把{repr(class_obs.class_id)}的侦测器"
                     f"给一个{repr(self._belongs_to)}的学生"
                 )
-
-            else:
-                ranking_data: List[Tuple[int, Student]] = (
-                    class_obs.rank_non_dumplicate
-                )
-                for index, student in ranking_data:
-                    if student.num == self.num:
-                        return index
+            ranking = class_obs.target_class.ranking
+            if self.num in ranking.items:
+                # 按学号找，和以前一样，不要求是同一个对象
+                return ranking.competition_rank(ranking.items[self.num][1])
             raise ValueError(
                 f"你确定这个学生({self.belongs_to})在这个班({class_obs.class_id})？"
             )
 
+        def watch_score(self, watcher: Any, replaces: Any = None) -> None:
+            """让一个索引或者统计跟着这个学生的分数更新（见_score_watchers）。
+
+            :param watcher: 有update(学生)和invalidate()方法的对象
+            :param replaces: 要换掉的旧对象（重建了的索引），没有则为None"""
+            self._score_watchers = tuple(
+                w for w in self._score_watchers if w is not replaces and w is not watcher
+            ) + (watcher,)
+
+        def unwatch_score(self, watcher: Any) -> None:
+            """不再让一个索引或者统计跟着这个学生的分数更新。
+
+            :param watcher: 之前传给watch_score的对象"""
+            if any(w is watcher for w in self._score_watchers):
+                self._score_watchers = tuple(
+                    w for w in self._score_watchers if w is not watcher
+                )
+
         def __add__(
             self, value: Union[Student, float]
         ) -> Student:
@@ -433,44 +551,60 @@ class Student(ClassDataType, SupportsKeyOrdering):
                 self.total_score += value
                 return self
 
+        def __setstate__(self, state: Any):
+            super().__setstate__(state)
+            # 老存档（pickle）里的历史记录是dict
+            history = self.__dict__.get("history")
+            if history is not None and not isinstance(history, ScoreLedger):
+                self.history = ScoreLedger.coerce(history)
+
+        def to_dict(self) -> dict:
+            "将学生对象转换为字典。"
+            return {
+                "type": self.chunk_type_name,
+                "name": self.name,
+                "num": self.num,
+                "score": float(self.score),
+                "belongs_to": self.belongs_to,
+                "history": [
+                    (h.execute_time_key, str(h.uuid))
+                    for h in self.history.values()
+                    if h.executed
+                ],
+                "last_reset": self.last_reset,
+                "achievements": [
+                    (a.time_key, str(a.uuid)) for a in self.achievements.values()
+                ],
+                "highest_score": self.highest_score,
+                "lowest_score": self.lowest_score,
+                "highest_score_cause_time": self.highest_score_cause_time,
+                "lowest_score_cause_time": self.lowest_score_cause_time,
+                "belongs_to_group": self.belongs_to_group,
+                "total_score": self.total_score,
+                # 上次重置信息存在它自己的历史记录里，这里只存一个指针
+                "last_reset_info": (
+                    str(self._last_reset_info.uuid) if self._last_reset_info is not None
+                    else self._last_reset_ref[1] if self._last_reset_ref is not None
+                    else None
+                ),
+                "last_reset_archive": (
+                    self.last_reset_archive if self.has_last_reset_info else None
+                ),
+                "pick_count": self.pick_count,
+                "last_pick_time": self.last_pick_time,
+                "uuid": str(self.uuid),
+                "archive_uuid": str(self.archive_uuid),
+            }
+
         def to_string(self) -> str:
             "将学生对象转换为JSON格式"
-            return json.dumps(
-                {
-                    "type": self.chunk_type_name,
-                    "name": self.name,
-                    "num": self.num,
-                    "score": float(self.score),
-                    "belongs_to": self.belongs_to,
-                    "history": [
-                        (h.execute_time_key, str(h.uuid))
-                        for h in self.history.values()
-                        if h.executed
-                    ],
-                    "last_reset": self.last_reset,
-                    "achievements": [
-                        (a.time_key, str(a.uuid)) for a in self.achievements.values()
-                    ],
-                    "highest_score": self.highest_score,
-                    "lowest_score": self.lowest_score,
-                    "highest_score_cause_time": self.highest_score_cause_time,
-                    "lowest_score_cause_time": self.lowest_score_cause_time,
-                    "belongs_to_group": self.belongs_to_group,
-                    "total_score": self.total_score,
-                    "last_reset_info": (
-                        str(self.last_reset_info.uuid) if self._last_reset_info else None
-                    ),
-                    "uuid": str(self.uuid),
-                    "archive_uuid": str(self.archive_uuid),
-                }
-            )
+            return json.dumps(self.to_dict())
 
         @staticmethod
-        def from_string(string: str) -> "Student":
-            "将字符串转换为学生对象。"
+        def from_dict(data: dict) -> "Student":
+            "从字典加载学生对象。"
             from .achievement import Achievement
             from .scoremod import ScoreModification
-            data = json.loads(string)
             if data["type"] != Student.chunk_type_name:
                 raise TypeError(
                     f"类型不匹配：{data['type']} != {Student.chunk_type_name}"
@@ -480,10 +614,10 @@ class Student(ClassDataType, SupportsKeyOrdering):
                 num=data["num"],
                 score=Student.score_dtype(data["score"]),
                 belongs_to=data["belongs_to"],
-                history={
-                    k: ClassDataObj.LoadUUID(v, ScoreModification)
+                history=ScoreLedger(
+                    (k, ClassDataObj.LoadUUID(v, ScoreModification))
                     for k, v in data["history"]
-                },
+                ),
                 last_reset=data["last_reset"],
                 highest_score=data["highest_score"],
                 lowest_score=data["lowest_score"],
@@ -495,13 +629,28 @@ class Student(ClassDataType, SupportsKeyOrdering):
                 highest_score_cause_time=data["highest_score_cause_time"],
                 lowest_score_cause_time=data["lowest_score_cause_time"],
                 belongs_to_group=data["belongs_to_group"],
-                last_reset_info=ClassDataObj.LoadUUID(data["last_reset_info"], Student),
+                last_reset_info=(
+                    ClassDataObj.LoadUUID(data["last_reset_info"], Student)
+                    if data.get("last_reset_archive") is None else None
+                ),
             )
+            if data.get("last_reset_archive") is not None and data["last_reset_info"] is not None:
+                # 在别的历史记录里，用到的时候再去找（见last_reset_info）
+                obj.last_reset_archive = data["last_reset_archive"]
+                obj._last_reset_ref = (data["last_reset_archive"], data["last_reset_info"])
+            # 老存档里没有随机点名的记录
+            obj.pick_count = data.get("pick_count", 0)
+            obj.last_pick_time = data.get("last_pick_time", 0.0)
 
             obj.uuid = data["uuid"]
             obj.archive_uuid = data["archive_uuid"]
             return obj
 
+        @staticmethod
+        def from_string(string: str) -> "Student":
+            "将字符串转换为学生对象。"
+            return Student.from_dict(json.loads(string))
+
         def inst_from_string(self, string: str):
             "将字符串加载与本身。"
             obj = self.from_string(string)
@@ -136,6 +136,7 @@ class AchievementStatusObserver:
                             self.achievement_templates[a], s
                         )
                         a2.give()
+                        self.base.journal_event("achievement", [a2, s])
                         self.display_achievement_queue.put(
                             {"achievement": a, "student": s}
                         )
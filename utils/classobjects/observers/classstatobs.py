@@ -81,15 +81,8 @@ class ClassStatusObserver:
                         f"从 {orig} 变为 {s.num}（二者不同步）",
                         "ClassStatusObserver._start",
                     )
-            self.stu_score_ord = dict(
-                enumerate(
-                    sorted(
-                        list(self.classes[self.class_id].students.values()),
-                        key=lambda a: a.score,
-                    ),
-                    start=1,
-                )
-            )
+            # 排名索引没变的时候直接返回缓存，不用每帧重新排序
+            self.stu_score_ord = self.classes[self.class_id].stu_score_ord
             self.mspt = (time.time() - last_frame_time) * 1000
             self.tps = 1 / max((time.time() - last_opreate_time), 0.001)
 
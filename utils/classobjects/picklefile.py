@@ -0,0 +1,246 @@
+"""
+pickle存档文件
+
+旧的pickle存档（v1）是把整个dill.dumps的结果base85编码之后写成文本，读的时候要先把整个文件解码进内存，
+再写一个.tmp文件，然后才能dill.load，内存峰值大概是数据的三倍，硬盘也多读写一遍。
+
+新的格式（v2）直接把pickle（协议5）流式写进文件，读的时候也是从文件直接流式读：
+    文件头 PICKLE_MAGIC，版本号(B)，标志(B，第0位为zlib压缩)，后面是pickle数据
+旧格式的文件还能读（同样是流式解码，不再写临时文件），也可以用convert_legacy_pickle转成新格式。
+"""
+
+import io
+import os
+import zlib
+import base64
+import pickle as pickle_orig
+from typing import Any, BinaryIO, Optional
+
+import dill as pickle
+
+
+PICKLE_MAGIC = b"\x89CMP"
+"v2 pickle存档的文件头，第一个字节不是ASCII，不会和base85文本搞混"
+
+PICKLE_VERSION = 2
+"当前的pickle存档版本"
+
+PICKLE_PROTOCOL = 5
+"v2存档用的pickle协议"
+
+FLAG_ZLIB = 0x01
+"标志位：pickle数据经过了zlib压缩"
+
+COMPRESS_LEVEL = 1
+"zlib压缩等级，存档里大部分是重复的字段名，1级已经能压掉大部分"
+
+CHUNK_SIZE = 1024 * 1024
+"流式读写时每次处理的字节数"
+
+# b85decode是纯Python实现，临时内存大概是输入的二三十倍，所以每次只解码一小段
+_B85_CHUNK = 64 * 1024 // 5 * 5
+"base85每5个字符解码成4个字节，读旧存档时每次读的字符数要是5的倍数"
+
+
+class _ZlibWriter(io.RawIOBase):
+    "边写边压缩，关闭的时候写入剩下的压缩数据（不会关闭底层文件）"
+
+    def __init__(self, raw: BinaryIO, level: int = COMPRESS_LEVEL):
+        super().__init__()
+        self.raw = raw
+        self.compressor = zlib.compressobj(level)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = self.compressor.compress(b)
+        if data:
+            self.raw.write(data)
+        return len(b)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.raw.write(self.compressor.flush())
+        super().close()
+
+
+class _ZlibReader(io.RawIOBase):
+    "边读边解压"
+
+    def __init__(self, raw: BinaryIO):
+        super().__init__()
+        self.raw = raw
+        self.decompressor = zlib.decompressobj()
+        self.pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while True:
+            if not self.pending:
+                if self.decompressor.eof:
+                    return 0
+                self.pending = self.raw.read(CHUNK_SIZE)
+                if not self.pending:
+                    # 文件在压缩流结束之前就没了
+                    raise EOFError("pickle存档不完整（压缩数据被截断）")
+            data = self.decompressor.decompress(self.pending, len(b))
+            self.pending = self.decompressor.unconsumed_tail or self.decompressor.unused_data
+            if self.decompressor.eof:
+                self.pending = b""
+            if data:
+                b[: len(data)] = data
+                return len(data)
+
+
+class _B85Reader(io.RawIOBase):
+    "边读边解码v1存档的base85文本"
+
+    def __init__(self, raw: BinaryIO):
+        super().__init__()
+        self.raw = raw
+        self.pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self.pending:
+            text = self.raw.read(_B85_CHUNK).strip()
+            if not text:
+                return 0
+            self.pending = base64.b85decode(text)
+        size = min(len(b), len(self.pending))
+        b[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def is_legacy_pickle(path: str) -> bool:
+    """
+    判断一个pickle存档是不是旧格式（base85文本）。
+
+    :param path: 存档文件
+    :return: 是否为旧格式
+    """
+    with open(path, "rb") as f:
+        return f.read(len(PICKLE_MAGIC)) != PICKLE_MAGIC
+
+
+def open_pickle_stream(path: str) -> io.BufferedReader:
+    """
+    打开一个pickle存档，返回里面pickle数据的流（v1和v2都可以）。
+
+    :param path: 存档文件
+    :return: 流，用完要关
+    :raise ValueError: 版本号不认识
+    """
+    f = open(path, "rb", buffering=CHUNK_SIZE)
+    try:
+        if f.read(len(PICKLE_MAGIC)) != PICKLE_MAGIC:
+            f.seek(0)
+            return io.BufferedReader(_B85Reader(f), CHUNK_SIZE)
+        version, flags = f.read(2)
+        if version > PICKLE_VERSION:
+            raise ValueError(f"不支持的pickle存档版本：{version}")
+        if flags & FLAG_ZLIB:
+            return io.BufferedReader(_ZlibReader(f), CHUNK_SIZE)
+        return f
+    except BaseException:
+        f.close()
+        raise
+
+
+def load_pickle(path: str) -> Any:
+    """
+    读取一个pickle存档。
+
+    :param path: 存档文件
+    :return: 存档里的对象
+    """
+    with open_pickle_stream(path) as stream:
+        try:
+            return pickle.load(stream)
+        except AttributeError:
+            pass
+    # 和原来一样，dill加载不了的再用原版pickle试一次
+    with open_pickle_stream(path) as stream:
+        return pickle_orig.load(stream)
+
+
+def _write_header(f: BinaryIO, compress: bool) -> BinaryIO:
+    f.write(PICKLE_MAGIC + bytes((PICKLE_VERSION, FLAG_ZLIB if compress else 0)))
+    if compress:
+        return io.BufferedWriter(_ZlibWriter(f), CHUNK_SIZE)
+    return f
+
+
+def dump_pickle(obj: Any, path: str, compress: bool = True) -> int:
+    """
+    把对象以v2格式写入pickle存档。
+
+    先写到旁边的临时文件，写完之后再替换，写到一半出错不会把原来的存档弄坏。
+
+    :param obj: 对象
+    :param path: 存档文件
+    :param compress: 是否zlib压缩
+    :return: 文件大小
+    """
+    temp_path = path + ".writing"
+    try:
+        with open(temp_path, "wb", buffering=CHUNK_SIZE) as f:
+            stream = _write_header(f, compress)
+            pickle.dump(obj, stream, protocol=PICKLE_PROTOCOL)
+            if stream is not f:
+                stream.close()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return os.path.getsize(path)
+
+
+def convert_legacy_pickle(src: str, dst: Optional[str] = None, compress: bool = True) -> bool:
+    """
+    把旧格式（base85文本）的pickle存档转成v2格式，不反序列化，只流式解码再写回去。
+
+    :param src: 旧存档文件
+    :param dst: 写到哪，不填就替换原文件
+    :param compress: 是否zlib压缩
+    :return: 是否转换了（已经是v2的不用转）
+    """
+    if not is_legacy_pickle(src):
+        return False
+    dst = src if dst is None else dst
+    temp_path = dst + ".writing"
+    try:
+        with open(src, "rb", buffering=CHUNK_SIZE) as raw, open(
+            temp_path, "wb", buffering=CHUNK_SIZE
+        ) as f:
+            reader = _B85Reader(raw)
+            stream = _write_header(f, compress)
+            buffer = bytearray(CHUNK_SIZE)
+            while True:
+                size = reader.readinto(buffer)
+                if not size:
+                    break
+                stream.write(memoryview(buffer)[:size])
+            if stream is not f:
+                stream.close()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, dst)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return True
@@ -0,0 +1,284 @@
+"""
+全局的对象uuid登记表
+
+以前按uuid找对象（ClassObj.find_with_uuid）要把所有班级、学生和他们的点评、成就挨个扫一遍，
+找"any"的时候还要一种一种地试，数据越多越慢。现在对象在这些时候会登记在这里，
+按(uuid, 数据类型名, 所在存档)直接查到：
+
+- 新构造出来的对象（ClassDataType.__init__，或者第一次读uuid的时候才生成uuid的）
+- 从存档加载（Chunk.load_history里inst_from_data之后）、深拷贝和pickle加载（__setstate__）
+- 登记过的对象改了uuid（refresh_uuid、uuid的setter）会换到新的位置
+
+另外：
+
+- 只用弱引用记着对象，对象没人用了会自动从表里去掉，不会因为登记了就释放不掉
+- 所在存档是加载时的历史记录uuid，此周是None；卸载或者删除历史记录的时候调用release_archive
+- 同一个uuid在同一个存档里可能同时有好几个活着的对象（深拷贝出来的副本、from_dict临时构造的对象），
+  都会记着，按登记的先后排，加载器登记的（replace=True）排在最前面；
+  用的时候由调用的人确认是哪一个（见ClassObj.find_with_uuid）
+"""
+
+import threading
+import weakref
+from uuid import UUID
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # basetype在构造对象的时候要用这里的登记表，这里只在类型标注里用到它
+    from .basetype import ClassDataType
+
+
+RegistryKey = Tuple[int, str, Optional[int]]
+"登记表里的键，(uuid的128位整数, 数据类型名, 所在存档)"
+
+SAME_ARCHIVE = object()
+"UUIDRegistry.register的archive参数：沿用对象原来登记的存档，没登记过就是此周"
+
+
+def uuid_int(value: Any) -> int:
+    """
+    把uuid（UUID、ClassDataTypeUUID或者字符串，带不带横线都行）转成128位整数。
+
+    :param value: uuid
+    :return: 整数
+    :raise ValueError: 字符串不是uuid
+    """
+    if isinstance(value, UUID):
+        return value.int
+    return UUID(str(value)).int
+
+
+def archive_key(value: Any) -> Optional[int]:
+    """
+    把存档（历史记录）uuid转成登记表里的写法，此周（None）还是None。
+
+    :param value: 历史记录uuid
+    :return: 整数或者None
+    """
+    return None if value is None else uuid_int(value)
+
+
+class RegistryEntry(weakref.ref):
+    "登记表里的一项：对象的弱引用，加上它的键（构造之后由UUIDRegistry.register填上）"
+
+    __slots__ = ("key", "obj_id")
+
+    key: RegistryKey
+    "(uuid, 数据类型名, 所在存档)"
+    obj_id: int
+    "对象的id，对象被回收之后用来清理owners"
+
+    @property
+    def type_name(self) -> str:
+        "数据类型名"
+        return self.key[1]
+
+    @property
+    def archive(self) -> Optional[int]:
+        "所在存档，None为此周"
+        return self.key[2]
+
+
+class _Paused:
+    "UUIDRegistry.paused返回的上下文管理器"
+
+    __slots__ = ("local",)
+
+    def __init__(self, local: threading.local):
+        self.local = local
+
+    def __enter__(self):
+        self.local.paused = getattr(self.local, "paused", 0) + 1
+
+    def __exit__(self, *exc_info):
+        self.local.paused -= 1
+
+
+class UUIDRegistry:
+    "对象uuid登记表，见模块说明"
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        "读写登记表用的锁"
+        self.entries: Dict[RegistryKey, Union[RegistryEntry, Tuple[RegistryEntry, ...]]] = {}
+        """entries[(uuid, 数据类型名, 所在存档)] = 登记项，
+        同一个位置有好几个对象的时候是按顺序排的元组（很少见，平时不为它多占内存）"""
+        self.owners: Dict[int, RegistryEntry] = {}
+        "owners[id(对象)] = 这个对象现在的登记项，改uuid的时候用来删掉旧的"
+        self.pending_removals: List[RegistryEntry] = []
+        "已经被回收的对象的登记项，等下次操作登记表的时候再删（回收可能发生在任何时候，回调里不直接改表）"
+        self.local = threading.local()
+        "每个线程自己的状态，local.paused为暂停登记的层数（见paused）"
+
+        def on_collected(entry: RegistryEntry, selfref=weakref.ref(self)):
+            registry = selfref()
+            if registry is not None:
+                registry.pending_removals.append(entry)
+
+        self._on_collected = on_collected
+
+    def __len__(self) -> int:
+        with self.lock:
+            self._purge()
+            return len(self.owners)
+
+    def _purge(self) -> None:
+        while self.pending_removals:
+            self._drop(self.pending_removals.pop())
+
+    def paused(self) -> "_Paused":
+        """
+        在这个线程里暂停登记新对象（replace=True的除外），可以嵌套：
+
+            with uuid_registry.paused():
+                ...
+
+        从存档加载的时候用，加载器会构造很多用完就扔的空对象（new_dummy、from_dict临时构造的），
+        不登记它们能省掉大量的弱引用，真正加载出来的对象由加载器自己登记。
+        """
+        return _Paused(self.local)
+
+    def _add(self, entry: RegistryEntry, first: bool) -> None:
+        current = self.entries.get(entry.key)
+        if current is None:
+            self.entries[entry.key] = entry
+            return
+        if isinstance(current, RegistryEntry):
+            current = (current,)
+        self.entries[entry.key] = (entry,) + current if first else current + (entry,)
+
+    def _drop(self, entry: RegistryEntry) -> None:
+        current = self.entries.get(entry.key)
+        if current is entry:
+            del self.entries[entry.key]
+        elif isinstance(current, tuple):
+            rest = tuple(e for e in current if e is not entry)
+            self.entries[entry.key] = rest[0] if len(rest) == 1 else rest
+        if self.owners.get(entry.obj_id) is entry:
+            del self.owners[entry.obj_id]
+
+    def register(
+        self, obj: "ClassDataType", archive: Any = SAME_ARCHIVE, replace: bool = False
+    ) -> None:
+        """
+        登记一个对象（对象原来登记在别的位置的话会先删掉）。
+
+        :param obj: 对象
+        :param archive: 所在存档（历史记录uuid），None为此周，不填则沿用原来的（见SAME_ARCHIVE）
+        :param replace: 是否排到同一个位置的其他对象前面（从存档加载出来的对象）
+        """
+        uuid = getattr(obj, "_uuid", None)
+        if uuid is None or (not replace and getattr(self.local, "paused", 0)):
+            return
+        with self.lock:
+            if self.pending_removals:
+                self._purge()
+            old = self.owners.get(id(obj))
+            if old is not None and old() is not obj:
+                # 原来的对象已经被回收了，id被新对象用了
+                self._drop(old)
+                old = None
+            if archive is SAME_ARCHIVE:
+                archive = old.key[2] if old is not None else None
+            elif archive is not None:
+                archive = uuid_int(archive)
+            key = (uuid.int, obj.chunk_type_name, archive)
+            if old is not None:
+                if old.key == key and not replace:
+                    return
+                self._drop(old)
+            # 加载的时候每个对象都要登记，不给RegistryEntry写__init__，少一层Python调用
+            entry = RegistryEntry(obj, self._on_collected)
+            entry.key, entry.obj_id = key, id(obj)
+            self._add(entry, replace)
+            self.owners[entry.obj_id] = entry
+
+    def rekey(self, obj: "ClassDataType") -> None:
+        """
+        对象改了uuid之后调用：登记过的话换到新uuid的位置，没登记过就不管。
+
+        :param obj: 对象
+        """
+        if id(obj) in self.owners:
+            self.register(obj)
+
+    def unregister(self, obj: "ClassDataType") -> None:
+        """
+        删掉一个对象的登记。
+
+        :param obj: 对象
+        """
+        with self.lock:
+            self._purge()
+            entry = self.owners.get(id(obj))
+            if entry is not None and entry() is obj:
+                self._drop(entry)
+
+    def candidates(
+        self, uuid: Any, type_names: Iterable[str], archive: Any = None
+    ) -> List["ClassDataType"]:
+        """
+        按uuid找所有登记了的（还活着的）对象。
+
+        :param uuid: 对象uuid（UUID、ClassDataTypeUUID或者字符串）
+        :param type_names: 可能的数据类型名，按顺序找
+        :param archive: 所在存档（历史记录uuid），None为此周
+        :return: 对象，按照数据类型名的顺序，同一种类型里按照登记的顺序
+        """
+        try:
+            number = uuid_int(uuid)
+        except ValueError:
+            return []
+        archive = archive_key(archive)
+        result = []
+        with self.lock:
+            self._purge()
+            for type_name in type_names:
+                current = self.entries.get((number, type_name, archive))
+                if current is None:
+                    continue
+                for entry in (current,) if isinstance(current, RegistryEntry) else current:
+                    obj = entry()
+                    if obj is not None:
+                        result.append(obj)
+        return result
+
+    def get(
+        self, uuid: Any, type_names: Iterable[str], archive: Any = None
+    ) -> Optional["ClassDataType"]:
+        """
+        按uuid找对象。
+
+        :param uuid: 对象uuid
+        :param type_names: 可能的数据类型名，按顺序找，返回第一个找到的
+        :param archive: 所在存档（历史记录uuid），None为此周
+        :return: 对象，找不到则为None
+        """
+        found = self.candidates(uuid, type_names, archive)
+        return found[0] if found else None
+
+    def release_archive(self, archive: Any) -> int:
+        """
+        删掉一个存档（历史记录）的所有登记，卸载或者删除历史记录的时候调用。
+
+        :param archive: 历史记录uuid，None为此周
+        :return: 删掉的数量
+        """
+        archive = archive_key(archive)
+        with self.lock:
+            self._purge()
+            removed = [e for e in self.owners.values() if e.key[2] == archive]
+            for entry in removed:
+                self._drop(entry)
+        return len(removed)
+
+    def clear(self) -> None:
+        "清空登记表"
+        with self.lock:
+            self.entries.clear()
+            self.owners.clear()
+            self.pending_removals.clear()
+
+
+uuid_registry = UUIDRegistry()
+"全局的对象uuid登记表"
@@ -0,0 +1,441 @@
+"""
+还原点
+
+以前每创建一个还原点都要把整个chunks（或者整个程序文件夹）copytree一份，还原点信息是pickle存的，
+用得越久备份越慢、越占地方。现在的还原点分成两部分：
+
+- 对象库（objects/<哈希前两位>/<sha256>）：按内容去重的文件，同样内容的文件不管出现在几个还原点里都只存一份
+- 清单（points/<还原点id>.json）：还原点里每个文件的相对路径、sha256、大小和修改时间
+
+创建还原点的时候，大小和修改时间都和上一个还原点一样的文件直接沿用上次的哈希，不用再读一遍；
+恢复的时候只重写内容不一样的文件，多出来的文件删掉；旧的还原点按照RetentionPolicy清理，
+没有清单引用的对象顺手删掉。
+
+只用标准库，不碰程序的全局状态，可以单独拿出来用。
+"""
+
+import os
+import time
+import json
+import shutil
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+"计算哈希和复制文件时每次读的字节数"
+
+FileEntry = Tuple[str, int, int]
+"清单里的一个文件，(sha256, 大小, 修改时间（纳秒）)"
+
+
+class RecoveryManifest(NamedTuple):
+    "一个还原点的清单"
+
+    point_id: str
+    "还原点id（也是清单的文件名）"
+    create_time: float
+    "创建时间"
+    mode: str
+    "备份模式（\"only_data\"或\"all\"）"
+    source: str
+    "备份的文件夹（绝对路径）"
+    files: Dict[str, FileEntry]
+    "files[相对路径（用/分隔）] = (sha256, 大小, 修改时间)"
+
+    @property
+    def total_size(self) -> int:
+        "还原点里所有文件加起来的大小（去重之前）"
+        return sum(entry[1] for entry in self.files.values())
+
+
+class RetentionPolicy(NamedTuple):
+    "还原点保留策略，满足任意一条的还原点都会留着"
+
+    keep_last: int = 10
+    "保留最新的几个"
+    keep_daily: int = 7
+    "最近有还原点的几天里，每天保留最新的一个"
+    keep_weekly: int = 4
+    "最近有还原点的几周里，每周保留最新的一个"
+
+
+class CreateStats(NamedTuple):
+    "创建还原点的统计"
+
+    files: int
+    "文件数量"
+    hashed: int
+    "重新读了内容计算哈希的文件数量（其他的沿用了上一个还原点的哈希）"
+    new_objects: int
+    "新存进对象库的文件数量"
+    new_bytes: int
+    "新存进对象库的字节数"
+
+
+class RestoreStats(NamedTuple):
+    "恢复还原点的统计"
+
+    written: int
+    "重写了的文件数量"
+    unchanged: int
+    "内容一样没有动的文件数量"
+    deleted: int
+    "删掉了的多余文件数量"
+
+
+def file_sha256(path: str) -> str:
+    """
+    计算一个文件的sha256。
+
+    :param path: 文件
+    :return: 十六进制的哈希
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_CHUNK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def iter_files(root: str, exclude: Iterable[str] = ()) -> Iterable[Tuple[str, str]]:
+    """
+    遍历文件夹里的所有文件。
+
+    :param root: 文件夹
+    :param exclude: 不要的文件或文件夹（绝对路径，或者相对于root的路径，或者只写名字）
+    :return: (相对路径（用/分隔）, 绝对路径)的迭代器
+    """
+    root = os.path.abspath(root)
+    excluded_paths = {os.path.abspath(os.path.join(root, e)) for e in exclude}
+    excluded_names = {e for e in exclude if os.sep not in e and "/" not in e}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(
+            d
+            for d in dirnames
+            if d not in excluded_names and os.path.join(dirpath, d) not in excluded_paths
+        )
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if name in excluded_names or path in excluded_paths:
+                continue
+            yield os.path.relpath(path, root).replace(os.sep, "/"), path
+
+
+class RecoveryStore:
+    "一个还原点存储（对象库+清单），见模块说明"
+
+    def __init__(self, root: str):
+        """
+        打开一个还原点存储，文件夹不存在会在第一次创建还原点时创建。
+
+        :param root: 存储的根文件夹
+        """
+        self.root = os.path.abspath(root)
+        "存储的根文件夹"
+        self.objects_path = os.path.join(self.root, "objects")
+        "对象库"
+        self.points_path = os.path.join(self.root, "points")
+        "清单文件夹"
+        self.lock = threading.RLock()
+        "创建、删除和清理还原点时用的锁"
+
+    def object_path(self, digest: str) -> str:
+        """
+        获取一个对象在对象库里的路径。
+
+        :param digest: sha256
+        :return: 路径
+        """
+        return os.path.join(self.objects_path, digest[:2], digest)
+
+    def points(self) -> List[RecoveryManifest]:
+        "所有还原点，按照创建时间从早到晚排，读不了的清单会被跳过"
+        if not os.path.isdir(self.points_path):
+            return []
+        result = []
+        for name in os.listdir(self.points_path):
+            if not name.endswith(".json"):
+                continue
+            manifest = self.get(name[:-5])
+            if manifest is not None:
+                result.append(manifest)
+        result.sort(key=lambda m: m.create_time)
+        return result
+
+    def get(self, point_id: str) -> Optional[RecoveryManifest]:
+        """
+        读取一个还原点的清单。
+
+        :param point_id: 还原点id
+        :return: 清单，不存在或者损坏则为None
+        """
+        try:
+            with open(
+                os.path.join(self.points_path, point_id + ".json"), "r", encoding="utf-8"
+            ) as f:
+                d = json.load(f)
+            return RecoveryManifest(
+                d["point_id"],
+                d["create_time"],
+                d["mode"],
+                d["source"],
+                {k: tuple(v) for k, v in d["files"].items()},
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_manifest(self, manifest: RecoveryManifest) -> None:
+        os.makedirs(self.points_path, exist_ok=True)
+        file = os.path.join(self.points_path, manifest.point_id + ".json")
+        with open(file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest._asdict(), f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(file + ".tmp", file)
+
+    def _store_file(self, path: str) -> Tuple[str, int, bool]:
+        "把一个文件边算哈希边复制进对象库，返回(sha256, 大小, 是否新存的)"
+        os.makedirs(self.objects_path, exist_ok=True)
+        temp_path = os.path.join(
+            self.objects_path, f".incoming_{threading.get_ident()}_{time.time_ns()}"
+        )
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with open(path, "rb") as src, open(temp_path, "wb") as dst:
+                while True:
+                    block = src.read(HASH_CHUNK_SIZE)
+                    if not block:
+                        break
+                    h.update(block)
+                    dst.write(block)
+                    size += len(block)
+            digest = h.hexdigest()
+            target = self.object_path(digest)
+            if os.path.isfile(target):
+                os.remove(temp_path)
+                return digest, size, False
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(temp_path, target)
+            return digest, size, True
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def create(
+        self,
+        source: str,
+        mode: str = "only_data",
+        exclude: Iterable[str] = (),
+        create_time: Optional[float] = None,
+    ) -> Tuple[RecoveryManifest, CreateStats]:
+        """
+        创建一个还原点。
+
+        :param source: 要备份的文件夹
+        :param mode: 备份模式，只是记在清单里
+        :param exclude: 不要备份的文件或文件夹，见iter_files
+        :param create_time: 创建时间，不填就是现在（导入旧还原点的时候用）
+        :return: (清单, 统计)
+        """
+        source = os.path.abspath(source)
+        create_time = time.time() if create_time is None else create_time
+        with self.lock:
+            previous: Dict[str, FileEntry] = {}
+            for manifest in reversed(self.points()):
+                if manifest.source == source and manifest.mode == mode:
+                    previous = manifest.files
+                    break
+            files: Dict[str, FileEntry] = {}
+            hashed = new_objects = new_bytes = 0
+            for rel, path in iter_files(source, exclude):
+                try:
+                    st = os.stat(path)
+                    old = previous.get(rel)
+                    if (
+                        old is not None
+                        and old[1] == st.st_size
+                        and old[2] == st.st_mtime_ns
+                        and os.path.isfile(self.object_path(old[0]))
+                    ):
+                        files[rel] = old
+                        continue
+                    digest, size, is_new = self._store_file(path)
+                except FileNotFoundError:
+                    # 遍历的时候被删掉了（比如数据库的-journal文件）
+                    continue
+                hashed += 1
+                if is_new:
+                    new_objects += 1
+                    new_bytes += size
+                files[rel] = (digest, size, st.st_mtime_ns)
+            point_id = time.strftime("%Y%m%d_%H%M%S", time.localtime(create_time)) + (
+                f"_{int(create_time * 1000) % 1000:03}"
+            )
+            while os.path.isfile(os.path.join(self.points_path, point_id + ".json")):
+                point_id += "_"
+            manifest = RecoveryManifest(point_id, create_time, mode, source, files)
+            self._write_manifest(manifest)
+            return manifest, CreateStats(len(files), hashed, new_objects, new_bytes)
+
+    def restore(self, point_id: str, target: str, prefix: str = "") -> RestoreStats:
+        """
+        把一个还原点恢复到文件夹里，内容一样的文件不动，不一样的重写，还原点里没有的删掉
+        （挡路的文件和文件夹也会删掉，比如还原点里是文件、现在同一个路径是文件夹）。
+
+        :param point_id: 还原点id
+        :param target: 恢复到的文件夹
+        :param prefix: 只恢复还原点里这个相对路径下面的文件（比如"default/"），
+            恢复出来的路径会去掉这个前缀
+        :return: 统计
+        :raise FileNotFoundError: 还原点不存在，或者对象库里缺了要用的对象（这时target不会被改动）
+        """
+        manifest = self.get(point_id)
+        if manifest is None:
+            raise FileNotFoundError(f"还原点{point_id}不存在")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        wanted = {
+            rel[len(prefix):]: entry
+            for rel, entry in manifest.files.items()
+            if rel.startswith(prefix)
+        }
+        missing = [rel for rel, entry in wanted.items() if not os.path.isfile(self.object_path(entry[0]))]
+        if missing:
+            raise FileNotFoundError(f"还原点{point_id}缺少{len(missing)}个文件的数据，比如{missing[0]}")
+        target = os.path.abspath(target)
+        written = unchanged = deleted = 0
+        for rel, (digest, size, mtime_ns) in wanted.items():
+            dest = os.path.join(target, *rel.split("/"))
+            if (
+                os.path.isfile(dest)
+                and os.path.getsize(dest) == size
+                and file_sha256(dest) == digest
+            ):
+                unchanged += 1
+                continue
+            if os.path.isdir(dest):
+                # 现在是文件夹，还原点里是文件
+                deleted += sum(len(files) for _, _, files in os.walk(dest))
+                shutil.rmtree(dest)
+            parent = target
+            for part in rel.split("/")[:-1]:
+                # 现在是文件，还原点里是文件夹
+                parent = os.path.join(parent, part)
+                if os.path.isfile(parent):
+                    os.remove(parent)
+                    deleted += 1
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(self.object_path(digest), dest + ".restoring")
+            os.replace(dest + ".restoring", dest)
+            os.utime(dest, ns=(mtime_ns, mtime_ns))
+            written += 1
+        if os.path.isdir(target):
+            for rel, path in list(iter_files(target)):
+                if rel not in wanted:
+                    os.remove(path)
+                    deleted += 1
+            for dirpath, _, _ in os.walk(target, topdown=False):
+                # 从下往上删，子文件夹删掉之后上一层才会变空，所以要重新看一下
+                if dirpath != target and not os.listdir(dirpath):
+                    try:
+                        os.rmdir(dirpath)
+                    except OSError:
+                        pass
+        return RestoreStats(written, unchanged, deleted)
+
+    def delete(self, point_id: str) -> None:
+        """
+        删除一个还原点的清单（对象要等collect_garbage才会删）。
+
+        :param point_id: 还原点id
+        """
+        with self.lock:
+            try:
+                os.remove(os.path.join(self.points_path, point_id + ".json"))
+            except FileNotFoundError:
+                pass
+
+    def select_expired(self, policy: RetentionPolicy, now: Optional[float] = None) -> List[str]:
+        """
+        按照保留策略选出要清理的还原点（不删除）。
+
+        :param policy: 保留策略
+        :param now: 现在的时间，不填就是time.time()，比现在还新的还原点总是保留
+        :return: 要清理的还原点id
+        """
+        now = time.time() if now is None else now
+        newest_first = sorted(self.points(), key=lambda m: m.create_time, reverse=True)
+        keep: Set[str] = {m.point_id for m in newest_first[: policy.keep_last]}
+        keep.update(m.point_id for m in newest_first if m.create_time > now)
+        for limit, bucket in (
+            (policy.keep_daily, lambda t: time.localtime(t)[:3]),
+            (policy.keep_weekly, lambda t: time.strftime("%G-%V", time.localtime(t))),
+        ):
+            seen: Set[Any] = set()
+            for m in newest_first:
+                if len(seen) >= limit:
+                    break
+                key = bucket(m.create_time)
+                if key not in seen:
+                    seen.add(key)
+                    keep.add(m.point_id)
+        return [m.point_id for m in newest_first if m.point_id not in keep]
+
+    def prune(self, policy: RetentionPolicy) -> Tuple[List[str], int]:
+        """
+        按照保留策略清理还原点，再删掉没有清单引用的对象。
+
+        :param policy: 保留策略
+        :return: (删掉的还原点id, 删掉的对象数量)
+        """
+        with self.lock:
+            expired = self.select_expired(policy)
+            for point_id in expired:
+                self.delete(point_id)
+            return expired, self.collect_garbage()
+
+    def collect_garbage(self) -> int:
+        """
+        删掉对象库里没有被任何清单引用的对象（和残留的临时文件）。
+
+        :return: 删掉的对象数量
+        """
+        with self.lock:
+            if not os.path.isdir(self.objects_path):
+                return 0
+            referenced = {
+                entry[0] for manifest in self.points() for entry in manifest.files.values()
+            }
+            removed = 0
+            for dirpath, _, filenames in os.walk(self.objects_path):
+                for name in filenames:
+                    if name not in referenced:
+                        os.remove(os.path.join(dirpath, name))
+                        removed += 1
+            return removed
+
+    def verify(self, point_id: str) -> List[str]:
+        """
+        检查一个还原点的对象是否都在、内容是否完好。
+
+        :param point_id: 还原点id
+        :return: 有问题的文件的相对路径，为空就是完好的
+        """
+        manifest = self.get(point_id)
+        if manifest is None:
+            raise FileNotFoundError(f"还原点{point_id}不存在")
+        bad = []
+        for rel, (digest, _, _) in manifest.files.items():
+            path = self.object_path(digest)
+            if not os.path.isfile(path) or file_sha256(path) != digest:
+                bad.append(rel)
+        return bad
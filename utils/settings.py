@@ -63,6 +63,8 @@ class SettingsInfo:
         self.subwindow_y_offset = 0
         self.use_animate_background = False
         self.max_framerate = 60
+
+        self.history_load_workers = 1
         return self
 
     def save_to(self, file_path: str) -> "SettingsInfo":
@@ -298,6 +298,8 @@ class AttendanceInfoWidget(Ui_Form, MyWidget):
         ]:
             self.attendanceinfo.is_leave_late.append(stu)
 
+        self.main_window.journal_event("attendance", [self.attendanceinfo])
+
         self.stu_buttons[num].setText(
             f"{stu.num} {stu.name}\n{f'{self.attending_state_to_string(self.stu_states[stu.num])}'}"
         )
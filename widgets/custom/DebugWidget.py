@@ -5,6 +5,7 @@
 
 
 import traceback
+from typing import List
 from widgets.basic import *
 from utils import (
     ClassObj,
@@ -12,6 +13,7 @@ from utils import (
     Thread,
     output_list
 )
+from utils.classobjects.dataloader import DataObject
 from widgets.ui.pyside6.DebugWindow import Ui_Form
 
 __all__ = ["DebugWidget"]
@@ -29,6 +31,7 @@ class DebugWidget(Ui_Form, MyWidget):
     ):
         super().__init__(master)
         self.setupUi(self)
+        self.setup_cache_group()
         self.main_window = main_window
         self.master = master
         self.pushButton.clicked.connect(self.send_command)
@@ -126,6 +129,21 @@ for i in range(100):
         self.destroyed.connect(self.update_timer.stop)
         self.update()
 
+    def setup_cache_group(self):
+        "在右下角加上对象缓存的统计（见DataObject.loaded_object_list）"
+        self.groupBox_cache = QGroupBox(self)
+        self.groupBox_cache.setGeometry(QRect(480, 350, 201, 71))
+        self.groupBox_cache.setTitle("对象缓存")
+        self.cache_labels: List[QLabel] = []
+        "对象缓存统计的数值标签"
+        for i, name in enumerate(("命中/未命中", "淘汰", "缓存/固定")):
+            label = QLabel(self.groupBox_cache)
+            label.setGeometry(QRect(10, 18 + i * 16, 81, 16))
+            label.setText(name)
+            value = QLabel(self.groupBox_cache)
+            value.setGeometry(QRect(90, 18 + i * 16, 101, 16))
+            self.cache_labels.append(value)
+
     def show(self):
         super().show()
         self.output_lines = []
@@ -154,6 +172,12 @@ for i in range(100):
         )
         self.label_27.setText(str(round(self.main_window.class_obs.mspt, 3)))
         self.label_28.setText(str(round(self.main_window.achievement_obs.mspt, 3)))
+        stats = DataObject.loaded_object_list.stats()
+        self.cache_labels[0].setText(f"{stats['hits']}/{stats['misses']}")
+        self.cache_labels[1].setText(str(stats["evictions"]))
+        self.cache_labels[2].setText(
+            f"{stats['objects']}/{stats['pinned']} ({stats['bytes'] / 1048576:.1f}M)"
+        )
 
         self.textbroser_last = len(output_list)
         self.label_9.setText(
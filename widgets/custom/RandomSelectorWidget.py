@@ -52,6 +52,8 @@ class RandomSelectWidget(Ui_Form, MyWidget):
             lambda item: self.show_stu_info(self.result[self.listWidget_4.row(item)])
         )
         self.select_window: Optional[StudentSelectorWidget] = None
+        for mode, name in main_window.random_choose_modes.items():
+            self.comboBox.addItem(name, mode)
         self.update_widgets()
 
     def update_widgets(self):
@@ -110,20 +112,24 @@ class RandomSelectWidget(Ui_Form, MyWidget):
         self.update_widgets()
 
     def start(self):
-        self.result = self.main_window.random_choose_stu(
-            min(
-                self.spinBox.value(),
-                (len(self.from_students) - len(self.excludes_students)),
-            ),
+        selector = self.main_window.random_selector(
             self.from_students,
             self.includes_students,
             self.excludes_students,
+            self.comboBox.currentData() or "uniform",
+        )
+        self.result = self.main_window.random_choose_stu(
+            min(self.spinBox.value(), selector.available),
+            record=True,
+            selector=selector,
         )
         if not isinstance(self.result, list):
             self.result = [self.result]
         self.listWidget_4.clear()
         for s in self.result:
-            self.listWidget_4.addItem(QListWidgetItem(f"{s.num}号 {s.name}"))
+            self.listWidget_4.addItem(
+                QListWidgetItem(f"{s.num}号 {s.name}（第{s.pick_count}次）")
+            )
         self.update_widgets()
 
     def show_stu_info(self, stu: Student):
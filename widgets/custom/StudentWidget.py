@@ -115,8 +115,7 @@ class StudentWidget(Ui_Form, MyWidget):
         )
         self.history_data = []
         index = 0
-        for key in reversed(self.student.history):
-            history = self.student.history[key]
+        for history in reversed(self.student.history.values()):
             if history.executed:
                 try:
                     text = f"{history.title} {history.execute_time.rsplit('.', 1)[0]} {history.mod:+.1f}"
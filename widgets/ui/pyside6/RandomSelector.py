@@ -15,9 +15,9 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QFont, QFontDatabase, QGradient, QIcon,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
-from PySide6.QtWidgets import (QApplication, QFrame, QLabel, QListWidget,
-    QListWidgetItem, QPushButton, QSizePolicy, QSpinBox,
-    QWidget)
+from PySide6.QtWidgets import (QApplication, QComboBox, QFrame, QLabel,
+    QListWidget, QListWidgetItem, QPushButton, QSizePolicy,
+    QSpinBox, QWidget)
 
 class Ui_Form(object):
     def setupUi(self, Form):
@@ -71,6 +71,12 @@ class Ui_Form(object):
         self.spinBox.setGeometry(QRect(550, 130, 81, 22))
         self.spinBox.setMinimum(1)
         self.spinBox.setMaximum(114514)
+        self.label_6 = QLabel(Form)
+        self.label_6.setObjectName(u"label_6")
+        self.label_6.setGeometry(QRect(480, 100, 71, 16))
+        self.comboBox = QComboBox(Form)
+        self.comboBox.setObjectName(u"comboBox")
+        self.comboBox.setGeometry(QRect(550, 98, 131, 22))
         self.pushButton_2 = QPushButton(Form)
         self.pushButton_2.setObjectName(u"pushButton_2")
         self.pushButton_2.setGeometry(QRect(40, 280, 75, 24))
@@ -97,6 +103,7 @@ class Ui_Form(object):
         self.label_4.setText(QCoreApplication.translate("Form", u"\u5fc5\u987b\u6392\u9664...", None))
         self.pushButton.setText(QCoreApplication.translate("Form", u"GO !", None))
         self.label_5.setText(QCoreApplication.translate("Form", u"\u62bd\u53d6\u4eba\u6570", None))
+        self.label_6.setText(QCoreApplication.translate("Form", u"\u62bd\u53d6\u65b9\u5f0f", None))
         self.pushButton_2.setText(QCoreApplication.translate("Form", u"\u9009\u62e9", None))
         self.pushButton_3.setText(QCoreApplication.translate("Form", u"\u9009\u62e9", None))
         self.pushButton_4.setText(QCoreApplication.translate("Form", u"\u9009\u62e9", None))